@@ -1,9 +1,13 @@
 import { NextResponse } from 'next/server'
-import { getBoatStatistics } from '@/lib/analytics'
+import { getBoatStatistics, parseAnalyticsPeriod } from '@/lib/analytics'
 
-export async function GET() {
+export async function GET(request: Request) {
   try {
-    const stats = await getBoatStatistics()
+    const { searchParams } = new URL(request.url)
+    const period = parseAnalyticsPeriod(searchParams.get('period'), 'all')
+    const venueId = parseInt(searchParams.get('venueId') || '0') || 0
+
+    const stats = await getBoatStatistics(period, venueId)
     return NextResponse.json(stats)
   } catch (error) {
     console.error('API Error:', error)
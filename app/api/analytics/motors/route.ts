@@ -0,0 +1,26 @@
+import { NextResponse } from 'next/server'
+import { getMotorStatistics, parseAnalyticsPeriod } from '@/lib/analytics'
+
+export async function GET(request: Request) {
+  try {
+    const { searchParams } = new URL(request.url)
+    const venueId = parseInt(searchParams.get('venueId') || '')
+    const period = parseAnalyticsPeriod(searchParams.get('period'), '90d')
+
+    if (!venueId) {
+      return NextResponse.json(
+        { error: 'venueId is required' },
+        { status: 400 }
+      )
+    }
+
+    const stats = await getMotorStatistics(venueId, period === 'all' ? '365d' : period)
+    return NextResponse.json(stats)
+  } catch (error) {
+    console.error('API Error:', error)
+    return NextResponse.json(
+      { error: 'データの取得に失敗しました' },
+      { status: 500 }
+    )
+  }
+}
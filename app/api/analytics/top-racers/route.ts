@@ -1,12 +1,13 @@
 import { NextResponse } from 'next/server'
-import { getTopRacers } from '@/lib/analytics'
+import { getTopRacers, parseAnalyticsPeriod } from '@/lib/analytics'
 
 export async function GET(request: Request) {
   try {
     const { searchParams } = new URL(request.url)
     const limit = parseInt(searchParams.get('limit') || '20')
+    const period = parseAnalyticsPeriod(searchParams.get('period'), '365d')
 
-    const racers = await getTopRacers(limit)
+    const racers = await getTopRacers(limit, period)
     return NextResponse.json(racers)
   } catch (error) {
     console.error('API Error:', error)
@@ -1,9 +1,22 @@
 import { NextRequest, NextResponse } from 'next/server'
 import { createServerClient } from '@/lib/supabase'
 
+// 表示する予測のモデルバージョン（ml/predict_race_enhanced.py が保存するバージョン）
+// predictions には複数のモデルの予測が race_id ごとに並んで保存されている
+const DEFAULT_MODEL_VERSION = 'enhanced_latest'
+
+// 予測結果の表示に使う出走表の項目
+interface RaceCardEntry {
+  boat_number: number
+  racer_id: number
+  racer_name: string | null
+  racer_grade: string | null
+  motor_number: number | null
+}
+
 export async function POST(request: NextRequest) {
   try {
-    const { raceId } = await request.json()
+    const { raceId, modelVersion = DEFAULT_MODEL_VERSION } = await request.json()
 
     if (!raceId) {
       return NextResponse.json(
@@ -21,51 +34,79 @@ export async function POST(request: NextRequest) {
       )
     }
 
-    // 1. レースエントリーデータ取得
-    const { data: entries, error: entriesError } = await supabase
-      .from('race_entries')
-      .select('*')
+    // 1. 出走表を取得（race_cards の主キー検索1回、ml/race_cards.py が作成）
+    const { data: cards, error: cardsError } = await supabase
+      .from('race_cards')
+      .select('boat_number, racer_id, racer_number, racer_name, racer_grade, racer_current_grade, motor_number')
       .eq('race_id', raceId)
       .order('boat_number', { ascending: true })
 
-    if (entriesError) {
-      console.error('Race entries fetch error:', entriesError)
-      return NextResponse.json(
-        { error: 'Failed to fetch race data' },
-        { status: 500 }
-      )
+    if (cardsError) {
+      console.error('Race card fetch error:', cardsError)
     }
 
-    if (!entries || entries.length === 0) {
-      return NextResponse.json(
-        { error: 'Race not found' },
-        { status: 404 }
-      )
-    }
+    let raceData: RaceCardEntry[]
 
-    // 選手データを個別に取得
-    const raceData = await Promise.all(
-      entries.map(async (entry) => {
-        const { data: racer, error: racerError } = await supabase
-          .from('racers')
-          .select('*')
-          .eq('id', entry.racer_id)
-          .single()
-
-        if (racerError) {
-          console.error('Racer fetch error:', racerError)
-          return { ...entry, racers: null }
-        }
+    if (cards && cards.length > 0) {
+      raceData = cards.map(card => ({
+        boat_number: card.boat_number,
+        racer_id: card.racer_id,
+        racer_name: card.racer_name,
+        racer_grade: card.racer_current_grade || card.racer_grade,
+        motor_number: card.motor_number,
+      }))
+    } else {
+      // 出走表がまだない場合は race_entries と racers から作る（選手はまとめて1回で取得）
+      const { data: entries, error: entriesError } = await supabase
+        .from('race_entries')
+        .select('boat_number, racer_id, racer_grade, motor_number')
+        .eq('race_id', raceId)
+        .order('boat_number', { ascending: true })
+
+      if (entriesError) {
+        console.error('Race entries fetch error:', entriesError)
+        return NextResponse.json(
+          { error: 'Failed to fetch race data' },
+          { status: 500 }
+        )
+      }
+
+      if (!entries || entries.length === 0) {
+        return NextResponse.json(
+          { error: 'Race not found' },
+          { status: 404 }
+        )
+      }
+
+      const { data: racers, error: racersError } = await supabase
+        .from('racers')
+        .select('id, name, grade')
+        .in('id', entries.map(entry => entry.racer_id))
+
+      if (racersError) {
+        console.error('Racer fetch error:', racersError)
+      }
 
-        return { ...entry, racers: racer }
+      const racersById = new Map((racers || []).map(racer => [racer.id, racer]))
+      raceData = entries.map(entry => {
+        const racer = racersById.get(entry.racer_id)
+        return {
+          boat_number: entry.boat_number,
+          racer_id: entry.racer_id,
+          racer_name: racer?.name ?? null,
+          racer_grade: racer?.grade || entry.racer_grade,
+          motor_number: entry.motor_number,
+        }
       })
-    )
+    }
 
     // 2. 既存の予測結果をチェック
     const { data: existingPredictions, error: predError } = await supabase
       .from('predictions')
       .select('*')
       .eq('race_id', raceId)
+      .eq('model_version', modelVersion)
+      .order('boat_number', { ascending: true })
 
     if (predError) {
       console.error('Prediction fetch error:', predError)
@@ -75,9 +116,9 @@ export async function POST(request: NextRequest) {
     if (existingPredictions && existingPredictions.length > 0) {
       const predictions = existingPredictions.map(pred => ({
         boatNumber: pred.boat_number,
-        racerName: raceData.find(r => r.boat_number === pred.boat_number)?.racers?.name || 'Unknown',
+        racerName: raceData.find(r => r.boat_number === pred.boat_number)?.racer_name || 'Unknown',
         racerNumber: raceData.find(r => r.boat_number === pred.boat_number)?.racer_id || 0,
-        grade: raceData.find(r => r.boat_number === pred.boat_number)?.racers?.grade || 'B2',
+        grade: raceData.find(r => r.boat_number === pred.boat_number)?.racer_grade || 'B2',
         motorNumber: raceData.find(r => r.boat_number === pred.boat_number)?.motor_number?.toString() || 'N/A',
         winProb: pred.predicted_win_prob || 0,
         secondProb: pred.predicted_second_prob || 0,
@@ -91,10 +132,19 @@ export async function POST(request: NextRequest) {
 
       return NextResponse.json({
         predictions,
-        recommendations
+        recommendations,
+        modelVersion
       })
     }
 
+    // 既定以外のバージョンはバッチ（ml/backtest.py --save-predictions など）で保存したものだけを返す
+    if (modelVersion !== DEFAULT_MODEL_VERSION) {
+      return NextResponse.json(
+        { error: `No predictions for model version ${modelVersion}` },
+        { status: 404 }
+      )
+    }
+
     // 3. 新規予測の場合（Pythonモデルで予測を実行）
     try {
       const { execSync } = require('child_process')
@@ -117,6 +167,8 @@ export async function POST(request: NextRequest) {
         .from('predictions')
         .select('*')
         .eq('race_id', raceId)
+        .eq('model_version', modelVersion)
+        .order('boat_number', { ascending: true })
 
       if (newPredError || !newPredictions || newPredictions.length === 0) {
         throw new Error('Failed to retrieve predictions after generation')
@@ -124,9 +176,9 @@ export async function POST(request: NextRequest) {
 
       const predictions = newPredictions.map(pred => ({
         boatNumber: pred.boat_number,
-        racerName: raceData.find(r => r.boat_number === pred.boat_number)?.racers?.name || 'Unknown',
+        racerName: raceData.find(r => r.boat_number === pred.boat_number)?.racer_name || 'Unknown',
         racerNumber: raceData.find(r => r.boat_number === pred.boat_number)?.racer_id || 0,
-        grade: raceData.find(r => r.boat_number === pred.boat_number)?.racers?.grade || 'B2',
+        grade: raceData.find(r => r.boat_number === pred.boat_number)?.racer_grade || 'B2',
         motorNumber: raceData.find(r => r.boat_number === pred.boat_number)?.motor_number?.toString() || 'N/A',
         winProb: pred.predicted_win_prob || 0,
         secondProb: pred.predicted_second_prob || 0,
@@ -141,7 +193,7 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({
         predictions,
         recommendations,
-        modelVersion: newPredictions[0]?.model_version || 'latest'
+        modelVersion: newPredictions[0]?.model_version || modelVersion
       })
 
     } catch (mlError) {
@@ -152,9 +204,9 @@ export async function POST(request: NextRequest) {
 
       const fallbackPredictions = raceData.map(entry => ({
         boatNumber: entry.boat_number,
-        racerName: entry.racers?.name || 'Unknown',
+        racerName: entry.racer_name || 'Unknown',
         racerNumber: entry.racer_id,
-        grade: entry.racers?.grade || 'B2',
+        grade: entry.racer_grade || 'B2',
         motorNumber: entry.motor_number?.toString() || 'N/A',
         winProb: 1.0 / 6.0,
         secondProb: 1.0 / 6.0,
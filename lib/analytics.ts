@@ -58,21 +58,57 @@ export async function getRecentRaces(limit: number = 20) {
   return data as (Race & { race_entries: (RaceEntry & { racer: Racer })[] })[]
 }
 
-// 予測データの取得
-export async function getPredictionsByRaceId(raceId: number) {
+// 予測データの取得（predictions にはモデルバージョンごとの予測が並んでいるため、バージョンを指定する）
+export async function getPredictionsByRaceId(raceId: number, modelVersion = 'enhanced_latest') {
   checkSupabase()
   const { data, error } = await supabase
     .from('predictions')
     .select('*')
     .eq('race_id', raceId)
+    .eq('model_version', modelVersion)
     .order('boat_number', { ascending: true })
 
   if (error) throw error
   return data as Prediction[]
 }
 
-// コース別成績の集計
-export async function getCourseStatistics() {
+// ダッシュボード用の集計テーブル（ml/analytics_summary.py が収集のたびに更新）の期間
+// 'all' | '365d' | '90d'（analytics_motor_summary は '365d' | '90d' のみ）
+export type AnalyticsPeriod = 'all' | '365d' | '90d'
+
+const ANALYTICS_PERIODS: AnalyticsPeriod[] = ['all', '365d', '90d']
+
+// クエリパラメータの期間を検証（不正な値は既定値）
+export function parseAnalyticsPeriod(value: string | null, fallback: AnalyticsPeriod): AnalyticsPeriod {
+  return ANALYTICS_PERIODS.includes(value as AnalyticsPeriod) ? (value as AnalyticsPeriod) : fallback
+}
+
+// コース別成績の集計（analytics_course_summary、venueId = 0 は全会場）
+export async function getCourseStatistics(period: AnalyticsPeriod = 'all', venueId: number = 0) {
+  checkSupabase()
+  const { data, error } = await supabase
+    .from('analytics_course_summary')
+    .select('course, races, first_place, win_rate')
+    .eq('period', period)
+    .eq('venue_id', venueId)
+    .order('course', { ascending: true })
+
+  if (error || !data || data.length === 0) {
+    // 集計テーブルがまだない場合は出走データから集計する（全期間・全会場）
+    console.warn('コース別集計テーブルが利用できません:', error?.message ?? 'データなし')
+    return computeCourseStatistics()
+  }
+
+  return data.map(row => ({
+    course: row.course,
+    totalRaces: row.races,
+    firstPlace: row.first_place,
+    winRate: Math.round((row.win_rate ?? 0) * 10) / 10
+  }))
+}
+
+// コース別成績を出走データから集計
+async function computeCourseStatistics() {
   checkSupabase()
   const { data, error } = await supabase
     .from('race_entries')
@@ -107,8 +143,35 @@ export async function getCourseStatistics() {
   return courseStats
 }
 
-// 艇別成績の集計
-export async function getBoatStatistics() {
+// 艇別成績の集計（analytics_boat_summary、venueId = 0 は全会場）
+export async function getBoatStatistics(period: AnalyticsPeriod = 'all', venueId: number = 0) {
+  checkSupabase()
+  const { data, error } = await supabase
+    .from('analytics_boat_summary')
+    .select('boat_number, races, first_place, second_place, third_place, win_rate, place_rate')
+    .eq('period', period)
+    .eq('venue_id', venueId)
+    .order('boat_number', { ascending: true })
+
+  if (error || !data || data.length === 0) {
+    // 集計テーブルがまだない場合は出走データから集計する（全期間・全会場）
+    console.warn('艇別集計テーブルが利用できません:', error?.message ?? 'データなし')
+    return computeBoatStatistics()
+  }
+
+  return data.map(row => ({
+    boatNumber: row.boat_number,
+    totalRaces: row.races,
+    firstPlace: row.first_place,
+    secondPlace: row.second_place,
+    thirdPlace: row.third_place,
+    winRate: Math.round((row.win_rate ?? 0) * 10) / 10,
+    placeRate: Math.round((row.place_rate ?? 0) * 10) / 10
+  }))
+}
+
+// 艇別成績を出走データから集計
+async function computeBoatStatistics() {
   checkSupabase()
   const { data, error } = await supabase
     .from('race_entries')
@@ -149,9 +212,39 @@ export async function getBoatStatistics() {
   return boatStats
 }
 
-// トップ選手の取得
-export async function getTopRacers(limit: number = 10) {
+// トップ選手の取得（analytics_top_racers、期間内の1着率の上位）
+export async function getTopRacers(limit: number = 10, period: AnalyticsPeriod = '365d') {
   checkSupabase()
+  const { data, error } = await supabase
+    .from('analytics_top_racers')
+    .select('racer_id, racer_number, name, grade, branch, races, win_rate, second_rate, third_rate')
+    .eq('period', period)
+    .order('rank', { ascending: true })
+    .limit(limit)
+
+  if (error || !data || data.length === 0) {
+    console.warn('上位選手の集計テーブルが利用できません:', error?.message ?? 'データなし')
+    return fetchTopRacersFromStats(limit)
+  }
+
+  // racer_stats から取得していた場合と同じ形にする
+  return data.map(row => ({
+    racer_id: row.racer_id,
+    races: row.races,
+    win_rate: row.win_rate,
+    second_rate: row.second_rate,
+    third_rate: row.third_rate,
+    racers: {
+      racer_number: row.racer_number,
+      name: row.name,
+      grade: row.grade,
+      branch: row.branch
+    }
+  }))
+}
+
+// 上位選手を racer_stats から取得
+async function fetchTopRacersFromStats(limit: number) {
   const { data, error } = await supabase
     .from('racer_stats')
     .select('*, racers!racer_id(*)')
@@ -162,3 +255,25 @@ export async function getTopRacers(limit: number = 10) {
   if (error) throw error
   return data
 }
+
+// モーター成績の取得（analytics_motor_summary、会場ごと、2連対率の高い順）
+export async function getMotorStatistics(venueId: number, period: Exclude<AnalyticsPeriod, 'all'> = '90d') {
+  checkSupabase()
+  const { data, error } = await supabase
+    .from('analytics_motor_summary')
+    .select('motor_number, races, top2, top3, second_rate, third_rate')
+    .eq('period', period)
+    .eq('venue_id', venueId)
+    .order('second_rate', { ascending: false })
+
+  if (error) throw error
+
+  return (data || []).map(row => ({
+    motorNumber: row.motor_number,
+    totalRaces: row.races,
+    top2: row.top2,
+    top3: row.top3,
+    secondRate: Math.round((row.second_rate ?? 0) * 10) / 10,
+    thirdRate: Math.round((row.third_rate ?? 0) * 10) / 10
+  }))
+}
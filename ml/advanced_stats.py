@@ -9,41 +9,77 @@
 """
 import os
 import sys
+import argparse
 import pandas as pd
-import numpy as np
-from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import execute_values
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from scraper.db import connect
+from ml.point_in_time_stats import WATERMARK_OVERLAP, has_entry_updated_at
 
-def fetch_race_data():
-    """データベースからレースデータを取得"""
-    print("=== レースデータを取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            re.racer_id,
-            r.venue_id,
-            r.race_date,
-            re.result_position,
-            re.start_timing
-        FROM race_entries re
-        JOIN races r ON re.race_id = r.id
-        WHERE re.result_position IS NOT NULL
-        ORDER BY r.race_date, r.venue_id
+def fetch_race_data(since=None):
+    """
+    データベースからレースデータを取得
+
+    Args:
+        since: 指定した場合、この日時以降に追加・更新された出走に関係する
+               選手×会場の組み合わせのデータのみ取得（増分更新用）
+               着順は出走表の行を作成した後の upsert で入るため、race_entries.updated_at で判定する
+               （scraper/migrations/add_race_entries_updated_at.sql）
     """
+    print("=== レースデータを取得中 ===\n")
 
-    df = pd.read_sql_query(query, conn)
+    conn = connect()
+
+    if since is None:
+        query = """
+            SELECT
+                re.racer_id,
+                r.venue_id,
+                r.race_date,
+                re.result_position,
+                re.start_timing
+            FROM race_entries re
+            JOIN races r ON re.race_id = r.id
+            WHERE re.result_position IS NOT NULL
+            ORDER BY r.race_date, r.venue_id
+        """
+        params = None
+    else:
+        print(f"増分更新: {since} 以降に追加・更新された出走の選手×会場のみ再計算")
+        query = """
+            WITH touched AS (
+                SELECT DISTINCT re.racer_id, r.venue_id
+                FROM race_entries re
+                JOIN races r ON re.race_id = r.id
+                WHERE re.updated_at > %s
+            )
+            SELECT
+                re.racer_id,
+                r.venue_id,
+                r.race_date,
+                re.result_position,
+                re.start_timing
+            FROM race_entries re
+            JOIN races r ON re.race_id = r.id
+            JOIN touched t ON t.racer_id = re.racer_id AND t.venue_id = r.venue_id
+            WHERE re.result_position IS NOT NULL
+            ORDER BY r.race_date, r.venue_id
+        """
+        # 前回の更新と同時に書き込まれていた出走を取りこぼさないよう少しさかのぼる
+        params = (since - WATERMARK_OVERLAP,)
+
+    df = pd.read_sql_query(query, conn, params=params)
     conn.close()
 
     print(f"取得データ数: {len(df)}件")
-    print(f"選手数: {df['racer_id'].nunique()}名")
-    print(f"会場数: {df['venue_id'].nunique()}場")
-    print(f"日付範囲: {df['race_date'].min()} ～ {df['race_date'].max()}\n")
+    if len(df) > 0:
+        print(f"選手数: {df['racer_id'].nunique()}名")
+        print(f"会場数: {df['venue_id'].nunique()}場")
+        print(f"日付範囲: {df['race_date'].min()} ～ {df['race_date'].max()}")
+    print()
 
     return df
 
@@ -61,67 +97,58 @@ def calculate_venue_stats(df, min_races=5):
     """
     print(f"=== 会場別選手成績を計算中（最低レース数: {min_races}） ===\n")
 
-    # 選手×会場でグループ化
-    grouped = df.groupby(['racer_id', 'venue_id'])
-
-    stats_list = []
-
-    for (racer_id, venue_id), group in grouped:
-        race_count = len(group)
-
-        # 最低レース数を満たさない場合はスキップ
-        if race_count < min_races:
-            continue
-
-        # 勝率（1着率）
-        win_rate = (group['result_position'] == 1).sum() / race_count * 100
-
-        # 2連対率（1着または2着）
-        second_rate = (group['result_position'] <= 2).sum() / race_count * 100
+    position = df['result_position']
 
-        # 3連対率（1着、2着、または3着）
-        third_rate = (group['result_position'] <= 3).sum() / race_count * 100
-
-        # 平均ST
-        avg_st = group['start_timing'].mean()
+    # 選手×会場で一括集計
+    stats_df = (
+        df.assign(
+            is_win=(position == 1),
+            is_top2=(position <= 2),
+            is_top3=(position <= 3)
+        )
+        .groupby(['racer_id', 'venue_id'], sort=False)
+        .agg(
+            race_count=('result_position', 'size'),
+            wins=('is_win', 'sum'),
+            top2=('is_top2', 'sum'),
+            top3=('is_top3', 'sum'),
+            avg_start_timing=('start_timing', 'mean'),
+            avg_position=('result_position', 'mean')
+        )
+        .reset_index()
+    )
 
-        # 平均着順
-        avg_position = group['result_position'].mean()
+    # 最低レース数を満たさない組み合わせは除外
+    stats_df = stats_df[stats_df['race_count'] >= min_races]
 
-        stats_list.append({
-            'racer_id': racer_id,
-            'venue_id': venue_id,
-            'race_count': race_count,
-            'win_rate': win_rate,
-            'second_rate': second_rate,
-            'third_rate': third_rate,
-            'avg_start_timing': avg_st,
-            'avg_position': avg_position
-        })
+    stats_df['win_rate'] = stats_df['wins'] / stats_df['race_count'] * 100
+    stats_df['second_rate'] = stats_df['top2'] / stats_df['race_count'] * 100
+    stats_df['third_rate'] = stats_df['top3'] / stats_df['race_count'] * 100
 
-    stats_df = pd.DataFrame(stats_list)
+    stats_df = stats_df[[
+        'racer_id', 'venue_id', 'race_count', 'win_rate', 'second_rate',
+        'third_rate', 'avg_start_timing', 'avg_position'
+    ]].reset_index(drop=True)
 
     print(f"計算完了: {len(stats_df)}件の統計")
-    print(f"選手数: {stats_df['racer_id'].nunique()}名")
-    print(f"平均レース数: {stats_df['race_count'].mean():.1f}レース")
-    print(f"平均勝率: {stats_df['win_rate'].mean():.2f}%\n")
+    if len(stats_df) > 0:
+        print(f"選手数: {stats_df['racer_id'].nunique()}名")
+        print(f"平均レース数: {stats_df['race_count'].mean():.1f}レース")
+        print(f"平均勝率: {stats_df['win_rate'].mean():.2f}%")
+    print()
 
     return stats_df
 
 
 def create_racer_venue_stats_table():
-    """racer_venue_statsテーブルを作成"""
-    print("=== racer_venue_stats テーブルを作成 ===\n")
+    """racer_venue_statsテーブルを作成（既存テーブルはそのまま使用）"""
+    print("=== racer_venue_stats テーブルを確認 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
-    # テーブルが存在する場合は削除
-    cursor.execute("DROP TABLE IF EXISTS racer_venue_stats")
-
-    # テーブル作成
     cursor.execute("""
-        CREATE TABLE racer_venue_stats (
+        CREATE TABLE IF NOT EXISTS racer_venue_stats (
             id SERIAL PRIMARY KEY,
             racer_id INT NOT NULL,
             venue_id INT NOT NULL,
@@ -138,12 +165,12 @@ def create_racer_venue_stats_table():
 
     # インデックス作成
     cursor.execute("""
-        CREATE INDEX idx_racer_venue_stats_racer
+        CREATE INDEX IF NOT EXISTS idx_racer_venue_stats_racer
         ON racer_venue_stats(racer_id)
     """)
 
     cursor.execute("""
-        CREATE INDEX idx_racer_venue_stats_venue
+        CREATE INDEX IF NOT EXISTS idx_racer_venue_stats_venue
         ON racer_venue_stats(venue_id)
     """)
 
@@ -151,37 +178,80 @@ def create_racer_venue_stats_table():
     cursor.close()
     conn.close()
 
-    print("テーブル作成完了\n")
+    print("テーブル準備完了\n")
 
 
-def save_to_database(stats_df):
-    """統計データをデータベースに保存"""
+def get_update_window(incremental=True):
+    """
+    増分更新の基準時刻を取得
+
+    Args:
+        incremental: False の場合は前回の更新時刻を None にする（全件再計算）
+
+    Returns:
+        tuple: (前回の更新時刻, 今回の集計開始時刻)
+               今回の集計開始時刻を updated_at に記録し、次回はそれ以降の出走を対象にする
+               race_entries.updated_at 列がない場合、前回の更新時刻は None（全件再計算）
+    """
+    conn = connect()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT MAX(updated_at), NOW()::timestamp FROM racer_venue_stats")
+    last_updated, started_at = cursor.fetchone()
+
+    if not incremental:
+        last_updated = None
+    elif last_updated is not None and not has_entry_updated_at(cursor):
+        print("[WARNING] race_entries.updated_at がありません（scraper/migrations/add_race_entries_updated_at.sql を"
+              "実行してください）。全件を再計算します")
+        last_updated = None
+
+    cursor.close()
+    conn.close()
+
+    return last_updated, started_at
+
+
+def save_to_database(stats_df, updated_at=None, removed_cells=None, replace_all=False):
+    """
+    統計データをデータベースに保存（upsertのためテーブルは更新中も参照可能）
+
+    upsert と削除は同じトランザクションで行う
+
+    Args:
+        updated_at: 保存する行の updated_at（次回の増分更新の基準）
+        removed_cells: 削除する (racer_id, venue_id) のリスト
+                       （再計算した結果、最低レース数を満たさなくなった組み合わせ）
+        replace_all: Trueの場合、今回保存しなかった行をすべて削除する（全件再計算用）
+                     最低レース数を満たさなくなった組み合わせや、古いレースの削除で出走がなくなった組み合わせが残らない
+    """
     print("=== データベースに保存中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     # データをタプルのリストに変換
     data = [
         (
-            row['racer_id'],
-            row['venue_id'],
-            row['race_count'],
-            row['win_rate'],
-            row['second_rate'],
-            row['third_rate'],
-            row['avg_start_timing'],
-            row['avg_position']
+            int(row.racer_id),
+            int(row.venue_id),
+            int(row.race_count),
+            float(row.win_rate),
+            float(row.second_rate),
+            float(row.third_rate),
+            None if pd.isna(row.avg_start_timing) else float(row.avg_start_timing),
+            float(row.avg_position),
+            updated_at
         )
-        for _, row in stats_df.iterrows()
+        for row in stats_df.itertuples(index=False)
     ]
 
-    # バッチで挿入
-    execute_batch(cursor, """
+    # 一括upsert
+    execute_values(cursor, """
         INSERT INTO racer_venue_stats
         (racer_id, venue_id, race_count, win_rate, second_rate, third_rate,
-         avg_start_timing, avg_position)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+         avg_start_timing, avg_position, updated_at)
+        VALUES %s
         ON CONFLICT (racer_id, venue_id)
         DO UPDATE SET
             race_count = EXCLUDED.race_count,
@@ -190,14 +260,32 @@ def save_to_database(stats_df):
             third_rate = EXCLUDED.third_rate,
             avg_start_timing = EXCLUDED.avg_start_timing,
             avg_position = EXCLUDED.avg_position,
-            updated_at = NOW()
-    """, data, page_size=1000)
+            updated_at = EXCLUDED.updated_at
+    """, data, template="(%s, %s, %s, %s, %s, %s, %s, %s, COALESCE(%s, NOW()))", page_size=5000)
+
+    deleted = 0
+    if replace_all:
+        # 今回の upsert で updated_at を書き換えなかった行
+        cursor.execute("""
+            DELETE FROM racer_venue_stats
+            WHERE updated_at IS NULL OR updated_at < COALESCE(%s, NOW())
+        """, (updated_at,))
+        deleted = cursor.rowcount
+    elif removed_cells:
+        execute_values(cursor, """
+            DELETE FROM racer_venue_stats
+            WHERE (racer_id, venue_id) IN (VALUES %s)
+        """, [(int(racer_id), int(venue_id)) for racer_id, venue_id in removed_cells], page_size=5000)
+        deleted = cursor.rowcount
 
     conn.commit()
     cursor.close()
     conn.close()
 
-    print(f"保存完了: {len(data)}件\n")
+    print(f"保存完了: {len(data)}件")
+    if deleted:
+        print(f"削除: {deleted}件（最低レース数未満・出走なし）")
+    print()
 
 
 def show_sample_stats(stats_df):
@@ -209,49 +297,69 @@ def show_sample_stats(stats_df):
 
     print("会場別勝率 Top 10:")
     print("-" * 80)
-    for idx, row in top_10.iterrows():
-        print(f"選手ID: {row['racer_id']:4d} | "
-              f"会場: {row['venue_id']:2d} | "
-              f"出走数: {row['race_count']:3d} | "
-              f"勝率: {row['win_rate']:5.2f}% | "
-              f"2連対率: {row['second_rate']:5.2f}% | "
-              f"平均ST: {row['avg_start_timing']:.3f}")
+    for row in top_10.itertuples(index=False):
+        print(f"選手ID: {row.racer_id:4d} | "
+              f"会場: {row.venue_id:2d} | "
+              f"出走数: {row.race_count:3d} | "
+              f"勝率: {row.win_rate:5.2f}% | "
+              f"2連対率: {row.second_rate:5.2f}% | "
+              f"平均ST: {row.avg_start_timing:.3f}")
 
     print()
 
 
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description='Calculate racer x venue stats')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only recompute racer x venue cells touched since the last update')
+    parser.add_argument('--min-races', type=int, default=5,
+                        help='Minimum races per racer x venue (default: 5)')
+    args = parser.parse_args()
+
     print("=" * 80)
     print("  会場別選手成績計算")
     print("=" * 80)
     print()
 
     try:
-        # 1. データ取得
-        df = fetch_race_data()
+        # 1. テーブル準備（存在しない場合のみ作成）
+        create_racer_venue_stats_table()
+
+        # 2. データ取得
+        since, started_at = get_update_window(incremental=args.incremental)
+        df = fetch_race_data(since=since)
 
         if len(df) == 0:
+            if since is not None:
+                print("[OK] 前回更新以降の新しい出走はありません")
+                return
             print("[ERROR] データが取得できませんでした")
             print("まずデータ収集を実行してください: python scraper/collect_all_venues.py")
             return
 
-        # 2. 会場別統計を計算
-        stats_df = calculate_venue_stats(df, min_races=5)
+        # 3. 会場別統計を計算
+        stats_df = calculate_venue_stats(df, min_races=args.min_races)
+
+        # 再計算した組み合わせのうち、最低レース数を満たさなくなったもの（増分更新時に削除する）
+        removed_cells = []
+        if since is not None:
+            cells = df[['racer_id', 'venue_id']].drop_duplicates()
+            kept = set(zip(stats_df['racer_id'], stats_df['venue_id']))
+            removed_cells = [cell for cell in zip(cells['racer_id'], cells['venue_id']) if cell not in kept]
 
-        if len(stats_df) == 0:
+        if len(stats_df) == 0 and not removed_cells:
             print("[WARNING] 統計データが生成できませんでした")
             print("データが不足している可能性があります")
             return
 
-        # 3. テーブル作成
-        create_racer_venue_stats_table()
-
-        # 4. データベースに保存
-        save_to_database(stats_df)
+        # 4. データベースに保存（全件再計算の場合は今回の結果にない行を削除）
+        save_to_database(stats_df, updated_at=started_at,
+                         removed_cells=removed_cells, replace_all=since is None)
 
         # 5. サンプル統計を表示
-        show_sample_stats(stats_df)
+        if len(stats_df) > 0:
+            show_sample_stats(stats_df)
 
         print("=" * 80)
         print("  計算完了！")
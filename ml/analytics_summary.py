@@ -0,0 +1,387 @@
+"""
+ダッシュボード（/api/analytics/*）用の集計テーブルの更新
+
+表示のたびに race_entries 全件を集計しないよう、結果を日次で集計したテーブルを増分更新し、
+そこから表示用の小さな集計テーブル（数百行）を作り直す
+
+日次集計（前回の集計以降に追加・更新された出走のレース日だけを再集計、point_in_time_stats.py と同じ方式）:
+- course_daily_stats: 会場×進入コース×日付ごとの出走数・1着数・2着数・3着数
+- boat_daily_stats: 会場×艇番×日付ごとの出走数・1着数・2着数・3着数
+- racer_daily_stats / motor_daily_stats: point_in_time_stats.py が更新する（このスクリプトより先に実行する）
+
+表示用（期間ごと。日次集計から毎回作り直す）:
+- analytics_course_summary: 期間×会場（0=全会場）×コース → /api/analytics/course
+- analytics_boat_summary: 期間×会場（0=全会場）×艇番 → /api/analytics/boats
+- analytics_top_racers: 期間ごとの勝率上位の選手（選手名・級別・支部を含む） → /api/analytics/top-racers
+- analytics_motor_summary: 期間×会場×モーター → /api/analytics/motors
+
+期間（PERIODS）は集計済みデータの最終日を基準にする
+日次集計の更新と表示用テーブルの作り直しは同じトランザクションで行う（表示側は更新中も旧データを読む）
+
+使用方法:
+    python ml/analytics_summary.py             # 増分更新
+    python ml/analytics_summary.py --rebuild   # 全期間を再集計
+"""
+import os
+import sys
+import argparse
+from datetime import timedelta
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.point_in_time_stats import (
+    create_daily_stats_tables, find_refresh_dates, describe_refresh_dates, DEFAULT_LOOKBACK_DAYS
+)
+from scraper.db import connect
+
+load_dotenv()
+
+# 期間名と日数（None は全期間）
+PERIODS = {
+    'all': None,
+    '365d': 365,
+    '90d': 90,
+}
+
+# モーターは毎年入れ替わるため全期間は作らない
+MOTOR_PERIODS = ['365d', '90d']
+
+# 期間ごとの上位選手の件数と、対象にする最低出走数
+TOP_RACERS_LIMIT = 50
+TOP_RACERS_MIN_RACES = {
+    'all': 100,
+    '365d': 50,
+    '90d': 15,
+}
+
+# 日次集計（キー列）
+DAILY_TABLES = {
+    'course_daily_stats': 'course',
+    'boat_daily_stats': 'boat_number',
+}
+
+
+def create_summary_tables(cursor):
+    """日次集計・表示用テーブルを作成（存在する場合は何もしない）"""
+    create_daily_stats_tables(cursor)
+
+    for table, key in DAILY_TABLES.items():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                venue_id INT NOT NULL,
+                {key} INT NOT NULL,
+                race_date DATE NOT NULL,
+                races INT NOT NULL,
+                first_place INT NOT NULL,
+                second_place INT NOT NULL,
+                third_place INT NOT NULL,
+                updated_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (venue_id, {key}, race_date)
+            )
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_date ON {table}(race_date)")
+
+    for table, key in [('analytics_course_summary', 'course'), ('analytics_boat_summary', 'boat_number')]:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                period VARCHAR(10) NOT NULL,
+                venue_id INT NOT NULL,
+                {key} INT NOT NULL,
+                races INT NOT NULL,
+                first_place INT NOT NULL,
+                second_place INT NOT NULL,
+                third_place INT NOT NULL,
+                win_rate FLOAT,
+                place_rate FLOAT,
+                updated_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (period, venue_id, {key})
+            )
+        """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_top_racers (
+            period VARCHAR(10) NOT NULL,
+            rank INT NOT NULL,
+            racer_id INT NOT NULL,
+            racer_number INT,
+            name VARCHAR(100),
+            grade VARCHAR(5),
+            branch VARCHAR(50),
+            races INT NOT NULL,
+            wins INT NOT NULL,
+            win_rate FLOAT,
+            second_rate FLOAT,
+            third_rate FLOAT,
+            avg_start_timing FLOAT,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (period, rank)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_motor_summary (
+            period VARCHAR(10) NOT NULL,
+            venue_id INT NOT NULL,
+            motor_number INT NOT NULL,
+            races INT NOT NULL,
+            top2 INT NOT NULL,
+            top3 INT NOT NULL,
+            second_rate FLOAT,
+            third_rate FLOAT,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (period, venue_id, motor_number)
+        )
+    """)
+
+    # ダッシュボード（anon キー）からは読み取りのみ許可
+    for table in ['analytics_course_summary', 'analytics_boat_summary',
+                  'analytics_top_racers', 'analytics_motor_summary']:
+        cursor.execute("SELECT 1 FROM pg_policies WHERE tablename = %s AND policyname = %s",
+                       (table, f"{table}_select_policy"))
+        if cursor.fetchone() is None:
+            cursor.execute(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY")
+            cursor.execute(f'CREATE POLICY "{table}_select_policy" ON {table} FOR SELECT USING (true)')
+
+
+def update_daily_tables(cursor, dates):
+    """
+    会場×コース、会場×艇番の日次集計を指定したレース日だけ作り直す（None の場合は全期間）
+
+    Returns:
+        dict: テーブルごとの行数
+    """
+    date_filter = "AND r.race_date = ANY(%(dates)s)" if dates is not None else ""
+    params = {'dates': dates}
+    counts = {}
+
+    for table, key in DAILY_TABLES.items():
+        if dates is not None:
+            if not dates:
+                counts[table] = 0
+                continue
+            cursor.execute(f"DELETE FROM {table} WHERE race_date = ANY(%(dates)s)", params)
+        else:
+            cursor.execute(f"TRUNCATE {table}")
+
+        cursor.execute(f"""
+            INSERT INTO {table}
+            (venue_id, {key}, race_date, races, first_place, second_place, third_place)
+            SELECT
+                r.venue_id,
+                re.{key},
+                r.race_date,
+                COUNT(*),
+                SUM(CASE WHEN re.result_position = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN re.result_position = 2 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN re.result_position = 3 THEN 1 ELSE 0 END)
+            FROM race_entries re
+            JOIN races r ON re.race_id = r.id
+            WHERE re.result_position IS NOT NULL
+            AND re.{key} IS NOT NULL
+            {date_filter}
+            GROUP BY r.venue_id, re.{key}, r.race_date
+        """, params)
+        counts[table] = cursor.rowcount
+
+    return counts
+
+
+def period_start_dates(latest_date):
+    """期間名 → 集計開始日（全期間は None）"""
+    return {
+        period: (latest_date - timedelta(days=days - 1) if days and latest_date else None)
+        for period, days in PERIODS.items()
+    }
+
+
+def rebuild_summary_tables(cursor, start_dates):
+    """
+    日次集計から表示用テーブルを作り直す
+
+    Returns:
+        dict: テーブルごとの行数
+    """
+    counts = {}
+
+    for summary, (daily, key) in {
+        'analytics_course_summary': ('course_daily_stats', 'course'),
+        'analytics_boat_summary': ('boat_daily_stats', 'boat_number'),
+    }.items():
+        cursor.execute(f"DELETE FROM {summary}")
+        counts[summary] = 0
+
+        for period, start_date in start_dates.items():
+            date_filter = "WHERE race_date >= %(start_date)s" if start_date else ""
+            # 会場別と全会場（venue_id = 0）を1回で集計
+            cursor.execute(f"""
+                INSERT INTO {summary}
+                (period, venue_id, {key}, races, first_place, second_place, third_place, win_rate, place_rate)
+                SELECT
+                    %(period)s,
+                    COALESCE(venue_id, 0),
+                    {key},
+                    SUM(races),
+                    SUM(first_place),
+                    SUM(second_place),
+                    SUM(third_place),
+                    SUM(first_place) * 100.0 / SUM(races),
+                    (SUM(first_place) + SUM(second_place) + SUM(third_place)) * 100.0 / SUM(races)
+                FROM {daily}
+                {date_filter}
+                GROUP BY GROUPING SETS ((venue_id, {key}), ({key}))
+            """, {'period': period, 'start_date': start_date})
+            counts[summary] += cursor.rowcount
+
+    cursor.execute("DELETE FROM analytics_top_racers")
+    counts['analytics_top_racers'] = 0
+
+    for period, start_date in start_dates.items():
+        date_filter = "WHERE race_date >= %(start_date)s" if start_date else ""
+        cursor.execute(f"""
+            INSERT INTO analytics_top_racers
+            (period, rank, racer_id, racer_number, name, grade, branch,
+             races, wins, win_rate, second_rate, third_rate, avg_start_timing)
+            SELECT
+                %(period)s,
+                ROW_NUMBER() OVER (ORDER BY s.win_rate DESC, s.races DESC, s.racer_id),
+                s.racer_id,
+                ra.racer_number,
+                ra.name,
+                ra.grade,
+                ra.branch,
+                s.races,
+                s.wins,
+                s.win_rate,
+                s.second_rate,
+                s.third_rate,
+                s.avg_start_timing
+            FROM (
+                SELECT
+                    racer_id,
+                    SUM(races) AS races,
+                    SUM(wins) AS wins,
+                    SUM(wins) * 100.0 / SUM(races) AS win_rate,
+                    SUM(top2) * 100.0 / SUM(races) AS second_rate,
+                    SUM(top3) * 100.0 / SUM(races) AS third_rate,
+                    SUM(st_sum) / NULLIF(SUM(st_count), 0) AS avg_start_timing
+                FROM racer_daily_stats
+                {date_filter}
+                GROUP BY racer_id
+                HAVING SUM(races) >= %(min_races)s
+                ORDER BY win_rate DESC, races DESC, racer_id
+                LIMIT %(limit)s
+            ) s
+            JOIN racers ra ON ra.id = s.racer_id
+        """, {'period': period, 'start_date': start_date,
+              'min_races': TOP_RACERS_MIN_RACES[period], 'limit': TOP_RACERS_LIMIT})
+        counts['analytics_top_racers'] += cursor.rowcount
+
+    cursor.execute("DELETE FROM analytics_motor_summary")
+    counts['analytics_motor_summary'] = 0
+
+    for period in MOTOR_PERIODS:
+        start_date = start_dates[period]
+        date_filter = "WHERE race_date >= %(start_date)s" if start_date else ""
+        cursor.execute(f"""
+            INSERT INTO analytics_motor_summary
+            (period, venue_id, motor_number, races, top2, top3, second_rate, third_rate)
+            SELECT
+                %(period)s,
+                venue_id,
+                motor_number,
+                SUM(races),
+                SUM(top2),
+                SUM(top3),
+                SUM(top2) * 100.0 / SUM(races),
+                SUM(top3) * 100.0 / SUM(races)
+            FROM motor_daily_stats
+            {date_filter}
+            GROUP BY venue_id, motor_number
+        """, {'period': period, 'start_date': start_date})
+        counts['analytics_motor_summary'] += cursor.rowcount
+
+    return counts
+
+
+def update_analytics_summary(rebuild=False, lookback_days=DEFAULT_LOOKBACK_DAYS, verbose=True):
+    """
+    日次集計を増分更新し、表示用テーブルを作り直す
+
+    Args:
+        rebuild: Trueの場合は日次集計を全期間で再集計
+        lookback_days: race_entries.updated_at がない場合に、最終集計日から何日さかのぼって再集計するか
+        verbose: 詳細出力
+
+    Returns:
+        dict: テーブルごとの行数
+    """
+    conn = connect()
+    cursor = conn.cursor()
+
+    try:
+        create_summary_tables(cursor)
+
+        # 過去の月のバックフィルで追加された古い日付も再集計の対象になる
+        dates = None if rebuild else find_refresh_dates(cursor, 'course_daily_stats', lookback_days)
+
+        if verbose:
+            print(f"=== 日次集計を更新中（{describe_refresh_dates(dates)}） ===\n")
+
+        counts = update_daily_tables(cursor, dates)
+
+        cursor.execute("SELECT MAX(race_date) FROM course_daily_stats")
+        latest_date = cursor.fetchone()[0]
+        start_dates = period_start_dates(latest_date)
+
+        if verbose:
+            print(f"=== 表示用テーブルを作成中（最終日: {latest_date}） ===\n")
+
+        counts.update(rebuild_summary_tables(cursor, start_dates))
+
+        conn.commit()
+
+        if verbose:
+            for table, rows in counts.items():
+                print(f"{table}: {rows}件")
+            print()
+
+        return counts
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description='Update pre-aggregated tables for the analytics dashboard')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Recompute all dates instead of only changed ones')
+    parser.add_argument('--lookback-days', type=int, default=DEFAULT_LOOKBACK_DAYS,
+                        help='Days to recompute before the last aggregated date when race_entries.updated_at '
+                             f'is not available (default: {DEFAULT_LOOKBACK_DAYS})')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("  ダッシュボード用集計テーブルの更新")
+    print("=" * 80)
+    print()
+
+    try:
+        update_analytics_summary(rebuild=args.rebuild, lookback_days=args.lookback_days)
+        print("[SUCCESS] 集計テーブルの更新が完了しました")
+
+    except Exception as e:
+        print(f"\n[ERROR] エラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,8 @@
     python ml/backtest.py                    # 直近100レースでテスト
     python ml/backtest.py --races 500        # 500レースでテスト
     python ml/backtest.py --date 2024-11-01  # 指定日以降のレースでテスト
+    python ml/backtest.py --races 1000 --model ml/model_b.pkl --save-predictions model_b
+                                             # 各レースの予測を predictions に model_b として保存
 """
 import os
 import sys
@@ -16,43 +18,58 @@ import pandas as pd
 from datetime import datetime, timedelta
 from collections import defaultdict
 from dotenv import load_dotenv
-import psycopg2
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ml.enhanced_feature_engineer import EnhancedFeatureEngineer
 from ml.race_predictor import RacePredictor
 from ml.improved_combination_predictor import ImprovedCombinationPredictor
+from ml.prediction_writer import PredictionWriter
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
+from scraper.db import connect, query_stats, print_query_stats
 
 load_dotenv()
 
 
-def fetch_completed_races(limit=100, start_date=None):
-    """結果が確定しているレースを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    cursor = conn.cursor()
-
-    # 結果が確定しているレース（result_positionがNULLでない）を取得
-    query = """
-        SELECT DISTINCT r.id, r.race_date, r.venue_id, r.race_number
-        FROM races r
-        JOIN race_entries re ON r.id = re.race_id
-        WHERE re.result_position IS NOT NULL
+def build_completed_races_query(limit=100, start_date=None):
     """
+    結果が確定しているレース（6艇とも着順あり）を新しい順に取得するクエリ
 
-    if start_date:
-        query += f" AND r.race_date >= '{start_date}'"
+    races を (race_date DESC, venue_id, race_number) の順に読み、レースごとに着順のある出走を数える
+    全出走を GROUP BY せずに済むため、idx_races_recent / idx_entries_finished
+    （scraper/migrations/add_ml_query_indexes.sql）があれば LIMIT 件数分だけ読んで終わる
 
-    query += """
-        GROUP BY r.id
-        HAVING COUNT(re.boat_number) = 6
+    Returns:
+        tuple: (query, params)
+    """
+    date_filter = "AND r.race_date >= %(start_date)s" if start_date else ""
+
+    query = f"""
+        SELECT r.id, r.race_date, r.venue_id, r.race_number
+        FROM races r
+        WHERE (
+            SELECT COUNT(*)
+            FROM race_entries re
+            WHERE re.race_id = r.id
+            AND re.result_position IS NOT NULL
+        ) = 6
+        {date_filter}
         ORDER BY r.race_date DESC, r.venue_id, r.race_number
+        LIMIT %(limit)s
     """
+    # LIMIT NULL は件数制限なし
+    params = {'start_date': start_date, 'limit': limit or None}
 
-    if limit:
-        query += f" LIMIT {limit}"
+    return query, params
+
+
+def fetch_completed_races(limit=100, start_date=None):
+    """結果が確定しているレースを取得"""
+    conn = connect()
+    cursor = conn.cursor()
 
-    cursor.execute(query)
+    query, params = build_completed_races_query(limit, start_date)
+    cursor.execute(query, params)
     races = cursor.fetchall()
 
     cursor.close()
@@ -63,7 +80,7 @@ def fetch_completed_races(limit=100, start_date=None):
 
 def fetch_race_data(race_id):
     """1レース分のデータを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
     query = """
         SELECT
@@ -97,8 +114,20 @@ def fetch_race_data(race_id):
     return df
 
 
-def run_backtest(races, model_path='ml/trained_model_latest.pkl', verbose=True):
-    """バックテストを実行"""
+def run_backtest(races, model_path='ml/trained_model_latest.pkl', verbose=True, fetch_race=fetch_race_data,
+                 prediction_writer=None):
+    """
+    バックテストを実行
+
+    Args:
+        races: (race_id, race_date, venue_id, race_number) のリスト
+        model_path: モデルファイルのパス
+        verbose: 進捗を表示
+        fetch_race: race_id から1レース分のDataFrameを返す関数（ベンチマークではDBの代わりに差し替える）
+        prediction_writer: 指定した場合、各レースの着順確率を追加する（PredictionWriter、まとめて保存される）
+
+    レースごとの fetch / features / predict / combinations を instrumentation.span で計測する
+    """
 
     if verbose:
         print("\n" + "=" * 70)
@@ -112,8 +141,9 @@ def run_backtest(races, model_path='ml/trained_model_latest.pkl', verbose=True):
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model not found: {model_path}")
 
-    predictor = RacePredictor()
-    predictor.load(model_path)
+    with span('load_model'):
+        predictor = RacePredictor()
+        predictor.load(model_path)
 
     fe = EnhancedFeatureEngineer()
 
@@ -137,7 +167,9 @@ def run_backtest(races, model_path='ml/trained_model_latest.pkl', verbose=True):
     for i, (race_id, race_date, venue_id, race_number) in enumerate(races):
         try:
             # レースデータ取得
-            race_df = fetch_race_data(race_id)
+            with span('fetch') as s:
+                race_df = fetch_race(race_id)
+                s.rows = len(race_df)
 
             if len(race_df) != 6:
                 continue
@@ -156,21 +188,28 @@ def run_backtest(races, model_path='ml/trained_model_latest.pkl', verbose=True):
             actual_3rd = actual_3rd[0]
 
             # 特徴量生成
-            features = fe.create_features(race_df)
+            with span('features') as s:
+                features = fe.create_features(race_df)
 
-            # 特徴量の順序を合わせる
-            if predictor.feature_names:
-                missing_features = set(predictor.feature_names) - set(features.columns)
-                for f in missing_features:
-                    features[f] = 0
-                features = features[predictor.feature_names]
+                # 特徴量の順序を合わせる
+                if predictor.feature_names:
+                    missing_features = set(predictor.feature_names) - set(features.columns)
+                    for f in missing_features:
+                        features[f] = 0
+                    features = features[predictor.feature_names]
+                s.rows = len(features)
 
             # 予測
-            predictions = predictor.predict_probabilities(features)
+            with span('predict', rows=len(features)):
+                predictions = predictor.predict_probabilities(features)
+
+            if prediction_writer is not None:
+                prediction_writer.add(race_id, predictions)
 
             # 組み合わせ予測
-            combo_predictor = ImprovedCombinationPredictor(predictions)
-            all_predictions = combo_predictor.get_all_predictions(top_n=20)
+            with span('combinations'):
+                combo_predictor = ImprovedCombinationPredictor(predictions)
+                all_predictions = combo_predictor.get_all_predictions(top_n=20)
 
             # 単勝予測（1着予測）
             win_probs = [(i + 1, predictions[i][0]) for i in range(6)]
@@ -251,7 +290,7 @@ def run_backtest(races, model_path='ml/trained_model_latest.pkl', verbose=True):
 
 def save_results_to_db(results, model_version='enhanced_latest'):
     """バックテスト結果をDBに保存"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     total = results['total_races']
@@ -294,7 +333,7 @@ def save_results_to_db(results, model_version='enhanced_latest'):
 
 def check_accuracy_degradation(current_results, threshold=5.0):
     """精度低下をチェック（前回比較）"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     try:
@@ -415,50 +454,85 @@ def main():
     parser.add_argument('--model', type=str, default='ml/trained_model_latest.pkl', help='Model path')
     parser.add_argument('--quiet', action='store_true', help='Suppress progress output')
     parser.add_argument('--save', action='store_true', help='Save results to database')
+    parser.add_argument('--save-predictions', type=str, nargs='?', const='', default=None, metavar='MODEL_VERSION',
+                        help='Upsert per-race probabilities into predictions under MODEL_VERSION '
+                             '(default: model file name)')
     parser.add_argument('--check-degradation', action='store_true', help='Check for accuracy degradation')
+    add_metrics_argument(parser)
 
     args = parser.parse_args()
+    enable_profiling(args)
 
     print("\n" + "=" * 70)
     print("  Backtest - Model Validation System")
     print("=" * 70)
 
-    # レースを取得
-    print("\nFetching completed races...")
-    races = fetch_completed_races(limit=args.races, start_date=args.date)
-    print(f"Found {len(races)} races with results")
-
-    if len(races) == 0:
-        print("No races found for backtest")
-        return
+    try:
+        # レースを取得
+        print("\nFetching completed races...")
+        with span('fetch_races') as s:
+            races = fetch_completed_races(limit=args.races, start_date=args.date)
+            s.rows = len(races)
+        print(f"Found {len(races)} races with results")
+
+        if len(races) == 0:
+            print("No races found for backtest")
+            return
+
+        # 予測の保存（モデルバージョンごとに並べて比較できる）
+        writer_conn = None
+        prediction_writer = None
+        if args.save_predictions is not None:
+            model_version = args.save_predictions or os.path.basename(args.model).replace('.pkl', '')
+            print(f"Saving predictions as model_version={model_version}")
+            writer_conn = connect()
+            prediction_writer = PredictionWriter(writer_conn, model_version)
+
+        # バックテスト実行
+        try:
+            with span('backtest') as s:
+                results, detailed = run_backtest(
+                    races,
+                    model_path=args.model,
+                    verbose=not args.quiet,
+                    prediction_writer=prediction_writer
+                )
+                s.rows = results['total_races']
+
+            if prediction_writer is not None:
+                with span('predictions_write') as s:
+                    prediction_writer.close()
+                    s.rows = prediction_writer.rows
+        finally:
+            if writer_conn is not None:
+                writer_conn.close()
+
+        # 結果表示
+        print_results(results, detailed)
+
+        # DB保存
+        if args.save:
+            with span('db_write'):
+                save_results_to_db(results)
+
+        # 精度低下チェック
+        if args.check_degradation:
+            alerts = check_accuracy_degradation(results)
+            if alerts:
+                print("\n" + "!" * 70)
+                print("  [WARNING] Accuracy Degradation Detected!")
+                print("!" * 70)
+                for alert in alerts:
+                    print(f"  - {alert}")
+                print("\nConsider retraining the model.")
+                sys.exit(1)  # GitHub Actions で失敗として検知可能
+            else:
+                print("\n[OK] No significant accuracy degradation detected.")
 
-    # バックテスト実行
-    results, detailed = run_backtest(
-        races,
-        model_path=args.model,
-        verbose=not args.quiet
-    )
-
-    # 結果表示
-    print_results(results, detailed)
-
-    # DB保存
-    if args.save:
-        save_results_to_db(results)
-
-    # 精度低下チェック
-    if args.check_degradation:
-        alerts = check_accuracy_degradation(results)
-        if alerts:
-            print("\n" + "!" * 70)
-            print("  [WARNING] Accuracy Degradation Detected!")
-            print("!" * 70)
-            for alert in alerts:
-                print(f"  - {alert}")
-            print("\nConsider retraining the model.")
-            sys.exit(1)  # GitHub Actions で失敗として検知可能
-        else:
-            print("\n[OK] No significant accuracy degradation detected.")
+    finally:
+        print_summary()
+        print_query_stats()
+        write_metrics(args.metrics_out, job='backtest', extra={'db': query_stats()})
 
 
 if __name__ == '__main__':
@@ -0,0 +1,482 @@
+"""
+予測パイプラインのベンチマーク
+
+synthetic_data.py の合成データ（シード固定）を SQLite または PostgreSQL の専用スキーマに読み込み、
+本番と同じ関数で各ステージを実行して処理時間を計測する（DATABASE_URL は不要）
+
+ステージ:
+  generate        合成データ生成
+  load            SQLite / PostgreSQL への読み込み
+  extract         fetch_training_data_enhanced（訓練データ取得SQL）
+  features        prepare_enhanced_features（EnhancedFeatureEngineer）
+  features_basic  FeatureEngineer.create_features
+  train           train_enhanced_model（XGBoost）
+  predict         RacePredictor.predict_probabilities（1レースずつ）
+  combinations    ImprovedCombinationPredictor.get_all_predictions
+  backtest        run_backtest
+
+処理時間が長いステージは --limit で対象レース数の上限を決める（結果JSONに記録）
+結果は ml/benchmarks/benchmark_<規模>_<日時>.json に保存し、history.jsonl に追記する
+--compare で前回（同じ規模）の結果と比較し、遅くなったステージを表示する
+
+使用方法:
+    python ml/benchmark.py                                  # 10k レース（SQLite）
+    python ml/benchmark.py --scale 100k
+    python ml/benchmark.py --scale 1m --stages extract,features
+    python ml/benchmark.py --postgres-url postgresql://localhost/bench
+    python ml/benchmark.py --compare latest --fail-on-regression
+    python ml/benchmark.py --profile features --profiler cprofile   # features ステージをプロファイル
+"""
+import io
+import os
+import sys
+import json
+import platform
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.synthetic_data import generate_dataset, load_into_sqlite, load_into_postgres, DEFAULT_SEED
+from ml.enhanced_feature_engineer import fetch_training_data_enhanced
+from ml.feature_engineer import FeatureEngineer
+from ml.train_enhanced_model import prepare_enhanced_features, train_enhanced_model
+from ml.improved_combination_predictor import ImprovedCombinationPredictor
+from ml.backtest import run_backtest
+from ml.instrumentation import get_recorder, enable_profiling
+from ml.profiling import add_profile_arguments
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+STAGES = ['generate', 'load', 'extract', 'features', 'features_basic', 'train', 'predict', 'combinations', 'backtest']
+
+# 各ステージの実行に必要な前段ステージ
+STAGE_DEPENDENCIES = {
+    'load': ['generate'],
+    'extract': ['load'],
+    'features': ['extract'],
+    'features_basic': ['extract'],
+    'train': ['features'],
+    'predict': ['train'],
+    'combinations': ['predict'],
+    'backtest': ['train'],
+}
+
+# 対象レース数の上限（全件では長すぎる、または規模に比例しないステージ）
+DEFAULT_LIMITS = {
+    'features': 20_000,
+    'features_basic': 500,
+    'predict': 2_000,
+    'combinations': 2_000,
+    'backtest': 500,
+}
+
+# ベンチマーク用の訓練パラメータ（本番より木を少なくして時間を抑える）
+BENCHMARK_PARAMS = {
+    'max_depth': 6,
+    'learning_rate': 0.1,
+    'n_estimators': 100,
+    'subsample': 0.8,
+    'colsample_bytree': 0.8,
+}
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+# --compare でこの割合以上遅くなったステージを回帰とみなす
+REGRESSION_THRESHOLD = 0.20
+
+
+class StageTimer:
+    """ステージごとの計測結果を記録（instrumentation.span で計測）"""
+
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, prerequisite=False):
+        """
+        ステージを計測
+
+        ブロック内で record['rows'] に処理件数を設定する
+        """
+        record = {'name': name, 'rows': None, 'prerequisite': prerequisite}
+        print(f"\n--- {name}{' (prerequisite)' if prerequisite else ''} ---")
+
+        with get_recorder().span(name) as s:
+            with redirect_stdout(io.StringIO()) if self.quiet else nullcontext():
+                yield record
+            s.rows = record['rows']
+
+        record['wall_seconds'] = round(s.wall_seconds, 4)
+        record['cpu_seconds'] = round(s.cpu_seconds, 4)
+        record['peak_rss_mb'] = s.peak_rss_mb
+        if record['rows'] and record['wall_seconds'] > 0:
+            record['rows_per_second'] = round(record['rows'] / record['wall_seconds'], 1)
+
+        self.stages.append(record)
+        print(f"  {name}: {record['wall_seconds']:.2f}s wall / {record['cpu_seconds']:.2f}s CPU"
+              + (f" / {record['rows']:,} rows" if record['rows'] else ''))
+
+
+def resolve_stages(selected):
+    """選択したステージと、その実行に必要な前段ステージを求める"""
+    required = set()
+
+    def add(stage):
+        if stage in required:
+            return
+        required.add(stage)
+        for dependency in STAGE_DEPENDENCIES.get(stage, []):
+            add(dependency)
+
+    for stage in selected:
+        add(stage)
+
+    return [stage for stage in STAGES if stage in required]
+
+
+def first_races(df, limit):
+    """race_id の出現順で先頭 limit レース分の行を返す"""
+    race_ids = df['race_id'].unique()
+    if limit is not None and len(race_ids) > limit:
+        race_ids = race_ids[:limit]
+        return df[df['race_id'].isin(race_ids)]
+    return df
+
+
+def _basic_feature_input(df):
+    """訓練データを FeatureEngineer の入力列名に合わせる（train_model.prepare_features と同じ対応）"""
+    df = df.copy()
+    df['racer_win_rate'] = df['win_rate']
+    df['racer_win_rate_venue'] = df['win_rate']
+    df['racer_second_rate'] = df['place_rate_2']
+    df['racer_third_rate'] = df['place_rate_3']
+    df['motor_second_rate'] = df['motor_rate_2']
+    df['motor_third_rate'] = df['motor_rate_3']
+    df['avg_start_timing'] = df['average_st']
+    df['grade'] = df['racer_grade']
+    df['racer_number'] = df['racer_id']
+    return df
+
+
+def run_benchmark(n_races, seed=DEFAULT_SEED, stages=None, limits=None, sqlite_path=None,
+                  postgres_url=None, train_params=None, quiet=False):
+    """
+    ベンチマークを実行
+
+    Args:
+        n_races: 合成データのレース数
+        seed: 乱数シード
+        stages: 計測するステージ（Noneの場合は全ステージ）
+        limits: {ステージ名: 対象レース数の上限}
+        sqlite_path: SQLiteファイル（Noneの場合は一時ファイル）
+        postgres_url: 指定した場合は SQLite の代わりに PostgreSQL の専用スキーマを使う
+        train_params: XGBoost のパラメータ
+        quiet: 各ステージの標準出力を抑制
+
+    Returns:
+        dict: ステージごとの計測結果と、訓練・バックテストの精度
+    """
+    selected = set(stages or STAGES)
+    plan = resolve_stages(selected)
+    limits = {**DEFAULT_LIMITS, **(limits or {})}
+    train_params = train_params or BENCHMARK_PARAMS
+
+    get_recorder().reset()
+    timer = StageTimer(quiet=quiet)
+    result = {'backend': 'postgres' if postgres_url else 'sqlite'}
+
+    temp_dir = None
+    if not postgres_url and sqlite_path is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        sqlite_path = os.path.join(temp_dir.name, 'benchmark.sqlite')
+
+    conn = None
+    model_file = None
+
+    try:
+        if 'generate' in plan:
+            with timer.stage('generate', 'generate' not in selected) as record:
+                dataset = generate_dataset(n_races, seed=seed)
+                record['rows'] = len(dataset['race_entries'])
+
+        if 'load' in plan:
+            with timer.stage('load', 'load' not in selected) as record:
+                if postgres_url:
+                    conn = load_into_postgres(dataset, postgres_url)
+                else:
+                    conn = load_into_sqlite(dataset, sqlite_path)
+                record['rows'] = sum(len(df) for df in dataset.values())
+
+        if 'extract' in plan:
+            with timer.stage('extract', 'extract' not in selected) as record:
+                df = fetch_training_data_enhanced(conn)
+                record['rows'] = len(df)
+
+        if 'features' in plan:
+            feature_input = first_races(df, limits.get('features'))
+            with timer.stage('features', 'features' not in selected) as record:
+                X, y, race_dates = prepare_enhanced_features(feature_input)
+                record['rows'] = len(X)
+
+        if 'features_basic' in plan:
+            basic_input = _basic_feature_input(first_races(df, limits.get('features_basic')))
+            racer_detailed_stats = pd.read_sql_query("SELECT * FROM racer_detailed_stats", conn)
+            with timer.stage('features_basic', 'features_basic' not in selected) as record:
+                feature_engineer = FeatureEngineer(historical_data=basic_input,
+                                                   racer_detailed_stats=racer_detailed_stats)
+                rows = 0
+                for _, race_data in basic_input.groupby('race_id', sort=False):
+                    rows += len(feature_engineer.create_features(race_data))
+                record['rows'] = rows
+
+        if 'train' in plan:
+            with timer.stage('train', 'train' not in selected) as record:
+                predictor, metrics = train_enhanced_model(X, y, race_dates, dict(train_params))
+                record['rows'] = len(X)
+            result['train_metrics'] = {key: round(float(value), 4) for key, value in metrics.items()}
+
+        if 'predict' in plan:
+            n_predict = min(len(X) // 6, limits.get('predict') or len(X) // 6)
+            with timer.stage('predict', 'predict' not in selected) as record:
+                probabilities = [
+                    predictor.predict_probabilities(X.iloc[i * 6:(i + 1) * 6])
+                    for i in range(n_predict)
+                ]
+                record['rows'] = n_predict * 6
+
+        if 'combinations' in plan:
+            n_combinations = min(len(probabilities), limits.get('combinations') or len(probabilities))
+            with timer.stage('combinations', 'combinations' not in selected) as record:
+                for probs in probabilities[:n_combinations]:
+                    ImprovedCombinationPredictor(probs).get_all_predictions(top_n=20)
+                record['rows'] = n_combinations
+
+        if 'backtest' in plan:
+            model_file = tempfile.NamedTemporaryFile(suffix='.pkl', delete=False)
+            model_file.close()
+            predictor.save(model_file.name)
+
+            # 訓練に使っていない末尾のレース（なければ先頭）を対象にする
+            race_ids = df['race_id'].unique()
+            n_backtest = min(len(race_ids), limits.get('backtest') or len(race_ids))
+            backtest_ids = race_ids[-n_backtest:]
+            races_by_id = {
+                race_id: race_df.sort_values('boat_number').reset_index(drop=True)
+                for race_id, race_df in df[df['race_id'].isin(backtest_ids)].groupby('race_id')
+            }
+            race_info = dataset['races'].set_index('id')
+            races = [
+                (race_id, race_info.at[race_id, 'race_date'], race_info.at[race_id, 'venue_id'],
+                 race_info.at[race_id, 'race_number'])
+                for race_id in backtest_ids
+            ]
+
+            with timer.stage('backtest', 'backtest' not in selected) as record:
+                backtest_results, _ = run_backtest(races, model_path=model_file.name, verbose=False,
+                                                   fetch_race=races_by_id.get)
+                record['rows'] = backtest_results['total_races']
+
+            total = backtest_results['total_races'] or 1
+            result['backtest'] = {
+                'total_races': backtest_results['total_races'],
+                'win_accuracy': round(backtest_results['win_correct'] / total, 4),
+                'sanrentan_top10': round(backtest_results['sanrentan_top10'] / total, 4),
+            }
+
+    finally:
+        if conn is not None:
+            conn.close()
+        if model_file is not None:
+            os.unlink(model_file.name)
+        if temp_dir is not None:
+            temp_dir.cleanup()
+
+    result['stages'] = timer.stages
+    # ステージ内の span（backtest/predict など）の内訳
+    result['spans'] = get_recorder().summary()
+    result['limits'] = limits
+    result['train_params'] = train_params
+    return result
+
+
+def environment_info():
+    """計測環境（結果の比較時に確認する）"""
+    import sklearn
+    import xgboost
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'git_commit': commit,
+        'packages': {
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'xgboost': xgboost.__version__,
+            'scikit-learn': sklearn.__version__,
+        },
+    }
+
+
+def load_previous(compare, output_dir, scale):
+    """比較対象の結果を読み込む（'latest' の場合は history.jsonl の同じ規模の最新）"""
+    if compare != 'latest':
+        with open(compare, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    history_path = os.path.join(output_dir, 'history.jsonl')
+    if not os.path.exists(history_path):
+        return None
+
+    previous = None
+    with open(history_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('scale') == scale:
+                previous = entry
+    return previous
+
+
+def compare_results(current, previous, threshold=REGRESSION_THRESHOLD):
+    """
+    ステージごとの経過時間を比較
+
+    Returns:
+        list: threshold 以上遅くなったステージ名
+    """
+    previous_stages = {s['name']: s for s in previous.get('stages', [])}
+    regressions = []
+
+    print(f"\n=== 前回との比較（{previous.get('timestamp')}, commit {previous.get('environment', {}).get('git_commit')}） ===")
+    for stage in current['stages']:
+        before = previous_stages.get(stage['name'])
+        if before is None or not before.get('wall_seconds'):
+            continue
+
+        ratio = stage['wall_seconds'] / before['wall_seconds']
+        mark = ''
+        if ratio >= 1 + threshold and not stage['prerequisite']:
+            mark = '  [SLOWER]'
+            regressions.append(stage['name'])
+        elif ratio <= 1 - threshold:
+            mark = '  [faster]'
+
+        print(f"  {stage['name']:15s} {before['wall_seconds']:9.2f}s -> {stage['wall_seconds']:9.2f}s "
+              f"({(ratio - 1) * 100:+.1f}%){mark}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the prediction pipeline on seeded synthetic data')
+    parser.add_argument('--scale', choices=SCALES.keys(), default='10k', help='Dataset size (default: 10k)')
+    parser.add_argument('--races', type=int, default=None, help='Number of races (overrides --scale)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f'Random seed (default: {DEFAULT_SEED})')
+    parser.add_argument('--stages', type=str, default=None,
+                        help=f'Comma separated stages to time (default: all). Choices: {",".join(STAGES)}')
+    parser.add_argument('--limit', action='append', default=[], metavar='STAGE=RACES',
+                        help='Cap the races used by a stage, e.g. --limit features=50000 (repeatable)')
+    parser.add_argument('--n-estimators', type=int, default=BENCHMARK_PARAMS['n_estimators'],
+                        help=f"Trees for the train stage (default: {BENCHMARK_PARAMS['n_estimators']})")
+    parser.add_argument('--sqlite', type=str, default=None, help='SQLite file to use (default: temporary file)')
+    parser.add_argument('--postgres-url', type=str, default=None,
+                        help='Use a scratch schema in this PostgreSQL database instead of SQLite')
+    parser.add_argument('--output-dir', type=str, default=DEFAULT_OUTPUT_DIR,
+                        help='Directory for result JSON and history.jsonl')
+    parser.add_argument('--compare', type=str, default=None,
+                        help="Result JSON to compare with, or 'latest' for the previous run of the same scale")
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help=f'Exit with status 1 if a stage is {REGRESSION_THRESHOLD:.0%} slower than --compare')
+    parser.add_argument('--quiet', action='store_true', help='Hide output printed inside stages')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    enable_profiling(args)
+
+    stages = None
+    if args.stages:
+        stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    limits = {}
+    for item in args.limit:
+        stage, _, value = item.partition('=')
+        if stage not in STAGES or not value.isdigit():
+            parser.error(f"invalid --limit: {item}")
+        limits[stage] = int(value)
+
+    n_races = args.races or SCALES[args.scale]
+    scale = args.scale if args.races is None else str(args.races)
+
+    print("=" * 70)
+    print(f"  Pipeline Benchmark - {n_races:,} races (seed {args.seed})")
+    print("=" * 70)
+
+    previous = load_previous(args.compare, args.output_dir, scale) if args.compare else None
+
+    result = run_benchmark(
+        n_races,
+        seed=args.seed,
+        stages=stages,
+        limits=limits,
+        sqlite_path=args.sqlite,
+        postgres_url=args.postgres_url,
+        train_params={**BENCHMARK_PARAMS, 'n_estimators': args.n_estimators},
+        quiet=args.quiet
+    )
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    result = {
+        'timestamp': timestamp,
+        'scale': scale,
+        'races': n_races,
+        'seed': args.seed,
+        'environment': environment_info(),
+        **result,
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f'benchmark_{scale}_{timestamp}.json')
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False, default=str)
+    with open(os.path.join(args.output_dir, 'history.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result, ensure_ascii=False, default=str) + '\n')
+
+    print("\n=== 結果 ===")
+    for stage in result['stages']:
+        rate = f"{stage['rows_per_second']:>12,.0f} rows/s" if stage.get('rows_per_second') else ''
+        print(f"  {stage['name']:15s} {stage['wall_seconds']:9.2f}s {rate}"
+              + (' (prerequisite)' if stage['prerequisite'] else ''))
+    print(f"\n保存: {output_path}")
+
+    if get_recorder().profiler is not None:
+        get_recorder().profiler.write(args.output_dir, f'benchmark_{scale}_{timestamp}')
+
+    regressions = []
+    if args.compare:
+        if previous is None:
+            print("\n比較対象の結果がありません")
+        else:
+            regressions = compare_results(result, previous)
+
+    if regressions and args.fail_on_regression:
+        print(f"\n[WARNING] 遅くなったステージ: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,22 @@
 """
 レーサー統計計算スクリプト
 過去のレース結果から各レーサーの統計データを計算してracer_statisticsテーブルに保存
+
+使用方法:
+    python ml/calculate_racer_stats.py                   # 全レーサーを一括集計（デフォルト）
+    python ml/calculate_racer_stats.py --since-last-run  # 前回以降に出走したレーサーのみ再計算
+    python ml/calculate_racer_stats.py --legacy          # 従来のレーサー単位の計算
 """
 import os
-import json
-from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import Json
+import sys
+import argparse
+from psycopg2.extras import Json, execute_values
 from datetime import datetime
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.db import connect
+from ml.point_in_time_stats import has_entry_updated_at
 
 
 def calculate_stats_for_racer(cursor, racer_number):
@@ -133,7 +140,7 @@ def calculate_stats_for_racer(cursor, racer_number):
 def calculate_all_racer_stats():
     """全レーサーの統計を計算してDBに保存"""
     print("データベース接続中...")
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     try:
@@ -195,5 +202,276 @@ def calculate_all_racer_stats():
         conn.close()
 
 
+def _empty_stats():
+    return {
+        'weather': {},
+        'venue': {},
+        'course': {},
+        'winning_technique': {}
+    }
+
+
+def _place_stats(races, wins, place_2, place_3):
+    """出走数・着順カウントから成績dictを作成（calculate_stats_for_racerと同じ形式）"""
+    return {
+        'races': races,
+        'wins': wins,
+        'place_2': place_2,
+        'place_3': place_3,
+        'win_rate': round(wins / races * 100, 2) if races > 0 else 0,
+        'place_rate_2': round(place_2 / races * 100, 2) if races > 0 else 0,
+        'place_rate_3': round(place_3 / races * 100, 2) if races > 0 else 0
+    }
+
+
+def fetch_target_racers(cursor, since_last_run=False):
+    """
+    統計を計算するレーサーを取得
+
+    Args:
+        since_last_run: Trueの場合、前回計算以降に出走データが追加・更新されたレーサーと
+                        統計未作成のレーサーのみを返す
+                        （race_entries.updated_at を使う: scraper/migrations/add_race_entries_updated_at.sql）
+                        着順は出走表の行を作成した後の upsert で入るため、created_at では判定できない
+                        updated_at 列がない場合は全レーサーを返す
+    """
+    if not since_last_run:
+        cursor.execute("SELECT racer_number FROM racers ORDER BY racer_number")
+        return [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("SELECT MAX(calculated_at) FROM racer_statistics")
+    last_run = cursor.fetchone()[0]
+
+    if last_run is None:
+        return fetch_target_racers(cursor, since_last_run=False)
+
+    if not has_entry_updated_at(cursor):
+        print("[WARNING] race_entries.updated_at がありません（scraper/migrations/add_race_entries_updated_at.sql を"
+              "実行してください）。全レーサーを再計算します")
+        return fetch_target_racers(cursor, since_last_run=False)
+
+    cursor.execute("""
+        SELECT rc.racer_number
+        FROM racers rc
+        WHERE NOT EXISTS (
+            SELECT 1 FROM racer_statistics rs WHERE rs.racer_number = rc.racer_number
+        )
+        OR EXISTS (
+            SELECT 1 FROM race_entries re
+            WHERE re.racer_id = rc.racer_number AND re.updated_at > %s
+        )
+        ORDER BY rc.racer_number
+    """, (last_run,))
+
+    return [row[0] for row in cursor.fetchall()]
+
+
+def calculate_stats_bulk(cursor, racer_numbers):
+    """
+    複数レーサーの統計をまとめて計算
+
+    レーサー単位で5クエリを発行する代わりに、内訳ごとに1回の GROUP BY で全員分を集計する
+
+    Returns:
+        dict: racer_number -> (stats, data_from_date, data_to_date)
+    """
+    params = {'racers': list(racer_numbers)}
+
+    results = {
+        racer_number: [_empty_stats(), None, None]
+        for racer_number in racer_numbers
+    }
+
+    # データ範囲
+    cursor.execute("""
+        SELECT re.racer_id, MIN(r.race_date), MAX(r.race_date)
+        FROM race_entries re
+        JOIN races r ON re.race_id = r.id
+        WHERE re.racer_id = ANY(%(racers)s)
+        GROUP BY re.racer_id
+    """, params)
+
+    for racer_number, data_from_date, data_to_date in cursor.fetchall():
+        results[racer_number][1] = data_from_date
+        results[racer_number][2] = data_to_date
+
+    # 天候別統計
+    cursor.execute("""
+        SELECT
+            re.racer_id,
+            wd.weather_condition,
+            COUNT(*) as races,
+            SUM(CASE WHEN re.result_position = 1 THEN 1 ELSE 0 END) as wins,
+            SUM(CASE WHEN re.result_position <= 2 THEN 1 ELSE 0 END) as place_2,
+            SUM(CASE WHEN re.result_position <= 3 THEN 1 ELSE 0 END) as place_3
+        FROM race_entries re
+        JOIN races r ON re.race_id = r.id
+        LEFT JOIN weather_data wd ON wd.race_id = r.id
+        WHERE re.racer_id = ANY(%(racers)s) AND re.result_position IS NOT NULL
+        AND wd.weather_condition IS NOT NULL
+        GROUP BY re.racer_id, wd.weather_condition
+    """, params)
+
+    for racer_number, weather, races, wins, place_2, place_3 in cursor.fetchall():
+        results[racer_number][0]['weather'][weather] = _place_stats(races, wins, place_2, place_3)
+
+    # 会場別統計
+    cursor.execute("""
+        SELECT
+            re.racer_id,
+            r.venue_id,
+            COUNT(*) as races,
+            SUM(CASE WHEN re.result_position = 1 THEN 1 ELSE 0 END) as wins,
+            SUM(CASE WHEN re.result_position <= 2 THEN 1 ELSE 0 END) as place_2,
+            SUM(CASE WHEN re.result_position <= 3 THEN 1 ELSE 0 END) as place_3
+        FROM race_entries re
+        JOIN races r ON re.race_id = r.id
+        WHERE re.racer_id = ANY(%(racers)s) AND re.result_position IS NOT NULL
+        GROUP BY re.racer_id, r.venue_id
+    """, params)
+
+    for racer_number, venue_id, races, wins, place_2, place_3 in cursor.fetchall():
+        results[racer_number][0]['venue'][str(venue_id)] = _place_stats(races, wins, place_2, place_3)
+
+    # コース別統計（実績ベース）
+    cursor.execute("""
+        SELECT
+            re.racer_id,
+            re.actual_course,
+            COUNT(*) as races,
+            SUM(CASE WHEN re.result_position = 1 THEN 1 ELSE 0 END) as wins,
+            SUM(CASE WHEN re.result_position <= 2 THEN 1 ELSE 0 END) as place_2,
+            SUM(CASE WHEN re.result_position <= 3 THEN 1 ELSE 0 END) as place_3
+        FROM race_entries re
+        WHERE re.racer_id = ANY(%(racers)s) AND re.result_position IS NOT NULL
+        AND re.actual_course IS NOT NULL
+        GROUP BY re.racer_id, re.actual_course
+    """, params)
+
+    for racer_number, course, races, wins, place_2, place_3 in cursor.fetchall():
+        results[racer_number][0]['course'][str(course)] = _place_stats(races, wins, place_2, place_3)
+
+    # 決まり手統計（実績ベース）
+    cursor.execute("""
+        SELECT
+            re.racer_id,
+            re.winning_technique,
+            COUNT(*) as count
+        FROM race_entries re
+        WHERE re.racer_id = ANY(%(racers)s)
+        AND re.result_position = 1
+        AND re.winning_technique IS NOT NULL
+        GROUP BY re.racer_id, re.winning_technique
+    """, params)
+
+    for racer_number, technique, count in cursor.fetchall():
+        results[racer_number][0]['winning_technique'][technique] = count
+
+    return {racer_number: tuple(value) for racer_number, value in results.items()}
+
+
+def save_stats_bulk(cursor, results, page_size=1000, calculated_at=None):
+    """
+    計算済み統計を execute_values で一括upsert
+
+    Args:
+        calculated_at: 計算日時（次回の --since-last-run の基準。省略時は現在時刻）
+    """
+    if calculated_at is None:
+        calculated_at = datetime.now()
+
+    rows = [
+        (
+            racer_number,
+            Json(stats['weather']),
+            Json(stats['venue']),
+            Json(stats['course']),
+            Json(stats['winning_technique']),
+            data_from_date,
+            data_to_date,
+            calculated_at
+        )
+        for racer_number, (stats, data_from_date, data_to_date) in results.items()
+    ]
+
+    execute_values(cursor, """
+        INSERT INTO racer_statistics
+        (racer_number, weather_stats, venue_stats, course_stats, winning_technique_stats,
+         data_from_date, data_to_date, calculated_at)
+        VALUES %s
+        ON CONFLICT (racer_number) DO UPDATE
+        SET weather_stats = EXCLUDED.weather_stats,
+            venue_stats = EXCLUDED.venue_stats,
+            course_stats = EXCLUDED.course_stats,
+            winning_technique_stats = EXCLUDED.winning_technique_stats,
+            data_from_date = EXCLUDED.data_from_date,
+            data_to_date = EXCLUDED.data_to_date,
+            calculated_at = EXCLUDED.calculated_at
+    """, rows, page_size=page_size)
+
+    return len(rows)
+
+
+def calculate_all_racer_stats_bulk(since_last_run=False):
+    """全レーサー（または前回以降に出走したレーサー）の統計を一括計算してDBに保存"""
+    print("データベース接続中...")
+    conn = connect()
+    cursor = conn.cursor()
+
+    try:
+        # 集計前のDBの時刻を計算日時とする（集計中に更新された出走は次回の対象になる）
+        cursor.execute("SELECT NOW()::timestamp")
+        calculated_at = cursor.fetchone()[0]
+
+        racer_numbers = fetch_target_racers(cursor, since_last_run=since_last_run)
+
+        if not racer_numbers:
+            print("[OK] 再計算が必要なレーサーはいません")
+            return
+
+        mode = "前回以降に出走したレーサー" if since_last_run else "全レーサー"
+        print(f"統計計算開始（一括集計・{mode}）... ({len(racer_numbers)} 人のレーサー)")
+
+        start_time = datetime.now()
+        results = calculate_stats_bulk(cursor, racer_numbers)
+        print(f"  集計完了: {(datetime.now() - start_time).total_seconds():.1f}秒")
+
+        start_time = datetime.now()
+        saved = save_stats_bulk(cursor, results, calculated_at=calculated_at)
+        conn.commit()
+        print(f"  保存完了: {(datetime.now() - start_time).total_seconds():.1f}秒")
+
+        print(f"[OK] 統計計算完了: {saved} 人のレーサー")
+
+        # 結果サマリー
+        cursor.execute("SELECT COUNT(*) FROM racer_statistics")
+        total_stats = cursor.fetchone()[0]
+        print(f"\n統計レコード数: {total_stats}")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"[ERROR] 統計計算失敗: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description='Calculate racer statistics')
+    parser.add_argument('--since-last-run', action='store_true',
+                        help='Only recompute racers with entries added or updated since the last run')
+    parser.add_argument('--legacy', action='store_true',
+                        help='Use the per-racer calculation (5 queries per racer)')
+    args = parser.parse_args()
+
+    if args.legacy:
+        calculate_all_racer_stats()
+    else:
+        calculate_all_racer_stats_bulk(since_last_run=args.since_last_run)
+
+
 if __name__ == '__main__':
-    calculate_all_racer_stats()
+    main()
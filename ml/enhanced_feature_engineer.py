@@ -11,22 +11,19 @@ race_entriesテーブルの実データを最大限活用して特徴量を生
 import pandas as pd
 import numpy as np
 import os
-from dotenv import load_dotenv
-import psycopg2
+import sys
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.db import connect
+from ml.race_cards import VENUE_NAMES, DETAILED_STATS_DEFAULTS, flatten_detailed_stats
 
 
 class EnhancedFeatureEngineer:
     """race_entriesの実データを活用した特徴量エンジニアリング"""
 
     # 会場IDと名前のマッピング
-    VENUE_NAMES = {
-        1: '桐生', 2: '戸田', 3: '江戸川', 4: '平和島', 5: '多摩川', 6: '浜名湖',
-        7: '蒲郡', 8: '常滑', 9: '津', 10: '三国', 11: '琵琶湖', 12: '住之江',
-        13: '尼崎', 14: '鳴門', 15: '丸亀', 16: '児島', 17: '宮島', 18: '徳山',
-        19: '下関', 20: '若松', 21: '芦屋', 22: '福岡', 23: '唐津', 24: '大村'
-    }
+    VENUE_NAMES = VENUE_NAMES
 
     # 会場別のコース1勝率（統計データ）
     VENUE_COURSE1_WIN_RATE = {
@@ -93,6 +90,192 @@ class EnhancedFeatureEngineer:
 
         return pd.DataFrame(features_list)
 
+    def create_features_table(self, table):
+        """
+        全レース分の特徴量をまとめて生成（create_features と同じ列・同じ値）
+
+        Args:
+            table: RaceTable（ml/race_table.py）
+
+        Returns:
+            DataFrame: 特徴量（レース数×6行、レース順・艇番順）
+        """
+        n = len(table) * 6
+
+        def rate(field, default):
+            # 欠損は default（float32 で保持している値を float64 で計算する）
+            values = table.float64(field)
+            return np.where(np.isnan(values), default, values)
+
+        def count(field, default=0):
+            # 欠損（-1）は default
+            values = table[field].astype(np.int64)
+            return np.where(values < 0, default, values)
+
+        def truthy_or(field, default):
+            # create_features の「値が 0 / 欠損なら default」
+            values = table.float64(field)
+            return np.where(np.isnan(values) | (values == 0), default, values)
+
+        features = {}
+
+        # 1. 基本特徴量
+        win_rate = rate('win_rate', 5.0)
+        grade = table['racer_grade']
+        features['win_rate'] = win_rate
+        features['place_rate_2'] = rate('place_rate_2', 30.0)
+        features['place_rate_3'] = rate('place_rate_3', 50.0)
+        features['grade_score'] = np.where(grade >= 0, 4 - grade.astype(np.int64), 2)
+        features['is_a_class'] = ((grade == 0) | (grade == 1)).astype(np.int64)
+        features['is_a1'] = (grade == 0).astype(np.int64)
+
+        # 2. モーター特徴量
+        motor_rate_2 = rate('motor_rate_2', 30.0)
+        features['motor_rate_2'] = motor_rate_2
+        features['motor_rate_3'] = rate('motor_rate_3', 50.0)
+        features['boat_rate_2'] = rate('boat_rate_2', 30.0)
+        features['motor_quality'] = (motor_rate_2 > 40).astype(np.int64)
+        features['motor_poor'] = (motor_rate_2 < 25).astype(np.int64)
+
+        # 3. 展示タイム特徴量
+        exhibition_time = rate('exhibition_time', 6.80)
+        features['exhibition_time'] = exhibition_time
+        features['exhibition_turn_time'] = rate('exhibition_turn_time', 5.50)
+        features['exhibition_straight_time'] = rate('exhibition_straight_time', 7.50)
+        features['exhibition_quality'] = np.maximum(0, (6.80 - exhibition_time) * 10)
+
+        # 4. スタート特徴量
+        average_st = rate('average_st', 0.15)
+        flying_count = count('flying_count')
+        late_count = count('late_count')
+        features['average_st'] = average_st
+        features['flying_count'] = flying_count
+        features['late_count'] = late_count
+        features['start_quality'] = np.maximum(0, (0.18 - average_st) * 50)
+        features['start_risk'] = flying_count + late_count * 0.5
+
+        # 5. コース特徴量
+        venue_id = np.repeat(np.where(table.venue_id > 0, table.venue_id, 1).astype(np.int64), 6).reshape(-1, 6)
+        boat_number = count('boat_number', 1)
+        course = count('course', -1)
+        course = np.where(course < 0, count('actual_course', -1), course)
+        course = np.where(course < 0, boat_number, course)
+
+        venue_course1_lookup = np.full(256, 0.54)
+        for venue, value in self.VENUE_COURSE1_WIN_RATE.items():
+            venue_course1_lookup[venue] = value
+        course_win_lookup = np.full(256, 0.10)
+        for course_number, value in self.COURSE_WIN_RATE.items():
+            course_win_lookup[course_number] = value
+
+        features['boat_number'] = boat_number
+        features['course'] = course
+        features['venue_id'] = venue_id
+        features['is_course_1'] = (course == 1).astype(np.int64)
+        features['is_inner_course'] = (course <= 3).astype(np.int64)
+        features['course_win_rate'] = course_win_lookup[np.clip(course, 0, 255)]
+        features['venue_course1_rate'] = venue_course1_lookup[np.clip(venue_id, 0, 255)]
+        features['course_advantage'] = np.maximum(0, (4 - course) * 0.1)
+
+        # 6. レース内相対特徴量（自艇より速い展示タイム・高い勝率の艇数 + 1）
+        exhibition_rank = (exhibition_time[:, None, :] < exhibition_time[:, :, None]).sum(axis=2) + 1
+        win_rate_rank = (win_rate[:, None, :] > win_rate[:, :, None]).sum(axis=2) + 1
+        features['exhibition_rank'] = exhibition_rank.astype(np.int64)
+        features['win_rate_rank'] = win_rate_rank.astype(np.int64)
+        features['is_top_exhibition'] = (exhibition_rank == 1).astype(np.int64)
+        features['is_top_win_rate'] = (win_rate_rank == 1).astype(np.int64)
+
+        # 7. 詳細統計特徴量
+        racer_win_rate = truthy_or('racer_overall_win_rate', 0.0)
+        sg_appearances = count('sg_appearances')
+        late_start_count = count('racer_late_count')
+        detailed = {
+            column: count(column, default) if isinstance(default, int) else rate(column, default)
+            for column, default in DETAILED_STATS_DEFAULTS.items()
+        }
+
+        features['racer_win_rate'] = racer_win_rate
+        features['racer_second_rate'] = truthy_or('racer_2nd_rate', 0.0)
+        features['racer_third_rate'] = truthy_or('racer_3rd_rate', 0.0)
+        features['racer_avg_st'] = truthy_or('racer_avg_st', 0.15)
+        features['sg_appearances'] = sg_appearances
+        features['high_grade_experience'] = (sg_appearances > 0).astype(np.int64)
+        features['late_start_count'] = late_start_count
+        features['penalty_risk_score'] = late_start_count * 0.5
+
+        features['sg_win_rate'] = detailed['sg_win_rate']
+        features['sg_experience_score'] = detailed['sg_experience_score']
+        features['g1_win_rate'] = detailed['g1_win_rate']
+        features['g2_win_rate'] = detailed['g2_win_rate']
+        features['g3_win_rate'] = detailed['g3_win_rate']
+        features['racer_grade_score'] = (
+            features['sg_win_rate'] * 2.0 +
+            features['g1_win_rate'] * 1.5 +
+            features['g2_win_rate'] * 1.2 +
+            features['g3_win_rate'] * 1.0
+        )
+        features['total_yusyutsu'] = detailed['total_yusyutsu']
+        features['total_yusho'] = detailed['total_yusho']
+        features['yusyutsu_rate'] = detailed['total_yusyutsu'] * 0.1
+        features['yusho_rate'] = detailed['total_yusho'] * 0.2
+
+        for column in ('course_specific_1st_rate', 'course_win_rate_venue', 'course_nige_rate',
+                       'course_sashi_rate', 'course_makuri_rate'):
+            features[column] = detailed[column]
+
+        features['venue_specific_win_rate'] = detailed['venue_specific_win_rate']
+        features['venue_specific_1st_rate'] = detailed['venue_specific_1st_rate']
+        features['venue_specific_2nd_rate'] = detailed['venue_specific_2nd_rate']
+        features['racer_win_rate_venue'] = detailed['venue_specific_win_rate']
+        features['racer_avg_st_venue'] = detailed['racer_avg_st_venue']
+        features['venue_experience'] = detailed['venue_experience']
+        features['racer_venue_experience'] = detailed['venue_experience']
+
+        features['total_ability_score'] = (
+            features['racer_win_rate'] * 0.3 +
+            features['racer_grade_score'] * 0.2 +
+            features['venue_specific_win_rate'] * 0.2 +
+            features['course_specific_1st_rate'] * 0.3
+        )
+
+        # create_features と同じく motor_rate_2 / motor_rate_3 が 0 の場合だけ既定値（欠損はそのまま）
+        zeros = np.zeros((len(table), 6))
+        features['racer_motor_score'] = zeros
+        features['motor_second_rate'] = self._table_or_default(table, 'motor_rate_2', 30.0)
+        features['motor_third_rate'] = self._table_or_default(table, 'motor_rate_3', 50.0)
+        features['boat_num_specific_1st_rate'] = zeros
+        features['boat_num_specific_2nd_rate'] = zeros
+        features['boat_num_affinity'] = zeros
+        features['recent_5races_avg'] = racer_win_rate
+        features['recent_10races_avg'] = racer_win_rate
+        for column in ('trend_score', 'temperature', 'wind_speed', 'wind_direction',
+                       'wave_height', 'wind_impact_score'):
+            features[column] = zeros
+
+        # 8. 複合特徴量
+        features['total_score'] = (
+            features['win_rate'] * 0.3 +
+            features['motor_rate_2'] * 0.2 +
+            features['exhibition_quality'] * 0.2 +
+            features['course_advantage'] * 10 +
+            features['start_quality'] * 0.1
+        )
+        features['course1_ability'] = features['is_course_1'] * features['win_rate'] * 0.1
+        features['motor_exhibition_score'] = features['motor_rate_2'] * features['exhibition_quality'] * 0.01
+
+        return pd.DataFrame({
+            column: np.ascontiguousarray(values).reshape(n)
+            for column, values in features.items()
+        })
+
+    @staticmethod
+    def _table_or_default(table, field, default):
+        """float(boat.get(field, default) or default) と同じ値（項目がない・0 なら default）"""
+        if not table.has(field):
+            return np.full((len(table), 6), default)
+        values = table.float64(field)
+        return np.where(values == 0, default, values)
+
     def _basic_features(self, boat):
         """基本的な選手・艇関連の特徴量"""
         # race_entriesの実データを使用（なければデフォルト値）
@@ -173,8 +356,11 @@ class EnhancedFeatureEngineer:
         if average_st is None or pd.isna(average_st):
             average_st = boat.get('avg_start_timing', 0.15)
 
-        flying_count = boat.get('flying_count', 0) or 0
-        late_count = boat.get('late_count', 0) or 0
+        # 欠損（None / NaN）は 0 回
+        flying_count = boat.get('flying_count', 0)
+        flying_count = 0 if flying_count is None or pd.isna(flying_count) else flying_count
+        late_count = boat.get('late_count', 0)
+        late_count = 0 if late_count is None or pd.isna(late_count) else late_count
 
         return {
             'average_st': float(average_st),
@@ -269,116 +455,51 @@ class EnhancedFeatureEngineer:
         features['high_grade_experience'] = 1 if features['sg_appearances'] > 0 else 0
 
         # フライング・出遅れ
-        features['late_start_count'] = int(boat.get('racer_late_count', 0) or 0)
+        racer_late_count = boat.get('racer_late_count')
+        features['late_start_count'] = int(racer_late_count) if racer_late_count and not pd.isna(racer_late_count) else 0
         features['penalty_risk_score'] = features['late_start_count'] * 0.5
 
-        # グレード別成績（grade_stats）
-        grade_stats = boat.get('grade_stats')
-        if grade_stats and isinstance(grade_stats, dict):
-            sg_stats = grade_stats.get('SG', {})
-            features['sg_win_rate'] = float(sg_stats.get('win_rate', 0))
-            features['sg_experience_score'] = 1 if sg_stats.get('races', 0) > 0 else 0
-
-            g1_stats = grade_stats.get('G1', {})
-            features['g1_win_rate'] = float(g1_stats.get('win_rate', 0))
-
-            g2_stats = grade_stats.get('G2', {})
-            features['g2_win_rate'] = float(g2_stats.get('win_rate', 0))
-
-            g3_stats = grade_stats.get('G3', {})
-            features['g3_win_rate'] = float(g3_stats.get('win_rate', 0))
-
-            features['racer_grade_score'] = (
-                features['sg_win_rate'] * 2.0 +
-                features['g1_win_rate'] * 1.5 +
-                features['g2_win_rate'] * 1.2 +
-                features['g3_win_rate'] * 1.0
+        # グレード別・コース別・会場別成績
+        # racer_detailed_stats の JSONB があればそこから取り出し、なければ race_cards の列を使う
+        if any(column in boat for column in ('grade_stats', 'course_stats', 'venue_stats')):
+            detailed = flatten_detailed_stats(
+                boat.get('grade_stats'), boat.get('course_stats'), boat.get('venue_stats'),
+                boat_number=int(boat.get('boat_number', 1)), venue_id=int(boat.get('venue_id', 1))
             )
-
-            total_yusyutsu = sum(g.get('yusyutsu', 0) for g in grade_stats.values() if isinstance(g, dict))
-            total_yusho = sum(g.get('yusho', 0) for g in grade_stats.values() if isinstance(g, dict))
-            features['total_yusyutsu'] = total_yusyutsu
-            features['total_yusho'] = total_yusho
-            features['yusyutsu_rate'] = total_yusyutsu * 0.1
-            features['yusho_rate'] = total_yusho * 0.2
-        else:
-            features['sg_win_rate'] = 0.0
-            features['sg_experience_score'] = 0
-            features['g1_win_rate'] = 0.0
-            features['g2_win_rate'] = 0.0
-            features['g3_win_rate'] = 0.0
-            features['racer_grade_score'] = 0.0
-            features['total_yusyutsu'] = 0
-            features['total_yusho'] = 0
-            features['yusyutsu_rate'] = 0.0
-            features['yusho_rate'] = 0.0
-
-        # コース別成績（course_stats）
-        course_stats = boat.get('course_stats')
-        boat_number = int(boat.get('boat_number', 1))
-
-        if course_stats and isinstance(course_stats, dict):
-            course_data = None
-            for key in course_stats.keys():
-                if str(boat_number) in key:
-                    course_data = course_stats[key]
-                    break
-
-            if course_data and isinstance(course_data, dict):
-                features['course_specific_1st_rate'] = float(course_data.get('1st_rate', 0))
-                features['course_win_rate_venue'] = float(course_data.get('win_rate', 0))
-                features['course_nige_rate'] = float(course_data.get('nige_rate', 0)) if 'nige_rate' in course_data else 0.0
-                features['course_sashi_rate'] = float(course_data.get('sashi_rate', 0)) if 'sashi_rate' in course_data else 0.0
-                features['course_makuri_rate'] = float(course_data.get('makuri_rate', 0)) if 'makuri_rate' in course_data else 0.0
-            else:
-                features['course_specific_1st_rate'] = 0.0
-                features['course_win_rate_venue'] = 0.0
-                features['course_nige_rate'] = 0.0
-                features['course_sashi_rate'] = 0.0
-                features['course_makuri_rate'] = 0.0
         else:
-            features['course_specific_1st_rate'] = 0.0
-            features['course_win_rate_venue'] = 0.0
-            features['course_nige_rate'] = 0.0
-            features['course_sashi_rate'] = 0.0
-            features['course_makuri_rate'] = 0.0
-
-        # 会場別成績（venue_stats）
-        venue_stats = boat.get('venue_stats')
-        venue_id = int(boat.get('venue_id', 1))
-
-        if venue_stats and isinstance(venue_stats, dict):
-            venue_data = None
-            venue_name = self.VENUE_NAMES.get(venue_id, '')
-            for key in venue_stats.keys():
-                if venue_name and venue_name in key:
-                    venue_data = venue_stats[key]
-                    break
-
-            if venue_data and isinstance(venue_data, dict):
-                features['venue_specific_win_rate'] = float(venue_data.get('win_rate', 0))
-                features['venue_specific_1st_rate'] = float(venue_data.get('1st_rate', 0))
-                features['venue_specific_2nd_rate'] = float(venue_data.get('2nd_rate', 0))
-                features['racer_win_rate_venue'] = float(venue_data.get('win_rate', 0))
-                features['racer_avg_st_venue'] = float(venue_data.get('avg_st', 0.15))
-                features['venue_experience'] = int(venue_data.get('races', 0))
-                features['racer_venue_experience'] = features['venue_experience']
-            else:
-                features['venue_specific_win_rate'] = 0.0
-                features['venue_specific_1st_rate'] = 0.0
-                features['venue_specific_2nd_rate'] = 0.0
-                features['racer_win_rate_venue'] = 0.0
-                features['racer_avg_st_venue'] = 0.15
-                features['venue_experience'] = 0
-                features['racer_venue_experience'] = 0
-        else:
-            features['venue_specific_win_rate'] = 0.0
-            features['venue_specific_1st_rate'] = 0.0
-            features['venue_specific_2nd_rate'] = 0.0
-            features['racer_win_rate_venue'] = 0.0
-            features['racer_avg_st_venue'] = 0.15
-            features['venue_experience'] = 0
-            features['racer_venue_experience'] = 0
+            detailed = {}
+            for column, default in DETAILED_STATS_DEFAULTS.items():
+                value = boat.get(column)
+                detailed[column] = type(default)(value) if value is not None and not pd.isna(value) else default
+
+        # 列の順序は従来と同じにする（保存済みモデルの特徴量順）
+        features['sg_win_rate'] = detailed['sg_win_rate']
+        features['sg_experience_score'] = detailed['sg_experience_score']
+        features['g1_win_rate'] = detailed['g1_win_rate']
+        features['g2_win_rate'] = detailed['g2_win_rate']
+        features['g3_win_rate'] = detailed['g3_win_rate']
+        features['racer_grade_score'] = (
+            features['sg_win_rate'] * 2.0 +
+            features['g1_win_rate'] * 1.5 +
+            features['g2_win_rate'] * 1.2 +
+            features['g3_win_rate'] * 1.0
+        )
+        features['total_yusyutsu'] = detailed['total_yusyutsu']
+        features['total_yusho'] = detailed['total_yusho']
+        features['yusyutsu_rate'] = detailed['total_yusyutsu'] * 0.1
+        features['yusho_rate'] = detailed['total_yusho'] * 0.2
+
+        for column in ('course_specific_1st_rate', 'course_win_rate_venue', 'course_nige_rate',
+                       'course_sashi_rate', 'course_makuri_rate'):
+            features[column] = detailed[column]
+
+        features['venue_specific_win_rate'] = detailed['venue_specific_win_rate']
+        features['venue_specific_1st_rate'] = detailed['venue_specific_1st_rate']
+        features['venue_specific_2nd_rate'] = detailed['venue_specific_2nd_rate']
+        features['racer_win_rate_venue'] = detailed['venue_specific_win_rate']
+        features['racer_avg_st_venue'] = detailed['racer_avg_st_venue']
+        features['venue_experience'] = detailed['venue_experience']
+        features['racer_venue_experience'] = detailed['venue_experience']
 
         # 総合能力スコア
         features['total_ability_score'] = (
@@ -430,49 +551,58 @@ class EnhancedFeatureEngineer:
         }
 
 
-def fetch_training_data_enhanced():
-    """訓練データを取得（race_entriesの全データを含む）"""
-    print("=== 強化版: 訓練データを取得中 ===\n")
+# 着順が確定した全出走（races の並び順 = idx_races_recent、出走は idx_entries_finished で読める）
+TRAINING_DATA_QUERY = """
+    SELECT
+        re.race_id,
+        re.boat_number,
+        re.racer_id,
+        re.motor_number,
+        re.start_timing,
+        re.course,
+        re.result_position,
+        re.racer_grade,
+        re.win_rate,
+        re.place_rate_2,
+        re.place_rate_3,
+        re.motor_rate_2,
+        re.motor_rate_3,
+        re.boat_rate_2,
+        re.boat_rate_3,
+        re.exhibition_time,
+        re.exhibition_turn_time,
+        re.exhibition_straight_time,
+        re.average_st,
+        re.flying_count,
+        re.late_count,
+        re.actual_course,
+        r.race_date,
+        r.venue_id,
+        r.race_number,
+        r.grade as race_grade
+    FROM race_entries re
+    JOIN races r ON re.race_id = r.id
+    WHERE re.result_position IS NOT NULL
+    ORDER BY r.race_date DESC, r.venue_id, r.race_number, re.boat_number
+"""
+
+
+def fetch_training_data_enhanced(conn=None):
+    """
+    訓練データを取得（race_entriesの全データを含む）
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            re.race_id,
-            re.boat_number,
-            re.racer_id,
-            re.motor_number,
-            re.start_timing,
-            re.course,
-            re.result_position,
-            re.racer_grade,
-            re.win_rate,
-            re.place_rate_2,
-            re.place_rate_3,
-            re.motor_rate_2,
-            re.motor_rate_3,
-            re.boat_rate_2,
-            re.boat_rate_3,
-            re.exhibition_time,
-            re.exhibition_turn_time,
-            re.exhibition_straight_time,
-            re.average_st,
-            re.flying_count,
-            re.late_count,
-            re.actual_course,
-            r.race_date,
-            r.venue_id,
-            r.race_number,
-            r.grade as race_grade
-        FROM race_entries re
-        LEFT JOIN races r ON re.race_id = r.id
-        WHERE re.result_position IS NOT NULL
-        AND r.id IS NOT NULL
-        ORDER BY r.race_date DESC, r.venue_id, r.race_number, re.boat_number
+    Args:
+        conn: DB接続（Noneの場合は DATABASE_URL に接続して閉じる、ベンチマークでは SQLite 接続も可）
     """
+    print("=== 強化版: 訓練データを取得中 ===\n")
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
 
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    df = pd.read_sql_query(TRAINING_DATA_QUERY, conn)
+    if own_conn:
+        conn.close()
 
     print(f"取得データ数: {len(df):,}件")
     print(f"レース数: {df['race_id'].nunique():,}レース")
@@ -487,6 +617,33 @@ def fetch_training_data_enhanced():
     return df
 
 
+def fetch_training_table(conn=None):
+    """
+    訓練データを RaceTable で取得（全行の DataFrame を作らずに型付きの配列に読む）
+
+    Args:
+        conn: DB接続（Noneの場合は DATABASE_URL に接続して閉じる、ベンチマークでは SQLite 接続も可）
+    """
+    from ml.race_table import RaceTable
+
+    print("=== 強化版: 訓練データを取得中 ===\n")
+
+    table = RaceTable.from_sql(conn, TRAINING_DATA_QUERY)
+
+    print(f"レース数: {len(table):,}レース（{len(table) * 6:,}件）")
+    if len(table) > 0:
+        print(f"日付範囲: {table.race_date.min()} ～ {table.race_date.max()}")
+    print(f"メモリ使用量: {table.memory_usage() / 1024 / 1024:.1f} MB")
+
+    # データ品質チェック
+    print(f"\n=== データ品質 ===")
+    for field in ('win_rate', 'exhibition_time', 'motor_rate_2'):
+        notna = int(np.count_nonzero(~np.isnan(table[field]))) if len(table) else 0
+        print(f"{field}非null: {notna:,} ({notna / max(len(table) * 6, 1) * 100:.1f}%)")
+
+    return table
+
+
 if __name__ == '__main__':
     # テスト実行
     print("=== EnhancedFeatureEngineer Test ===\n")
@@ -5,8 +5,6 @@ import os
 import sys
 import pandas as pd
 import numpy as np
-from dotenv import load_dotenv
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
 # 親ディレクトリをパスに追加
@@ -14,15 +12,16 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ml.feature_engineer import FeatureEngineer
 from ml.race_predictor import RacePredictor
-
-load_dotenv()
+from ml.point_in_time_stats import update_daily_stats, load_point_in_time_stats
+from ml.weather_alignment import attach_weather
+from scraper.db import connect
 
 
 def fetch_training_data():
     """データベースから訓練データを取得"""
     print("=== データベースから訓練データを取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
     # race_entries と racers, races を結合してデータ取得
     query = """
@@ -59,67 +58,37 @@ def fetch_training_data():
     return df
 
 
-def fetch_racer_stats():
-    """選手統計データを取得（実データ）"""
-    print("\n=== 選手統計データを取得中 ===\n")
-
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            racer_id,
-            AVG(CASE WHEN result_position = 1 THEN 1.0 ELSE 0.0 END) * 100 as win_rate,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate,
-            AVG(start_timing) as avg_start_timing
-        FROM race_entries
-        WHERE result_position IS NOT NULL
-        GROUP BY racer_id
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    print(f"選手統計: {len(df)}名分")
-    return df
-
-
-def fetch_motor_stats():
-    """モーター統計データを取得（実データ）"""
-    print("\n=== モーター統計データを取得中 ===\n")
+def fetch_point_in_time_stats(df):
+    """選手・モーター統計をレース日時点で取得（当日以降の結果は含まない）"""
+    print("\n=== 選手・モーター統計（レース日時点）を取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    # 日次集計を最新化してから、各レース日時点の成績を計算
+    update_daily_stats()
+    racer_stats, motor_stats = load_point_in_time_stats(df)
 
-    query = """
-        SELECT
-            venue_id,
-            motor_number,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate
-        FROM race_entries re
-        JOIN races r ON re.race_id = r.id
-        WHERE motor_number IS NOT NULL AND result_position IS NOT NULL
-        GROUP BY venue_id, motor_number
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    print(f"モーター統計: {len(df)}個")
-    return df
+    print(f"選手統計: {racer_stats['racer_id'].nunique()}名 / {len(racer_stats)}件（選手×日付）")
+    print(f"モーター統計: {len(motor_stats)}件（会場×モーター×日付）")
+    return racer_stats, motor_stats
 
 
 def prepare_features(df, racer_stats, motor_stats):
     """特徴量を準備（実データ使用）"""
     print("\n=== 特徴量の生成 ===\n")
 
-    # 統計データをマージ
-    df = df.merge(racer_stats, on='racer_id', how='left', suffixes=('', '_stat'))
+    # 統計データをマージ（race_date列がある場合はレース日時点の統計として結合）
+    racer_keys = ['racer_id']
+    motor_keys = ['venue_id', 'motor_number']
+    if 'race_date' in racer_stats.columns:
+        racer_keys.append('race_date')
+    if 'race_date' in motor_stats.columns:
+        motor_keys.append('race_date')
+
+    df = df.merge(racer_stats, on=racer_keys, how='left', suffixes=('', '_stat'))
 
     # モーター統計をマージ
     df = df.merge(
         motor_stats,
-        on=['venue_id', 'motor_number'],
+        on=motor_keys,
         how='left',
         suffixes=('', '_motor')
     )
@@ -130,6 +99,9 @@ def prepare_features(df, racer_stats, motor_stats):
     df['third_rate'] = df['third_rate_motor'].fillna(50.0)
     df['avg_start_timing'] = df['avg_start_timing'].fillna(0.17)
 
+    # 天気データ（発走予定時刻時点の観測値を結合）
+    df = attach_weather(df)
+
     # FeatureEngineerの初期化（履歴データとして全データを渡す）
     feature_engineer = FeatureEngineer(historical_data=df)
 
@@ -145,13 +117,6 @@ def prepare_features(df, racer_stats, motor_stats):
             # 6艇揃っていないレースはスキップ
             continue
 
-        # 天気データ（現時点ではダミー値、将来的にweather_dataテーブルから取得）
-        # TODO: weather_dataテーブルから実データを取得する実装を追加
-        race_data['wind_speed'] = np.random.uniform(0.5, 8.0, len(race_data))
-        race_data['wind_direction'] = np.random.randint(0, 360, len(race_data))
-        race_data['temperature'] = np.random.uniform(15.0, 30.0, len(race_data))
-        race_data['wave_height'] = np.random.uniform(0, 10, len(race_data))
-
         # 選手統計をコピー
         race_data['racer_win_rate'] = race_data['win_rate']
         race_data['racer_win_rate_venue'] = race_data['win_rate']  # 簡易的に全国勝率を使用
@@ -219,8 +184,7 @@ def main():
             return
 
         # 2. 統計データ取得
-        racer_stats = fetch_racer_stats()
-        motor_stats = fetch_motor_stats()
+        racer_stats, motor_stats = fetch_point_in_time_stats(df)
 
         # 3. 特徴量生成
         X, y = prepare_features(df, racer_stats, motor_stats)
@@ -0,0 +1,227 @@
+"""
+主要クエリの実行計画の比較（インデックス追加前後）
+
+合成データ（synthetic_data.py）を検証用の PostgreSQL に読み込み、
+訓練・バックテストのクエリを EXPLAIN (ANALYZE, BUFFERS) で計測する
+1. 本番と同じインデックス（synthetic_data.TABLE_INDEXES）で計測
+2. scraper/migrations/add_ml_query_indexes.sql を適用
+3. 同じクエリを再計測
+
+fetch_completed_races は書き換え前のクエリ（全出走の GROUP BY）も計測する
+
+結果は ml/benchmarks/explain_<レース数>_<日時>.json に保存する
+本番DBではなく、作り直してよい検証用DBを指定すること（専用スキーマを作り直す）
+
+使用方法:
+    python ml/explain_queries.py --postgres-url postgresql://localhost/bench
+    python ml/explain_queries.py --postgres-url postgresql://localhost/bench --races 100000 --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.synthetic_data import generate_dataset, load_into_postgres, DEFAULT_SEED
+from ml.backtest import build_completed_races_query
+from ml.train_model import TRAINING_DATA_QUERY
+from ml.enhanced_feature_engineer import TRAINING_DATA_QUERY as ENHANCED_TRAINING_DATA_QUERY
+
+DEFAULT_RACES = 1_000_000
+DEFAULT_RUNS = 3
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIGRATION = os.path.join(ROOT_DIR, 'scraper', 'migrations', 'add_ml_query_indexes.sql')
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT_DIR, 'ml', 'benchmarks')
+
+# 書き換え前の fetch_completed_races（比較用）
+LEGACY_COMPLETED_RACES_QUERY = """
+    SELECT DISTINCT r.id, r.race_date, r.venue_id, r.race_number
+    FROM races r
+    JOIN race_entries re ON r.id = re.race_id
+    WHERE re.result_position IS NOT NULL
+    {date_filter}
+    GROUP BY r.id
+    HAVING COUNT(re.boat_number) = 6
+    ORDER BY r.race_date DESC, r.venue_id, r.race_number
+    LIMIT %(limit)s
+"""
+
+
+def build_queries(recent_date):
+    """
+    計測するクエリ
+
+    Returns:
+        list: (名前, クエリ, パラメータ)
+    """
+    queries = [
+        ('completed_races_legacy', LEGACY_COMPLETED_RACES_QUERY.format(date_filter=''), {'limit': 100}),
+        ('completed_races_since_legacy',
+         LEGACY_COMPLETED_RACES_QUERY.format(date_filter="AND r.race_date >= %(start_date)s"),
+         {'limit': 1000, 'start_date': recent_date}),
+    ]
+
+    query, params = build_completed_races_query(limit=100)
+    queries.append(('completed_races', query, params))
+    query, params = build_completed_races_query(limit=1000, start_date=recent_date)
+    queries.append(('completed_races_since', query, params))
+
+    queries.append(('training_data', TRAINING_DATA_QUERY, {}))
+    queries.append(('training_data_enhanced', ENHANCED_TRAINING_DATA_QUERY, {}))
+
+    return queries
+
+
+def _walk_plan(node, indexes, nodes):
+    nodes.append(node['Node Type'])
+    if 'Index Name' in node:
+        indexes.add(node['Index Name'])
+    for child in node.get('Plans', []):
+        _walk_plan(child, indexes, nodes)
+
+
+def explain(cursor, query, params, runs=DEFAULT_RUNS):
+    """
+    EXPLAIN (ANALYZE, BUFFERS) を runs 回実行して集計（1回目はキャッシュを温めるため集計しない）
+
+    Returns:
+        dict: 実行時間（中央値）、使用したインデックス、ノードの種類、バッファ
+    """
+    # psycopg2 は params が空の場合 % を置換しないため、空の場合は None を渡す
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params or None)
+
+    results = []
+    for _ in range(runs):
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params or None)
+        results.append(cursor.fetchone()[0][0])
+
+    last = results[-1]
+    indexes = set()
+    nodes = []
+    _walk_plan(last['Plan'], indexes, nodes)
+
+    return {
+        'execution_ms': round(statistics.median(r['Execution Time'] for r in results), 2),
+        'planning_ms': round(statistics.median(r['Planning Time'] for r in results), 2),
+        'runs_ms': [round(r['Execution Time'], 2) for r in results],
+        'rows': last['Plan'].get('Actual Rows'),
+        'shared_hit_blocks': last['Plan'].get('Shared Hit Blocks'),
+        'shared_read_blocks': last['Plan'].get('Shared Read Blocks'),
+        'temp_written_blocks': last['Plan'].get('Temp Written Blocks'),
+        'indexes': sorted(indexes),
+        'has_sort': 'Sort' in nodes or 'Incremental Sort' in nodes,
+        'root_node': last['Plan']['Node Type'],
+    }
+
+
+def run_phase(conn, queries, runs, label):
+    """全クエリを計測"""
+    cursor = conn.cursor()
+    results = {}
+
+    print(f"\n=== {label} ===")
+    for name, query, params in queries:
+        result = explain(cursor, query, params, runs)
+        results[name] = result
+        print(f"  {name:30s} {result['execution_ms']:10.1f}ms  "
+              f"{'sort ' if result['has_sort'] else ''}{', '.join(result['indexes']) or 'seq scan'}")
+
+    conn.rollback()
+    cursor.close()
+    return results
+
+
+def index_sizes(conn):
+    """races / race_entries のインデックスサイズ（MB）"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT indexrelname, pg_relation_size(indexrelid)
+        FROM pg_stat_user_indexes
+        WHERE schemaname = current_schema()
+        AND relname IN ('races', 'race_entries')
+        ORDER BY indexrelname
+    """)
+    sizes = {name: round(size / 1024 / 1024, 1) for name, size in cursor.fetchall()}
+    cursor.close()
+    return sizes
+
+
+def print_comparison(before, after):
+    print("\n=== 比較（実行時間の中央値） ===")
+    print(f"  {'query':30s} {'before':>10s} {'after':>10s} {'speedup':>8s}")
+    for name in before:
+        b = before[name]['execution_ms']
+        a = after[name]['execution_ms']
+        speedup = f"{b / a:.1f}x" if a > 0 else '-'
+        print(f"  {name:30s} {b:9.1f}ms {a:9.1f}ms {speedup:>8s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare EXPLAIN ANALYZE timings of hot ML queries '
+                                                 'before and after the index migration on synthetic data')
+    parser.add_argument('--postgres-url', type=str, required=True,
+                        help='Scratch database to load synthetic data into (a dedicated schema is recreated)')
+    parser.add_argument('--races', type=int, default=DEFAULT_RACES, help=f'Number of races (default: {DEFAULT_RACES:,})')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f'Random seed (default: {DEFAULT_SEED})')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                        help=f'Measured runs per query after one warm-up run (default: {DEFAULT_RUNS})')
+    parser.add_argument('--migration', type=str, default=DEFAULT_MIGRATION, help='Migration SQL to apply between phases')
+    parser.add_argument('--output-dir', type=str, default=DEFAULT_OUTPUT_DIR,
+                        help='Directory for the result JSON (default: ml/benchmarks)')
+    args = parser.parse_args()
+
+    print(f"合成データを生成中（{args.races:,}レース）...")
+    dataset = generate_dataset(args.races, seed=args.seed)
+    print("PostgreSQL に読み込み中...")
+    conn = load_into_postgres(dataset, args.postgres_url)
+    del dataset
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(race_date) - 30 FROM races")
+    recent_date = cursor.fetchone()[0]
+    cursor.close()
+
+    queries = build_queries(recent_date)
+
+    sizes_before = index_sizes(conn)
+    before = run_phase(conn, queries, args.runs, 'インデックス追加前')
+
+    print(f"\nマイグレーションを適用: {args.migration}")
+    with open(args.migration, 'r', encoding='utf-8') as f:
+        migration_sql = f.read()
+    cursor = conn.cursor()
+    cursor.execute(migration_sql)
+    conn.commit()
+    cursor.close()
+
+    sizes_after = index_sizes(conn)
+    after = run_phase(conn, queries, args.runs, 'インデックス追加後')
+
+    print_comparison(before, after)
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'races': args.races,
+        'seed': args.seed,
+        'runs': args.runs,
+        'migration': os.path.relpath(args.migration, ROOT_DIR),
+        'index_sizes_mb': {'before': sizes_before, 'after': sizes_after},
+        'before': before,
+        'after': after,
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"explain_{args.races}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False, default=str)
+    print(f"\n結果: {output_path}")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
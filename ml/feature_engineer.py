@@ -1,11 +1,12 @@
 import pandas as pd
 import numpy as np
 import os
-from dotenv import load_dotenv
-import psycopg2
+import sys
 import json
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.db import connect
 
 
 class FeatureEngineer:
@@ -28,7 +29,7 @@ class FeatureEngineer:
     def _fetch_racer_detailed_stats(self):
         """racer_detailed_statsテーブルからデータを取得"""
         try:
-            conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+            conn = connect()
             query = """
                 SELECT
                     racer_number,
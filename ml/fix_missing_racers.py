@@ -2,12 +2,13 @@
 race_entriesからracersテーブルに不足している選手を登録
 """
 import os
-import psycopg2
-from dotenv import load_dotenv
+import sys
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+from scraper.db import connect
+
+conn = connect()
 cursor = conn.cursor()
 
 # race_entriesから不足している選手IDを取得
@@ -9,11 +9,10 @@ XGBoostモデルの最適なハイパーパラメータを探索
 import os
 import sys
 import json
+import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
-import psycopg2
 
 import xgboost as xgb
 from sklearn.model_selection import RandomizedSearchCV, StratifiedKFold
@@ -24,8 +23,10 @@ from scipy.stats import uniform, randint
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ml.feature_engineer import FeatureEngineer
-
-load_dotenv()
+from ml.point_in_time_stats import update_daily_stats, load_point_in_time_stats
+from ml.weather_alignment import attach_weather
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
+from scraper.db import connect
 
 
 def calculate_sample_weight(race_dates, half_life_years=3.0):
@@ -72,7 +73,7 @@ def fetch_training_data():
     """データベースから訓練データを取得"""
     print("=== データベースから訓練データを取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
     # race_entries と racers, races を結合してデータ取得
     query = """
@@ -109,67 +110,37 @@ def fetch_training_data():
     return df
 
 
-def fetch_racer_stats():
-    """選手統計データを取得"""
-    print("\n=== 選手統計データを取得中 ===\n")
-
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            racer_id,
-            AVG(CASE WHEN result_position = 1 THEN 1.0 ELSE 0.0 END) * 100 as win_rate,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate,
-            AVG(start_timing) as avg_start_timing
-        FROM race_entries
-        WHERE result_position IS NOT NULL
-        GROUP BY racer_id
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    print(f"選手統計: {len(df)}名分")
-    return df
-
-
-def fetch_motor_stats():
-    """モーター統計データを取得"""
-    print("\n=== モーター統計データを取得中 ===\n")
-
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+def fetch_point_in_time_stats(df):
+    """選手・モーター統計をレース日時点で取得（当日以降の結果は含まない）"""
+    print("\n=== 選手・モーター統計（レース日時点）を取得中 ===\n")
 
-    query = """
-        SELECT
-            venue_id,
-            motor_number,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate
-        FROM race_entries re
-        JOIN races r ON re.race_id = r.id
-        WHERE motor_number IS NOT NULL AND result_position IS NOT NULL
-        GROUP BY venue_id, motor_number
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    # 日次集計を最新化してから、各レース日時点の成績を計算
+    update_daily_stats()
+    racer_stats, motor_stats = load_point_in_time_stats(df)
 
-    print(f"モーター統計: {len(df)}個")
-    return df
+    print(f"選手統計: {racer_stats['racer_id'].nunique()}名 / {len(racer_stats)}件（選手×日付）")
+    print(f"モーター統計: {len(motor_stats)}件（会場×モーター×日付）")
+    return racer_stats, motor_stats
 
 
 def prepare_features(df, racer_stats, motor_stats):
     """特徴量を準備"""
     print("\n=== 特徴量の生成 ===\n")
 
-    # 統計データをマージ
-    df = df.merge(racer_stats, on='racer_id', how='left', suffixes=('', '_stat'))
+    # 統計データをマージ（race_date列がある場合はレース日時点の統計として結合）
+    racer_keys = ['racer_id']
+    motor_keys = ['venue_id', 'motor_number']
+    if 'race_date' in racer_stats.columns:
+        racer_keys.append('race_date')
+    if 'race_date' in motor_stats.columns:
+        motor_keys.append('race_date')
+
+    df = df.merge(racer_stats, on=racer_keys, how='left', suffixes=('', '_stat'))
 
     # モーター統計をマージ
     df = df.merge(
         motor_stats,
-        on=['venue_id', 'motor_number'],
+        on=motor_keys,
         how='left',
         suffixes=('', '_motor')
     )
@@ -180,6 +151,9 @@ def prepare_features(df, racer_stats, motor_stats):
     df['third_rate'] = df['third_rate_motor'].fillna(50.0)
     df['avg_start_timing'] = df['avg_start_timing'].fillna(0.17)
 
+    # 天気データ（発走予定時刻時点の観測値を結合）
+    df = attach_weather(df)
+
     # FeatureEngineerの初期化
     feature_engineer = FeatureEngineer(historical_data=df)
 
@@ -196,12 +170,6 @@ def prepare_features(df, racer_stats, motor_stats):
             # 6艇揃っていないレースはスキップ
             continue
 
-        # 天気データ（現時点ではダミー値、将来的にweather_dataテーブルから取得）
-        race_data['wind_speed'] = np.random.uniform(0.5, 8.0, len(race_data))
-        race_data['wind_direction'] = np.random.randint(0, 360, len(race_data))
-        race_data['temperature'] = np.random.uniform(15.0, 30.0, len(race_data))
-        race_data['wave_height'] = np.random.uniform(0, 10, len(race_data))
-
         # 選手統計をコピー
         race_data['racer_win_rate'] = race_data['win_rate']
         race_data['racer_win_rate_venue'] = race_data['win_rate']  # 簡易的に全国勝率を使用
@@ -393,6 +361,11 @@ def save_best_params(params, score, output_dir='ml'):
 
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description='Search XGBoost hyperparameters')
+    add_metrics_argument(parser)
+    args = parser.parse_args()
+    enable_profiling(args)
+
     print("=" * 80)
     print("  競艇予測モデル - ハイパーパラメータ最適化")
     print("=" * 80)
@@ -400,7 +373,9 @@ def main():
 
     try:
         # 1. データ取得
-        df = fetch_training_data()
+        with span('fetch') as s:
+            df = fetch_training_data()
+            s.rows = len(df)
 
         if len(df) == 0:
             print("[ERROR] 訓練データが取得できませんでした")
@@ -408,11 +383,14 @@ def main():
             return
 
         # 2. 統計データ取得
-        racer_stats = fetch_racer_stats()
-        motor_stats = fetch_motor_stats()
+        with span('fetch_stats') as s:
+            racer_stats, motor_stats = fetch_point_in_time_stats(df)
+            s.rows = len(racer_stats) + len(motor_stats)
 
         # 3. 特徴量生成
-        X, y, race_dates = prepare_features(df, racer_stats, motor_stats)
+        with span('features') as s:
+            X, y, race_dates = prepare_features(df, racer_stats, motor_stats)
+            s.rows = len(X)
 
         if len(X) < 100:
             print(f"[WARNING] データが少なすぎます（{len(X)}件）")
@@ -422,12 +400,13 @@ def main():
                 return
 
         # 4. ハイパーパラメータ最適化（時系列重み付け有効）
-        best_params, best_score = optimize_hyperparameters(
-            X, y, race_dates,
-            n_iter=50,              # 試行回数（時間がある場合は100以上推奨）
-            cv_folds=5,             # 交差検証分割数
-            use_time_weighting=True # 時系列重み付けを使用
-        )
+        with span('search', rows=len(X)):
+            best_params, best_score = optimize_hyperparameters(
+                X, y, race_dates,
+                n_iter=50,              # 試行回数（時間がある場合は100以上推奨）
+                cv_folds=5,             # 交差検証分割数
+                use_time_weighting=True # 時系列重み付けを使用
+            )
 
         # 5. 最適パラメータを保存
         save_best_params(best_params, best_score)
@@ -445,6 +424,10 @@ def main():
         import traceback
         traceback.print_exc()
 
+    finally:
+        print_summary()
+        write_metrics(args.metrics_out, job='hyperparameter_tuning')
+
 
 if __name__ == '__main__':
     main()
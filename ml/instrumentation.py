@@ -0,0 +1,280 @@
+"""
+処理時間・メモリの計測（ステージ別）
+
+with span('fetch') as s: ... の形で処理を囲み、ステージごとに以下を記録する
+- wall_seconds: 経過時間
+- cpu_seconds: CPU時間（subprocess で実行した子プロセスの分を含む）
+- rows: 処理件数（s.rows に設定、または s.add_rows() で加算）
+- peak_rss_mb: ステージ終了時点のプロセスの最大RSS（子プロセスを含む）
+
+span を入れ子にすると 'backtest/predict' のようにパスで記録する
+同じパスのステージ（1レースごとの予測など）は回数・合計時間にまとめる
+
+結果は --metrics-out で指定したファイルに保存する
+- *.prom: Prometheus textfile 形式（node_exporter の textfile collector 用）
+- それ以外: JSON
+
+--profile でステージを指定すると、そのステージだけプロファイルする（profiling.py）
+
+使用方法:
+    from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics
+
+    add_metrics_argument(parser)
+    args = parser.parse_args()
+    enable_profiling(args)
+
+    with span('fetch') as s:
+        df = fetch_training_data()
+        s.rows = len(df)
+
+    write_metrics(args.metrics_out, job='train_model')
+"""
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from ml.profiling import add_profile_arguments, build_stage_profiler, DEFAULT_PROFILE_DIR
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = 'boatrace_stage'
+
+
+def _cpu_seconds():
+    """自プロセスと終了済み子プロセスのCPU時間の合計"""
+    children = os.times()
+    return time.process_time() + children.children_user + children.children_system
+
+
+def peak_rss_mb():
+    """最大RSS（MB、自プロセスと子プロセスの大きい方）"""
+    if not HAS_RESOURCE:
+        return None
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux は KB、macOS はバイト
+    return round(usage / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+class Span:
+    """1回分の計測結果"""
+
+    __slots__ = ('name', 'path', 'rows', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'error')
+
+    def __init__(self, name, path, rows=None):
+        self.name = name
+        self.path = path
+        self.rows = rows
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+        self.error = False
+
+    def add_rows(self, n):
+        self.rows = (self.rows or 0) + n
+
+
+class MetricsRecorder:
+    """ステージ（パス）ごとに計測結果を集計"""
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self._stack = []
+        self.stages = {}
+        self.profiler = None
+
+    def reset(self):
+        """計測結果を消去（プロファイラの設定は残す）"""
+        profiler = self.profiler
+        self.__init__()
+        self.profiler = profiler
+
+    @contextmanager
+    def span(self, name, rows=None):
+        """ステージを計測"""
+        path = '/'.join(self._stack + [name])
+        s = Span(name, path, rows)
+
+        self._stack.append(name)
+        profiling = self.profiler is not None and self.profiler.start(name, path)
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_seconds()
+
+        try:
+            yield s
+        except BaseException:
+            s.error = True
+            raise
+        finally:
+            s.wall_seconds = time.perf_counter() - wall_start
+            s.cpu_seconds = _cpu_seconds() - cpu_start
+            s.peak_rss_mb = peak_rss_mb()
+            if profiling:
+                self.profiler.stop(path)
+            self._stack.pop()
+            self.record(s)
+
+    def record(self, s):
+        stage = self.stages.get(s.path)
+        if stage is None:
+            stage = self.stages[s.path] = {
+                'stage': s.path,
+                'calls': 0,
+                'wall_seconds': 0.0,
+                'cpu_seconds': 0.0,
+                'rows': None,
+                'peak_rss_mb': None,
+                'errors': 0,
+            }
+
+        stage['calls'] += 1
+        stage['wall_seconds'] += s.wall_seconds
+        stage['cpu_seconds'] += s.cpu_seconds
+        if s.rows is not None:
+            stage['rows'] = (stage['rows'] or 0) + int(s.rows)
+        if s.peak_rss_mb is not None:
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'] or 0.0, s.peak_rss_mb)
+        if s.error:
+            stage['errors'] += 1
+
+    def summary(self):
+        """ステージごとの集計（最初に終了した順）"""
+        result = []
+        for stage in self.stages.values():
+            stage = dict(stage)
+            stage['wall_seconds'] = round(stage['wall_seconds'], 4)
+            stage['cpu_seconds'] = round(stage['cpu_seconds'], 4)
+            if stage['rows'] and stage['wall_seconds'] > 0:
+                stage['rows_per_second'] = round(stage['rows'] / stage['wall_seconds'], 1)
+            result.append(stage)
+        return result
+
+    def to_dict(self, job, extra=None):
+        return {
+            'job': job,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_wall_seconds': round(time.perf_counter() - self._start, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.summary(),
+            **(extra or {}),
+        }
+
+    def to_prometheus(self, job):
+        """Prometheus textfile 形式"""
+        metrics = [
+            ('wall_seconds', 'Wall clock time spent in the stage', 'wall_seconds', 1),
+            ('cpu_seconds', 'CPU time spent in the stage, including child processes', 'cpu_seconds', 1),
+            ('rows', 'Rows processed by the stage', 'rows', 1),
+            ('calls', 'Number of times the stage ran', 'calls', 1),
+            ('errors', 'Number of times the stage raised', 'errors', 1),
+            ('peak_rss_bytes', 'Process peak RSS when the stage finished', 'peak_rss_mb', 1024 * 1024),
+        ]
+        stages = self.summary()
+        lines = []
+
+        for metric, help_text, key, scale in metrics:
+            name = f"{METRIC_PREFIX}_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for stage in stages:
+                if stage[key] is None:
+                    continue
+                lines.append(f'{name}{{job="{_escape(job)}",stage="{_escape(stage["stage"])}"}} '
+                             f'{stage[key] * scale:g}')
+
+        name = f"{METRIC_PREFIX}_last_run_timestamp_seconds"
+        lines.append(f"# HELP {name} Unix time the metrics were written")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f'{name}{{job="{_escape(job)}"}} {time.time():.0f}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, job, extra=None):
+        """
+        計測結果を保存（拡張子 .prom は Prometheus textfile、それ以外は JSON）
+
+        textfile collector が書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if path.endswith('.prom'):
+            content = self.to_prometheus(job)
+        else:
+            content = json.dumps(self.to_dict(job, extra), indent=2, ensure_ascii=False, default=str)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def print_summary(self, file=None):
+        """ステージごとの集計を表示"""
+        print("\n=== Stage timings ===", file=file)
+        for stage in self.summary():
+            rows = f" {stage['rows']:>10,} rows" if stage['rows'] is not None else ''
+            calls = f" x{stage['calls']}" if stage['calls'] > 1 else ''
+            rss = f" peak {stage['peak_rss_mb']:.0f}MB" if stage['peak_rss_mb'] is not None else ''
+            print(f"  {stage['stage']:30s} {stage['wall_seconds']:9.2f}s wall {stage['cpu_seconds']:9.2f}s CPU"
+                  f"{rows}{calls}{rss}", file=file)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# プロセス全体で共有する記録先
+_recorder = MetricsRecorder()
+
+
+def get_recorder():
+    return _recorder
+
+
+def span(name, rows=None):
+    """
+    ステージを計測（共有の記録先に記録）
+
+    Args:
+        name: ステージ名（入れ子の場合は親のパスの下に記録）
+        rows: 処理件数（ブロック内で Span.rows に設定してもよい）
+    """
+    return _recorder.span(name, rows)
+
+
+def enable_profiling(args):
+    """--profile が指定されていれば、対象ステージのプロファイラを有効にする"""
+    _recorder.profiler = build_stage_profiler(args)
+
+
+def write_metrics(path, job, extra=None):
+    """
+    共有の記録先の計測結果を保存（path が None の場合は保存しない）
+
+    プロファイル結果は path と同じディレクトリ（None の場合は DEFAULT_PROFILE_DIR）に保存する
+    """
+    if path:
+        _recorder.write(path, job, extra)
+    if _recorder.profiler is not None:
+        _recorder.profiler.write(os.path.dirname(path) if path else DEFAULT_PROFILE_DIR, job)
+
+
+def print_summary(file=None):
+    _recorder.print_summary(file=file)
+
+
+def add_metrics_argument(parser):
+    """--metrics-out 引数とプロファイル用の引数（profiling.add_profile_arguments）を追加"""
+    parser.add_argument('--metrics-out', type=str, default=None,
+                        help='Write stage timings to this file (.prom for Prometheus textfile, otherwise JSON)')
+    add_profile_arguments(parser)
@@ -0,0 +1,467 @@
+"""
+時点別（point-in-time）選手・モーター成績の集計スクリプト
+
+race_entries を日次で集計したテーブルを増分更新し、
+「日付D時点の成績」（D当日以降の結果を含まない）を返す
+- racer_daily_stats: 選手×日付ごとの出走数・1着数・2連対数・3連対数・ST合計
+- motor_daily_stats: 会場×モーター×日付ごとの出走数・2連対数・3連対数
+
+更新時は、前回の集計以降に追加・更新された出走（race_entries.updated_at）のレース日だけを再集計する
+- 結果の遅延反映や、過去の月のバックフィル（古い日付）も対象になる
+- race_entries.updated_at がない場合（scraper/migrations/add_race_entries_updated_at.sql 未適用）は、
+  集計済みの最終日から数日さかのぼって再集計する
+使用方法:
+    python ml/point_in_time_stats.py             # 増分更新
+    python ml/point_in_time_stats.py --rebuild   # 全期間を再集計
+"""
+import os
+import sys
+import argparse
+from datetime import timedelta
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.db import connect
+
+# race_entries.updated_at がない場合に、最終集計日から何日さかのぼって再集計するか
+DEFAULT_LOOKBACK_DAYS = 3
+
+# 前回の集計と同時に書き込まれていた出走を取りこぼさないよう、前回の集計日時からさかのぼる時間
+WATERMARK_OVERLAP = timedelta(minutes=30)
+
+RACER_COUNT_COLUMNS = ['races', 'wins', 'top2', 'top3', 'st_sum', 'st_count']
+MOTOR_COUNT_COLUMNS = ['races', 'top2', 'top3']
+
+
+def create_daily_stats_tables(cursor):
+    """日次集計テーブルを作成（存在する場合は何もしない）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS racer_daily_stats (
+            racer_id INT NOT NULL,
+            race_date DATE NOT NULL,
+            races INT NOT NULL,
+            wins INT NOT NULL,
+            top2 INT NOT NULL,
+            top3 INT NOT NULL,
+            st_sum FLOAT NOT NULL DEFAULT 0,
+            st_count INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (racer_id, race_date)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS motor_daily_stats (
+            venue_id INT NOT NULL,
+            motor_number INT NOT NULL,
+            race_date DATE NOT NULL,
+            races INT NOT NULL,
+            top2 INT NOT NULL,
+            top3 INT NOT NULL,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (venue_id, motor_number, race_date)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_racer_daily_stats_date
+        ON racer_daily_stats(race_date)
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_motor_daily_stats_date
+        ON motor_daily_stats(race_date)
+    """)
+
+
+def has_entry_updated_at(cursor):
+    """race_entries に updated_at 列があるか"""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'race_entries' AND column_name = 'updated_at'
+    """)
+    return cursor.fetchone() is not None
+
+
+def fetch_changed_race_dates(cursor, since):
+    """since 以降に追加・更新された出走のレース日（古い順）"""
+    cursor.execute("""
+        SELECT DISTINCT r.race_date
+        FROM race_entries re
+        JOIN races r ON re.race_id = r.id
+        WHERE re.updated_at > %s
+        ORDER BY r.race_date
+    """, (since - WATERMARK_OVERLAP,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def find_refresh_dates(cursor, table, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """
+    日次集計テーブルで再集計するレース日を決める
+
+    前回の集計日時（table の MAX(updated_at)）以降に追加・更新された出走のレース日を返す
+    race_entries.updated_at がない場合は、集計済みの最終日から lookback_days さかのぼった日以降を返す
+
+    Args:
+        table: 日次集計テーブル（race_date, updated_at 列を持つ）
+
+    Returns:
+        list or None: 再集計するレース日（None の場合は全期間）
+    """
+    cursor.execute(f"SELECT MAX(race_date), MAX(updated_at) FROM {table}")
+    last_date, watermark = cursor.fetchone()
+
+    if last_date is None:
+        return None
+
+    if watermark is not None and has_entry_updated_at(cursor):
+        return fetch_changed_race_dates(cursor, watermark)
+
+    cursor.execute("SELECT MAX(race_date) FROM races")
+    end_date = max(filter(None, [cursor.fetchone()[0], last_date]))
+    from_date = last_date - timedelta(days=lookback_days)
+    return [from_date + timedelta(days=i) for i in range((end_date - from_date).days + 1)]
+
+
+def describe_refresh_dates(dates):
+    """再集計の対象の表示用文字列"""
+    if dates is None:
+        return "全期間"
+    if not dates:
+        return "変更なし"
+    if len(dates) == 1:
+        return f"{dates[0]} の1日"
+    return f"{min(dates)} ～ {max(dates)} の{len(dates)}日"
+
+
+def update_daily_stats(rebuild=False, lookback_days=DEFAULT_LOOKBACK_DAYS, verbose=True):
+    """
+    日次集計テーブルを増分更新
+
+    Args:
+        rebuild: Trueの場合は全期間を再集計
+        lookback_days: race_entries.updated_at がない場合に、最終集計日から何日さかのぼって再集計するか
+        verbose: 詳細出力
+
+    Returns:
+        list or None: 再集計したレース日（全期間の場合はNone）
+    """
+    conn = connect()
+    cursor = conn.cursor()
+
+    try:
+        create_daily_stats_tables(cursor)
+
+        dates = None if rebuild else find_refresh_dates(cursor, 'racer_daily_stats', lookback_days)
+
+        if verbose:
+            print(f"=== 日次集計を更新中（{describe_refresh_dates(dates)}） ===\n")
+
+        if dates is not None and not dates:
+            conn.commit()
+            if verbose:
+                print("前回の集計以降に追加・更新された出走はありません\n")
+            return dates
+
+        date_filter = "AND r.race_date = ANY(%(dates)s)" if dates is not None else ""
+        params = {'dates': dates}
+
+        # 対象日を削除してから集計し直す（同一トランザクション内なので読み取り側は旧データを参照し続ける）
+        if dates is not None:
+            cursor.execute("DELETE FROM racer_daily_stats WHERE race_date = ANY(%(dates)s)", params)
+            cursor.execute("DELETE FROM motor_daily_stats WHERE race_date = ANY(%(dates)s)", params)
+        else:
+            cursor.execute("TRUNCATE racer_daily_stats, motor_daily_stats")
+
+        cursor.execute(f"""
+            INSERT INTO racer_daily_stats
+            (racer_id, race_date, races, wins, top2, top3, st_sum, st_count)
+            SELECT
+                re.racer_id,
+                r.race_date,
+                COUNT(*),
+                SUM(CASE WHEN re.result_position = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN re.result_position <= 2 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN re.result_position <= 3 THEN 1 ELSE 0 END),
+                COALESCE(SUM(re.start_timing), 0),
+                COUNT(re.start_timing)
+            FROM race_entries re
+            JOIN races r ON re.race_id = r.id
+            WHERE re.result_position IS NOT NULL
+            AND re.racer_id IS NOT NULL
+            {date_filter}
+            GROUP BY re.racer_id, r.race_date
+        """, params)
+        racer_rows = cursor.rowcount
+
+        cursor.execute(f"""
+            INSERT INTO motor_daily_stats
+            (venue_id, motor_number, race_date, races, top2, top3)
+            SELECT
+                r.venue_id,
+                re.motor_number,
+                r.race_date,
+                COUNT(*),
+                SUM(CASE WHEN re.result_position <= 2 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN re.result_position <= 3 THEN 1 ELSE 0 END)
+            FROM race_entries re
+            JOIN races r ON re.race_id = r.id
+            WHERE re.result_position IS NOT NULL
+            AND re.motor_number IS NOT NULL
+            {date_filter}
+            GROUP BY r.venue_id, re.motor_number, r.race_date
+        """, params)
+        motor_rows = cursor.rowcount
+
+        conn.commit()
+
+        if verbose:
+            print(f"選手日次集計: {racer_rows}件")
+            print(f"モーター日次集計: {motor_rows}件\n")
+
+        return dates
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def fetch_racer_daily_stats(end_date=None):
+    """選手の日次集計を取得（end_date当日は含まない）"""
+    conn = connect()
+
+    query = """
+        SELECT racer_id, race_date, races, wins, top2, top3, st_sum, st_count
+        FROM racer_daily_stats
+    """
+    params = None
+    if end_date is not None:
+        query += " WHERE race_date < %s"
+        params = (end_date,)
+
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    return df
+
+
+def fetch_motor_daily_stats(end_date=None):
+    """モーターの日次集計を取得（end_date当日は含まない）"""
+    conn = connect()
+
+    query = """
+        SELECT venue_id, motor_number, race_date, races, top2, top3
+        FROM motor_daily_stats
+    """
+    params = None
+    if end_date is not None:
+        query += " WHERE race_date < %s"
+        params = (end_date,)
+
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    return df
+
+
+def _as_of_counts(daily, targets, keys, count_columns):
+    """
+    targetsの各(キー, race_date)について、race_date前日までの累積カウントを返す
+
+    日次集計をキーごとに累積和へ変換し、merge_asofで当日を含まない直近の行を結合する
+    """
+    left = targets[keys + ['race_date']].dropna(subset=keys).drop_duplicates()
+    left = left.astype({key: 'int64' for key in keys})
+    left['_as_of'] = pd.to_datetime(left['race_date'])
+    left = left.sort_values('_as_of')
+
+    if len(daily) == 0:
+        for col in count_columns:
+            left[col] = 0
+        return left.drop(columns='_as_of')
+
+    daily = daily.sort_values(keys + ['race_date'])
+    cumulative = daily[keys].astype('int64')
+    cumulative[count_columns] = daily.groupby(keys)[count_columns].cumsum()
+    cumulative['_as_of'] = pd.to_datetime(daily['race_date'])
+    cumulative = cumulative.sort_values('_as_of')
+
+    merged = pd.merge_asof(
+        left,
+        cumulative,
+        on='_as_of',
+        by=keys,
+        allow_exact_matches=False
+    )
+    merged[count_columns] = merged[count_columns].fillna(0)
+
+    return merged.drop(columns='_as_of')
+
+
+def _racer_rates(counts):
+    """累積カウントから選手成績（率）を計算"""
+    races = counts['races'].where(counts['races'] > 0)
+    st_count = counts['st_count'].where(counts['st_count'] > 0)
+
+    counts['win_rate'] = counts['wins'] / races * 100
+    counts['second_rate'] = counts['top2'] / races * 100
+    counts['third_rate'] = counts['top3'] / races * 100
+    counts['avg_start_timing'] = counts['st_sum'] / st_count
+
+    return counts.drop(columns=RACER_COUNT_COLUMNS)
+
+
+def _motor_rates(counts):
+    """累積カウントからモーター成績（率）を計算"""
+    races = counts['races'].where(counts['races'] > 0)
+
+    counts['second_rate'] = counts['top2'] / races * 100
+    counts['third_rate'] = counts['top3'] / races * 100
+
+    return counts.drop(columns=MOTOR_COUNT_COLUMNS)
+
+
+def racer_stats_as_of(racer_daily, targets):
+    """
+    各レース日時点の選手成績を計算
+
+    Args:
+        racer_daily: fetch_racer_daily_stats() の結果
+        targets: racer_id, race_date 列を持つDataFrame
+
+    Returns:
+        DataFrame: racer_id, race_date, win_rate, second_rate, third_rate, avg_start_timing
+    """
+    counts = _as_of_counts(racer_daily, targets, ['racer_id'], RACER_COUNT_COLUMNS)
+    return _racer_rates(counts)
+
+
+def motor_stats_as_of(motor_daily, targets):
+    """
+    各レース日時点のモーター成績を計算
+
+    Args:
+        motor_daily: fetch_motor_daily_stats() の結果
+        targets: venue_id, motor_number, race_date 列を持つDataFrame
+
+    Returns:
+        DataFrame: venue_id, motor_number, race_date, second_rate, third_rate
+    """
+    counts = _as_of_counts(motor_daily, targets, ['venue_id', 'motor_number'], MOTOR_COUNT_COLUMNS)
+    return _motor_rates(counts)
+
+
+def fetch_racer_stats_as_of(as_of_date, racer_ids=None):
+    """
+    指定日時点の選手成績を取得（当日の結果は含まない）
+
+    予測時に1レース分だけ必要な場合に使用する
+    戻り値の列は従来の全期間集計（racer_id単位）と同じ
+    """
+    conn = connect()
+
+    query = """
+        SELECT
+            racer_id,
+            SUM(wins) * 100.0 / NULLIF(SUM(races), 0) as win_rate,
+            SUM(top2) * 100.0 / NULLIF(SUM(races), 0) as second_rate,
+            SUM(top3) * 100.0 / NULLIF(SUM(races), 0) as third_rate,
+            SUM(st_sum) / NULLIF(SUM(st_count), 0) as avg_start_timing
+        FROM racer_daily_stats
+        WHERE race_date < %s
+    """
+    params = [as_of_date]
+    if racer_ids is not None:
+        query += " AND racer_id = ANY(%s)"
+        params.append([int(r) for r in racer_ids])
+    query += " GROUP BY racer_id"
+
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    return df
+
+
+def fetch_motor_stats_as_of(as_of_date, venue_id=None):
+    """
+    指定日時点のモーター成績を取得（当日の結果は含まない）
+
+    戻り値の列は従来の全期間集計（venue_id, motor_number単位）と同じ
+    """
+    conn = connect()
+
+    query = """
+        SELECT
+            venue_id,
+            motor_number,
+            SUM(top2) * 100.0 / NULLIF(SUM(races), 0) as second_rate,
+            SUM(top3) * 100.0 / NULLIF(SUM(races), 0) as third_rate
+        FROM motor_daily_stats
+        WHERE race_date < %s
+    """
+    params = [as_of_date]
+    if venue_id is not None:
+        query += " AND venue_id = %s"
+        params.append(int(venue_id))
+    query += " GROUP BY venue_id, motor_number"
+
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+
+    return df
+
+
+def load_point_in_time_stats(df):
+    """
+    訓練データの各行について、レース日時点の選手・モーター成績を返す
+
+    Args:
+        df: racer_id, venue_id, motor_number, race_date 列を持つ訓練データ
+
+    Returns:
+        tuple: (racer_stats, motor_stats) いずれも race_date 列を含む
+    """
+    end_date = df['race_date'].max()
+
+    racer_daily = fetch_racer_daily_stats(end_date)
+    motor_daily = fetch_motor_daily_stats(end_date)
+
+    racer_stats = racer_stats_as_of(racer_daily, df)
+    motor_stats = motor_stats_as_of(motor_daily, df)
+
+    return racer_stats, motor_stats
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description='Update point-in-time racer/motor stats')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Recompute all dates instead of only changed ones')
+    parser.add_argument('--lookback-days', type=int, default=DEFAULT_LOOKBACK_DAYS,
+                        help='Days to recompute before the last aggregated date when race_entries.updated_at '
+                             f'is not available (default: {DEFAULT_LOOKBACK_DAYS})')
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("  時点別 選手・モーター成績の集計")
+    print("=" * 80)
+    print()
+
+    try:
+        update_daily_stats(rebuild=args.rebuild, lookback_days=args.lookback_days)
+        print("[SUCCESS] 日次集計の更新が完了しました")
+
+    except Exception as e:
+        print(f"\n[ERROR] エラーが発生しました: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,6 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
-import psycopg2
 
 # 親ディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -21,13 +20,17 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from ml.feature_engineer import FeatureEngineer
 from ml.race_predictor import RacePredictor
 from ml.combination_predictor import CombinationPredictor, format_predictions
+from ml.point_in_time_stats import fetch_racer_stats_as_of, fetch_motor_stats_as_of
+from ml.weather_alignment import align_weather, WEATHER_COLUMNS
+from ml.prediction_writer import save_predictions
+from scraper.db import connect
 
 load_dotenv()
 
 
 def fetch_race_data(race_id):
     """指定されたレースのデータを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     # レース基本情報
@@ -77,7 +80,7 @@ def fetch_race_data(race_id):
 
 def fetch_historical_data():
     """過去データを取得（特徴量生成用）"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
     query = """
         SELECT
@@ -109,53 +112,19 @@ def fetch_historical_data():
     return df
 
 
-def fetch_racer_stats():
-    """選手統計データを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+def fetch_racer_stats(race_date, racer_ids=None):
+    """選手統計データを取得（レース日時点、当日の結果は含まない）"""
+    return fetch_racer_stats_as_of(race_date, racer_ids)
 
-    query = """
-        SELECT
-            racer_id,
-            AVG(CASE WHEN result_position = 1 THEN 1.0 ELSE 0.0 END) * 100 as win_rate,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate,
-            AVG(start_timing) as avg_start_timing
-        FROM race_entries
-        WHERE result_position IS NOT NULL
-        GROUP BY racer_id
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    return df
-
-
-def fetch_motor_stats():
-    """モーター統計データを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            venue_id,
-            motor_number,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate
-        FROM race_entries re
-        JOIN races r ON re.race_id = r.id
-        WHERE motor_number IS NOT NULL AND result_position IS NOT NULL
-        GROUP BY venue_id, motor_number
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
 
-    return df
+def fetch_motor_stats(race_date, venue_id=None):
+    """モーター統計データを取得（レース日時点、当日の結果は含まない）"""
+    return fetch_motor_stats_as_of(race_date, venue_id)
 
 
 def fetch_racer_detailed_stats():
     """選手詳細統計データを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
     query = """
         SELECT
@@ -181,45 +150,22 @@ def fetch_racer_detailed_stats():
     return df
 
 
-def fetch_weather_data(venue_id, race_date):
-    """天気データを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    cursor = conn.cursor()
+def fetch_weather_data(race_id, venue_id, race_date, race_number):
+    """
+    天気データを取得
 
-    cursor.execute("""
-        SELECT
-            wind_speed,
-            wind_direction,
-            temperature,
-            wave_height,
-            water_temperature
-        FROM weather_data
-        WHERE venue_id = %s
-        AND DATE(record_datetime) = DATE(%s)
-        ORDER BY record_datetime DESC
-        LIMIT 1
-    """, (venue_id, race_date))
-
-    weather = cursor.fetchone()
-    conn.close()
+    発走予定時刻以前で最も新しい観測値（なければ races の日別の値、既定値）を使う
+    （訓練時と同じ weather_alignment.align_weather で結合する）
+    """
+    race = pd.DataFrame([{
+        'race_id': race_id,
+        'race_date': race_date,
+        'venue_id': venue_id,
+        'race_number': race_number
+    }])
+    weather = align_weather(race).iloc[0]
 
-    if weather:
-        return {
-            'wind_speed': weather[0] or 3.0,
-            'wind_direction': weather[1] or 180,
-            'temperature': weather[2] or 20.0,
-            'wave_height': weather[3] or 2.0,
-            'water_temperature': weather[4] or 20.0
-        }
-    else:
-        # デフォルト値
-        return {
-            'wind_speed': 3.0,
-            'wind_direction': 180,
-            'temperature': 20.0,
-            'wave_height': 2.0,
-            'water_temperature': 20.0
-        }
+    return {col: weather[col] for col in WEATHER_COLUMNS}
 
 
 def prepare_race_features(race_df, historical_df, racer_stats, motor_stats, racer_detailed_stats, weather_data):
@@ -263,42 +209,19 @@ def prepare_race_features(race_df, historical_df, racer_stats, motor_stats, race
 
 
 def save_predictions_to_db(race_id, predictions, model_version='latest'):
-    """予測結果をDBに保存"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    cursor = conn.cursor()
+    """
+    予測結果をDBに保存（race_id, boat_number, model_version 単位で upsert）
 
-    # 既存の予測を削除
-    cursor.execute("DELETE FROM predictions WHERE race_id = %s", (race_id,))
-
-    # 新しい予測を挿入
-    for boat_number, probs in enumerate(predictions, start=1):
-        cursor.execute("""
-            INSERT INTO predictions (
-                race_id,
-                boat_number,
-                predicted_win_prob,
-                predicted_second_prob,
-                predicted_third_prob,
-                predicted_fourth_prob,
-                predicted_fifth_prob,
-                predicted_sixth_prob,
-                model_version,
-                created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-        """, (
-            race_id,
-            boat_number,
-            float(probs[0]),  # 1着確率
-            float(probs[1]),  # 2着確率
-            float(probs[2]),  # 3着確率
-            float(probs[3]),  # 4着確率
-            float(probs[4]),  # 5着確率
-            float(probs[5]),  # 6着確率
-            model_version
-        ))
-
-    conn.commit()
-    conn.close()
+    同じレースの他のモデルバージョンの予測は残す
+
+    Returns:
+        dict: 保存件数と書き込み速度（PredictionWriter.stats()）
+    """
+    conn = connect()
+    try:
+        return save_predictions(conn, race_id, predictions, model_version)
+    finally:
+        conn.close()
 
 
 def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=True, verbose=True):
@@ -342,14 +265,12 @@ def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=T
         print("Fetching historical data and statistics...")
 
     historical_df = fetch_historical_data()
-    racer_stats = fetch_racer_stats()
-    motor_stats = fetch_motor_stats()
+    racer_stats = fetch_racer_stats(race_info[1], race_df['racer_id'].tolist())
+    motor_stats = fetch_motor_stats(race_info[1], race_info[2])
     racer_detailed_stats = fetch_racer_detailed_stats()
 
     # 4. 天気データを取得
-    venue_id = race_info[2]
-    race_date = race_info[1]
-    weather_data = fetch_weather_data(venue_id, race_date)
+    weather_data = fetch_weather_data(race_info[0], race_info[2], race_info[1], race_info[3])
 
     if verbose:
         print(f"  Weather: Wind {weather_data['wind_speed']}m/s, Temp {weather_data['temperature']}°C")
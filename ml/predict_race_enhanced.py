@@ -7,142 +7,74 @@
 使用方法:
     python ml/predict_race_enhanced.py <race_id>
     python ml/predict_race_enhanced.py <race_id> --quiet  # JSON出力
+    python ml/predict_race_enhanced.py <race_id> --model ml/model_b.pkl --model-version model_b
 """
 import os
 import sys
 import json
 import argparse
+from contextlib import redirect_stdout
 import pandas as pd
 import numpy as np
 from datetime import datetime
 from dotenv import load_dotenv
-import psycopg2
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ml.enhanced_feature_engineer import EnhancedFeatureEngineer
 from ml.race_predictor import RacePredictor
 from ml.improved_combination_predictor import ImprovedCombinationPredictor, format_all_predictions
+from ml.race_cards import read_race_card
+from ml.prediction_writer import save_predictions
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
+from scraper.db import connect, query_stats, print_query_stats
 
 load_dotenv()
 
 
 def fetch_race_data(race_id):
-    """指定されたレースのデータを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    cursor = conn.cursor()
-
-    # レース基本情報
-    cursor.execute("""
-        SELECT id, race_date, venue_id, race_number, grade
-        FROM races
-        WHERE id = %s
-    """, (race_id,))
-
-    race_info = cursor.fetchone()
-    if not race_info:
-        conn.close()
-        raise ValueError(f"Race ID {race_id} not found")
+    """
+    指定されたレースのデータを取得
 
-    # レースエントリー情報（race_entriesの全データ + racer_detailed_statsを取得）
-    query = """
-        SELECT
-            re.race_id,
-            re.boat_number,
-            re.racer_id,
-            re.motor_number,
-            re.start_timing,
-            re.course,
-            re.result_position,
-            re.racer_grade,
-            re.win_rate,
-            re.place_rate_2,
-            re.place_rate_3,
-            re.motor_rate_2,
-            re.motor_rate_3,
-            re.boat_rate_2,
-            re.boat_rate_3,
-            re.exhibition_time,
-            re.exhibition_turn_time,
-            re.exhibition_straight_time,
-            re.average_st,
-            re.flying_count,
-            re.late_count,
-            re.actual_course,
-            r.race_date,
-            r.venue_id,
-            r.race_number,
-            r.grade as race_grade,
-            rc.name as racer_name,
-            rc.racer_number,
-            rds.overall_win_rate as racer_overall_win_rate,
-            rds.overall_1st_rate as racer_1st_rate,
-            rds.overall_2nd_rate as racer_2nd_rate,
-            rds.overall_3rd_rate as racer_3rd_rate,
-            rds.avg_start_timing as racer_avg_st,
-            rds.sg_appearances,
-            rds.flying_count as racer_flying_count,
-            rds.late_start_count as racer_late_count,
-            rds.grade_stats,
-            rds.course_stats,
-            rds.venue_stats
-        FROM race_entries re
-        JOIN races r ON re.race_id = r.id
-        LEFT JOIN racers rc ON re.racer_id = rc.id
-        LEFT JOIN racer_detailed_stats rds ON rc.racer_number = rds.racer_number
-        WHERE re.race_id = %s
-        ORDER BY re.boat_number
+    race_cards（出走表）から race_id の主キー検索1回で読む
+    出走表がまだない場合はその場で作成する（race_cards.read_race_card）
     """
+    conn = connect()
+    try:
+        df = read_race_card(conn, race_id)
+    finally:
+        conn.close()
 
-    df = pd.read_sql_query(query, conn, params=(race_id,))
-    conn.close()
+    if len(df) == 0:
+        raise ValueError(f"Race ID {race_id} not found")
 
     if len(df) != 6:
         raise ValueError(f"Race {race_id} does not have exactly 6 boats (found {len(df)})")
 
+    first = df.iloc[0]
+    race_info = (race_id, first['race_date'], first['venue_id'], first['race_number'], first['race_grade'])
+
     return df, race_info
 
 
 def save_predictions_to_db(race_id, predictions, model_version='enhanced_latest'):
-    """予測結果をDBに保存"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-    cursor = conn.cursor()
-
-    # 既存の予測を削除
-    cursor.execute("DELETE FROM predictions WHERE race_id = %s", (race_id,))
-
-    # 新しい予測を挿入
-    for boat_number, probs in enumerate(predictions, start=1):
-        cursor.execute("""
-            INSERT INTO predictions (
-                race_id,
-                boat_number,
-                predicted_win_prob,
-                predicted_second_prob,
-                predicted_third_prob,
-                predicted_fourth_prob,
-                predicted_fifth_prob,
-                predicted_sixth_prob,
-                model_version,
-                created_at
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-        """, (
-            race_id,
-            boat_number,
-            float(probs[0]),
-            float(probs[1]),
-            float(probs[2]),
-            float(probs[3]),
-            float(probs[4]),
-            float(probs[5]),
-            model_version
-        ))
-
-    conn.commit()
-    conn.close()
-
-
-def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=True, verbose=True):
+    """
+    予測結果をDBに保存（race_id, boat_number, model_version 単位で upsert）
+
+    同じレースの他のモデルバージョンの予測は残す
+
+    Returns:
+        dict: 保存件数と書き込み速度（PredictionWriter.stats()）
+    """
+    conn = connect()
+    try:
+        return save_predictions(conn, race_id, predictions, model_version)
+    finally:
+        conn.close()
+
+
+def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=True, verbose=True,
+                 model_version='enhanced_latest'):
     """
     レースの予測を実行（強化版）
 
@@ -151,6 +83,7 @@ def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=T
         model_path: モデルファイルのパス
         save_to_db: DBに保存するか
         verbose: 詳細出力
+        model_version: 保存する予測のモデルバージョン（/api/predict は enhanced_latest を読む）
 
     Returns:
         dict: 全賭け式の予測結果
@@ -165,14 +98,17 @@ def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=T
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found: {model_path}")
 
-    predictor = RacePredictor()
-    predictor.load(model_path)
+    with span('load_model'):
+        predictor = RacePredictor()
+        predictor.load(model_path)
 
     # 2. レースデータを取得
     if verbose:
         print("Fetching race data...")
 
-    race_df, race_info = fetch_race_data(race_id)
+    with span('fetch') as s:
+        race_df, race_info = fetch_race_data(race_id)
+        s.rows = len(race_df)
 
     if verbose:
         venue_names = {
@@ -190,8 +126,10 @@ def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=T
     if verbose:
         print("\nGenerating enhanced features...")
 
-    fe = EnhancedFeatureEngineer()
-    features = fe.create_features(race_df)
+    with span('features') as s:
+        fe = EnhancedFeatureEngineer()
+        features = fe.create_features(race_df)
+        s.rows = len(features)
 
     if verbose:
         print(f"  Features: {features.shape[1]} dimensions")
@@ -215,11 +153,13 @@ def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=T
 
         features = features[predictor.feature_names]
 
-    predictions = predictor.predict_probabilities(features)
+    with span('predict', rows=len(features)):
+        predictions = predictor.predict_probabilities(features)
 
     # 5. 組み合わせ予測
-    combo_predictor = ImprovedCombinationPredictor(predictions)
-    all_predictions = combo_predictor.get_all_predictions(top_n=10)
+    with span('combinations'):
+        combo_predictor = ImprovedCombinationPredictor(predictions)
+        all_predictions = combo_predictor.get_all_predictions(top_n=10)
 
     if verbose:
         print("\n" + "=" * 60)
@@ -253,7 +193,8 @@ def predict_race(race_id, model_path='ml/trained_model_latest.pkl', save_to_db=T
         if verbose:
             print("\nSaving predictions to database...")
 
-        save_predictions_to_db(race_id, predictions, 'enhanced_latest')
+        with span('db_write', rows=len(predictions)):
+            save_predictions_to_db(race_id, predictions, model_version)
 
         if verbose:
             print("  [OK] Saved to predictions table")
@@ -305,17 +246,22 @@ def main():
                         help='Model file path')
     parser.add_argument('--no-save', action='store_true',
                         help='Do not save to database')
+    parser.add_argument('--model-version', type=str, default='enhanced_latest',
+                        help='Model version to save predictions under (default: enhanced_latest)')
     parser.add_argument('--quiet', action='store_true',
                         help='Quiet mode (JSON output only)')
+    add_metrics_argument(parser)
 
     args = parser.parse_args()
+    enable_profiling(args)
 
     try:
         result = predict_race(
             race_id=args.race_id,
             model_path=args.model,
             save_to_db=not args.no_save,
-            verbose=not args.quiet
+            verbose=not args.quiet,
+            model_version=args.model_version
         )
 
         if args.quiet:
@@ -330,6 +276,15 @@ def main():
             traceback.print_exc()
         sys.exit(1)
 
+    finally:
+        # --quiet の場合は標準出力を JSON のみにする
+        if not args.quiet:
+            print_summary()
+            print_query_stats()
+        with redirect_stdout(sys.stderr if args.quiet else sys.stdout):
+            write_metrics(args.metrics_out, job='predict_race',
+                          extra={'race_id': args.race_id, 'db': query_stats()})
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,228 @@
+"""
+予測結果（predictions テーブル）の一括保存
+
+複数レースの着順確率をまとめて upsert する（race_id, boat_number, model_version 単位）
+- model_version が違う予測は別の行になるため、複数のモデルの予測を同じレースに並べて保存できる
+  （以前は race_id の全バージョンの予測を削除してから1行ずつ挿入していた）
+- 行数が COPY_THRESHOLD 未満の場合は execute_values の INSERT ... ON CONFLICT、
+  それ以上の場合は一時テーブルに COPY してから INSERT ... SELECT ... ON CONFLICT 1回で反映する
+- 保存した行数と rows/秒 を表示する（stats() でも取得できる）
+
+predictions が model_version で分割されている場合
+（scraper/migrations/partition_predictions_by_model_version.sql）、
+新しい model_version の子テーブルを ensure_prediction_partition() で作成してから書き込む
+
+使用方法:
+    from ml.prediction_writer import PredictionWriter
+
+    with PredictionWriter(conn, model_version='enhanced_latest') as writer:
+        for race_id, predictions in results:
+            writer.add(race_id, predictions)   # predictions: 6艇 × 6着順の確率
+"""
+import io
+import csv
+import time
+
+from psycopg2.extras import execute_values
+
+# 1回の flush で書き込む行数（add() でこの行数に達したら書き込む）
+DEFAULT_BATCH_SIZE = 6000
+
+# この行数以上は一時テーブルへの COPY で書き込む
+COPY_THRESHOLD = 1200
+
+PROB_COLUMNS = [
+    'predicted_win_prob',
+    'predicted_second_prob',
+    'predicted_third_prob',
+    'predicted_fourth_prob',
+    'predicted_fifth_prob',
+    'predicted_sixth_prob',
+]
+
+COLUMNS = ['race_id', 'boat_number'] + PROB_COLUMNS + ['model_version']
+
+UPSERT_CONFLICT = f"""
+    ON CONFLICT (race_id, boat_number, model_version) DO UPDATE
+    SET {', '.join(f"{column} = EXCLUDED.{column}" for column in PROB_COLUMNS)},
+        created_at = NOW()
+"""
+
+STAGING_TABLE = 'predictions_staging'
+
+
+class PredictionWriter:
+    """予測結果をまとめて predictions に upsert する"""
+
+    def __init__(self, conn, model_version, batch_size=DEFAULT_BATCH_SIZE,
+                 copy_threshold=COPY_THRESHOLD, verbose=True):
+        """
+        Args:
+            conn: DB接続（flush のたびに commit する）
+            model_version: 保存する予測のモデルバージョン（add() で個別に指定もできる）
+            batch_size: この行数がたまったら書き込む
+            copy_threshold: この行数以上は COPY で書き込む
+            verbose: close() で保存件数と rows/秒 を表示する
+        """
+        self.conn = conn
+        self.model_version = model_version
+        self.batch_size = batch_size
+        self.copy_threshold = copy_threshold
+        self.verbose = verbose
+
+        # (race_id, boat_number, model_version) -> 行（同じキーは後から追加したものを使う）
+        self._buffer = {}
+        self._partitioned = None
+        self._partitions = set()
+        self._staging_ready = False
+
+        self.rows = 0
+        self.races = 0
+        self.flushes = 0
+        self.seconds = 0.0
+
+    def add(self, race_id, predictions, model_version=None):
+        """
+        1レース分の予測を追加
+
+        Args:
+            race_id: レースID
+            predictions: 艇番順の着順確率（6艇 × 6着順）
+            model_version: 省略時はコンストラクタで指定したバージョン
+        """
+        version = model_version or self.model_version
+        race_id = int(race_id)
+
+        for boat_number, probs in enumerate(predictions, start=1):
+            self._buffer[(race_id, boat_number, version)] = (
+                (race_id, boat_number) + tuple(float(p) for p in probs[:6]) + (version,)
+            )
+        self.races += 1
+
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        たまっている予測を書き込んで commit
+
+        Returns:
+            int: 書き込んだ行数
+        """
+        if not self._buffer:
+            return 0
+
+        rows = list(self._buffer.values())
+        start = time.perf_counter()
+
+        cursor = self.conn.cursor()
+        try:
+            self._ensure_partitions(cursor, {row[-1] for row in rows})
+
+            if len(rows) >= self.copy_threshold:
+                self._copy_upsert(cursor, rows)
+            else:
+                execute_values(cursor, f"""
+                    INSERT INTO predictions ({', '.join(COLUMNS)}, created_at)
+                    VALUES %s
+                    {UPSERT_CONFLICT}
+                """, rows, template=f"({', '.join(['%s'] * len(COLUMNS))}, NOW())", page_size=len(rows))
+
+            self.conn.commit()
+
+        except Exception:
+            self.conn.rollback()
+            # 同じトランザクションで作成した一時テーブル・子テーブルも取り消される
+            self._staging_ready = False
+            self._partitions.clear()
+            raise
+
+        finally:
+            cursor.close()
+
+        self.seconds += time.perf_counter() - start
+        self.rows += len(rows)
+        self.flushes += 1
+        self._buffer.clear()
+        return len(rows)
+
+    def _copy_upsert(self, cursor, rows):
+        """一時テーブルに COPY してから1回の INSERT ... SELECT で upsert"""
+        if not self._staging_ready:
+            # ON COMMIT DELETE ROWS: commit のたびに空になるため、同じ接続で使い回せる
+            cursor.execute(f"""
+                CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+                    race_id INT,
+                    boat_number INT,
+                    {', '.join(f'{column} FLOAT' for column in PROB_COLUMNS)},
+                    model_version VARCHAR(50)
+                ) ON COMMIT DELETE ROWS
+            """)
+            self._staging_ready = True
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+
+        cursor.execute(f"""
+            INSERT INTO predictions ({', '.join(COLUMNS)}, created_at)
+            SELECT {', '.join(COLUMNS)}, NOW() FROM {STAGING_TABLE}
+            {UPSERT_CONFLICT}
+        """)
+
+    def _ensure_partitions(self, cursor, versions):
+        """predictions が model_version で分割されている場合、子テーブルを作成"""
+        if self._partitioned is None:
+            cursor.execute("SELECT to_regproc('ensure_prediction_partition') IS NOT NULL")
+            self._partitioned = cursor.fetchone()[0]
+
+        if not self._partitioned:
+            return
+
+        for version in sorted(versions - self._partitions):
+            cursor.execute("SELECT ensure_prediction_partition(%s)", (version,))
+            self._partitions.add(version)
+
+    def stats(self):
+        """保存件数と書き込み速度"""
+        return {
+            'rows': self.rows,
+            'races': self.races,
+            'flushes': self.flushes,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows / self.seconds, 1) if self.seconds > 0 else None,
+        }
+
+    def close(self):
+        """残りを書き込み、保存件数と rows/秒 を表示"""
+        self.flush()
+
+        if self.verbose and self.rows:
+            stats = self.stats()
+            rate = f"{stats['rows_per_second']:,.0f} rows/s" if stats['rows_per_second'] else '-'
+            print(f"  predictions: {stats['rows']:,}行 ({stats['races']:,}レース, {stats['flushes']}回) "
+                  f"{stats['seconds']:.2f}秒 {rate}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._buffer.clear()
+
+
+def save_predictions(conn, race_id, predictions, model_version, verbose=False):
+    """
+    1レース分の予測を保存（同じ race_id / model_version の予測は上書き、他のバージョンは残す）
+
+    Returns:
+        dict: PredictionWriter.stats()
+    """
+    with PredictionWriter(conn, model_version, verbose=verbose) as writer:
+        writer.add(race_id, predictions)
+    return writer.stats()
@@ -0,0 +1,258 @@
+"""
+ステージ単位のプロファイリング（--profile で指定したときだけ有効）
+
+instrumentation.span の名前（またはパス）を --profile で指定すると、そのステージの実行中だけ
+プロファイラを動かし、--metrics-out と同じディレクトリに保存する（未指定の場合は metrics/）
+同じステージが何度も実行される場合（バックテストの1レースごとの特徴量生成など）は合算する
+
+プロファイラ:
+  sampling  一定間隔でスタックを記録（既定）→ <job>_<stage>.folded
+            flamegraph.pl / speedscope / inferno でそのまま読める折りたたみ形式
+  cprofile  cProfile で全関数呼び出しを記録 → <job>_<stage>.prof
+            snakeviz / flameprof / pstats で読む（上位の関数は画面にも表示）
+
+--profile-lines で関数を指定すると line_profiler で行単位の計測も行う（<job>_<stage>.lines.txt）
+line_profiler は任意の依存（pip install line_profiler）
+
+ワーカープロセス（非同期収集のパース、n_jobs を使う交差検証など）の処理は計測されない
+
+使用方法:
+    python ml/train_enhanced_model.py --profile features
+    python ml/backtest.py --races 100 --profile backtest/features --profiler cprofile
+    python ml/train_model.py --profile features \\
+        --profile-lines ml.feature_engineer.FeatureEngineer.create_features
+"""
+import os
+import io
+import sys
+import pstats
+import cProfile
+import threading
+import importlib
+from collections import Counter
+
+try:
+    from line_profiler import LineProfiler
+    HAS_LINE_PROFILER = True
+except ImportError:
+    HAS_LINE_PROFILER = False
+
+PROFILERS = ['sampling', 'cprofile']
+DEFAULT_PROFILER = 'sampling'
+
+# サンプリング間隔（秒）
+DEFAULT_INTERVAL = 0.005
+
+# 出力先（--metrics-out を指定しない場合）
+DEFAULT_PROFILE_DIR = 'metrics'
+
+# cProfile の結果を画面に表示する件数
+PRINT_TOP_FUNCTIONS = 25
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """別スレッドから対象スレッドのスタックを一定間隔で記録"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self, base_path):
+        """折りたたみ形式（1行に「呼び出し元;...;関数 サンプル数」）で保存"""
+        path = f"{base_path}.folded"
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return [path]
+
+
+class CProfileProfiler:
+    """cProfile（決定的プロファイラ）"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, base_path):
+        path = f"{base_path}.prof"
+        self.profile.dump_stats(path)
+
+        output = io.StringIO()
+        pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(PRINT_TOP_FUNCTIONS)
+        print(output.getvalue())
+        return [path]
+
+
+class LineLevelProfiler:
+    """line_profiler で指定した関数を行単位で計測"""
+
+    def __init__(self, functions):
+        self.profile = LineProfiler()
+        for function in functions:
+            self.profile.add_function(function)
+
+    def start(self):
+        self.profile.enable_by_count()
+
+    def stop(self):
+        self.profile.disable_by_count()
+
+    def write(self, base_path):
+        path = f"{base_path}.lines.txt"
+        with open(path, 'w', encoding='utf-8') as f:
+            self.profile.print_stats(stream=f, output_unit=1e-3)
+        return [path]
+
+
+def resolve_function(dotted_name):
+    """'ml.feature_engineer.FeatureEngineer.create_features' のような名前から関数を取得"""
+    parts = dotted_name.split('.')
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            target = importlib.import_module('.'.join(parts[:i]))
+        except ImportError:
+            continue
+        for attr in parts[i:]:
+            target = getattr(target, attr)
+        return target
+    raise ImportError(f"cannot resolve {dotted_name}")
+
+
+class StageProfiler:
+    """
+    指定したステージの実行中だけプロファイラを動かす
+
+    Args:
+        stages: ステージ名またはパスのリスト（'features'、'backtest/features' など）
+        profiler: 'sampling' / 'cprofile'
+        line_functions: 行単位で計測する関数名のリスト（line_profiler が必要）
+        interval: サンプリング間隔（秒）
+    """
+
+    def __init__(self, stages, profiler=DEFAULT_PROFILER, line_functions=None, interval=DEFAULT_INTERVAL):
+        self.stages = set(stages)
+        self.profiler = profiler
+        self.interval = interval
+        self.line_functions = []
+        self._profilers = {}
+        self._active = None
+
+        if line_functions:
+            if not HAS_LINE_PROFILER:
+                print("[WARNING] line_profiler がインストールされていないため、行単位の計測は行いません")
+            else:
+                self.line_functions = [resolve_function(name) for name in line_functions]
+
+    def matches(self, name, path):
+        return name in self.stages or path in self.stages
+
+    def _create(self):
+        profilers = []
+        if self.profiler == 'cprofile':
+            profilers.append(CProfileProfiler())
+        else:
+            profilers.append(SamplingProfiler(self.interval))
+        if self.line_functions:
+            profilers.append(LineLevelProfiler(self.line_functions))
+        return profilers
+
+    def start(self, name, path):
+        """ステージ開始（対象外、または外側のステージを計測中の場合は何もしない）"""
+        if self._active is not None or not self.matches(name, path):
+            return False
+
+        profilers = self._profilers.get(path)
+        if profilers is None:
+            profilers = self._profilers[path] = self._create()
+        for profiler in profilers:
+            profiler.start()
+        self._active = path
+        return True
+
+    def stop(self, path):
+        if self._active != path:
+            return
+        for profiler in self._profilers[path]:
+            profiler.stop()
+        self._active = None
+
+    def write(self, output_dir, job):
+        """
+        計測結果を保存
+
+        Returns:
+            list: 保存したファイルのパス
+        """
+        if not self._profilers:
+            print(f"[WARNING] --profile で指定したステージが実行されませんでした: {', '.join(sorted(self.stages))}")
+            return []
+
+        os.makedirs(output_dir, exist_ok=True)
+        written = []
+        for path, profilers in self._profilers.items():
+            base_path = os.path.join(output_dir, f"{job}_{path.replace('/', '-')}")
+            for profiler in profilers:
+                written.extend(profiler.write(base_path))
+
+        print("\nプロファイル:")
+        for path in written:
+            print(f"  {path}")
+        return written
+
+
+def add_profile_arguments(parser):
+    """--profile / --profiler / --profile-lines / --profile-interval 引数を追加"""
+    parser.add_argument('--profile', type=str, default=None, metavar='STAGE[,STAGE]',
+                        help='Profile only these stages (span name or path, e.g. features or backtest/features)')
+    parser.add_argument('--profiler', type=str, default=DEFAULT_PROFILER, choices=PROFILERS,
+                        help=f'Profiler for --profile (default: {DEFAULT_PROFILER}; sampling writes .folded '
+                             'for flame graphs, cprofile writes .prof)')
+    parser.add_argument('--profile-lines', type=str, default=None, metavar='FUNC[,FUNC]',
+                        help='Also record line timings for these functions, e.g. '
+                             'ml.feature_engineer.FeatureEngineer.create_features (requires line_profiler)')
+    parser.add_argument('--profile-interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f'Sampling interval in seconds (default: {DEFAULT_INTERVAL})')
+
+
+def build_stage_profiler(args):
+    """add_profile_arguments の引数から StageProfiler を作成（--profile 未指定の場合は None）"""
+    if not getattr(args, 'profile', None):
+        return None
+
+    stages = [stage.strip() for stage in args.profile.split(',') if stage.strip()]
+    line_functions = [f.strip() for f in (args.profile_lines or '').split(',') if f.strip()]
+    return StageProfiler(stages, profiler=args.profiler, line_functions=line_functions,
+                         interval=args.profile_interval)
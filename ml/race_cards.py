@@ -0,0 +1,340 @@
+"""
+出走表（race_cards テーブル）の作成・取得
+
+予測に必要な1レース分のデータ（race_entries / races / racers / racer_detailed_stats）を
+1艇1行にまとめて保存しておき、予測時は race_id の主キー検索1回で読む
+- racer_detailed_stats の JSONB（grade_stats / course_stats / venue_stats）は
+  その艇の枠番・会場に該当する数値だけを取り出して列にする（flatten_detailed_stats）
+- 特徴量の計算（EnhancedFeatureEngineer）は JSONB からでも race_cards の列からでも同じ値になる
+
+更新のタイミング:
+- kyotei24_scraper.py: レースを保存するたびに、そのレースの出走表を作り直す
+- boatrace_db_scraper.py: 選手の詳細統計を更新した後、当日以降のレースの出走表を作り直す
+- predict_race_enhanced.py: 出走表がないレースはその場で作成する
+
+テーブルは scraper/migrations/create_race_cards.sql で作成する
+
+使用方法:
+    python ml/race_cards.py --days 3                 # 3日前以降のレースの出走表を作り直す
+    python ml/race_cards.py --since 2025-01-01
+    python ml/race_cards.py --race-id 12345
+"""
+import os
+import sys
+import argparse
+from datetime import date, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 会場IDと名前のマッピング（venue_stats のキーの検索に使う）
+VENUE_NAMES = {
+    1: '桐生', 2: '戸田', 3: '江戸川', 4: '平和島', 5: '多摩川', 6: '浜名湖',
+    7: '蒲郡', 8: '常滑', 9: '津', 10: '三国', 11: '琵琶湖', 12: '住之江',
+    13: '尼崎', 14: '鳴門', 15: '丸亀', 16: '児島', 17: '宮島', 18: '徳山',
+    19: '下関', 20: '若松', 21: '芦屋', 22: '福岡', 23: '唐津', 24: '大村'
+}
+
+# 出走表の元データ（predict_race_enhanced.py が以前直接実行していたクエリと同じ結合）
+CARD_SOURCE_QUERY = """
+    SELECT
+        re.race_id,
+        re.boat_number,
+        re.racer_id,
+        re.motor_number,
+        re.start_timing,
+        re.course,
+        re.result_position,
+        re.racer_grade,
+        re.win_rate,
+        re.place_rate_2,
+        re.place_rate_3,
+        re.motor_rate_2,
+        re.motor_rate_3,
+        re.boat_rate_2,
+        re.boat_rate_3,
+        re.exhibition_time,
+        re.exhibition_turn_time,
+        re.exhibition_straight_time,
+        re.average_st,
+        re.flying_count,
+        re.late_count,
+        re.actual_course,
+        r.race_date,
+        r.venue_id,
+        r.race_number,
+        r.grade as race_grade,
+        rc.name as racer_name,
+        rc.racer_number,
+        rc.grade as racer_current_grade,
+        rds.overall_win_rate as racer_overall_win_rate,
+        rds.overall_1st_rate as racer_1st_rate,
+        rds.overall_2nd_rate as racer_2nd_rate,
+        rds.overall_3rd_rate as racer_3rd_rate,
+        rds.avg_start_timing as racer_avg_st,
+        rds.sg_appearances,
+        rds.flying_count as racer_flying_count,
+        rds.late_start_count as racer_late_count,
+        rds.grade_stats,
+        rds.course_stats,
+        rds.venue_stats
+    FROM race_entries re
+    JOIN races r ON re.race_id = r.id
+    LEFT JOIN racers rc ON re.racer_id = rc.id
+    LEFT JOIN racer_detailed_stats rds ON rc.racer_number = rds.racer_number
+    WHERE {condition}
+    ORDER BY re.race_id, re.boat_number
+"""
+
+JSON_COLUMNS = ['grade_stats', 'course_stats', 'venue_stats']
+
+# JSONB から取り出す値と、該当データがない場合の値（EnhancedFeatureEngineer の既定値と同じ）
+DETAILED_STATS_DEFAULTS = {
+    'sg_win_rate': 0.0,
+    'sg_experience_score': 0,
+    'g1_win_rate': 0.0,
+    'g2_win_rate': 0.0,
+    'g3_win_rate': 0.0,
+    'total_yusyutsu': 0,
+    'total_yusho': 0,
+    'course_specific_1st_rate': 0.0,
+    'course_win_rate_venue': 0.0,
+    'course_nige_rate': 0.0,
+    'course_sashi_rate': 0.0,
+    'course_makuri_rate': 0.0,
+    'venue_specific_win_rate': 0.0,
+    'venue_specific_1st_rate': 0.0,
+    'venue_specific_2nd_rate': 0.0,
+    'racer_avg_st_venue': 0.15,
+    'venue_experience': 0,
+}
+
+# race_cards の列（refreshed_at を除く）
+CARD_COLUMNS = [
+    'race_id', 'boat_number', 'racer_id', 'motor_number', 'start_timing', 'course', 'result_position',
+    'racer_grade', 'win_rate', 'place_rate_2', 'place_rate_3', 'motor_rate_2', 'motor_rate_3',
+    'boat_rate_2', 'boat_rate_3', 'exhibition_time', 'exhibition_turn_time', 'exhibition_straight_time',
+    'average_st', 'flying_count', 'late_count', 'actual_course',
+    'race_date', 'venue_id', 'race_number', 'race_grade',
+    'racer_name', 'racer_number', 'racer_current_grade',
+    'racer_overall_win_rate', 'racer_1st_rate', 'racer_2nd_rate', 'racer_3rd_rate', 'racer_avg_st',
+    'sg_appearances', 'racer_flying_count', 'racer_late_count',
+] + list(DETAILED_STATS_DEFAULTS)
+
+
+def flatten_detailed_stats(grade_stats, course_stats, venue_stats, boat_number, venue_id):
+    """
+    racer_detailed_stats の JSONB から、その艇の枠番・会場に該当する数値を取り出す
+
+    Args:
+        grade_stats / course_stats / venue_stats: JSONB の値（dict、ない場合は None）
+        boat_number: 枠番（course_stats のキーを探す）
+        venue_id: 会場ID（venue_stats のキーを会場名で探す）
+
+    Returns:
+        dict: DETAILED_STATS_DEFAULTS と同じキー
+    """
+    stats = dict(DETAILED_STATS_DEFAULTS)
+
+    # グレード別成績
+    if grade_stats and isinstance(grade_stats, dict):
+        sg_stats = grade_stats.get('SG', {})
+        stats['sg_win_rate'] = float(sg_stats.get('win_rate', 0))
+        stats['sg_experience_score'] = 1 if sg_stats.get('races', 0) > 0 else 0
+        stats['g1_win_rate'] = float(grade_stats.get('G1', {}).get('win_rate', 0))
+        stats['g2_win_rate'] = float(grade_stats.get('G2', {}).get('win_rate', 0))
+        stats['g3_win_rate'] = float(grade_stats.get('G3', {}).get('win_rate', 0))
+        stats['total_yusyutsu'] = sum(g.get('yusyutsu', 0) for g in grade_stats.values() if isinstance(g, dict))
+        stats['total_yusho'] = sum(g.get('yusho', 0) for g in grade_stats.values() if isinstance(g, dict))
+
+    # コース別成績（キーに枠番を含む最初の項目）
+    if course_stats and isinstance(course_stats, dict):
+        course_data = None
+        for key in course_stats.keys():
+            if str(boat_number) in key:
+                course_data = course_stats[key]
+                break
+
+        if course_data and isinstance(course_data, dict):
+            stats['course_specific_1st_rate'] = float(course_data.get('1st_rate', 0))
+            stats['course_win_rate_venue'] = float(course_data.get('win_rate', 0))
+            stats['course_nige_rate'] = float(course_data.get('nige_rate', 0))
+            stats['course_sashi_rate'] = float(course_data.get('sashi_rate', 0))
+            stats['course_makuri_rate'] = float(course_data.get('makuri_rate', 0))
+
+    # 会場別成績（キーに会場名を含む最初の項目）
+    if venue_stats and isinstance(venue_stats, dict):
+        venue_data = None
+        venue_name = VENUE_NAMES.get(venue_id, '')
+        for key in venue_stats.keys():
+            if venue_name and venue_name in key:
+                venue_data = venue_stats[key]
+                break
+
+        if venue_data and isinstance(venue_data, dict):
+            stats['venue_specific_win_rate'] = float(venue_data.get('win_rate', 0))
+            stats['venue_specific_1st_rate'] = float(venue_data.get('1st_rate', 0))
+            stats['venue_specific_2nd_rate'] = float(venue_data.get('2nd_rate', 0))
+            stats['racer_avg_st_venue'] = float(venue_data.get('avg_st', 0.15))
+            stats['venue_experience'] = int(venue_data.get('races', 0))
+
+    return stats
+
+
+def fetch_card_rows(cursor, race_ids=None, since=None):
+    """
+    出走表の行を作成（保存はしない）
+
+    Args:
+        cursor: DBカーソル
+        race_ids: 対象のレースIDのリスト
+        since: この日付以降のレースを対象にする（race_ids を指定しない場合）
+
+    Returns:
+        list: CARD_COLUMNS をキーとする dict のリスト（race_id, boat_number 順）
+    """
+    if race_ids is not None:
+        condition, params = "re.race_id = ANY(%(race_ids)s)", {'race_ids': list(race_ids)}
+    elif since is not None:
+        condition, params = "r.race_date >= %(since)s", {'since': since}
+    else:
+        raise ValueError("race_ids or since is required")
+
+    cursor.execute(CARD_SOURCE_QUERY.format(condition=condition), params)
+    columns = [desc[0] for desc in cursor.description]
+
+    rows = []
+    for values in cursor.fetchall():
+        row = dict(zip(columns, values))
+        json_values = [row.pop(column) for column in JSON_COLUMNS]
+        row.update(flatten_detailed_stats(*json_values, boat_number=row['boat_number'], venue_id=row['venue_id']))
+        rows.append(row)
+
+    return rows
+
+
+def refresh_race_cards(conn, race_ids=None, since=None, page_size=1000):
+    """
+    出走表を作り直して保存（race_id, boat_number 単位で upsert）
+
+    Returns:
+        int: 保存した行数
+    """
+    if race_ids is not None and len(race_ids) == 0:
+        return 0
+
+    cursor = conn.cursor()
+    try:
+        rows = fetch_card_rows(cursor, race_ids=race_ids, since=since)
+
+        if rows:
+            updates = ', '.join(f"{column} = EXCLUDED.{column}"
+                                for column in CARD_COLUMNS if column not in ('race_id', 'boat_number'))
+            execute_values(cursor, f"""
+                INSERT INTO race_cards ({', '.join(CARD_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (race_id, boat_number) DO UPDATE
+                SET {updates}, refreshed_at = NOW()
+            """, [tuple(row[column] for column in CARD_COLUMNS) for row in rows], page_size=page_size)
+
+        conn.commit()
+        return len(rows)
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        cursor.close()
+
+
+def try_refresh_race_cards(conn, race_ids=None, since=None):
+    """
+    refresh_race_cards を実行し、失敗してもエラーを表示するだけにする（収集処理は止めない）
+
+    Returns:
+        int: 保存した行数（失敗時は0）
+    """
+    try:
+        return refresh_race_cards(conn, race_ids=race_ids, since=since)
+    except psycopg2.errors.UndefinedTable:
+        print("[WARNING] race_cards テーブルがありません（scraper/migrations/create_race_cards.sql を実行してください）")
+    except psycopg2.Error as e:
+        print(f"[WARNING] 出走表の更新に失敗しました: {e}")
+    return 0
+
+
+def read_race_card(conn, race_id):
+    """
+    1レース分の出走表を取得（race_cards の主キー検索）
+
+    出走表がない（または6艇そろっていない）場合はその場で作成して保存する
+    race_cards テーブルがない場合は保存せずに作成した行を返す
+
+    Returns:
+        DataFrame: CARD_COLUMNS の列（boat_number 順、NUMERIC 列は float）
+    """
+    import pandas as pd
+
+    query = f"""
+        SELECT {', '.join(CARD_COLUMNS)}
+        FROM race_cards
+        WHERE race_id = %s
+        ORDER BY boat_number
+    """
+
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute(query, (race_id,))
+            rows = cursor.fetchall()
+
+            if len(rows) != 6:
+                refresh_race_cards(conn, race_ids=[race_id])
+                cursor.execute(query, (race_id,))
+                rows = cursor.fetchall()
+
+        except psycopg2.errors.UndefinedTable:
+            conn.rollback()
+            rows = fetch_card_rows(cursor, race_ids=[race_id])
+
+        # NUMERIC 列（Decimal）は float にする（特徴量の計算で float と混ざるとエラーになる）
+        return pd.DataFrame.from_records(rows, columns=CARD_COLUMNS, coerce_float=True)
+
+    finally:
+        cursor.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    # スクレイパー（db を直接 import する）から読み込まれた場合に別のプールを作らないよう、ここで import する
+    from scraper.db import connect
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Rebuild race cards (one indexed row per boat for prediction)')
+    parser.add_argument('--race-id', type=int, action='append', default=None,
+                        help='Rebuild this race (can be repeated)')
+    parser.add_argument('--since', type=str, default=None, help='Rebuild races on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=1,
+                        help='Rebuild races from this many days ago onward when --since is not given (default: 1)')
+    args = parser.parse_args()
+
+    since = args.since or (date.today() - timedelta(days=args.days)).isoformat()
+
+    conn = connect()
+    try:
+        if args.race_id:
+            count = refresh_race_cards(conn, race_ids=args.race_id)
+            print(f"出走表を更新: {count}行（{len(args.race_id)}レース）")
+        else:
+            count = refresh_race_cards(conn, since=since)
+            print(f"出走表を更新: {count}行（{since} 以降）")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+"""
+レースをまとめて保持する型付きの配列コンテナ（RaceTable）
+
+訓練データのような多数のレースを、1艇1行の DataFrame（文字列・JSONB・object 列を含む）ではなく
+項目ごとの (R, 6) の NumPy 配列で持つ（R = レース数、6 = 艇番順）
+- 率・タイムなど: float32（欠損は NaN）
+- 回数・番号など: 整数（欠損は -1）
+- 級別・レースグレード・決まり手: カテゴリコード int8（GRADES / RACE_GRADES / TECHNIQUES の位置、欠損・不明は -1）
+- 会場: venue_id（1-24）をそのままコードとして int8 で持つ
+- racer_detailed_stats の JSONB は読み込み時に flatten_detailed_stats で数値にする
+- 元データにない項目は領域を確保しない（全レース欠損の読み取り専用配列を返す）
+
+レースは table.race(i) のビュー（RaceView）で参照し、コピーせずに table['win_rate'][i] のように添字で読む
+特徴量は EnhancedFeatureEngineer.create_features_table(table) で全レース分をまとめて計算できる
+
+読み込み:
+    table = RaceTable.from_sql(conn)              # TRAINING_DATA_QUERY をサーバー側カーソルで少しずつ読む
+    table = RaceTable.from_dataframe(df)          # fetch_training_data_enhanced() などの1艇1行の DataFrame
+    table = RaceTable.from_parquet(path)          # to_parquet() で保存したもの（要 pyarrow）
+
+使用方法:
+    from ml.race_table import RaceTable
+
+    table = RaceTable.from_sql(conn)
+    print(len(table), table.memory_usage() / 1024 / 1024)
+    win_rate = table['win_rate']                  # (R, 6) float32
+    race = table.race(0)
+    race['exhibition_time']                       # (6,) のビュー
+    race.to_frame()                               # create_features にそのまま渡せる DataFrame
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.race_cards import DETAILED_STATS_DEFAULTS, flatten_detailed_stats
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+BOATS = 6
+
+# カテゴリ（コードはリスト内の位置）
+GRADES = ['A1', 'A2', 'B1', 'B2']
+RACE_GRADES = ['SG', 'G1', 'G2', 'G3', '一般']
+TECHNIQUES = ['逃げ', '差し', 'まくり', 'まくり差し', '抜き', '恵まれ']
+
+# 艇ごとの float32 の項目
+FLOAT_FIELDS = [
+    'win_rate', 'place_rate_2', 'place_rate_3',
+    'motor_rate_2', 'motor_rate_3', 'boat_rate_2', 'boat_rate_3',
+    'exhibition_time', 'exhibition_turn_time', 'exhibition_straight_time',
+    'average_st', 'start_timing',
+    'racer_overall_win_rate', 'racer_1st_rate', 'racer_2nd_rate', 'racer_3rd_rate', 'racer_avg_st',
+] + [field for field, default in DETAILED_STATS_DEFAULTS.items() if isinstance(default, float)]
+
+# race_entries の DECIMAL 列の小数桁数（float32 から float64 に戻すときに丸める）
+DECIMAL_PLACES = {
+    'win_rate': 2, 'place_rate_2': 2, 'place_rate_3': 2,
+    'motor_rate_2': 2, 'motor_rate_3': 2, 'boat_rate_2': 2, 'boat_rate_3': 2,
+    'exhibition_time': 2, 'exhibition_turn_time': 2, 'exhibition_straight_time': 2,
+    'average_st': 2,
+}
+
+# 艇ごとの整数の項目と型（欠損は -1）
+INT_FIELDS = {
+    'boat_number': np.int8,
+    'racer_id': np.int32,
+    'motor_number': np.int16,
+    'course': np.int8,
+    'actual_course': np.int8,
+    'result_position': np.int8,
+    'flying_count': np.int16,
+    'late_count': np.int16,
+    'sg_appearances': np.int16,
+    'racer_flying_count': np.int16,
+    'racer_late_count': np.int16,
+    **{field: np.int32 for field, default in DETAILED_STATS_DEFAULTS.items() if isinstance(default, int)},
+}
+
+# 艇ごとのカテゴリの項目（項目名 → (元の列の候補, カテゴリ)）
+CATEGORY_FIELDS = {
+    'racer_grade': (['racer_grade', 'grade'], GRADES),
+    'winning_technique': (['winning_technique'], TECHNIQUES),
+}
+
+JSON_COLUMNS = ['grade_stats', 'course_stats', 'venue_stats']
+
+# from_sql でサーバー側カーソルから1回に読む行数
+DEFAULT_CHUNK_ROWS = 60000
+
+
+def _numeric(df, column):
+    """列を float64 の配列にする（数値にできない値は NaN）"""
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _codes(values, categories):
+    """文字列の列をカテゴリコードにする（欠損・不明は -1）"""
+    return pd.Categorical(np.asarray(values, dtype=object), categories=categories).codes.astype(np.int8)
+
+
+def _missing(field, shape):
+    """元データにない項目（全レース欠損、領域は確保しない）"""
+    if field in FLOAT_FIELDS:
+        value = np.float32(np.nan)
+    elif field in INT_FIELDS:
+        value = INT_FIELDS[field](-1)
+    else:
+        value = np.int8(-1)
+    return np.broadcast_to(value, shape)
+
+
+class RaceTable:
+    """
+    R レース分の出走データ（項目ごとの (R, 6) 配列）
+
+    レース単位の項目: race_id (int64), race_date (datetime64[D]), venue_id (int8),
+                      race_number (int8), race_grade (RACE_GRADES のコード)
+    艇ごとの項目: table[項目名] で (R, 6) の配列（FLOAT_FIELDS / INT_FIELDS / CATEGORY_FIELDS）
+    """
+
+    def __init__(self, race_id, race_date, venue_id, race_number, race_grade, boats):
+        self.race_id = race_id
+        self.race_date = race_date
+        self.venue_id = venue_id
+        self.race_number = race_number
+        self.race_grade = race_grade
+        # 元データにあった項目だけを持つ
+        self.boats = boats
+
+    def __len__(self):
+        return len(self.race_id)
+
+    def __getitem__(self, field):
+        """艇ごとの項目の (R, 6) 配列（元データにない項目は欠損の読み取り専用配列）"""
+        if field in self.boats:
+            return self.boats[field]
+        if field in FLOAT_FIELDS or field in INT_FIELDS or field in CATEGORY_FIELDS:
+            return _missing(field, (len(self), BOATS))
+        raise KeyError(field)
+
+    def float64(self, field):
+        """
+        float の項目を float64 の (R, 6) 配列で取得（計算用のコピー）
+
+        DECIMAL 列は元の桁数に丸めるため、float32 にしたことで 6.80 が 6.8000002 になるなどの
+        誤差が出ない（展示タイムの順位などの比較が元の値と同じになる）
+        """
+        values = self[field].astype(np.float64)
+        if field in DECIMAL_PLACES and self.has(field):
+            values = np.round(values, DECIMAL_PLACES[field])
+        return values
+
+    def has(self, field):
+        """元データにあった項目か"""
+        return field in self.boats
+
+    def race(self, index):
+        """1レース分のビュー"""
+        return RaceView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield RaceView(self, index)
+
+    def take(self, indices):
+        """指定したレースだけの RaceTable（indices は位置の配列、または長さ R の bool 配列）"""
+        indices = np.asarray(indices)
+        return RaceTable(
+            self.race_id[indices], self.race_date[indices], self.venue_id[indices],
+            self.race_number[indices], self.race_grade[indices],
+            {field: values[indices] for field, values in self.boats.items()}
+        )
+
+    def memory_usage(self):
+        """配列の合計バイト数"""
+        arrays = [self.race_id, self.race_date, self.venue_id, self.race_number, self.race_grade]
+        return sum(array.nbytes for array in arrays + list(self.boats.values()))
+
+    def labels(self, field):
+        """カテゴリの項目を文字列に戻す（(R, 6) の object 配列、欠損は None）"""
+        if field == 'race_grade':
+            codes, categories = self.race_grade, RACE_GRADES
+        else:
+            codes, categories = self[field], CATEGORY_FIELDS[field][1]
+        lookup = np.array(categories + [None], dtype=object)
+        return lookup[np.where(codes < 0, len(categories), codes)]
+
+    @classmethod
+    def concat(cls, tables):
+        """RaceTable を順に連結（項目は全 table の和集合、ない分は欠損）"""
+        tables = [table for table in tables if len(table) > 0]
+        if not tables:
+            return cls.empty()
+        if len(tables) == 1:
+            return tables[0]
+
+        fields = []
+        for table in tables:
+            fields.extend(field for field in table.boats if field not in fields)
+
+        return cls(
+            np.concatenate([table.race_id for table in tables]),
+            np.concatenate([table.race_date for table in tables]),
+            np.concatenate([table.venue_id for table in tables]),
+            np.concatenate([table.race_number for table in tables]),
+            np.concatenate([table.race_grade for table in tables]),
+            {field: np.concatenate([table[field] for table in tables]) for field in fields}
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, np.int64), np.empty(0, 'datetime64[D]'), np.empty(0, np.int8),
+                   np.empty(0, np.int8), np.empty(0, np.int8), {})
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        1艇1行の DataFrame から作成
+
+        6艇そろっていないレースは除く
+        レースの順序は race_id の出現順、レース内は boat_number 順
+
+        Args:
+            df: race_id, boat_number と FLOAT_FIELDS / INT_FIELDS / CATEGORY_FIELDS の列
+                （races の列 race_date / venue_id / race_number / race_grade、
+                 racer_detailed_stats の JSONB 列 grade_stats / course_stats / venue_stats も使う）
+        """
+        if len(df) == 0:
+            return cls.empty()
+
+        df = df[df['race_id'].notna()]
+        sizes = df.groupby('race_id', sort=False)['race_id'].transform('size').to_numpy()
+        df = df[sizes == BOATS]
+        if len(df) == 0:
+            return cls.empty()
+
+        race_codes, race_ids = pd.factorize(df['race_id'], sort=False)
+        boat_number = np.nan_to_num(_numeric(df, 'boat_number'), nan=0.0)
+        order = np.lexsort((boat_number, race_codes))
+        shape = (len(race_ids), BOATS)
+
+        def boat_values(values):
+            return np.asarray(values)[order].reshape(shape)
+
+        boats = {}
+        for field in FLOAT_FIELDS:
+            if field in df.columns:
+                boats[field] = boat_values(_numeric(df, field).astype(np.float32))
+
+        for field, dtype in INT_FIELDS.items():
+            if field in df.columns:
+                values = _numeric(df, field)
+                boats[field] = boat_values(np.where(np.isnan(values), -1, values).astype(dtype))
+
+        for field, (columns, categories) in CATEGORY_FIELDS.items():
+            column = next((c for c in columns if c in df.columns), None)
+            if column is not None:
+                boats[field] = boat_values(_codes(df[column], categories))
+
+        # racer_detailed_stats の JSONB は数値にする（EnhancedFeatureEngineer と同じ取り出し方）
+        if any(column in df.columns for column in JSON_COLUMNS):
+            detailed = [
+                flatten_detailed_stats(grade_stats, course_stats, venue_stats,
+                                       boat_number=int(number) if pd.notna(number) else 1,
+                                       venue_id=int(venue) if pd.notna(venue) else 1)
+                for grade_stats, course_stats, venue_stats, number, venue in zip(
+                    *(df[column] if column in df.columns else [None] * len(df) for column in JSON_COLUMNS),
+                    df['boat_number'],
+                    df['venue_id'] if 'venue_id' in df.columns else [1] * len(df)
+                )
+            ]
+            for field, default in DETAILED_STATS_DEFAULTS.items():
+                dtype = np.float32 if isinstance(default, float) else INT_FIELDS[field]
+                boats[field] = boat_values(np.array([row[field] for row in detailed]).astype(dtype))
+
+        # レース単位の項目はレースの先頭の行から
+        first = order.reshape(shape)[:, 0]
+
+        def race_values(column, missing=-1, dtype=np.int8):
+            if column not in df.columns:
+                return np.full(shape[0], missing, dtype=dtype)
+            values = _numeric(df, column)[first]
+            return np.where(np.isnan(values), missing, values).astype(dtype)
+
+        if 'race_date' in df.columns:
+            race_date = pd.to_datetime(df['race_date'].to_numpy()[first]).to_numpy().astype('datetime64[D]')
+        else:
+            race_date = np.full(shape[0], np.datetime64('NaT'), dtype='datetime64[D]')
+
+        race_grade_column = 'race_grade' if 'race_grade' in df.columns else None
+        race_grade = (_codes(df[race_grade_column].to_numpy()[first], RACE_GRADES)
+                      if race_grade_column else np.full(shape[0], -1, dtype=np.int8))
+
+        return cls(
+            np.asarray(race_ids, dtype=np.int64),
+            race_date,
+            race_values('venue_id'),
+            race_values('race_number'),
+            race_grade,
+            boats
+        )
+
+    @classmethod
+    def from_sql(cls, conn=None, query=None, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """
+        SQL の結果から作成（全行の DataFrame を作らず、chunk_rows 行ずつ配列にする）
+
+        PostgreSQL ではサーバー側カーソル（名前付きカーソル）で少しずつ読む
+        クエリは同じレースの行が連続するように並べること（TRAINING_DATA_QUERY は race の順）
+
+        Args:
+            conn: DB接続（Noneの場合は DATABASE_URL に接続して閉じる、SQLite 接続も可）
+            query: 既定は enhanced_feature_engineer.TRAINING_DATA_QUERY
+        """
+        if query is None:
+            from ml.enhanced_feature_engineer import TRAINING_DATA_QUERY
+            query = TRAINING_DATA_QUERY
+
+        own_conn = conn is None
+        if own_conn:
+            from scraper.db import connect
+            conn = connect()
+
+        try:
+            try:
+                cursor = conn.cursor(name='race_table_load')
+                cursor.itersize = chunk_rows
+            except TypeError:
+                # SQLite など名前付きカーソルがない接続
+                cursor = conn.cursor()
+
+            cursor.execute(query, params) if params is not None else cursor.execute(query)
+
+            tables = []
+            pending = None
+            columns = None
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if columns is None:
+                    columns = [desc[0] for desc in cursor.description]
+                if not rows:
+                    break
+
+                chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                if pending is not None:
+                    chunk = pd.concat([pending, chunk], ignore_index=True)
+
+                # 最後のレースは次の chunk に続いている可能性があるため持ち越す
+                last = chunk['race_id'].to_numpy() == chunk['race_id'].iloc[-1]
+                pending = chunk[last]
+                tables.append(cls.from_dataframe(chunk[~last]))
+
+            if pending is not None:
+                tables.append(cls.from_dataframe(pending))
+
+            cursor.close()
+            if not own_conn and not getattr(conn, 'autocommit', True):
+                # 名前付きカーソルのトランザクションを終える（読み取りのみ）
+                conn.rollback()
+
+        finally:
+            if own_conn:
+                conn.close()
+
+        return cls.concat(tables)
+
+    def to_frame(self):
+        """
+        1艇1行の DataFrame に戻す（カテゴリは文字列、to_parquet / create_features 用）
+
+        Returns:
+            DataFrame: race_id, race_date, venue_id, race_number, race_grade と艇ごとの項目
+        """
+        n = len(self)
+        frame = {
+            'race_id': np.repeat(self.race_id, BOATS),
+            'race_date': np.repeat(self.race_date, BOATS),
+            'venue_id': np.repeat(self.venue_id, BOATS),
+            'race_number': np.repeat(self.race_number, BOATS),
+            'race_grade': pd.Categorical.from_codes(np.repeat(self.race_grade, BOATS), RACE_GRADES),
+        }
+        for field, values in self.boats.items():
+            flat = values.reshape(n * BOATS)
+            if field in CATEGORY_FIELDS:
+                frame[field] = pd.Categorical.from_codes(flat, CATEGORY_FIELDS[field][1])
+            elif field in INT_FIELDS:
+                frame[field] = pd.array(np.where(flat < 0, None, flat), dtype=pd.Int64Dtype())
+            else:
+                frame[field] = flat
+        return pd.DataFrame(frame)
+
+    def to_parquet(self, path):
+        """Parquet で保存（1艇1行、カテゴリは辞書エンコード）"""
+        if not HAS_PYARROW:
+            raise ImportError("Parquet の保存には pyarrow が必要です: pip install pyarrow")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.to_frame().to_parquet(path, compression='zstd', index=False)
+
+    @classmethod
+    def from_parquet(cls, path):
+        """to_parquet() で保存した Parquet（または同じ列の1艇1行の Parquet）から作成"""
+        if not HAS_PYARROW:
+            raise ImportError("Parquet の読み込みには pyarrow が必要です: pip install pyarrow")
+        return cls.from_dataframe(pd.read_parquet(path))
+
+
+class RaceView:
+    """RaceTable の1レース分（配列はコピーせずに参照する）"""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def race_id(self):
+        return int(self.table.race_id[self.index])
+
+    @property
+    def race_date(self):
+        return self.table.race_date[self.index]
+
+    @property
+    def venue_id(self):
+        return int(self.table.venue_id[self.index])
+
+    @property
+    def race_number(self):
+        return int(self.table.race_number[self.index])
+
+    def __getitem__(self, field):
+        """艇番順の (6,) の配列（RaceTable の配列のビュー）"""
+        return self.table[field][self.index]
+
+    def to_frame(self):
+        """6行の DataFrame（EnhancedFeatureEngineer.create_features の入力と同じ列）"""
+        frame = self.table.take([self.index]).to_frame()
+        # create_features は欠損を None / NaN として扱うため、整数の列も float にする
+        for field in INT_FIELDS:
+            if field in frame.columns:
+                frame[field] = frame[field].astype('float64')
+        frame['boat_number'] = frame['boat_number'].astype('int64')
+        frame['venue_id'] = frame['venue_id'].where(frame['venue_id'] >= 0).astype('float64')
+        for field in list(CATEGORY_FIELDS) + ['race_grade']:
+            if field in frame.columns:
+                frame[field] = frame[field].astype(object).where(frame[field].notna(), None)
+        return frame
@@ -0,0 +1,414 @@
+"""
+ベンチマーク用の合成データ生成
+
+races / race_entries / racers / racer_detailed_stats と同じ列構成のデータを
+シード固定で生成し、SQLite または PostgreSQL（専用スキーマ）に読み込む
+本番DB（DATABASE_URL）なしで ml/benchmark.py を実行するために使う
+
+- 1日 12会場 × 12レース、各レース6艇（選手は重複なし）
+- 着順は選手の実力・モーター・枠番・展示タイムにノイズを加えて決める
+  （特徴量と結果に相関があるため、訓練・予測の処理量は実データに近い）
+
+使用方法:
+    python ml/synthetic_data.py --races 10000 --sqlite /tmp/boatrace_bench.sqlite
+    python ml/synthetic_data.py --races 100000 --postgres-url postgresql://localhost/bench
+"""
+import io
+import json
+import argparse
+import sqlite3
+from datetime import date
+import numpy as np
+import pandas as pd
+
+DEFAULT_SEED = 42
+DEFAULT_RACERS = 1600
+DEFAULT_START_DATE = date(2020, 1, 1)
+
+VENUES_PER_DAY = 12
+RACES_PER_VENUE = 12
+MOTORS_PER_VENUE = 60
+
+# PostgreSQL に読み込む場合のスキーマ（本番テーブルと混ざらないよう分ける）
+POSTGRES_SCHEMA = 'boatrace_benchmark'
+
+VENUE_NAMES = [
+    '桐生', '戸田', '江戸川', '平和島', '多摩川', '浜名湖', '蒲郡', '常滑', '津', '三国', '琵琶湖', '住之江',
+    '尼崎', '鳴門', '丸亀', '児島', '宮島', '徳山', '下関', '若松', '芦屋', '福岡', '唐津', '大村'
+]
+
+RACE_GRADES = ['一般', 'G3', 'G2', 'G1', 'SG']
+RACE_GRADE_PROBS = [0.80, 0.10, 0.05, 0.04, 0.01]
+RACER_GRADES = ['B2', 'B1', 'A2', 'A1']
+
+# 枠番ごとの有利さ（1号艇が最も有利）
+COURSE_ADVANTAGE = np.array([1.6, 0.5, 0.35, 0.2, -0.1, -0.4])
+
+# 合成データのテーブル定義（SQLite / PostgreSQL 共通の型のみ使用）
+TABLE_DDL = {
+    'races': """
+        CREATE TABLE races (
+            id INTEGER PRIMARY KEY,
+            race_date DATE NOT NULL,
+            venue_id INTEGER NOT NULL,
+            race_number INTEGER NOT NULL,
+            grade VARCHAR(10)
+        )
+    """,
+    'racers': """
+        CREATE TABLE racers (
+            id INTEGER PRIMARY KEY,
+            racer_number INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            grade VARCHAR(5)
+        )
+    """,
+    'race_entries': """
+        CREATE TABLE race_entries (
+            race_id INTEGER NOT NULL,
+            boat_number INTEGER NOT NULL,
+            racer_id INTEGER NOT NULL,
+            motor_number INTEGER,
+            start_timing REAL,
+            course INTEGER,
+            result_position INTEGER,
+            racer_grade VARCHAR(5),
+            win_rate REAL,
+            place_rate_2 REAL,
+            place_rate_3 REAL,
+            motor_rate_2 REAL,
+            motor_rate_3 REAL,
+            boat_rate_2 REAL,
+            boat_rate_3 REAL,
+            exhibition_time REAL,
+            exhibition_turn_time REAL,
+            exhibition_straight_time REAL,
+            average_st REAL,
+            flying_count INTEGER,
+            late_count INTEGER,
+            actual_course INTEGER,
+            PRIMARY KEY (race_id, boat_number)
+        )
+    """,
+    'racer_detailed_stats': """
+        CREATE TABLE racer_detailed_stats (
+            racer_number INTEGER PRIMARY KEY,
+            total_races INTEGER,
+            total_wins INTEGER,
+            overall_win_rate REAL,
+            overall_1st_rate REAL,
+            overall_2nd_rate REAL,
+            overall_3rd_rate REAL,
+            total_優出 INTEGER,
+            total_優勝 INTEGER,
+            avg_start_timing REAL,
+            grade_stats TEXT,
+            boat_number_stats TEXT,
+            course_stats TEXT,
+            venue_stats TEXT,
+            sg_appearances INTEGER,
+            flying_count INTEGER,
+            late_start_count INTEGER
+        )
+    """,
+}
+
+# 本番（supabase/schema.sql）と同じインデックス
+TABLE_INDEXES = [
+    "CREATE UNIQUE INDEX races_race_date_venue_id_race_number_key ON races(race_date, venue_id, race_number)",
+    "CREATE INDEX idx_races_date_venue ON races(race_date, venue_id)",
+    "CREATE INDEX idx_races_date ON races(race_date)",
+    "CREATE INDEX idx_entries_race ON race_entries(race_id)",
+    "CREATE INDEX idx_entries_racer ON race_entries(racer_id)",
+    "CREATE INDEX idx_entries_result ON race_entries(race_id, result_position)",
+]
+
+
+def generate_racers(rng, n_racers=DEFAULT_RACERS):
+    """選手マスタと実力値を生成"""
+    racer_numbers = np.arange(3001, 3001 + n_racers)
+    skill = rng.normal(0.0, 1.0, n_racers)
+
+    # 実力の分位で級別を決める（B2: 10%, B1: 45%, A2: 25%, A1: 20%）
+    grade_index = np.searchsorted(np.quantile(skill, [0.10, 0.55, 0.80]), skill)
+
+    racers = pd.DataFrame({
+        'id': racer_numbers,
+        'racer_number': racer_numbers,
+        'name': [f'選手{n}' for n in racer_numbers],
+        'grade': np.array(RACER_GRADES)[grade_index],
+    })
+    return racers, skill
+
+
+def generate_races(rng, n_races, start_date=DEFAULT_START_DATE):
+    """レース基本情報を生成"""
+    index = np.arange(n_races)
+    per_day = VENUES_PER_DAY * RACES_PER_VENUE
+    day = index // per_day
+    slot = (index % per_day) // RACES_PER_VENUE
+
+    # 日ごとに開催会場をずらす
+    venue_id = (slot + day * 7) % 24 + 1
+
+    return pd.DataFrame({
+        'id': index + 1,
+        'race_date': pd.to_datetime(start_date) + pd.to_timedelta(day, unit='D'),
+        'venue_id': venue_id,
+        'race_number': index % RACES_PER_VENUE + 1,
+        'grade': rng.choice(RACE_GRADES, size=n_races, p=RACE_GRADE_PROBS),
+    })
+
+
+def generate_entries(rng, races, racers, skill):
+    """出走情報（6艇×レース数）と着順を生成"""
+    n_races = len(races)
+    n_racers = len(racers)
+
+    # 各レースの6選手（等間隔に選ぶため同じレースで重複しない）
+    base = rng.integers(0, n_racers, n_races)
+    step = rng.integers(1, n_racers // 6, n_races)
+    racer_index = (base[:, None] + step[:, None] * np.arange(6)) % n_racers
+
+    racer_skill = skill[racer_index]
+    motor_number = rng.integers(1, MOTORS_PER_VENUE + 1, (n_races, 6))
+    motor_quality = rng.normal(0.0, 1.0, (24, MOTORS_PER_VENUE + 1))
+    motor_skill = motor_quality[races['venue_id'].values[:, None] - 1, motor_number]
+
+    exhibition_time = 6.78 - 0.04 * racer_skill - 0.03 * motor_skill + rng.normal(0, 0.05, (n_races, 6))
+    average_st = np.clip(0.16 - 0.01 * racer_skill + rng.normal(0, 0.01, (n_races, 6)), 0.08, 0.25)
+
+    # 着順: 実力・モーター・枠・展示タイムの合計にGumbelノイズを加えた強さの順位
+    strength = (
+        0.9 * racer_skill + 0.4 * motor_skill + COURSE_ADVANTAGE[None, :]
+        - 3.0 * (exhibition_time - 6.78)
+        + rng.gumbel(0.0, 1.0, (n_races, 6))
+    )
+    result_position = np.argsort(np.argsort(-strength, axis=1), axis=1) + 1
+
+    win_rate = np.clip(5.5 + 1.3 * racer_skill + rng.normal(0, 0.3, (n_races, 6)), 1.0, 9.5)
+    motor_rate_2 = np.clip(33 + 8 * motor_skill + rng.normal(0, 2, (n_races, 6)), 5, 70)
+    boat_rate_2 = np.clip(rng.normal(33, 6, (n_races, 6)), 5, 70)
+    boat_number = np.tile(np.arange(1, 7), (n_races, 1))
+
+    def flat(values):
+        return np.asarray(values).ravel()
+
+    grades = racers['grade'].values[racer_index]
+
+    return pd.DataFrame({
+        'race_id': np.repeat(races['id'].values, 6),
+        'boat_number': flat(boat_number),
+        'racer_id': flat(racers['id'].values[racer_index]),
+        'motor_number': flat(motor_number),
+        'start_timing': flat(np.round(average_st + rng.normal(0, 0.03, (n_races, 6)), 2)),
+        'course': flat(boat_number),
+        'result_position': flat(result_position),
+        'racer_grade': flat(grades),
+        'win_rate': flat(np.round(win_rate, 2)),
+        'place_rate_2': flat(np.round(np.clip(win_rate * 6.5, 5, 80), 2)),
+        'place_rate_3': flat(np.round(np.clip(win_rate * 9.0, 10, 95), 2)),
+        'motor_rate_2': flat(np.round(motor_rate_2, 2)),
+        'motor_rate_3': flat(np.round(np.clip(motor_rate_2 * 1.5, 10, 95), 2)),
+        'boat_rate_2': flat(np.round(boat_rate_2, 2)),
+        'boat_rate_3': flat(np.round(np.clip(boat_rate_2 * 1.5, 10, 95), 2)),
+        'exhibition_time': flat(np.round(exhibition_time, 2)),
+        'exhibition_turn_time': flat(np.round(exhibition_time - 1.3 + rng.normal(0, 0.05, (n_races, 6)), 2)),
+        'exhibition_straight_time': flat(np.round(exhibition_time + 0.7 + rng.normal(0, 0.05, (n_races, 6)), 2)),
+        'average_st': flat(np.round(average_st, 2)),
+        'flying_count': flat(rng.binomial(1, 0.03, (n_races, 6))),
+        'late_count': flat(rng.binomial(1, 0.02, (n_races, 6))),
+        'actual_course': flat(boat_number),
+    })
+
+
+def generate_racer_detailed_stats(rng, racers, skill):
+    """選手詳細統計（JSON列は文字列）を生成"""
+    rows = []
+
+    for racer_number, racer_skill in zip(racers['racer_number'].values, skill):
+        total_races = int(rng.integers(200, 3000))
+        first_rate = float(np.clip(16.7 + 8 * racer_skill + rng.normal(0, 2), 1, 60))
+
+        grade_stats = {
+            grade: {
+                'races': int(rng.integers(0, 60)),
+                'win_rate': round(float(np.clip(5.5 + racer_skill + rng.normal(0, 0.5), 1, 9.5)), 2),
+                'yusyutsu': int(rng.integers(0, 10)),
+                'yusho': int(rng.integers(0, 3)),
+            }
+            for grade in ['SG', 'G1', 'G2', 'G3']
+        }
+        boat_number_stats = {
+            str(boat): {
+                '1st_rate': round(float(np.clip(first_rate + COURSE_ADVANTAGE[boat - 1] * 10, 0, 90)), 1),
+                '2nd_rate': round(float(np.clip(first_rate * 1.8, 0, 95)), 1),
+            }
+            for boat in range(1, 7)
+        }
+        course_stats = {
+            str(course): {
+                '1st_rate': round(float(np.clip(first_rate + COURSE_ADVANTAGE[course - 1] * 10, 0, 90)), 1),
+                '決まり手': {
+                    '逃げ': int(rng.integers(0, 50)) if course == 1 else 0,
+                    '差し': int(rng.integers(0, 20)),
+                    'まくり': int(rng.integers(0, 20)),
+                },
+            }
+            for course in range(1, 7)
+        }
+        venue_stats = {
+            name: {
+                'races': int(rng.integers(0, 120)),
+                'win_rate': round(float(np.clip(5.5 + racer_skill + rng.normal(0, 0.5), 1, 9.5)), 2),
+                '1st_rate': round(first_rate, 1),
+                '2nd_rate': round(first_rate * 1.8, 1),
+            }
+            for name in rng.choice(VENUE_NAMES, size=5, replace=False)
+        }
+
+        rows.append({
+            'racer_number': int(racer_number),
+            'total_races': total_races,
+            'total_wins': int(total_races * first_rate / 100),
+            'overall_win_rate': round(float(np.clip(5.5 + 1.3 * racer_skill, 1, 9.5)), 2),
+            'overall_1st_rate': round(first_rate, 1),
+            'overall_2nd_rate': round(float(np.clip(first_rate * 1.8, 0, 95)), 1),
+            'overall_3rd_rate': round(float(np.clip(first_rate * 2.5, 0, 98)), 1),
+            'total_優出': int(rng.integers(0, 80)),
+            'total_優勝': int(rng.integers(0, 20)),
+            'avg_start_timing': round(float(np.clip(0.16 - 0.01 * racer_skill, 0.08, 0.25)), 2),
+            'grade_stats': json.dumps(grade_stats, ensure_ascii=False),
+            'boat_number_stats': json.dumps(boat_number_stats, ensure_ascii=False),
+            'course_stats': json.dumps(course_stats, ensure_ascii=False),
+            'venue_stats': json.dumps(venue_stats, ensure_ascii=False),
+            'sg_appearances': grade_stats['SG']['races'],
+            'flying_count': int(rng.integers(0, 3)),
+            'late_start_count': int(rng.integers(0, 3)),
+        })
+
+    return pd.DataFrame(rows)
+
+
+def generate_dataset(n_races, seed=DEFAULT_SEED, n_racers=DEFAULT_RACERS, start_date=DEFAULT_START_DATE):
+    """
+    合成データ一式を生成
+
+    Args:
+        n_races: レース数
+        seed: 乱数シード（同じ値なら同じデータ）
+        n_racers: 選手数
+        start_date: 最初の開催日
+
+    Returns:
+        dict: {テーブル名: DataFrame}（races, racers, race_entries, racer_detailed_stats）
+    """
+    rng = np.random.default_rng(seed)
+
+    racers, skill = generate_racers(rng, n_racers)
+    races = generate_races(rng, n_races, start_date)
+    entries = generate_entries(rng, races, racers, skill)
+    detailed_stats = generate_racer_detailed_stats(rng, racers, skill)
+
+    races['race_date'] = races['race_date'].dt.date
+
+    return {
+        'races': races,
+        'racers': racers,
+        'race_entries': entries,
+        'racer_detailed_stats': detailed_stats,
+    }
+
+
+def load_into_sqlite(dataset, path):
+    """
+    合成データを SQLite に読み込む（既存のテーブルは作り直す）
+
+    Returns:
+        sqlite3.Connection
+    """
+    conn = sqlite3.connect(path)
+
+    for table, ddl in TABLE_DDL.items():
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(ddl)
+
+        df = dataset[table]
+        placeholders = ', '.join(['?'] * len(df.columns))
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(df.columns)}) VALUES ({placeholders})",
+            df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        )
+
+    for statement in TABLE_INDEXES:
+        conn.execute(statement)
+    conn.commit()
+
+    return conn
+
+
+def load_into_postgres(dataset, database_url, schema=POSTGRES_SCHEMA):
+    """
+    合成データを PostgreSQL の専用スキーマに読み込む（スキーマは作り直す）
+
+    接続の search_path はこのスキーマになるため、本番と同じSQLをそのまま実行できる
+
+    Returns:
+        psycopg2 connection
+    """
+    import psycopg2
+
+    conn = psycopg2.connect(database_url)
+    cursor = conn.cursor()
+
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {schema}")
+    cursor.execute(f"SET search_path TO {schema}")
+
+    for table, ddl in TABLE_DDL.items():
+        cursor.execute(ddl)
+
+        df = dataset[table]
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(df.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    for statement in TABLE_INDEXES:
+        cursor.execute(statement)
+    cursor.execute("ANALYZE")
+
+    conn.commit()
+    cursor.close()
+
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a seeded synthetic boatrace dataset')
+    parser.add_argument('--races', type=int, default=10000, help='Number of races (default: 10000)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f'Random seed (default: {DEFAULT_SEED})')
+    parser.add_argument('--racers', type=int, default=DEFAULT_RACERS, help=f'Number of racers (default: {DEFAULT_RACERS})')
+    parser.add_argument('--sqlite', type=str, default=None, help='Load into this SQLite file')
+    parser.add_argument('--postgres-url', type=str, default=None,
+                        help=f'Load into the "{POSTGRES_SCHEMA}" schema of this database (the schema is recreated)')
+    args = parser.parse_args()
+
+    if not args.sqlite and not args.postgres_url:
+        parser.error('--sqlite or --postgres-url is required')
+
+    dataset = generate_dataset(args.races, seed=args.seed, n_racers=args.racers)
+    for table, df in dataset.items():
+        print(f"{table}: {len(df):,}行")
+
+    if args.sqlite:
+        load_into_sqlite(dataset, args.sqlite).close()
+        print(f"SQLite: {args.sqlite}")
+
+    if args.postgres_url:
+        load_into_postgres(dataset, args.postgres_url).close()
+        print(f"PostgreSQL: schema {POSTGRES_SCHEMA}")
+
+
+if __name__ == '__main__':
+    main()
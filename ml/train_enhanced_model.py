@@ -9,11 +9,10 @@ race_entriesの実データを最大限活用
 import os
 import sys
 import json
+import argparse
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
-import psycopg2
 
 import xgboost as xgb
 from sklearn.model_selection import train_test_split
@@ -23,10 +22,10 @@ import pickle
 # 親ディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from ml.enhanced_feature_engineer import EnhancedFeatureEngineer, fetch_training_data_enhanced
+from ml.enhanced_feature_engineer import EnhancedFeatureEngineer, fetch_training_table
 from ml.race_predictor import RacePredictor
-
-load_dotenv()
+from ml.race_table import RaceTable
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
 
 
 def calculate_sample_weight(race_dates, half_life_years=2.0):
@@ -51,50 +50,33 @@ def calculate_sample_weight(race_dates, half_life_years=2.0):
     return weights
 
 
-def prepare_enhanced_features(df):
-    """強化版特徴量エンジニアリング"""
+def prepare_enhanced_features(data):
+    """
+    強化版特徴量エンジニアリング
+
+    Args:
+        data: RaceTable、または1艇1行の DataFrame（fetch_training_data_enhanced の結果など）
+    """
     print("\n=== 強化版特徴量の生成 ===\n")
 
     fe = EnhancedFeatureEngineer()
 
-    all_features = []
-    all_labels = []
-    all_race_dates = []
-
-    race_ids = df['race_id'].unique()
-    total_races = len(race_ids)
-    valid_races = 0
-
-    for i, race_id in enumerate(race_ids):
-        race_data = df[df['race_id'] == race_id].copy()
-
-        if len(race_data) != 6:
-            continue
-
-        try:
-            features = fe.create_features(race_data)
-            labels = race_data['result_position'].values
-
-            all_features.append(features)
-            all_labels.append(labels)
-
-            race_date = race_data['race_date'].iloc[0]
-            all_race_dates.extend([race_date] * 6)
-
-            valid_races += 1
+    if isinstance(data, RaceTable):
+        table = data
+        total_races = len(table)
+    else:
+        total_races = data['race_id'].nunique()
+        table = RaceTable.from_dataframe(data)
 
-            if valid_races % 1000 == 0:
-                print(f"  処理済みレース数: {valid_races}/{total_races}")
+    # レースごとに DataFrame を切り出さず、全レース分を配列でまとめて計算する
+    X = fe.create_features_table(table)
+    y = table['result_position'].reshape(-1).astype(np.int64)
+    race_dates = pd.Series(np.repeat(table.race_date, 6))
 
-        except Exception as e:
-            print(f"  [Warning] Race {race_id} skipped: {e}")
-            continue
+    if len(table) < total_races:
+        print(f"  6艇そろっていないレースを除外: {total_races - len(table)}レース")
 
-    X = pd.concat(all_features, ignore_index=True)
-    y = np.concatenate(all_labels)
-    race_dates = pd.Series(all_race_dates)
-
-    print(f"\n有効レース数: {valid_races}レース")
+    print(f"\n有効レース数: {len(table)}レース")
     print(f"特徴量サンプル数: {len(X)}件")
     print(f"特徴量の次元数: {X.shape[1]}次元")
 
@@ -295,6 +277,11 @@ def train_enhanced_model(X, y, race_dates, best_params=None):
 
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description='Train the enhanced boat race prediction model')
+    add_metrics_argument(parser)
+    args = parser.parse_args()
+    enable_profiling(args)
+
     print("=" * 70)
     print("  競艇予測モデル - 強化版訓練")
     print("  目標: 1着予測精度 45%")
@@ -303,14 +290,18 @@ def main():
 
     try:
         # 1. データ取得
-        df = fetch_training_data_enhanced()
+        with span('fetch') as s:
+            table = fetch_training_table()
+            s.rows = len(table) * 6
 
-        if len(df) == 0:
+        if len(table) == 0:
             print("[ERROR] 訓練データが取得できませんでした")
             return
 
         # 2. 特徴量生成
-        X, y, race_dates = prepare_enhanced_features(df)
+        with span('features') as s:
+            X, y, race_dates = prepare_enhanced_features(table)
+            s.rows = len(X)
 
         # 3. 最適パラメータを読み込み（あれば）
         best_params = None
@@ -322,17 +313,18 @@ def main():
                 print(f"最適パラメータを読み込み: {params_path}")
 
         # 4. モデル訓練
-        predictor, metrics = train_enhanced_model(X, y, race_dates, best_params)
+        with span('fit', rows=len(X)):
+            predictor, metrics = train_enhanced_model(X, y, race_dates, best_params)
 
         # 5. モデル保存
         print("\n=== モデルの保存 ===\n")
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         model_path = os.path.join('ml', f'enhanced_model_{timestamp}.pkl')
-        predictor.save(model_path)
-
-        # 最新モデルとしても保存
         latest_path = os.path.join('ml', 'trained_model_latest.pkl')
-        predictor.save(latest_path)
+        with span('save'):
+            predictor.save(model_path)
+            # 最新モデルとしても保存
+            predictor.save(latest_path)
 
         # メトリクスを保存
         metrics_path = os.path.join('ml', f'enhanced_metrics_{timestamp}.json')
@@ -369,6 +361,10 @@ def main():
         import traceback
         traceback.print_exc()
 
+    finally:
+        print_summary()
+        write_metrics(args.metrics_out, job='train_enhanced_model')
+
 
 if __name__ == '__main__':
     main()
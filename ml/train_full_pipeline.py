@@ -7,9 +7,12 @@
 3. ハイパーパラメータ最適化
 4. 最適パラメータでモデル訓練
 5. 精度評価とレポート
+
+--metrics-out を指定すると各ステップの処理時間を保存する（train_model.py の内訳は <名前>_train_model.<拡張子>）
 """
 import os
 import sys
+import argparse
 import subprocess
 import json
 from datetime import datetime
@@ -17,6 +20,8 @@ from datetime import datetime
 # 親ディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
+
 
 def print_header(title):
     """ヘッダーを表示"""
@@ -25,13 +30,14 @@ def print_header(title):
     print("=" * 80 + "\n")
 
 
-def run_script(script_path, description):
+def run_script(script_path, description, args=None):
     """Pythonスクリプトを実行"""
+    args = args or []
     print(f"\n▶ {description}")
-    print(f"  実行: python {script_path}\n")
+    print(f"  実行: python {' '.join([script_path] + args)}\n")
 
     result = subprocess.run(
-        [sys.executable, script_path],
+        [sys.executable, script_path] + args,
         capture_output=False,
         text=True
     )
@@ -51,13 +57,10 @@ def check_file_exists(filepath):
 
 def check_table_exists(table_name):
     """テーブルの存在確認"""
-    from dotenv import load_dotenv
-    import psycopg2
-
-    load_dotenv()
+    from scraper.db import connect
 
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        conn = connect()
         cursor = conn.cursor()
 
         cursor.execute("""
@@ -79,13 +82,10 @@ def check_table_exists(table_name):
 
 def get_race_count():
     """レース数を取得"""
-    from dotenv import load_dotenv
-    import psycopg2
-
-    load_dotenv()
+    from scraper.db import connect
 
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        conn = connect()
         cursor = conn.cursor()
 
         cursor.execute("SELECT COUNT(*) FROM races")
@@ -100,8 +100,28 @@ def get_race_count():
         return 0
 
 
+def child_metrics_path(metrics_out, name):
+    """子スクリプトの計測結果の保存先（metrics.json → metrics_train_model.json）"""
+    root, ext = os.path.splitext(metrics_out)
+    return f"{root}_{name}{ext}"
+
+
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description='Run the full training pipeline')
+    add_metrics_argument(parser)
+    args = parser.parse_args()
+    enable_profiling(args)
+
+    try:
+        run_pipeline(args.metrics_out)
+    finally:
+        print_summary()
+        write_metrics(args.metrics_out, job='train_full_pipeline')
+
+
+def run_pipeline(metrics_out=None):
+    """データ確認から訓練・レポートまでを実行"""
     print_header("競艇予測モデル - 統合訓練パイプライン")
 
     print("このスクリプトは以下のステップを自動実行します:")
@@ -122,7 +142,8 @@ def main():
     # Step 1: データ収集状況の確認
     print_header("Step 1: データ収集状況の確認")
 
-    race_count = get_race_count()
+    with span('check_data'):
+        race_count = get_race_count()
     print(f"現在のレース数: {race_count:,} レース")
 
     if race_count < 1000:
@@ -141,8 +162,9 @@ def main():
         print("   スキップします")
     else:
         print("会場別統計を計算します...")
-        if not run_script('ml/advanced_stats.py', '会場別統計の計算'):
-            print("\n会場別統計の計算をスキップして続行します...")
+        with span('venue_stats'):
+            if not run_script('ml/advanced_stats.py', '会場別統計の計算'):
+                print("\n会場別統計の計算をスキップして続行します...")
 
     # Step 3: ハイパーパラメータ最適化
     print_header("Step 3: ハイパーパラメータ最適化")
@@ -164,8 +186,9 @@ def main():
             print("\n⚠️ 最適パラメータが1週間以上古いです")
             response = input("   再最適化しますか？ (y/n): ")
             if response.lower() == 'y':
-                if not run_script('ml/hyperparameter_tuning.py', 'ハイパーパラメータ最適化'):
-                    print("\n最適化に失敗しましたが、既存のパラメータで続行します...")
+                with span('hyperparameter_tuning'):
+                    if not run_script('ml/hyperparameter_tuning.py', 'ハイパーパラメータ最適化'):
+                        print("\n最適化に失敗しましたが、既存のパラメータで続行します...")
         else:
             print("   既存のパラメータを使用します")
 
@@ -176,8 +199,9 @@ def main():
         if race_count >= 5000:
             response = input("実行しますか？ (y/n, スキップする場合は n): ")
             if response.lower() == 'y':
-                if not run_script('ml/hyperparameter_tuning.py', 'ハイパーパラメータ最適化'):
-                    print("\n最適化に失敗しましたが、デフォルトパラメータで続行します...")
+                with span('hyperparameter_tuning'):
+                    if not run_script('ml/hyperparameter_tuning.py', 'ハイパーパラメータ最適化'):
+                        print("\n最適化に失敗しましたが、デフォルトパラメータで続行します...")
             else:
                 print("スキップしました（デフォルトパラメータを使用）")
         else:
@@ -187,7 +211,10 @@ def main():
     # Step 4: 最適パラメータでモデル訓練
     print_header("Step 4: 最適パラメータでモデル訓練")
 
-    if not run_script('ml/train_model.py', 'モデル訓練'):
+    train_args = ['--metrics-out', child_metrics_path(metrics_out, 'train_model')] if metrics_out else []
+    with span('train_model'):
+        trained = run_script('ml/train_model.py', 'モデル訓練', train_args)
+    if not trained:
         print("\n❌ モデル訓練に失敗しました")
         return
 
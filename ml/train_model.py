@@ -13,8 +13,6 @@ import json
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
-import psycopg2
 
 import xgboost as xgb
 from sklearn.model_selection import train_test_split
@@ -25,8 +23,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from ml.feature_engineer import FeatureEngineer
 from ml.race_predictor import RacePredictor
-
-load_dotenv()
+from ml.point_in_time_stats import update_daily_stats, load_point_in_time_stats
+from ml.weather_alignment import attach_weather
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
+from scraper.db import connect
 
 
 def calculate_sample_weight(race_dates, half_life_years=3.0):
@@ -86,38 +86,38 @@ def load_best_params(filepath='ml/best_params_latest.json'):
     return data['best_params']
 
 
+# 着順が確定した全出走（races の並び順 = idx_races_recent、出走は idx_entries_finished で読める）
+TRAINING_DATA_QUERY = """
+    SELECT
+        re.race_id,
+        re.boat_number,
+        re.racer_id,
+        re.motor_number,
+        re.start_timing,
+        re.course,
+        re.result_position,
+        r.race_date,
+        r.venue_id,
+        r.race_number,
+        r.grade,
+        rc.racer_number,
+        rc.name as racer_name,
+        rc.grade as racer_grade
+    FROM race_entries re
+    JOIN races r ON re.race_id = r.id
+    JOIN racers rc ON re.racer_id = rc.id
+    WHERE re.result_position IS NOT NULL
+    ORDER BY r.race_date DESC, r.venue_id, r.race_number, re.boat_number
+"""
+
+
 def fetch_training_data():
     """データベースから訓練データを取得"""
     print("=== データベースから訓練データを取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
-    query = """
-        SELECT
-            re.race_id,
-            re.boat_number,
-            re.racer_id,
-            re.motor_number,
-            re.start_timing,
-            re.course,
-            re.result_position,
-            r.race_date,
-            r.venue_id,
-            r.race_number,
-            r.grade,
-            rc.racer_number,
-            rc.name as racer_name,
-            rc.grade as racer_grade
-        FROM race_entries re
-        LEFT JOIN races r ON re.race_id = r.id
-        LEFT JOIN racers rc ON re.racer_id = rc.id
-        WHERE re.result_position IS NOT NULL
-        AND r.id IS NOT NULL
-        AND rc.id IS NOT NULL
-        ORDER BY r.race_date DESC, r.venue_id, r.race_number, re.boat_number
-    """
-
-    df = pd.read_sql_query(query, conn)
+    df = pd.read_sql_query(TRAINING_DATA_QUERY, conn)
     conn.close()
 
     print(f"取得データ数: {len(df)}件")
@@ -128,61 +128,24 @@ def fetch_training_data():
     return df
 
 
-def fetch_racer_stats():
-    """選手統計データを取得"""
-    print("\n=== 選手統計データを取得中 ===\n")
+def fetch_point_in_time_stats(df):
+    """選手・モーター統計をレース日時点で取得（当日以降の結果は含まない）"""
+    print("\n=== 選手・モーター統計（レース日時点）を取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            racer_id,
-            AVG(CASE WHEN result_position = 1 THEN 1.0 ELSE 0.0 END) * 100 as win_rate,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate,
-            AVG(start_timing) as avg_start_timing
-        FROM race_entries
-        WHERE result_position IS NOT NULL
-        GROUP BY racer_id
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    print(f"選手統計: {len(df)}名分")
-    return df
+    # 日次集計を最新化してから、各レース日時点の成績を計算
+    update_daily_stats()
+    racer_stats, motor_stats = load_point_in_time_stats(df)
 
-
-def fetch_motor_stats():
-    """モーター統計データを取得"""
-    print("\n=== モーター統計データを取得中 ===\n")
-
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-
-    query = """
-        SELECT
-            venue_id,
-            motor_number,
-            AVG(CASE WHEN result_position <= 2 THEN 1.0 ELSE 0.0 END) * 100 as second_rate,
-            AVG(CASE WHEN result_position <= 3 THEN 1.0 ELSE 0.0 END) * 100 as third_rate
-        FROM race_entries re
-        JOIN races r ON re.race_id = r.id
-        WHERE motor_number IS NOT NULL AND result_position IS NOT NULL
-        GROUP BY venue_id, motor_number
-    """
-
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-
-    print(f"モーター統計: {len(df)}個")
-    return df
+    print(f"選手統計: {racer_stats['racer_id'].nunique()}名 / {len(racer_stats)}件（選手×日付）")
+    print(f"モーター統計: {len(motor_stats)}件（会場×モーター×日付）")
+    return racer_stats, motor_stats
 
 
 def fetch_racer_detailed_stats():
     """選手詳細統計データを取得（新規）"""
     print("\n=== 選手詳細統計データを取得中 ===\n")
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
 
     query = """
         SELECT
@@ -222,11 +185,18 @@ def prepare_features(df, racer_stats, motor_stats, racer_detailed_stats):
     print(f"  最大艇数: {race_boat_counts.max()}")
     print()
 
-    # 統計データをマージ
-    df = df.merge(racer_stats, on='racer_id', how='left', suffixes=('', '_stat'))
+    # 統計データをマージ（race_date列がある場合はレース日時点の統計として結合）
+    racer_keys = ['racer_id']
+    motor_keys = ['venue_id', 'motor_number']
+    if 'race_date' in racer_stats.columns:
+        racer_keys.append('race_date')
+    if 'race_date' in motor_stats.columns:
+        motor_keys.append('race_date')
+
+    df = df.merge(racer_stats, on=racer_keys, how='left', suffixes=('', '_stat'))
     df = df.merge(
         motor_stats,
-        on=['venue_id', 'motor_number'],
+        on=motor_keys,
         how='left',
         suffixes=('', '_motor')
     )
@@ -237,6 +207,9 @@ def prepare_features(df, racer_stats, motor_stats, racer_detailed_stats):
     df['third_rate'] = df['third_rate_motor'].fillna(50.0)
     df['avg_start_timing'] = df['avg_start_timing'].fillna(0.17)
 
+    # 天気データ（発走予定時刻時点の観測値を結合）
+    df = attach_weather(df)
+
     # FeatureEngineerの初期化（詳細統計データを渡す）
     feature_engineer = FeatureEngineer(
         historical_data=df,
@@ -254,12 +227,6 @@ def prepare_features(df, racer_stats, motor_stats, racer_detailed_stats):
         if len(race_data) != 6:
             continue
 
-        # 天気データ（TODO: weather_dataテーブルから取得）
-        race_data['wind_speed'] = np.random.uniform(0.5, 8.0, len(race_data))
-        race_data['wind_direction'] = np.random.randint(0, 360, len(race_data))
-        race_data['temperature'] = np.random.uniform(15.0, 30.0, len(race_data))
-        race_data['wave_height'] = np.random.uniform(0, 10, len(race_data))
-
         # 選手統計をコピー
         race_data['racer_win_rate'] = race_data['win_rate']
         race_data['racer_win_rate_venue'] = race_data['win_rate']
@@ -594,7 +561,9 @@ def main():
                         help='Use ensemble learning (train multiple models)')
     parser.add_argument('--n-models', type=int, default=3,
                         help='Number of models for ensemble (default: 3)')
+    add_metrics_argument(parser)
     args = parser.parse_args()
+    enable_profiling(args)
 
     print("=" * 80)
     print("  競艇予測モデル - 最適化版訓練")
@@ -608,7 +577,9 @@ def main():
         best_params = load_best_params()
 
         # 2. データ取得
-        df = fetch_training_data()
+        with span('fetch') as s:
+            df = fetch_training_data()
+            s.rows = len(df)
 
         if len(df) == 0:
             print("[ERROR] 訓練データが取得できませんでした")
@@ -616,30 +587,34 @@ def main():
             return
 
         # 3. 統計データ取得
-        racer_stats = fetch_racer_stats()
-        motor_stats = fetch_motor_stats()
-        racer_detailed_stats = fetch_racer_detailed_stats()
+        with span('fetch_stats') as s:
+            racer_stats, motor_stats = fetch_point_in_time_stats(df)
+            racer_detailed_stats = fetch_racer_detailed_stats()
+            s.rows = len(racer_stats) + len(motor_stats) + len(racer_detailed_stats)
 
         # 4. 特徴量生成
-        X, y, race_dates = prepare_features(df, racer_stats, motor_stats, racer_detailed_stats)
+        with span('features') as s:
+            X, y, race_dates = prepare_features(df, racer_stats, motor_stats, racer_detailed_stats)
+            s.rows = len(X)
 
         # 5. モデル訓練と評価
-        if args.ensemble:
-            # アンサンブル学習
-            predictor, metrics = train_ensemble_models(X, y, race_dates, best_params, n_models=args.n_models)
-        else:
-            # 通常訓練（時系列重み付け有効）
-            predictor, metrics = train_and_evaluate(X, y, race_dates, best_params, use_time_weighting=True)
+        with span('fit', rows=len(X)):
+            if args.ensemble:
+                # アンサンブル学習
+                predictor, metrics = train_ensemble_models(X, y, race_dates, best_params, n_models=args.n_models)
+            else:
+                # 通常訓練（時系列重み付け有効）
+                predictor, metrics = train_and_evaluate(X, y, race_dates, best_params, use_time_weighting=True)
 
         # 6. モデル保存
         print("\n=== モデルの保存 ===\n")
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         model_path = os.path.join('ml', f'trained_model_{timestamp}.pkl')
-        predictor.save(model_path)
-
-        # 最新モデルとしても保存
         latest_path = os.path.join('ml', 'trained_model_latest.pkl')
-        predictor.save(latest_path)
+        with span('save'):
+            predictor.save(model_path)
+            # 最新モデルとしても保存
+            predictor.save(latest_path)
 
         # メトリクスを保存
         metrics_path = os.path.join('ml', f'metrics_{timestamp}.json')
@@ -667,6 +642,10 @@ def main():
         import traceback
         traceback.print_exc()
 
+    finally:
+        print_summary()
+        write_metrics(args.metrics_out, job='train_model')
+
 
 if __name__ == '__main__':
     main()
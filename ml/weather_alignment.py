@@ -0,0 +1,213 @@
+"""
+レースごとの天気データ結合（発走予定時刻時点）
+
+各レースの発走予定時刻を推定し、同じ会場の weather_data のうち
+発走時刻以前で最も新しい観測値を結合する
+- 全会場を1回の merge_asof(by='venue_id') で結合する（会場ごとに別々に探すのと同じ結果）
+- 発走予定時刻は scraper/venues_config.py の1R時刻・レース間隔から推定する
+- weather_data は (venue_id, record_datetime) の範囲で1回だけ取得（idx_weather_venue_date を使用）
+- 観測値がない（または MAX_OBSERVATION_AGE より古い）レースは races の天気カラム
+  （backfill_weather_openmeteo.py が保存する日別の値）で補い、それもなければ既定値を使う
+
+訓練（train_model.py など）と予測（predict_race.py）で同じ処理を使う
+
+使用方法:
+    python ml/weather_alignment.py --start-date 2025-12-01 --end-date 2025-12-31   # 結合状況を表示
+"""
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+import pandas as pd
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scraper.db import connect
+from scraper.venues_config import FIRST_RACE_MINUTES, RACE_INTERVAL_MINUTES, VENUE_FIRST_RACE_MINUTES
+
+load_dotenv()
+
+WEATHER_COLUMNS = ['wind_speed', 'wind_direction', 'temperature', 'wave_height', 'water_temperature']
+
+# 天気データがない場合の既定値
+DEFAULT_WEATHER = {
+    'wind_speed': 3.0,
+    'wind_direction': 180,
+    'temperature': 20.0,
+    'wave_height': 2.0,
+    'water_temperature': 20.0
+}
+
+# 発走時刻より前の観測値をどこまでさかのぼって使うか
+MAX_OBSERVATION_AGE = timedelta(hours=3)
+
+# races.wind_direction（8方位）を角度に変換
+DIRECTION_DEGREES = {
+    '北': 0, '北東': 45, '東': 90, '南東': 135,
+    '南': 180, '南西': 225, '西': 270, '北西': 315
+}
+
+
+def estimate_start_times(races):
+    """
+    発走予定時刻を推定（venues_config の1R時刻 + (レース番号 - 1) × レース間隔）
+
+    Args:
+        races: race_date, venue_id, race_number 列を持つDataFrame
+
+    Returns:
+        pd.Series: 発走予定時刻（datetime64）
+    """
+    first_race = races['venue_id'].map(VENUE_FIRST_RACE_MINUTES).fillna(FIRST_RACE_MINUTES)
+    minutes = first_race + (races['race_number'] - 1) * RACE_INTERVAL_MINUTES
+    scheduled_at = pd.to_datetime(races['race_date']) + pd.to_timedelta(minutes, unit='m')
+    return scheduled_at.astype('datetime64[ns]')
+
+
+def fetch_weather_observations(conn, venue_ids, start, end):
+    """weather_data から期間内の観測値を取得"""
+    query = """
+        SELECT venue_id, record_datetime, wind_speed, wind_direction,
+               temperature, wave_height, water_temperature
+        FROM weather_data
+        WHERE venue_id = ANY(%s)
+        AND record_datetime >= %s
+        AND record_datetime <= %s
+    """
+    df = pd.read_sql_query(query, conn, params=(
+        [int(v) for v in venue_ids], start.to_pydatetime(), end.to_pydatetime()
+    ))
+    for col in WEATHER_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def fetch_race_weather(conn, race_ids):
+    """races の天気カラム（日別の値）を取得"""
+    query = """
+        SELECT id AS race_id, wind_speed, wind_direction AS wind_direction_text,
+               temperature, wave_height, water_temperature
+        FROM races
+        WHERE id = ANY(%s)
+    """
+    df = pd.read_sql_query(query, conn, params=([int(r) for r in race_ids],))
+    df['wind_direction'] = df.pop('wind_direction_text').map(DIRECTION_DEGREES)
+    for col in WEATHER_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.set_index('race_id')
+
+
+def align_weather(races, conn=None, max_age=MAX_OBSERVATION_AGE):
+    """
+    各レースの発走予定時刻時点の天気を求める
+
+    Args:
+        races: race_id, race_date, venue_id, race_number 列を持つDataFrame（出走表形式でもよい）
+        conn: DB接続（Noneの場合はプールから取得して戻す）
+        max_age: 発走時刻より前の観測値をどこまでさかのぼるか
+
+    Returns:
+        pd.DataFrame: race_id, WEATHER_COLUMNS, weather_source（observed / daily / default）
+    """
+    left = races[['race_id', 'race_date', 'venue_id', 'race_number']].drop_duplicates('race_id')
+    left = left.astype({'race_id': 'int64', 'venue_id': 'int64'})
+    left['_scheduled_at'] = estimate_start_times(left)
+    left = left.sort_values('_scheduled_at')
+
+    if len(left) == 0:
+        return pd.DataFrame(columns=['race_id'] + WEATHER_COLUMNS + ['weather_source'])
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect()
+
+    try:
+        observations = fetch_weather_observations(
+            conn,
+            left['venue_id'].unique(),
+            left['_scheduled_at'].min() - max_age,
+            left['_scheduled_at'].max()
+        )
+        daily = fetch_race_weather(conn, left['race_id'])
+    finally:
+        if own_conn:
+            conn.close()
+
+    if len(observations) > 0:
+        observations['venue_id'] = observations['venue_id'].astype('int64')
+        observations['_scheduled_at'] = pd.to_datetime(observations.pop('record_datetime')).astype('datetime64[ns]')
+        observations = observations.sort_values('_scheduled_at')
+
+        # by='venue_id' で同じ会場の観測値だけを対象にする
+        merged = pd.merge_asof(
+            left,
+            observations,
+            on='_scheduled_at',
+            by='venue_id',
+            tolerance=pd.Timedelta(max_age),
+            direction='backward'
+        )
+    else:
+        merged = left.copy()
+        for col in WEATHER_COLUMNS:
+            merged[col] = float('nan')
+
+    merged = merged.set_index('race_id')
+    observed = merged[WEATHER_COLUMNS].notna().any(axis=1)
+
+    merged[WEATHER_COLUMNS] = merged[WEATHER_COLUMNS].fillna(daily.reindex(merged.index)[WEATHER_COLUMNS])
+    from_daily = ~observed & merged[WEATHER_COLUMNS].notna().any(axis=1)
+
+    merged[WEATHER_COLUMNS] = merged[WEATHER_COLUMNS].fillna(DEFAULT_WEATHER).astype(float)
+    merged['weather_source'] = 'default'
+    merged.loc[from_daily, 'weather_source'] = 'daily'
+    merged.loc[observed, 'weather_source'] = 'observed'
+
+    return merged.reset_index()[['race_id'] + WEATHER_COLUMNS + ['weather_source']]
+
+
+def attach_weather(df, conn=None, verbose=True):
+    """
+    出走データ（1行1艇）に天気カラムを結合
+
+    既存の天気カラムは置き換える
+    """
+    weather = align_weather(df, conn=conn)
+
+    if verbose:
+        counts = weather['weather_source'].value_counts()
+        print(f"天気データ: 観測値 {counts.get('observed', 0)}レース / "
+              f"日別 {counts.get('daily', 0)}レース / 既定値 {counts.get('default', 0)}レース")
+
+    df = df.drop(columns=[col for col in WEATHER_COLUMNS if col in df.columns])
+    return df.merge(weather[['race_id'] + WEATHER_COLUMNS], on='race_id', how='left')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show how races are matched to weather observations')
+    parser.add_argument('--start-date', type=str, required=True, help='First race date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', type=str, default=None, help='Last race date (YYYY-MM-DD, default: same as start)')
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start_date, '%Y-%m-%d').date()
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else start_date
+
+    conn = connect()
+    try:
+        races = pd.read_sql_query("""
+            SELECT id AS race_id, race_date, venue_id, race_number
+            FROM races
+            WHERE race_date BETWEEN %s AND %s
+        """, conn, params=(start_date, end_date))
+        weather = align_weather(races, conn=conn)
+    finally:
+        conn.close()
+
+    print(f"レース数: {len(weather)}")
+    for source, count in weather['weather_source'].value_counts().items():
+        print(f"  {source}: {count}")
+
+
+if __name__ == '__main__':
+    main()
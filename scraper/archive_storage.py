@@ -0,0 +1,148 @@
+"""
+アーカイブの保存先（Supabase Storage）
+
+cleanup_old_data.py が削除前に書いた Parquet を Storage のバケットへアップロードする
+（GitHub Actions の Artifact は保持期間が過ぎると消えるため、削除するデータの保存先には使わない）
+アップロード後にオブジェクトのサイズを確認し、一致しない場合はエラーにする
+
+バケットは Supabase ダッシュボードの Storage で非公開（private）として作成しておく
+
+環境変数:
+  SUPABASE_URL               プロジェクトのURL（なければ NEXT_PUBLIC_SUPABASE_URL）
+  SUPABASE_SERVICE_ROLE_KEY  service_role キー（非公開バケットの読み書きに必要）
+
+使用方法:
+    storage = ArchiveStorage('retention-archive')
+    storage.upload('data/retention_archive/races/year_month=2021-01/part-1-1000.parquet',
+                   'races/year_month=2021-01/part-1-1000.parquet')
+    storage.download_all('data/retention_archive')   # load_archive() の前に手元へ取得
+"""
+import os
+
+import requests
+
+
+DEFAULT_TIMEOUT = 120
+
+# 一覧取得の1リクエストあたりの件数
+LIST_PAGE_SIZE = 1000
+
+
+class ArchiveStorage:
+    """Supabase Storage のバケット1つへの読み書き"""
+
+    def __init__(self, bucket, url=None, key=None, timeout=DEFAULT_TIMEOUT):
+        """
+        Args:
+            bucket: バケット名
+            url: プロジェクトのURL（Noneの場合は環境変数）
+            key: service_role キー（Noneの場合は環境変数）
+            timeout: 1リクエストのタイムアウト秒数
+        """
+        url = url or os.getenv('SUPABASE_URL') or os.getenv('NEXT_PUBLIC_SUPABASE_URL')
+        key = key or os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+        if not url or not key:
+            raise RuntimeError("SUPABASE_URL と SUPABASE_SERVICE_ROLE_KEY を設定してください")
+
+        self.bucket = bucket
+        self.base_url = f"{url.rstrip('/')}/storage/v1"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'Bearer {key}',
+            'apikey': key,
+        })
+
+    def _object_url(self, object_path, kind='object'):
+        return f"{self.base_url}/{kind}/{self.bucket}/{object_path}"
+
+    def upload(self, local_path, object_path):
+        """
+        ファイルをアップロード（同じパスがあれば置き換える）し、保存されたサイズを確認
+
+        Raises:
+            RuntimeError: アップロードに失敗した、またはサイズが一致しない場合
+        """
+        size = os.path.getsize(local_path)
+        with open(local_path, 'rb') as f:
+            response = self.session.post(
+                self._object_url(object_path),
+                data=f,
+                headers={'Content-Type': 'application/octet-stream', 'x-upsert': 'true'},
+                timeout=self.timeout
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f"Storage へのアップロードに失敗: {object_path} "
+                               f"(HTTP {response.status_code}: {response.text[:200]})")
+
+        stored = self.size(object_path)
+        if stored != size:
+            raise RuntimeError(f"Storage のサイズが一致しません: {object_path} (local {size}, stored {stored})")
+
+    def size(self, object_path):
+        """オブジェクトのサイズ（ない場合は None）"""
+        response = self.session.head(self._object_url(object_path, 'object/authenticated'),
+                                     timeout=self.timeout)
+        if response.status_code != 200:
+            return None
+        length = response.headers.get('Content-Length')
+        return int(length) if length is not None else None
+
+    def list(self, prefix=''):
+        """
+        prefix 以下のオブジェクトのパスを再帰的に取得
+
+        Returns:
+            list: オブジェクトのパス
+        """
+        paths = []
+        offset = 0
+        while True:
+            response = self.session.post(
+                f"{self.base_url}/object/list/{self.bucket}",
+                json={'prefix': prefix, 'limit': LIST_PAGE_SIZE, 'offset': offset,
+                      'sortBy': {'column': 'name', 'order': 'asc'}},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            items = response.json()
+
+            for item in items:
+                path = f"{prefix.rstrip('/')}/{item['name']}" if prefix else item['name']
+                # id がないものはフォルダ
+                if item.get('id') is None:
+                    paths.extend(self.list(path))
+                else:
+                    paths.append(path)
+
+            if len(items) < LIST_PAGE_SIZE:
+                return paths
+            offset += LIST_PAGE_SIZE
+
+    def download(self, object_path, local_path):
+        """オブジェクトをダウンロード（一時ファイルに書いてから置き換える）"""
+        response = self.session.get(self._object_url(object_path, 'object/authenticated'),
+                                    timeout=self.timeout)
+        response.raise_for_status()
+
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp_path = local_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(response.content)
+        os.replace(tmp_path, local_path)
+
+    def download_all(self, local_dir, prefix=''):
+        """
+        prefix 以下のオブジェクトを local_dir に同じ構成でダウンロード（手元にあるファイルは飛ばす）
+
+        Returns:
+            int: ダウンロードしたファイル数
+        """
+        count = 0
+        for object_path in self.list(prefix):
+            local_path = os.path.join(local_dir, *object_path.split('/'))
+            if os.path.exists(local_path):
+                continue
+            self.download(object_path, local_path)
+            count += 1
+        return count
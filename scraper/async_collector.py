@@ -0,0 +1,248 @@
+"""
+kyotei.fun レースページの非同期収集パイプライン
+
+取得・パース・DB書き込みを別々のステージで並行実行する
+- 取得: keep-aliveの aiohttp セッションを共有し、RateLimiter.slot() で同時数・頻度を制限
+        429 / 503 は RateLimiter に通知して Retry-After まで待つ
+- パース: イベントループを塞がないようプロセスプールで実行
+- DB書き込み: キュー経由で1つのコンシューマが Kyotei24Scraper.buffer_race() を呼ぶ
+
+collect_historical_data.py / fetch_scheduled_races.py の --async オプションから利用する
+"""
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from kyotei24_scraper import Kyotei24Scraper
+from rate_limiter import RateLimiter
+from page_parser import DEFAULT_BACKEND
+from crawl_state import STATUS_NO_RACE, STATUS_FAILED
+
+
+# 取得失敗時に再試行するHTTPステータス
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def build_rate_limiter(delay, concurrency):
+    """
+    従来の --delay（リクエスト間隔）と同じ頻度になる RateLimiter を作成
+
+    同時実行数は concurrency まで許可し、全体の頻度は 1/delay 件/秒 に抑える
+    """
+    delay = max(delay, 0.1)
+    return RateLimiter(
+        requests_per_second=1.0 / delay,
+        requests_per_minute=None,
+        requests_per_hour=None,
+        requests_per_day=None,
+        concurrent_requests=concurrency
+    )
+
+
+async def fetch_page(session, rate_limiter, url, max_retries=3, timeout=30):
+    """
+    1ページを取得
+
+    Returns:
+        tuple: (status, content)
+               status は HTTPステータス（通信エラーで全試行失敗した場合は None）
+    """
+    status = None
+
+    for attempt in range(max_retries):
+        try:
+            # 同時実行数の枠はレスポンスを読み終えるまで保持する
+            async with rate_limiter.slot(url):
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    status = response.status
+                    rate_limiter.report(url, status, response.headers.get('Retry-After'))
+
+                    if status == 200:
+                        return status, await response.read()
+
+                    if status not in RETRY_STATUSES:
+                        return status, None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = None
+            if attempt == max_retries - 1:
+                print(f"Error fetching {url}: {e}")
+
+        # 429 / 503 の待機は RateLimiter が行う
+        if attempt < max_retries - 1 and status not in (429, 503):
+            await asyncio.sleep(2 ** attempt)
+
+    return status, None
+
+
+async def _mark(scraper, target, status, http_status=None):
+    """クロール状態を記録（scraper に CrawlState がない場合は何もしない）"""
+    if scraper.crawl_state is not None:
+        await asyncio.to_thread(scraper.crawl_state.mark, *target, status, http_status)
+
+
+async def _fetch_worker(scraper, session, rate_limiter, executor, target_queue, db_queue, stats, max_retries):
+    """対象レースを取り出して取得・パースし、結果をDBキューへ渡す"""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        target = await target_queue.get()
+        if target is None:
+            target_queue.task_done()
+            return
+
+        race_date, venue_id, race_number = target
+        url = scraper.race_url(race_date, venue_id, race_number)
+
+        try:
+            status, content = await fetch_page(session, rate_limiter, url, max_retries=max_retries)
+
+            if content is None:
+                if status == 404:
+                    stats['skipped'] += 1
+                    await _mark(scraper, target, STATUS_NO_RACE, status)
+                else:
+                    print(f"  Venue {venue_id:2d} Race {race_number:2d}: Failed (status: {status})")
+                    stats['failed'] += 1
+                    await _mark(scraper, target, STATUS_FAILED, status)
+                continue
+
+            if scraper.archive is not None:
+                await asyncio.to_thread(scraper.archive_page, url, content, race_date, venue_id, race_number)
+
+            # パースはイベントループ外で実行
+            race_data = await loop.run_in_executor(
+                executor, Kyotei24Scraper.parse_race_page,
+                content, race_date, venue_id, race_number, scraper.parser_backend
+            )
+
+            if race_data and race_data.get('entries'):
+                # done は書き込み成功時に Kyotei24Scraper が記録する
+                await db_queue.put(race_data)
+                stats['successful'] += 1
+            elif race_data is None:
+                # メインテーブルがない（レース未開催など）
+                stats['skipped'] += 1
+                await _mark(scraper, target, STATUS_NO_RACE, status)
+            else:
+                # メインテーブルはあるが出走を取り出せない場合は、開催なしにせず失敗として再試行する
+                print(f"  Venue {venue_id:2d} Race {race_number:2d}: Failed (no entries parsed)")
+                stats['failed'] += 1
+                await _mark(scraper, target, STATUS_FAILED, status)
+
+        except Exception as e:
+            print(f"  Venue {venue_id:2d} Race {race_number:2d}: Error - {e}")
+            stats['failed'] += 1
+            await _mark(scraper, target, STATUS_FAILED)
+
+        finally:
+            target_queue.task_done()
+
+
+async def _db_consumer(scraper, db_queue):
+    """DBキューからレースデータを取り出して書き込みバッファへ渡す"""
+    while True:
+        race_data = await db_queue.get()
+
+        try:
+            if race_data is None:
+                await asyncio.to_thread(scraper.flush)
+                return
+
+            # 書き込みはスレッドで実行し、その間も取得・パースを続ける
+            await asyncio.to_thread(scraper.buffer_race, race_data)
+
+        finally:
+            db_queue.task_done()
+
+
+async def collect_races_async(targets, delay=1.0, concurrency=2, max_retries=3,
+                              batch_size=50, flush_interval=60.0, parse_workers=2,
+                              scraper=None, progress_interval=60, archive=None, parser_backend=DEFAULT_BACKEND,
+                              crawl_state=None):
+    """
+    複数レースを非同期パイプラインで収集
+
+    Args:
+        targets: (datetime, venue_id, race_number) のリスト
+        delay: 平均リクエスト間隔（秒）
+        concurrency: 同時リクエスト数
+        max_retries: 最大再試行回数
+        batch_size: まとめてDBに書き込むレース数
+        flush_interval: バッファを書き込む最大間隔（秒）
+        parse_workers: パース用プロセス数
+        scraper: 既存の Kyotei24Scraper（Noneの場合は作成してクローズまで行う）
+        progress_interval: 進捗を表示する間隔（秒）
+        archive: 取得したHTMLを保存する HtmlArchive（scraper を作成する場合のみ使用）
+        parser_backend: HTMLパーサー（scraper を作成する場合のみ使用）
+        crawl_state: 結果を記録する CrawlState（scraper を作成する場合のみ使用）
+
+    Returns:
+        dict: successful / failed / skipped 件数
+    """
+    stats = {
+        'total_races': len(targets),
+        'successful': 0,
+        'failed': 0,
+        'skipped': 0
+    }
+
+    owns_scraper = scraper is None
+    if owns_scraper:
+        scraper = Kyotei24Scraper(batch_size=batch_size, flush_interval=flush_interval, archive=archive,
+                                  parser_backend=parser_backend, crawl_state=crawl_state)
+
+    rate_limiter = build_rate_limiter(delay, concurrency)
+    target_queue = asyncio.Queue()
+    db_queue = asyncio.Queue(maxsize=max(batch_size * 2, 10))
+
+    for target in targets:
+        target_queue.put_nowait(target)
+    for _ in range(concurrency):
+        target_queue.put_nowait(None)
+
+    start_time = time.monotonic()
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, parse_workers)) as executor:
+            async with aiohttp.ClientSession(connector=connector) as session:
+                consumer = asyncio.create_task(_db_consumer(scraper, db_queue))
+                workers = [
+                    asyncio.create_task(_fetch_worker(
+                        scraper, session, rate_limiter, executor,
+                        target_queue, db_queue, stats, max_retries
+                    ))
+                    for _ in range(concurrency)
+                ]
+
+                # 進捗表示
+                pending = set(workers)
+                while pending:
+                    _, pending = await asyncio.wait(pending, timeout=progress_interval)
+                    done = stats['successful'] + stats['failed'] + stats['skipped']
+                    elapsed = time.monotonic() - start_time
+                    print(f"  Progress: {done}/{len(targets)} "
+                          f"({done / elapsed:.2f} pages/s, queued for DB: {db_queue.qsize()})")
+
+                await asyncio.gather(*workers)
+
+                # 残りを書き込んでコンシューマを終了
+                await db_queue.put(None)
+                await consumer
+
+    finally:
+        if owns_scraper:
+            scraper.close()
+
+    # バッファ書き込みで失敗したレースを反映
+    stats['successful'] -= scraper.write_stats['failed_races']
+    stats['failed'] += scraper.write_stats['failed_races']
+
+    elapsed = time.monotonic() - start_time
+    stats['seconds'] = elapsed
+    stats['rate_limiter'] = rate_limiter.metrics()
+    rate_limiter.print_metrics()
+    return stats
@@ -57,10 +57,9 @@ class GentleBackfillScraper(BoatRaceScraper):
                 except:
                     pass
 
-            # 新しい接続を作成
-            import psycopg2
-            import os
-            self.db_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+            # 新しい接続を取得（プールから、切断されていた接続は取り直される）
+            from db import connect
+            self.db_conn = connect()
             print("  [DB] 接続を再確立しました")
         except Exception as e:
             print(f"  [DB] 再接続エラー: {e}")
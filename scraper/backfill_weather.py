@@ -21,12 +21,10 @@ import asyncio
 import aiohttp
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-import psycopg2
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-load_dotenv()
+from scraper.db import connect
 
 
 class WeatherBackfiller:
@@ -35,7 +33,7 @@ class WeatherBackfiller:
     def __init__(self, delay=3.0):
         self.delay = delay
         self.session = None
-        self.db_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        self.db_conn = connect()
 
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
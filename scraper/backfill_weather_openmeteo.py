@@ -9,10 +9,17 @@ Open-Meteo API:
 - 過去データは1940年から利用可能
 - レート制限: 10,000リクエスト/日
 
+デフォルトは範囲モード: 未取得の (日付, 会場) を会場ごとの期間にまとめ、
+1リクエストで最大 --max-span-days 日分を取得する（会場ごとに並行実行）
+更新は --batch-size 件ごとに UPDATE ... FROM (VALUES ...) でまとめて書き込む
+--per-day で従来どおり1日×1会場ずつ取得する
+
 使用方法:
     python scraper/backfill_weather_openmeteo.py
     python scraper/backfill_weather_openmeteo.py --limit 500
     python scraper/backfill_weather_openmeteo.py --dry-run
+    python scraper/backfill_weather_openmeteo.py --concurrency 4 --max-span-days 366
+    python scraper/backfill_weather_openmeteo.py --per-day
 """
 
 import os
@@ -22,14 +29,14 @@ import argparse
 import asyncio
 import aiohttp
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-import psycopg2
+import numpy as np
+from psycopg2.extras import execute_values
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from scraper.venue_coordinates import VENUE_COORDINATES
-
-load_dotenv()
+from scraper.rate_limiter import RateLimiter
+from scraper.db import connect
 
 
 class OpenMeteoWeatherBackfiller:
@@ -38,6 +45,12 @@ class OpenMeteoWeatherBackfiller:
     # Open-Meteo Historical Weather API
     API_URL = "https://archive-api.open-meteo.com/v1/archive"
 
+    HOURLY_VARIABLES = 'temperature_2m,wind_speed_10m,wind_direction_10m,weather_code'
+
+    # レース時間帯（12:00-17:00）と天気コードを使う時刻
+    RACE_HOURS = slice(12, 18)
+    CONDITION_HOUR = 14
+
     def __init__(self, delay=0.5):
         """
         Args:
@@ -45,7 +58,7 @@ class OpenMeteoWeatherBackfiller:
         """
         self.delay = delay
         self.session = None
-        self.db_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        self.db_conn = connect()
 
         # 統計
         self.stats = {
@@ -162,53 +175,83 @@ class OpenMeteoWeatherBackfiller:
 
     def parse_weather(self, api_response):
         """
-        Open-MeteoのAPIレスポンスを解析
+        Open-MeteoのAPIレスポンスを解析（1日分）
 
         レース時間帯（12:00-17:00頃）の平均を使用
         """
+        days = self.parse_weather_range(api_response)
+        return next(iter(days.values()), None) if days else None
+
+    def parse_weather_range(self, api_response):
+        """
+        Open-MeteoのAPIレスポンスを日ごとに解析
+
+        時間別データを (日数, 24) の配列にして、レース時間帯（12:00-17:00）の平均をまとめて計算する
+
+        Returns:
+            dict: {date: 天気データ}（気温データがない日は None）
+        """
         try:
             hourly = api_response.get('hourly', {})
-
-            # 時間別データを取得
+            times = hourly.get('time', [])
             temps = hourly.get('temperature_2m', [])
-            winds = hourly.get('wind_speed_10m', [])
-            wind_dirs = hourly.get('wind_direction_10m', [])
-            weather_codes = hourly.get('weather_code', [])
 
             if not temps:
-                return None
-
-            # レース時間帯（12:00-17:00、インデックス12-17）の平均
-            race_hours = range(12, 18)
-
-            def avg(data, hours):
-                values = [data[h] for h in hours if h < len(data) and data[h] is not None]
-                return sum(values) / len(values) if values else None
-
-            temperature = avg(temps, race_hours)
-            wind_speed = avg(winds, race_hours)
-            wind_direction_deg = avg(wind_dirs, race_hours)
-
-            # 風向きを方位に変換
-            wind_direction = self.degree_to_direction(wind_direction_deg)
-
-            # 天気コードを天気条件に変換
-            weather_condition = self.code_to_condition(
-                weather_codes[14] if len(weather_codes) > 14 else None  # 14時の天気
-            )
-
-            return {
-                'temperature': round(temperature, 1) if temperature else None,
-                'wind_speed': round(wind_speed) if wind_speed else None,
-                'wind_direction': wind_direction,
-                'water_temperature': None,  # Open-Meteoからは取得不可
-                'wave_height': None,  # Open-Meteoからは取得不可
-                'weather_condition': weather_condition
-            }
+                return {}
+
+            n_days = len(temps) // 24
+            if n_days == 0:
+                return {}
+
+            def day_matrix(name):
+                # None は NaN に変換（欠損時間は平均から除外）
+                values = np.array(hourly.get(name, []), dtype=float)
+                matrix = np.full(n_days * 24, np.nan)
+                matrix[:min(len(values), n_days * 24)] = values[:n_days * 24]
+                return matrix.reshape(n_days, 24)
+
+            def window_mean(matrix):
+                window = matrix[:, self.RACE_HOURS]
+                counts = np.sum(~np.isnan(window), axis=1)
+                sums = np.nansum(window, axis=1)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+            temperature = window_mean(day_matrix('temperature_2m'))
+            wind_speed = window_mean(day_matrix('wind_speed_10m'))
+            wind_direction_deg = window_mean(day_matrix('wind_direction_10m'))
+            condition_codes = day_matrix('weather_code')[:, self.CONDITION_HOUR]
+
+            if times:
+                dates = [datetime.strptime(times[day * 24][:10], '%Y-%m-%d').date() for day in range(n_days)]
+            else:
+                dates = list(range(n_days))
+
+            result = {}
+            for day, race_date in enumerate(dates):
+                temp = None if np.isnan(temperature[day]) else float(temperature[day])
+                wind = None if np.isnan(wind_speed[day]) else float(wind_speed[day])
+                wind_deg = None if np.isnan(wind_direction_deg[day]) else float(wind_direction_deg[day])
+                code = None if np.isnan(condition_codes[day]) else int(condition_codes[day])
+
+                if temp is None:
+                    result[race_date] = None
+                    continue
+
+                result[race_date] = {
+                    'temperature': round(temp, 1) if temp else None,
+                    'wind_speed': round(wind) if wind else None,
+                    'wind_direction': self.degree_to_direction(wind_deg),
+                    'water_temperature': None,  # Open-Meteoからは取得不可
+                    'wave_height': None,  # Open-Meteoからは取得不可
+                    'weather_condition': self.code_to_condition(code)
+                }
+
+            return result
 
         except Exception as e:
             print(f"  Parse error: {e}")
-            return None
+            return {}
 
     def degree_to_direction(self, degrees):
         """風向きの角度を方位に変換"""
@@ -294,6 +337,245 @@ class OpenMeteoWeatherBackfiller:
         finally:
             cursor.close()
 
+    def update_races_weather_many(self, updates):
+        """
+        複数の日×会場の天気データを1回の UPDATE ... FROM (VALUES ...) で更新
+
+        Args:
+            updates: (race_date, venue_id, 天気データ) のリスト
+
+        Returns:
+            set: 更新された (race_date, venue_id)
+        """
+        if not updates:
+            return set()
+
+        cursor = self.db_conn.cursor()
+
+        try:
+            rows = execute_values(cursor, """
+                UPDATE races AS r
+                SET temperature = v.temperature,
+                    wind_speed = v.wind_speed,
+                    wind_direction = v.wind_direction,
+                    water_temperature = v.water_temperature,
+                    wave_height = v.wave_height,
+                    weather_condition = v.weather_condition
+                FROM (VALUES %s) AS v (race_date, venue_id, temperature, wind_speed, wind_direction,
+                                       water_temperature, wave_height, weather_condition)
+                WHERE r.race_date = v.race_date AND r.venue_id = v.venue_id
+                RETURNING r.race_date, r.venue_id
+            """, [
+                (
+                    race_date, venue_id,
+                    weather_data['temperature'],
+                    weather_data['wind_speed'],
+                    weather_data['wind_direction'],
+                    weather_data['water_temperature'],
+                    weather_data['wave_height'],
+                    weather_data['weather_condition']
+                )
+                for race_date, venue_id, weather_data in updates
+            ], template='(%s::date, %s::int, %s::numeric, %s::int, %s::varchar, %s::numeric, %s::int, %s::varchar)',
+               page_size=len(updates), fetch=True)
+
+            self.db_conn.commit()
+            return set(rows)
+
+        except Exception as e:
+            self.db_conn.rollback()
+            print(f"  DB error: {e}")
+            return set()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def group_date_ranges(combinations, max_span_days=366):
+        """
+        未取得の (日付, 会場) を会場ごとの期間にまとめる
+
+        期間内の未取得でない日も取得するが、1リクエストあたりのデータ量は小さいため問題ない
+
+        Args:
+            combinations: (race_date, venue_id) のリスト
+            max_span_days: 1リクエストで取得する最大日数
+
+        Returns:
+            list: (venue_id, start_date, end_date, 期間内の未取得日のリスト)
+        """
+        by_venue = {}
+        for race_date, venue_id in combinations:
+            by_venue.setdefault(venue_id, set()).add(race_date)
+
+        ranges = []
+        for venue_id, dates in sorted(by_venue.items()):
+            chunk = []
+            for race_date in sorted(dates):
+                if chunk and (race_date - chunk[0]).days >= max_span_days:
+                    ranges.append((venue_id, chunk[0], chunk[-1], chunk))
+                    chunk = []
+                chunk.append(race_date)
+            ranges.append((venue_id, chunk[0], chunk[-1], chunk))
+
+        return ranges
+
+    async def fetch_weather_range(self, rate_limiter, venue_id, start_date, end_date, max_retries=3):
+        """
+        1会場の期間分の天気データをまとめて取得
+
+        Returns:
+            dict: {date: 天気データ}、取得失敗時はNone
+        """
+        venue_info = VENUE_COORDINATES.get(venue_id)
+        if not venue_info:
+            print(f"  Unknown venue_id: {venue_id}")
+            return None
+
+        lat, lon, venue_name = venue_info
+
+        params = {
+            'latitude': lat,
+            'longitude': lon,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': end_date.strftime('%Y-%m-%d'),
+            'hourly': self.HOURLY_VARIABLES,
+            'timezone': 'Asia/Tokyo'
+        }
+
+        for attempt in range(max_retries):
+            status = None
+            try:
+                async with rate_limiter.slot(self.API_URL):
+                    self.stats['api_calls'] += 1
+                    async with self.session.get(
+                        self.API_URL,
+                        params=params,
+                        timeout=aiohttp.ClientTimeout(total=120)
+                    ) as response:
+                        status = response.status
+                        rate_limiter.report(self.API_URL, status, response.headers.get('Retry-After'))
+
+                        if status == 200:
+                            data = await response.json()
+                            return self.parse_weather_range(data)
+
+                        error_text = await response.text()
+                        print(f"  API error {status} ({venue_name} {start_date}〜{end_date}): {error_text[:100]}")
+                        if status < 500 and status != 429:
+                            return None
+
+            except asyncio.TimeoutError:
+                print(f"  Timeout: venue {venue_id} {start_date}〜{end_date}")
+            except Exception as e:
+                print(f"  Error: venue {venue_id} {start_date}〜{end_date} - {e}")
+
+            # 429 / 503 の待機は RateLimiter が行う
+            if attempt < max_retries - 1 and status not in (429, 503):
+                await asyncio.sleep(2 ** attempt)
+
+        return None
+
+    async def run_ranges(self, limit=None, dry_run=False, concurrency=4, max_span_days=366, batch_size=500):
+        """
+        範囲モードでバックフィルを実行
+
+        会場ごとの期間をまとめて並行取得し、batch_size 件ごとにまとめてDBを更新する
+        """
+        print("=" * 60)
+        print("  Weather Backfill (Open-Meteo API, range mode)")
+        print("=" * 60)
+        print()
+
+        completed, total = self.get_progress()
+        pending = total - completed
+
+        print(f"Total combinations: {total:,}")
+        print(f"Completed: {completed:,}")
+        print(f"Pending: {pending:,}")
+        print()
+
+        combinations = self.get_pending_combinations(limit)
+
+        if not combinations:
+            print("No pending combinations found.")
+            return
+
+        ranges = self.group_date_ranges(combinations, max_span_days)
+
+        print(f"Processing {len(combinations)} combinations in {len(ranges)} range requests...")
+        print(f"Concurrency: {concurrency}, delay: {self.delay}s per request, "
+              f"max span: {max_span_days} days, DB batch: {batch_size}")
+        print()
+
+        rate_limiter = RateLimiter(
+            requests_per_second=1.0 / max(self.delay, 0.01),
+            requests_per_minute=None,
+            requests_per_hour=None,
+            requests_per_day=None,
+            concurrent_requests=concurrency
+        )
+        start_time = time.monotonic()
+        pending_updates = []
+
+        async def flush():
+            if dry_run:
+                for race_date, venue_id, weather_data in pending_updates[:10]:
+                    print(f"  [DRY-RUN] Would update: {race_date} venue {venue_id}: {weather_data}")
+                self.stats['updated'] += len(pending_updates)
+            else:
+                updated = await asyncio.to_thread(self.update_races_weather_many, list(pending_updates))
+                self.stats['updated'] += len(updated)
+                self.stats['failed'] += len(pending_updates) - len(updated)
+            pending_updates.clear()
+
+        async with aiohttp.ClientSession() as session:
+            self.session = session
+
+            async def fetch(venue_id, start_date, end_date, dates):
+                weather_by_date = await self.fetch_weather_range(rate_limiter, venue_id, start_date, end_date)
+                return venue_id, dates, weather_by_date
+
+            tasks = [asyncio.create_task(fetch(*r)) for r in ranges]
+
+            for i, task in enumerate(asyncio.as_completed(tasks), 1):
+                venue_id, dates, weather_by_date = await task
+                self.stats['processed'] += len(dates)
+
+                if weather_by_date is None:
+                    self.stats['failed'] += len(dates)
+                    print(f"  venue {venue_id:2d} {dates[0]}〜{dates[-1]}: FAIL ({len(dates)} days)")
+                    continue
+
+                for race_date in dates:
+                    weather_data = weather_by_date.get(race_date)
+                    if weather_data is None:
+                        self.stats['failed'] += 1
+                    else:
+                        pending_updates.append((race_date, venue_id, weather_data))
+
+                if len(pending_updates) >= batch_size:
+                    await flush()
+
+                if i % 10 == 0 or i == len(tasks):
+                    elapsed = time.monotonic() - start_time
+                    print(f"[{i}/{len(tasks)}] ranges done, {self.stats['processed']} combinations "
+                          f"(API calls: {self.stats['api_calls']}, {elapsed:.0f}s)")
+
+            if pending_updates:
+                await flush()
+
+        print()
+        print("=" * 60)
+        print("  Summary")
+        print("=" * 60)
+        print(f"Processed: {self.stats['processed']}")
+        print(f"Updated: {self.stats['updated']}")
+        print(f"Failed: {self.stats['failed']}")
+        print(f"API calls: {self.stats['api_calls']}")
+        print(f"Success rate: {self.stats['updated']*100/max(1,self.stats['processed']):.1f}%")
+        print(f"Elapsed: {time.monotonic() - start_time:.1f}s")
+        rate_limiter.print_metrics()
+
     async def process_combination(self, race_date, venue_id, dry_run=False):
         """
         1つの日×会場の組み合わせを処理
@@ -395,13 +677,25 @@ async def main():
                         help='Delay between requests in seconds (default: 0.5)')
     parser.add_argument('--dry-run', action='store_true',
                         help='Do not actually update database')
+    parser.add_argument('--per-day', action='store_true',
+                        help='Request one day for one venue at a time (previous behavior)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Concurrent range requests (default: 4)')
+    parser.add_argument('--max-span-days', type=int, default=366,
+                        help='Maximum days per range request (default: 366)')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Venue-days per DB update batch (default: 500)')
 
     args = parser.parse_args()
 
     backfiller = OpenMeteoWeatherBackfiller(delay=args.delay)
 
     try:
-        await backfiller.run(limit=args.limit, dry_run=args.dry_run)
+        if args.per_day:
+            await backfiller.run(limit=args.limit, dry_run=args.dry_run)
+        else:
+            await backfiller.run_ranges(limit=args.limit, dry_run=args.dry_run, concurrency=args.concurrency,
+                                        max_span_days=args.max_span_days, batch_size=args.batch_size)
     finally:
         backfiller.close()
 
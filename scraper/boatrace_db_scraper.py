@@ -5,28 +5,49 @@ boatrace-db.netから詳細統計データを取得するスクレイパー
   python boatrace_db_scraper.py --mode racers  # 選手詳細データ収集
   python boatrace_db_scraper.py --mode venues  # 会場データ収集
   python boatrace_db_scraper.py --mode all     # 全データ収集
+  python boatrace_db_scraper.py --mode racers --archive-dir data/html_archive  # 取得HTMLを保存
+  python boatrace_db_scraper.py --mode all --archive-dir data/html_archive --reparse  # 保存済みHTMLから再パース
+  python boatrace_db_scraper.py --mode racers --async --concurrency 4  # 非同期・条件付きリクエストで選手データ収集
+  python boatrace_db_scraper.py --mode racers --changed-since 2025-11-01  # 指定日以降に出走した選手のみ
+  python boatrace_db_scraper.py --mode racers --limit 50 --profile racers  # 選手データ収集をプロファイル
 """
 
 import requests
-from bs4 import BeautifulSoup
 import time
 import os
-from dotenv import load_dotenv
-import psycopg2
+from db import connect
+from psycopg2.extras import execute_values
 import json
 import argparse
+import asyncio
 import re
+import sys
+from datetime import datetime
+from html_archive import HtmlArchive
+from page_parser import parse_page, DEFAULT_BACKEND, PARSER_BACKENDS
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.race_cards import try_refresh_race_cards
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
 
 
 class BoatraceDBScraper:
     """boatrace-db.netサイトからデータを収集するスクレイパー"""
 
-    def __init__(self, delay=2.0):
+    def __init__(self, delay=2.0, archive=None, connect_db=True, parser_backend=DEFAULT_BACKEND):
+        """
+        Args:
+            delay: レート制限（秒）
+            archive: 取得したHTMLを保存する HtmlArchive（Noneの場合は保存しない）
+            connect_db: Falseの場合はDBに接続しない（再パース用のパース専用インスタンス）
+            parser_backend: HTMLパーサー（'bs4' / 'lxml'、page_parser.py 参照）
+        """
         self.base_url = "https://boatrace-db.net"
         self.delay = delay  # レート制限（秒）
-        self.db_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        self.archive = archive
+        self.parser_backend = parser_backend
+        self.db_conn = connect() if connect_db else None
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -136,48 +157,11 @@ class BoatraceDBScraper:
                 print(f"  Failed to fetch racer {racer_number}")
                 return None
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # データ抽出
-            racer_data = {
-                'racer_number': racer_number,
-                'registration_period': None,
-                'branch': None,
-                'total_races': 0,
-                'total_wins': 0,
-                'overall_win_rate': 0.0,
-                'overall_1st_rate': 0.0,
-                'overall_2nd_rate': 0.0,
-                'overall_3rd_rate': 0.0,
-                'total_優出': 0,
-                'total_優勝': 0,
-                'avg_start_timing': 0.0,
-                'grade_stats': {},
-                'boat_number_stats': {},
-                'course_stats': {},
-                'venue_stats': {},
-                'sg_appearances': 0,
-                'flying_count': 0,
-                'late_start_count': 0
-            }
-
-            # プロフィール情報を抽出
-            racer_data = self._parse_racer_profile(soup, racer_data)
-
-            # 通算成績を抽出
-            racer_data = self._parse_racer_overall_stats(soup, racer_data)
-
-            # グレード別着順（フライング・出遅れ）を抽出
-            racer_data = self._parse_racer_grade_order_stats(soup, racer_data)
-
-            # 艇番別成績を抽出
-            racer_data = self._parse_boat_number_stats(soup, racer_data)
-
-            # コース別成績を抽出
-            racer_data = self._parse_course_stats(soup, racer_data)
-
-            # 場別成績を抽出
-            racer_data = self._parse_venue_stats(soup, racer_data)
+            if self.archive is not None:
+                self.archive.put(url, response.content, source='boatrace_db',
+                                 meta={'page': 'racer', 'racer_number': racer_number})
+
+            racer_data = self.parse_racer_page(response.content, racer_number)
 
             print(f"  Success: {racer_data.get('branch', 'Unknown')}支部")
 
@@ -190,18 +174,69 @@ class BoatraceDBScraper:
             traceback.print_exc()
             return None
 
-    def _parse_racer_profile(self, soup, racer_data):
+    def parse_racer_page(self, content, racer_number, parser_backend=None):
+        """
+        選手詳細ページのHTMLから選手詳細データを抽出
+
+        Args:
+            content: ページのHTML
+            racer_number: 選手番号
+            parser_backend: HTMLパーサー（Noneの場合はインスタンスの設定）
+
+        Returns:
+            dict: 選手詳細データ
+        """
+        # DOMは1回だけ構築し、全テーブルを1回の走査で抽出する
+        page = parse_page(content, parser_backend or self.parser_backend)
+
+        # データ抽出
+        racer_data = {
+            'racer_number': racer_number,
+            'registration_period': None,
+            'branch': None,
+            'total_races': 0,
+            'total_wins': 0,
+            'overall_win_rate': 0.0,
+            'overall_1st_rate': 0.0,
+            'overall_2nd_rate': 0.0,
+            'overall_3rd_rate': 0.0,
+            'total_優出': 0,
+            'total_優勝': 0,
+            'avg_start_timing': 0.0,
+            'grade_stats': {},
+            'boat_number_stats': {},
+            'course_stats': {},
+            'venue_stats': {},
+            'sg_appearances': 0,
+            'flying_count': 0,
+            'late_start_count': 0
+        }
+
+        # プロフィール情報を抽出
+        racer_data = self._parse_racer_profile(page, racer_data)
+
+        # 通算成績を抽出
+        racer_data = self._parse_racer_overall_stats(page, racer_data)
+
+        # グレード別着順（フライング・出遅れ）を抽出
+        racer_data = self._parse_racer_grade_order_stats(page, racer_data)
+
+        # 艇番別成績を抽出
+        racer_data = self._parse_boat_number_stats(page, racer_data)
+
+        # コース別成績を抽出
+        racer_data = self._parse_course_stats(page, racer_data)
+
+        # 場別成績を抽出
+        racer_data = self._parse_venue_stats(page, racer_data)
+
+        return racer_data
+
+    def _parse_racer_profile(self, page, racer_data):
         """プロフィール情報を抽出"""
         try:
-            # h1から選手番号と名前を取得（念のため）
-            h1 = soup.find('h1')
-            if h1:
-                text = h1.get_text()
-                # "5000 岡本  翔太郎オカモト ショウタロウ" のような形式
-
             # 登録期を抽出（リンクテキストから）
-            for link in soup.find_all('a'):
-                link_text = link.get_text()
+            for link_text in page.links:
                 if '登録' in link_text and '期' in link_text:
                     # "登録121期" から数値を抽出
                     match = re.search(r'登録(\d+)期', link_text)
@@ -219,38 +254,34 @@ class BoatraceDBScraper:
 
         return racer_data
 
-    def _parse_racer_overall_stats(self, soup, racer_data):
+    def _parse_racer_overall_stats(self, page, racer_data):
         """通算成績を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             grade_stats = {}
 
             for i, table in enumerate(tables):
                 # ヘッダー行を確認
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # グレード別成績テーブルを特定（テーブル1）
                 # ヘッダー: グレード、出場節数、出走数、1着数、勝率、1着率、2連対率、3連対率、優出、優勝、平均ST
                 if ('グレード' in headers and '出場節数' in headers and '優出' in headers and '平均ST' in headers):
-                    rows = table.find_all('tr')[1:]  # ヘッダー行をスキップ
+                    rows = table.rows[1:]  # ヘッダー行をスキップ
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 11:
-                            grade = cells[0].get_text().strip()
+                            grade = cells[0]
                             try:
-                                races = self._parse_number(cells[2].get_text().strip())
-                                wins = self._parse_number(cells[3].get_text().strip())
-                                win_rate = self._parse_float(cells[4].get_text().strip())
-                                rate_1st = self._parse_float(cells[5].get_text().strip())
-                                rate_2nd = self._parse_float(cells[6].get_text().strip())
-                                rate_3rd = self._parse_float(cells[7].get_text().strip())
-                                yusyutsu = self._parse_number(cells[8].get_text().strip())
-                                yusho = self._parse_number(cells[9].get_text().strip())
-                                avg_st = self._parse_float(cells[10].get_text().strip())
+                                races = self._parse_number(cells[2])
+                                wins = self._parse_number(cells[3])
+                                win_rate = self._parse_float(cells[4])
+                                rate_1st = self._parse_float(cells[5])
+                                rate_2nd = self._parse_float(cells[6])
+                                rate_3rd = self._parse_float(cells[7])
+                                yusyutsu = self._parse_number(cells[8])
+                                yusho = self._parse_number(cells[9])
+                                avg_st = self._parse_float(cells[10])
 
                                 grade_stats[grade] = {
                                     'races': races,
@@ -278,7 +309,7 @@ class BoatraceDBScraper:
 
                                 # SG出場回数を取得
                                 if grade == 'SG':
-                                    sg_nodes = self._parse_number(cells[1].get_text().strip())  # 出場節数
+                                    sg_nodes = self._parse_number(cells[1])  # 出場節数
                                     racer_data['sg_appearances'] = sg_nodes
 
                             except (ValueError, IndexError) as e:
@@ -292,32 +323,28 @@ class BoatraceDBScraper:
 
         return racer_data
 
-    def _parse_racer_grade_order_stats(self, soup, racer_data):
+    def _parse_racer_grade_order_stats(self, page, racer_data):
         """グレード別着順（フライング・出遅れ）を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
 
             for i, table in enumerate(tables):
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # グレード別着順テーブルを特定（テーブル2）
                 # ヘッダー: グレード、出走数、1着、2着、3着、4着、5着、6着、S0、S1、S2、F、L0、L1、K0、K1
                 if ('グレード' in headers and 'F' in headers and 'L0' in headers):
-                    rows = table.find_all('tr')[1:]  # ヘッダー行をスキップ
+                    rows = table.rows[1:]  # ヘッダー行をスキップ
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 13:
-                            grade = cells[0].get_text().strip()
+                            grade = cells[0]
 
                             # 「総合」行からフライング・出遅れを取得
                             if grade == '総合':
                                 try:
-                                    flying = self._parse_number(cells[11].get_text().strip())  # F列
-                                    late_start = self._parse_number(cells[12].get_text().strip())  # L0列
+                                    flying = self._parse_number(cells[11])  # F列
+                                    late_start = self._parse_number(cells[12])  # L0列
 
                                     racer_data['flying_count'] = flying
                                     racer_data['late_start_count'] = late_start
@@ -353,31 +380,27 @@ class BoatraceDBScraper:
         except:
             return 0.0
 
-    def _parse_boat_number_stats(self, soup, racer_data):
+    def _parse_boat_number_stats(self, page, racer_data):
         """艇番別成績を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             boat_stats = {}
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # 艇番別成績テーブルを特定（テーブル3）
                 if '艇番' in headers and '1着数' in headers and '優出' in headers:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 5:
-                            boat_no = cells[0].get_text().strip()
+                            boat_no = cells[0]
                             try:
-                                races = self._parse_number(cells[1].get_text().strip())
-                                wins = self._parse_number(cells[2].get_text().strip())
-                                rate_1st = self._parse_float(cells[3].get_text().strip())
-                                rate_2nd = self._parse_float(cells[4].get_text().strip())
+                                races = self._parse_number(cells[1])
+                                wins = self._parse_number(cells[2])
+                                rate_1st = self._parse_float(cells[3])
+                                rate_2nd = self._parse_float(cells[4])
 
                                 boat_stats[boat_no] = {
                                     'races': races,
@@ -396,39 +419,35 @@ class BoatraceDBScraper:
 
         return racer_data
 
-    def _parse_course_stats(self, soup, racer_data):
+    def _parse_course_stats(self, page, racer_data):
         """コース別成績を抽出（決まり手含む）"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             course_stats = {}
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # Table 6: コース別決まり手テーブルを特定
                 # ヘッダー: コース、出走数、1着数、逃げ、差し、まくり、まくり差し、抜き、恵まれ
                 if 'コース' in headers and '逃げ' in headers and '差し' in headers:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 9:
-                            course_no = cells[0].get_text().strip()
+                            course_no = cells[0]
                             try:
-                                races = self._parse_number(cells[1].get_text().strip())
-                                wins = self._parse_number(cells[2].get_text().strip())
+                                races = self._parse_number(cells[1])
+                                wins = self._parse_number(cells[2])
 
                                 # 決まり手を抽出
                                 kimarite = {
-                                    '逃げ': self._parse_number(cells[3].get_text().strip()),
-                                    '差し': self._parse_number(cells[4].get_text().strip()),
-                                    'まくり': self._parse_number(cells[5].get_text().strip()),
-                                    'まくり差し': self._parse_number(cells[6].get_text().strip()),
-                                    '抜き': self._parse_number(cells[7].get_text().strip()),
-                                    '恵まれ': self._parse_number(cells[8].get_text().strip())
+                                    '逃げ': self._parse_number(cells[3]),
+                                    '差し': self._parse_number(cells[4]),
+                                    'まくり': self._parse_number(cells[5]),
+                                    'まくり差し': self._parse_number(cells[6]),
+                                    '抜き': self._parse_number(cells[7]),
+                                    '恵まれ': self._parse_number(cells[8])
                                 }
 
                                 course_stats[course_no] = {
@@ -445,17 +464,16 @@ class BoatraceDBScraper:
 
                 # 代替: 平均STを含むコース別成績テーブル（決まり手なし）
                 elif 'コース' in headers and '平均ST' in headers and not course_stats:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 7:
-                            course_no = cells[0].get_text().strip()
+                            course_no = cells[0]
                             try:
-                                races = self._parse_number(cells[1].get_text().strip())
-                                rate_1st = self._parse_float(cells[3].get_text().strip())
-                                rate_2nd = self._parse_float(cells[4].get_text().strip())
-                                avg_st = self._parse_float(cells[6].get_text().strip())
+                                races = self._parse_number(cells[1])
+                                rate_1st = self._parse_float(cells[3])
+                                rate_2nd = self._parse_float(cells[4])
+                                avg_st = self._parse_float(cells[6])
 
                                 course_stats[course_no] = {
                                     'races': races,
@@ -473,38 +491,34 @@ class BoatraceDBScraper:
 
         return racer_data
 
-    def _parse_venue_stats(self, soup, racer_data):
+    def _parse_venue_stats(self, page, racer_data):
         """場別成績を抽出（Table 7）"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             venue_stats = {}
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # 場別成績テーブルを特定（テーブル7）
                 # ヘッダー: 場、出場節数、出走数、1着数、勝率、1着率、2連対率、3連対率、優出、優勝、平均ST
                 if ('場' in headers and '出場節数' in headers and '優出' in headers and '平均ST' in headers):
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 11:
-                            venue_name = cells[0].get_text().strip()
+                            venue_name = cells[0]
                             try:
-                                nodes = self._parse_number(cells[1].get_text().strip())  # 出場節数
-                                races = self._parse_number(cells[2].get_text().strip())
-                                wins = self._parse_number(cells[3].get_text().strip())
-                                win_rate = self._parse_float(cells[4].get_text().strip())
-                                rate_1st = self._parse_float(cells[5].get_text().strip())
-                                rate_2nd = self._parse_float(cells[6].get_text().strip())
-                                rate_3rd = self._parse_float(cells[7].get_text().strip())
-                                yusyutsu = self._parse_number(cells[8].get_text().strip())
-                                yusho = self._parse_number(cells[9].get_text().strip())
-                                avg_st = self._parse_float(cells[10].get_text().strip())
+                                nodes = self._parse_number(cells[1])  # 出場節数
+                                races = self._parse_number(cells[2])
+                                wins = self._parse_number(cells[3])
+                                win_rate = self._parse_float(cells[4])
+                                rate_1st = self._parse_float(cells[5])
+                                rate_2nd = self._parse_float(cells[6])
+                                rate_3rd = self._parse_float(cells[7])
+                                yusyutsu = self._parse_number(cells[8])
+                                yusho = self._parse_number(cells[9])
+                                avg_st = self._parse_float(cells[10])
 
                                 venue_stats[venue_name] = {
                                     'nodes': nodes,
@@ -529,6 +543,72 @@ class BoatraceDBScraper:
 
         return racer_data
 
+    RACER_STATS_COLUMNS = (
+        'racer_number', 'registration_period', 'branch',
+        'total_races', 'total_wins', 'overall_win_rate',
+        'overall_1st_rate', 'overall_2nd_rate', 'overall_3rd_rate',
+        'total_優出', 'total_優勝', 'avg_start_timing',
+        'grade_stats', 'boat_number_stats', 'course_stats', 'venue_stats',
+        'sg_appearances', 'flying_count', 'late_start_count'
+    )
+
+    RACER_STATS_UPSERT = """
+        INSERT INTO racer_detailed_stats (
+            racer_number, registration_period, branch,
+            total_races, total_wins, overall_win_rate,
+            overall_1st_rate, overall_2nd_rate, overall_3rd_rate,
+            total_優出, total_優勝, avg_start_timing,
+            grade_stats, boat_number_stats, course_stats, venue_stats,
+            sg_appearances, flying_count, late_start_count
+        )
+        VALUES %s
+        ON CONFLICT (racer_number) DO UPDATE SET
+            registration_period = EXCLUDED.registration_period,
+            branch = EXCLUDED.branch,
+            total_races = EXCLUDED.total_races,
+            total_wins = EXCLUDED.total_wins,
+            overall_win_rate = EXCLUDED.overall_win_rate,
+            overall_1st_rate = EXCLUDED.overall_1st_rate,
+            overall_2nd_rate = EXCLUDED.overall_2nd_rate,
+            overall_3rd_rate = EXCLUDED.overall_3rd_rate,
+            total_優出 = EXCLUDED.total_優出,
+            total_優勝 = EXCLUDED.total_優勝,
+            avg_start_timing = EXCLUDED.avg_start_timing,
+            grade_stats = EXCLUDED.grade_stats,
+            boat_number_stats = EXCLUDED.boat_number_stats,
+            course_stats = EXCLUDED.course_stats,
+            venue_stats = EXCLUDED.venue_stats,
+            sg_appearances = EXCLUDED.sg_appearances,
+            flying_count = EXCLUDED.flying_count,
+            late_start_count = EXCLUDED.late_start_count,
+            updated_at = NOW()
+    """
+
+    @staticmethod
+    def _racer_stats_row(racer_data):
+        """racer_detailed_stats の1行分の値"""
+        return (
+            racer_data['racer_number'],
+            racer_data.get('registration_period'),
+            racer_data.get('branch'),
+            racer_data.get('total_races', 0),
+            racer_data.get('total_wins', 0),
+            racer_data.get('overall_win_rate', 0.0),
+            racer_data.get('overall_1st_rate', 0.0),
+            racer_data.get('overall_2nd_rate', 0.0),
+            racer_data.get('overall_3rd_rate', 0.0),
+            racer_data.get('total_優出', 0),
+            racer_data.get('total_優勝', 0),
+            racer_data.get('avg_start_timing', 0.0),
+            json.dumps(racer_data.get('grade_stats', {})),
+            json.dumps(racer_data.get('boat_number_stats', {})),
+            json.dumps(racer_data.get('course_stats', {})),
+            json.dumps(racer_data.get('venue_stats', {})),
+            racer_data.get('sg_appearances', 0),
+            racer_data.get('flying_count', 0),
+            racer_data.get('late_start_count', 0)
+        )
+
     def save_racer_stats(self, racer_data):
         """
         選手詳細統計をデータベースに保存
@@ -539,82 +619,122 @@ class BoatraceDBScraper:
         Returns:
             bool: 成功時True
         """
+        return self.save_racer_stats_many([racer_data]) == 1
+
+    def save_racer_stats_many(self, racer_data_list, validators=None):
+        """
+        複数選手の詳細統計を1トランザクションで保存
+
+        Args:
+            racer_data_list: 選手詳細データのリスト
+            validators: {選手番号: (ETag, Last-Modified)} 条件付きリクエスト用に保存する値
+
+        Returns:
+            int: 保存した選手数（失敗時は0）
+        """
+        if not racer_data_list:
+            return 0
+
+        # 同じ選手が複数含まれると ON CONFLICT が失敗するため最後の値を使う
+        rows = {data['racer_number']: self._racer_stats_row(data) for data in racer_data_list}
+
         cursor = self.db_conn.cursor()
 
         try:
-            cursor.execute("""
-                INSERT INTO racer_detailed_stats (
-                    racer_number, registration_period, branch,
-                    total_races, total_wins, overall_win_rate,
-                    overall_1st_rate, overall_2nd_rate, overall_3rd_rate,
-                    total_優出, total_優勝, avg_start_timing,
-                    grade_stats, boat_number_stats, course_stats, venue_stats,
-                    sg_appearances, flying_count, late_start_count
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (racer_number) DO UPDATE SET
-                    registration_period = EXCLUDED.registration_period,
-                    branch = EXCLUDED.branch,
-                    total_races = EXCLUDED.total_races,
-                    total_wins = EXCLUDED.total_wins,
-                    overall_win_rate = EXCLUDED.overall_win_rate,
-                    overall_1st_rate = EXCLUDED.overall_1st_rate,
-                    overall_2nd_rate = EXCLUDED.overall_2nd_rate,
-                    overall_3rd_rate = EXCLUDED.overall_3rd_rate,
-                    total_優出 = EXCLUDED.total_優出,
-                    total_優勝 = EXCLUDED.total_優勝,
-                    avg_start_timing = EXCLUDED.avg_start_timing,
-                    grade_stats = EXCLUDED.grade_stats,
-                    boat_number_stats = EXCLUDED.boat_number_stats,
-                    course_stats = EXCLUDED.course_stats,
-                    venue_stats = EXCLUDED.venue_stats,
-                    sg_appearances = EXCLUDED.sg_appearances,
-                    flying_count = EXCLUDED.flying_count,
-                    late_start_count = EXCLUDED.late_start_count,
-                    updated_at = NOW()
-            """, (
-                racer_data['racer_number'],
-                racer_data.get('registration_period'),
-                racer_data.get('branch'),
-                racer_data.get('total_races', 0),
-                racer_data.get('total_wins', 0),
-                racer_data.get('overall_win_rate', 0.0),
-                racer_data.get('overall_1st_rate', 0.0),
-                racer_data.get('overall_2nd_rate', 0.0),
-                racer_data.get('overall_3rd_rate', 0.0),
-                racer_data.get('total_優出', 0),
-                racer_data.get('total_優勝', 0),
-                racer_data.get('avg_start_timing', 0.0),
-                json.dumps(racer_data.get('grade_stats', {})),
-                json.dumps(racer_data.get('boat_number_stats', {})),
-                json.dumps(racer_data.get('course_stats', {})),
-                json.dumps(racer_data.get('venue_stats', {})),
-                racer_data.get('sg_appearances', 0),
-                racer_data.get('flying_count', 0),
-                racer_data.get('late_start_count', 0)
-            ))
+            execute_values(cursor, self.RACER_STATS_UPSERT, list(rows.values()), page_size=500)
+
+            if validators:
+                execute_values(cursor, """
+                    UPDATE racer_detailed_stats AS s
+                    SET http_etag = v.etag, http_last_modified = v.last_modified
+                    FROM (VALUES %s) AS v (racer_number, etag, last_modified)
+                    WHERE s.racer_number = v.racer_number
+                """, [
+                    (racer_number, etag, last_modified)
+                    for racer_number, (etag, last_modified) in validators.items()
+                    if racer_number in rows
+                ], template='(%s::int, %s::text, %s::text)', page_size=500)
 
             self.db_conn.commit()
-            return True
+            return len(rows)
 
         except Exception as e:
             self.db_conn.rollback()
             print(f"Database error: {e}")
-            return False
+            return 0
+
+    def has_http_validator_columns(self):
+        """条件付きリクエスト用の列（migrations/add_racer_http_validators.sql）があるか"""
+        cursor = self.db_conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_name = 'racer_detailed_stats'
+              AND column_name IN ('http_etag', 'http_last_modified')
+        """)
+        count = cursor.fetchone()[0]
+        cursor.close()
+        return count == 2
 
-    def collect_all_racer_stats(self, limit=None, racer_ids=None):
+    def get_http_validators(self, racers):
         """
-        登録済み選手の詳細統計を収集
+        保存済みの ETag / Last-Modified を取得
+
+        Returns:
+            dict: {選手番号: (ETag, Last-Modified)}
+        """
+        cursor = self.db_conn.cursor()
+        cursor.execute("""
+            SELECT racer_number, http_etag, http_last_modified
+            FROM racer_detailed_stats
+            WHERE racer_number = ANY(%s)
+              AND (http_etag IS NOT NULL OR http_last_modified IS NOT NULL)
+        """, (list(racers),))
+        validators = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        cursor.close()
+        return validators
+
+    def get_recently_raced(self, since):
+        """
+        指定日以降に出走した選手番号を取得（racers に登録済みの選手のみ）
+
+        Args:
+            since: date/datetime
+
+        Returns:
+            list: 選手番号のリスト
+        """
+        cursor = self.db_conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT re.racer_id
+            FROM race_entries re
+            JOIN races r ON r.id = re.race_id
+            JOIN racers rc ON rc.racer_number = re.racer_id
+            WHERE r.race_date >= %s
+            ORDER BY re.racer_id
+        """, (since,))
+        racers = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        print(f"Found {len(racers)} racers who raced since {since}")
+        return racers
+
+    def select_racers(self, limit=None, racer_ids=None, changed_since=None):
+        """
+        収集対象の選手番号を決める
 
         Args:
             limit: 収集する選手数の上限（Noneの場合は全選手）
             racer_ids: 収集する選手番号のリスト（Noneの場合はDBから取得）
+            changed_since: この日以降に出走した選手だけを対象にする（date、Noneの場合は全選手）
         """
         # 特定の選手IDが指定されている場合
         if racer_ids:
             racers = racer_ids
             print(f"\n=== Starting racer stats collection (specific IDs) ===")
             print(f"Racer IDs: {racer_ids}")
+        elif changed_since:
+            # 成績が変わるのは出走した選手だけ
+            racers = self.get_recently_raced(changed_since)
+            print(f"\n=== Starting racer stats collection (raced since {changed_since}) ===")
         else:
             racers = self.get_registered_racers()
             print(f"\n=== Starting racer stats collection ===")
@@ -626,9 +746,43 @@ class BoatraceDBScraper:
             print(f"Limiting to first {limit} racers")
 
         print(f"Total racers to collect: {len(racers)}\n")
+        return racers
+
+    def flush_racer_stats(self, racer_data_list, validators=None):
+        """
+        まとめて保存し、失敗した場合は1件ずつ保存し直す（不正な1件で全件を失わないため）
+
+        Returns:
+            int: 保存した選手数
+        """
+        saved = self.save_racer_stats_many(racer_data_list, validators)
+        if saved or len(racer_data_list) <= 1:
+            return saved
+
+        print(f"  Batch of {len(racer_data_list)} failed, retrying one by one")
+        saved = 0
+        for racer_data in racer_data_list:
+            racer_validators = None
+            if validators and racer_data['racer_number'] in validators:
+                racer_validators = {racer_data['racer_number']: validators[racer_data['racer_number']]}
+            saved += self.save_racer_stats_many([racer_data], racer_validators)
+        return saved
+
+    def collect_all_racer_stats(self, limit=None, racer_ids=None, changed_since=None, batch_size=50):
+        """
+        登録済み選手の詳細統計を収集
+
+        Args:
+            limit: 収集する選手数の上限（Noneの場合は全選手）
+            racer_ids: 収集する選手番号のリスト（Noneの場合はDBから取得）
+            changed_since: この日以降に出走した選手だけを対象にする（date、Noneの場合は全選手）
+            batch_size: まとめてDBに書き込む選手数
+        """
+        racers = self.select_racers(limit, racer_ids, changed_since)
 
         success_count = 0
         failed_count = 0
+        batch = []
 
         for i, racer_number in enumerate(racers, 1):
             print(f"[{i}/{len(racers)}] Processing racer {racer_number}")
@@ -636,13 +790,16 @@ class BoatraceDBScraper:
             racer_data = self.fetch_racer_detail(racer_number)
 
             if racer_data:
-                if self.save_racer_stats(racer_data):
-                    success_count += 1
-                else:
-                    failed_count += 1
+                batch.append(racer_data)
             else:
                 failed_count += 1
 
+            if len(batch) >= batch_size or (batch and i == len(racers)):
+                saved = self.flush_racer_stats(batch)
+                success_count += saved
+                failed_count += len(batch) - saved
+                batch = []
+
         print(f"\n=== Collection Complete ===")
         print(f"Success: {success_count}")
         print(f"Failed: {failed_count}")
@@ -713,30 +870,11 @@ class BoatraceDBScraper:
                 print(f"  Failed to fetch venue {venue_id}")
                 return None
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # データ抽出
-            venue_data = {
-                'venue_id': venue_id,
-                'venue_name': venue_name,
-                'course_stats': {},
-                'motor_stats': [],
-                'boat_stats': [],
-                'exhibition_time_stats': {},
-                'winning_number_stats': {}
-            }
-
-            # コース別成績を抽出
-            venue_data = self._parse_venue_course_stats(soup, venue_data)
-
-            # モーター成績を抽出
-            venue_data = self._parse_venue_motor_stats(soup, venue_data)
+            if self.archive is not None:
+                self.archive.put(url, response.content, source='boatrace_db',
+                                 meta={'page': 'venue', 'venue_id': venue_id, 'venue_name': venue_name})
 
-            # ボート成績を抽出
-            venue_data = self._parse_venue_boat_stats(soup, venue_data)
-
-            # 展示タイム順位別成績を抽出
-            venue_data = self._parse_venue_exhibition_stats(soup, venue_data)
+            venue_data = self.parse_venue_page(response.content, venue_id, venue_name)
 
             print(f"  Success: {len(venue_data.get('motor_stats', []))} motors, {len(venue_data.get('boat_stats', []))} boats")
 
@@ -749,37 +887,73 @@ class BoatraceDBScraper:
             traceback.print_exc()
             return None
 
-    def _parse_venue_course_stats(self, soup, venue_data):
+    def parse_venue_page(self, content, venue_id, venue_name, parser_backend=None):
+        """
+        会場詳細ページのHTMLから会場詳細データを抽出
+
+        Args:
+            content: ページのHTML
+            venue_id: 会場ID (1-24)
+            venue_name: 会場名
+            parser_backend: HTMLパーサー（Noneの場合はインスタンスの設定）
+
+        Returns:
+            dict: 会場詳細データ
+        """
+        page = parse_page(content, parser_backend or self.parser_backend)
+
+        # データ抽出
+        venue_data = {
+            'venue_id': venue_id,
+            'venue_name': venue_name,
+            'course_stats': {},
+            'motor_stats': [],
+            'boat_stats': [],
+            'exhibition_time_stats': {},
+            'winning_number_stats': {}
+        }
+
+        # コース別成績を抽出
+        venue_data = self._parse_venue_course_stats(page, venue_data)
+
+        # モーター成績を抽出
+        venue_data = self._parse_venue_motor_stats(page, venue_data)
+
+        # ボート成績を抽出
+        venue_data = self._parse_venue_boat_stats(page, venue_data)
+
+        # 展示タイム順位別成績を抽出
+        venue_data = self._parse_venue_exhibition_stats(page, venue_data)
+
+        return venue_data
+
+    def _parse_venue_course_stats(self, page, venue_data):
         """会場のコース別成績を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             course_stats = {}
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # コース別成績テーブルを検出（決まり手含む）
                 if 'コース' in headers and '1着率' in headers and '逃げ' in headers:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 8:
-                            course_no = cells[0].get_text().strip()
+                            course_no = cells[0]
                             try:
-                                rate_1st = self._parse_float(cells[1].get_text().strip())
-                                rate_2nd = self._parse_float(cells[2].get_text().strip())
+                                rate_1st = self._parse_float(cells[1])
+                                rate_2nd = self._parse_float(cells[2])
 
                                 # 決まり手を抽出（%形式）
                                 kimarite = {
-                                    '逃げ': self._parse_float(cells[3].get_text().strip()),
-                                    '差し': self._parse_float(cells[4].get_text().strip()),
-                                    'まくり': self._parse_float(cells[5].get_text().strip()),
-                                    'まくり差し': self._parse_float(cells[6].get_text().strip()),
-                                    '抜き': self._parse_float(cells[7].get_text().strip())
+                                    '逃げ': self._parse_float(cells[3]),
+                                    '差し': self._parse_float(cells[4]),
+                                    'まくり': self._parse_float(cells[5]),
+                                    'まくり差し': self._parse_float(cells[6]),
+                                    '抜き': self._parse_float(cells[7])
                                 }
 
                                 course_stats[course_no] = {
@@ -798,31 +972,27 @@ class BoatraceDBScraper:
 
         return venue_data
 
-    def _parse_venue_motor_stats(self, soup, venue_data):
+    def _parse_venue_motor_stats(self, page, venue_data):
         """会場のモーター成績を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             motor_stats = []
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # モーター成績テーブルを検出
                 if 'モーター' in headers and '2連率' in headers and '出走数' in headers:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 5:
                             try:
-                                motor_no = self._parse_number(cells[0].get_text().strip())
-                                races = self._parse_number(cells[1].get_text().strip())
-                                win_rate = self._parse_float(cells[2].get_text().strip())
-                                rate_1st = self._parse_float(cells[3].get_text().strip())
-                                rate_2nd = self._parse_float(cells[4].get_text().strip())
+                                motor_no = self._parse_number(cells[0])
+                                races = self._parse_number(cells[1])
+                                win_rate = self._parse_float(cells[2])
+                                rate_1st = self._parse_float(cells[3])
+                                rate_2nd = self._parse_float(cells[4])
 
                                 if motor_no > 0:  # 有効なモーター番号のみ
                                     motor_stats.append({
@@ -843,31 +1013,27 @@ class BoatraceDBScraper:
 
         return venue_data
 
-    def _parse_venue_boat_stats(self, soup, venue_data):
+    def _parse_venue_boat_stats(self, page, venue_data):
         """会場のボート成績を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             boat_stats = []
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # ボート成績テーブルを検出
                 if 'ボート' in headers and '2連率' in headers and '出走数' in headers:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 5:
                             try:
-                                boat_no = self._parse_number(cells[0].get_text().strip())
-                                races = self._parse_number(cells[1].get_text().strip())
-                                win_rate = self._parse_float(cells[2].get_text().strip())
-                                rate_1st = self._parse_float(cells[3].get_text().strip())
-                                rate_2nd = self._parse_float(cells[4].get_text().strip())
+                                boat_no = self._parse_number(cells[0])
+                                races = self._parse_number(cells[1])
+                                win_rate = self._parse_float(cells[2])
+                                rate_1st = self._parse_float(cells[3])
+                                rate_2nd = self._parse_float(cells[4])
 
                                 if boat_no > 0:  # 有効なボート番号のみ
                                     boat_stats.append({
@@ -888,29 +1054,25 @@ class BoatraceDBScraper:
 
         return venue_data
 
-    def _parse_venue_exhibition_stats(self, soup, venue_data):
+    def _parse_venue_exhibition_stats(self, page, venue_data):
         """会場の展示タイム順位別成績を抽出"""
         try:
-            tables = soup.find_all('table')
+            tables = page.tables
             exhibition_stats = {}
 
             for table in tables:
-                headers = []
-                header_row = table.find('tr')
-                if header_row:
-                    headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+                headers = table.headers
 
                 # 展示タイム順位別成績テーブルを検出
                 if '展示' in ''.join(headers) and '順位' in ''.join(headers) and '1着率' in headers:
-                    rows = table.find_all('tr')[1:]
+                    rows = table.rows[1:]
 
-                    for row in rows:
-                        cells = row.find_all(['td', 'th'])
+                    for cells in rows:
                         if len(cells) >= 3:
                             try:
-                                rank = cells[0].get_text().strip()
-                                races = self._parse_number(cells[1].get_text().strip())
-                                rate_1st = self._parse_float(cells[2].get_text().strip())
+                                rank = cells[0]
+                                races = self._parse_number(cells[1])
+                                rate_1st = self._parse_float(cells[2])
 
                                 exhibition_stats[rank] = {
                                     'races': races,
@@ -981,9 +1143,44 @@ def main():
     parser.add_argument('--racer-ids', type=str, default=None,
                         help='Comma-separated racer IDs to collect (e.g., "4001,4002,4003")')
 
+    # HTMLアーカイブ
+    parser.add_argument('--archive-dir', type=str, default=None,
+                        help='Directory to archive fetched HTML (see html_archive.py)')
+    parser.add_argument('--reparse', action='store_true',
+                        help='Rebuild rows from --archive-dir without network access')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Parser processes for --reparse (default: CPU count) / --async (default: 2)')
+    parser.add_argument('--parser', type=str, default=DEFAULT_BACKEND, choices=PARSER_BACKENDS,
+                        help=f'HTML parser backend (default: {DEFAULT_BACKEND})')
+
+    # 選手データの収集方法
+    parser.add_argument('--changed-since', type=str, default=None,
+                        help='Only collect racers who raced on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='Racers per DB write batch (default: 50)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Collect racer pages concurrently with conditional requests')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Concurrent requests in async mode (default: 4)')
+    parser.add_argument('--no-conditional', dest='conditional', action='store_false',
+                        help='Async mode: ignore stored ETag/Last-Modified and fetch every page')
+    add_metrics_argument(parser)
+
     args = parser.parse_args()
+    enable_profiling(args)
+
+    if args.reparse:
+        if not args.archive_dir:
+            print("Error: --reparse requires --archive-dir")
+            return
+
+        from reparse_archive import reparse_boatrace_db
+        pages = {'racers': ['racer'], 'venues': ['venue'], 'all': ['racer', 'venue']}[args.mode]
+        reparse_boatrace_db(args.archive_dir, pages=pages, workers=args.workers, parser_backend=args.parser)
+        return
 
-    scraper = BoatraceDBScraper(delay=args.delay)
+    archive = HtmlArchive(args.archive_dir) if args.archive_dir else None
+    scraper = BoatraceDBScraper(delay=args.delay, archive=archive, parser_backend=args.parser)
 
     try:
         # 特定の選手IDが指定されている場合
@@ -991,16 +1188,35 @@ def main():
         if args.racer_ids:
             racer_ids = [int(x.strip()) for x in args.racer_ids.split(',')]
 
-        if args.mode == 'racers':
-            scraper.collect_all_racer_stats(limit=args.limit, racer_ids=racer_ids)
-        elif args.mode == 'venues':
-            scraper.collect_venue_stats(limit=args.venue_limit)
-        elif args.mode == 'all':
-            scraper.collect_all_racer_stats(limit=args.limit, racer_ids=racer_ids)
-            scraper.collect_venue_stats(limit=args.venue_limit)
+        changed_since = datetime.strptime(args.changed_since, '%Y-%m-%d').date() if args.changed_since else None
+
+        if args.mode in ('racers', 'all'):
+            with span('racers'):
+                if args.use_async:
+                    from racer_profile_crawler import crawl_racer_profiles
+                    racers = scraper.select_racers(limit=args.limit, racer_ids=racer_ids, changed_since=changed_since)
+                    asyncio.run(crawl_racer_profiles(
+                        scraper, racers, delay=args.delay, concurrency=args.concurrency,
+                        batch_size=args.batch_size, parse_workers=args.workers or 2, conditional=args.conditional
+                    ))
+                else:
+                    scraper.collect_all_racer_stats(limit=args.limit, racer_ids=racer_ids,
+                                                    changed_since=changed_since, batch_size=args.batch_size)
+
+            # 選手の詳細統計が変わったため、当日以降のレースの出走表を作り直す
+            with span('race_cards') as s:
+                s.rows = try_refresh_race_cards(scraper.db_conn, since=datetime.now().date())
+
+        if args.mode in ('venues', 'all'):
+            with span('venues'):
+                scraper.collect_venue_stats(limit=args.venue_limit)
 
     finally:
         scraper.close()
+        if archive is not None:
+            archive.close()
+        print_summary()
+        write_metrics(args.metrics_out, job='boatrace_db_scraper')
 
 
 if __name__ == '__main__':
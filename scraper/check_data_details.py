@@ -2,19 +2,15 @@
 """
 データベースの詳細なデータ状況を確認するスクリプト
 """
-import os
-import psycopg2
-from dotenv import load_dotenv
+from db import connect
 from datetime import datetime
 
 # .envファイルから環境変数を読み込む
-load_dotenv()
-
 def check_data_details():
     """データベースの詳細情報を確認"""
 
     # データベース接続
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cur = conn.cursor()
 
     print("=" * 80)
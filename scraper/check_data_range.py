@@ -2,16 +2,12 @@
 """
 データベース内のレースデータ範囲を確認
 """
-import os
-from dotenv import load_dotenv
-import psycopg2
-
-load_dotenv()
+from db import connect
 
 
 def check_data_range():
     """データ範囲を確認"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     try:
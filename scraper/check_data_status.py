@@ -6,13 +6,9 @@
 - データの充足度
 - 推奨される次のアクション
 """
-import os
-from dotenv import load_dotenv
-import psycopg2
+from db import connect
 from datetime import datetime, timedelta
 
-load_dotenv()
-
 
 def check_database_status():
     """データベースの状態を確認"""
@@ -21,7 +17,7 @@ def check_database_status():
     print("=" * 80)
     print()
 
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     # 1. レース基本情報
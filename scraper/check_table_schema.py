@@ -2,15 +2,11 @@
 """
 racesテーブルのスキーマを確認するスクリプト
 """
-import os
-import psycopg2
-from dotenv import load_dotenv
-
-load_dotenv()
+from db import connect
 
 def check_schema():
     """テーブルスキーマを確認"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cur = conn.cursor()
 
     print("=" * 80)
@@ -6,18 +6,48 @@ Supabaseデータ容量管理スクリプト
 - 90%（450MB）を超えた場合、4年以上前のレースデータを削除
 - 削除対象: races, race_entries のみ
 - 削除しない: backtest_results, predictions, racer_*, venue_*, weather_data など
+
+削除は古い月から順に、月内を batch_size レースずつ別トランザクションで行う
+（バッチ間で --sleep 秒待機し、ロックとWALの急増を避ける）
+途中で止まっても、削除済みのバッチはコミット済みのため再実行すると続きから削除する
+
+削除前に各バッチを Parquet（zstd圧縮）で保存し、Supabase Storage（--archive-bucket）に
+アップロードしてから削除する（archive_storage.py）。アップロードとサイズの確認が済まないバッチは削除しない
+--archive-bucket を指定しない場合は削除を行わない（--dry-run / --status のみ）
+  <archive-dir>/races/year_month=YYYY-MM/part-<最小ID>-<最大ID>.parquet
+  <archive-dir>/race_entries/year_month=YYYY-MM/part-<最小ID>-<最大ID>.parquet
+  （バケット内も races/..., race_entries/... の同じ構成）
+ファイル名はバッチのレースIDで決まるため、中断後の再実行でも重複しない
+列の型はテーブル定義（information_schema）から決めるため、どのバッチのファイルも同じスキーマになる
+読み込みは load_archive() を使用（要 pyarrow、bucket を指定すると手元にないファイルを先に取得する）
 """
 
 import os
 import sys
+import json
+import time
 import argparse
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
-import psycopg2
+from db import connect
+from archive_storage import ArchiveStorage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 load_dotenv()
 
+# 1トランザクションで削除するレース数と、バッチ間の待機秒数
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_SLEEP = 1.0
+
+DEFAULT_ARCHIVE_DIR = 'data/retention_archive'
+
 
 def setup_logging():
     """ロギングを設定"""
@@ -85,57 +115,301 @@ def get_old_race_entries_count(conn, cutoff_date):
     return count
 
 
-def delete_old_data(conn, cutoff_date, dry_run=False, logger=None):
+def get_old_months(conn, cutoff_date):
+    """
+    削除対象のレースを月ごとに集計
+
+    Returns:
+        list: [(月初日 date, レース数)]（古い順）
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT date_trunc('month', race_date)::date AS month, COUNT(*)
+        FROM races
+        WHERE race_date < %s
+        GROUP BY month
+        ORDER BY month
+    """, (cutoff_date,))
+    months = cursor.fetchall()
+    cursor.close()
+    return months
+
+
+def next_month(month_start):
+    """翌月の月初日"""
+    if month_start.month == 12:
+        return date(month_start.year + 1, 1, 1)
+    return date(month_start.year, month_start.month + 1, 1)
+
+
+def _arrow_type(data_type, precision, scale):
+    """
+    PostgreSQL の列の型に対応する Arrow の型と、値の変換関数（不要な場合は None）
+
+    データの中身によらず列の型で決めるため、全件 NULL のバッチでも他のファイルと同じ型になる
+    """
+    if data_type == 'smallint':
+        return pa.int16(), None
+    if data_type == 'integer':
+        return pa.int32(), None
+    if data_type == 'bigint':
+        return pa.int64(), None
+    if data_type == 'real':
+        return pa.float32(), None
+    if data_type == 'double precision':
+        return pa.float64(), None
+    if data_type == 'numeric':
+        if precision is not None:
+            return pa.decimal128(precision, scale or 0), None
+        # 精度指定のない NUMERIC は桁数が決まらないため float64 にする
+        return pa.float64(), float
+    if data_type == 'boolean':
+        return pa.bool_(), None
+    if data_type == 'date':
+        return pa.date32(), None
+    if data_type == 'timestamp without time zone':
+        return pa.timestamp('us'), None
+    if data_type == 'timestamp with time zone':
+        return pa.timestamp('us', tz='UTC'), None
+    if data_type in ('json', 'jsonb'):
+        return pa.string(), lambda value: json.dumps(value, ensure_ascii=False)
+    if data_type in ('character varying', 'character', 'text'):
+        return pa.string(), None
+    return pa.string(), str
+
+
+def get_archive_schema(conn, table):
+    """
+    テーブルの列から Parquet のスキーマを作成（バッチ間で同じスキーマにする）
+
+    Returns:
+        tuple: (pa.Schema, 列ごとの変換関数のリスト)
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT column_name, data_type, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+        ORDER BY ordinal_position
+    """, (table,))
+    columns = cursor.fetchall()
+    cursor.close()
+
+    fields = []
+    converters = []
+    for name, data_type, precision, scale in columns:
+        arrow_type, converter = _arrow_type(data_type, precision, scale)
+        fields.append(pa.field(name, arrow_type))
+        converters.append(converter)
+
+    return pa.schema(fields), converters
+
+
+def _write_parquet(cursor, table, schema, converters, condition, params, path):
+    """
+    テーブルの行を Parquet で保存（一時ファイルに書いてから置き換える）
+
+    列は schema の順に読み、どのバッチも同じスキーマで書く
+    """
+    columns = ', '.join(f'"{name}"' for name in schema.names)
+    cursor.execute(f"SELECT {columns} FROM {table} WHERE {condition}", params)
+    rows = cursor.fetchall()
+
+    arrays = []
+    for i, (field, converter) in enumerate(zip(schema, converters)):
+        values = [row[i] for row in rows]
+        if converter is not None:
+            values = [None if value is None else converter(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+
+    table = pa.Table.from_arrays(arrays, schema=schema)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+    return len(rows)
+
+
+def archive_batch(conn, archive_dir, month_start, race_ids, storage=None):
+    """
+    削除するバッチの races / race_entries を Parquet で保存し、storage にアップロード
+
+    アップロードに失敗した場合は例外を送出する（呼び出し側はそのバッチを削除しない）
+
+    Returns:
+        tuple: (保存したレース数, 保存したrace_entries数)
+    """
+    partition = f"year_month={month_start.strftime('%Y-%m')}"
+    filename = f"part-{min(race_ids)}-{max(race_ids)}.parquet"
+    races_path = f"races/{partition}/{filename}"
+    entries_path = f"race_entries/{partition}/{filename}"
+
+    cursor = conn.cursor()
+    try:
+        races = _write_parquet(
+            cursor, 'races', *get_archive_schema(conn, 'races'),
+            "id = ANY(%s) ORDER BY id",
+            (race_ids,),
+            os.path.join(archive_dir, *races_path.split('/'))
+        )
+        entries = _write_parquet(
+            cursor, 'race_entries', *get_archive_schema(conn, 'race_entries'),
+            "race_id = ANY(%s) ORDER BY race_id, boat_number",
+            (race_ids,),
+            os.path.join(archive_dir, *entries_path.split('/'))
+        )
+    finally:
+        cursor.close()
+
+    if storage is not None:
+        for object_path in (races_path, entries_path):
+            storage.upload(os.path.join(archive_dir, *object_path.split('/')), object_path)
+
+    return races, entries
+
+
+def load_archive(archive_dir, table='race_entries', bucket=None):
+    """
+    アーカイブした Parquet を読み込む
+
+    Args:
+        archive_dir: --archive-dir に指定したディレクトリ
+        table: 'races' または 'race_entries'
+        bucket: Storage のバケット名（指定した場合は手元にないファイルを先にダウンロード）
+
+    Returns:
+        pandas.DataFrame（year_month 列付き）
+
+    後から列を追加した場合など、ファイルごとに列が異なる場合は列をそろえて読む（ない列は NULL）
     """
-    4年以上前のレースデータを削除
+    import pyarrow.dataset as ds
 
-    削除順序:
-    1. race_entries（外部キー制約のため先に削除）
-    2. races
+    if bucket:
+        ArchiveStorage(bucket).download_all(archive_dir, prefix=table)
+
+    path = os.path.join(archive_dir, table)
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    schema = pa.unify_schemas(
+        [pq.read_schema(file) for file in dataset.files] + [dataset.partitioning.schema]
+    )
+    dataset = ds.dataset(path, schema=schema, format='parquet', partitioning='hive')
+    return dataset.to_table().to_pandas()
+
+
+def delete_old_data(conn, cutoff_date, dry_run=False, logger=None, batch_size=DEFAULT_BATCH_SIZE,
+                    sleep_seconds=DEFAULT_SLEEP, archive_dir=DEFAULT_ARCHIVE_DIR, storage=None,
+                    time_limit=None):
+    """
+    基準日より前のレースデータを月ごとにバッチ削除
+
+    削除順序（バッチごとに1トランザクション）:
+    1. races / race_entries を Parquet で保存し、storage にアップロード
+    2. race_entries（外部キー制約のため先に削除）
+    3. races
+
+    Args:
+        conn: psycopg2接続
+        cutoff_date: この日付より前のレースを削除
+        dry_run: Trueの場合は件数の確認のみ
+        batch_size: 1トランザクションで削除するレース数
+        sleep_seconds: バッチ間の待機秒数
+        archive_dir: 削除前に Parquet を保存するディレクトリ
+        storage: アップロード先の ArchiveStorage（dry_run 以外では必須）
+        time_limit: 削除を打ち切る経過秒数（Noneの場合は制限なし、再実行で続きから削除）
+
+    Returns:
+        tuple: (削除したレース数, 削除したrace_entries数)
     """
     if logger is None:
         logger = logging.getLogger(__name__)
 
+    # 保存先のないまま削除すると履歴が失われるため、アップロード先がなければ削除しない
+    if not dry_run and storage is None:
+        raise ValueError("storage is required to delete races (the archive must be uploaded first)")
+
     cursor = conn.cursor()
 
     try:
-        # 削除対象のrace_idを取得
-        cursor.execute("""
-            SELECT id FROM races WHERE race_date < %s
-        """, (cutoff_date,))
-        old_race_ids = [row[0] for row in cursor.fetchall()]
+        months = get_old_months(conn, cutoff_date)
 
-        if not old_race_ids:
+        if not months:
             logger.info("削除対象のレースはありません")
             return 0, 0
 
-        logger.info(f"削除対象レース数: {len(old_race_ids)}")
+        total_races = sum(count for _, count in months)
+        logger.info(f"削除対象レース数: {total_races}（{len(months)}か月: "
+                    f"{months[0][0].strftime('%Y-%m')} ～ {months[-1][0].strftime('%Y-%m')}）")
 
         if dry_run:
             logger.info("[DRY RUN] 実際の削除は行いません")
             # race_entriesの数を推定
             cursor.execute("""
-                SELECT COUNT(*) FROM race_entries WHERE race_id = ANY(%s)
-            """, (old_race_ids,))
+                SELECT COUNT(*) FROM race_entries re
+                JOIN races r ON re.race_id = r.id
+                WHERE r.race_date < %s
+            """, (cutoff_date,))
             entries_count = cursor.fetchone()[0]
-            return len(old_race_ids), entries_count
+            return total_races, entries_count
+
+        cutoff_day = cutoff_date.date() if isinstance(cutoff_date, datetime) else cutoff_date
+        start_time = time.monotonic()
+        deleted_races = 0
+        deleted_entries = 0
+        archived_races = 0
+        archived_entries = 0
+
+        for month_start, month_count in months:
+            month_end = min(next_month(month_start), cutoff_day)
+            month_deleted = 0
+
+            while True:
+                if time_limit is not None and time.monotonic() - start_time > time_limit:
+                    logger.info(f"時間制限（{time_limit:.0f}秒）に達したため中断します（再実行で続きから削除）")
+                    return deleted_races, deleted_entries
+
+                cursor.execute("""
+                    SELECT id FROM races
+                    WHERE race_date >= %s AND race_date < %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (month_start, month_end, batch_size))
+                race_ids = [row[0] for row in cursor.fetchall()]
+
+                if not race_ids:
+                    break
+
+                races, entries = archive_batch(conn, archive_dir, month_start, race_ids, storage=storage)
+                archived_races += races
+                archived_entries += entries
+
+                # 1. race_entriesを削除
+                cursor.execute("""
+                    DELETE FROM race_entries WHERE race_id = ANY(%s)
+                """, (race_ids,))
+                deleted_entries += cursor.rowcount
+
+                # 2. racesを削除
+                cursor.execute("""
+                    DELETE FROM races WHERE id = ANY(%s)
+                """, (race_ids,))
+                deleted_races += cursor.rowcount
+                month_deleted += cursor.rowcount
+
+                conn.commit()
+
+                if len(race_ids) == batch_size and sleep_seconds > 0:
+                    time.sleep(sleep_seconds)
+
+            logger.info(f"  {month_start.strftime('%Y-%m')}: {month_deleted}/{month_count}レース削除 "
+                        f"（累計 races: {deleted_races}, race_entries: {deleted_entries}）")
 
-        # 1. race_entriesを削除
-        cursor.execute("""
-            DELETE FROM race_entries WHERE race_id = ANY(%s)
-        """, (old_race_ids,))
-        deleted_entries = cursor.rowcount
-        logger.info(f"削除されたrace_entries: {deleted_entries}")
-
-        # 2. racesを削除
-        cursor.execute("""
-            DELETE FROM races WHERE id = ANY(%s)
-        """, (old_race_ids,))
-        deleted_races = cursor.rowcount
         logger.info(f"削除されたraces: {deleted_races}")
-
-        conn.commit()
-        logger.info("削除完了（コミット済み）")
+        logger.info(f"削除されたrace_entries: {deleted_entries}")
+        logger.info(f"アーカイブ: races {archived_races}件, race_entries {archived_entries}件 "
+                    f"-> {archive_dir}, storage://{storage.bucket}")
+        logger.info("削除完了（バッチごとにコミット済み）")
 
         return deleted_races, deleted_entries
 
@@ -144,6 +418,9 @@ def delete_old_data(conn, cutoff_date, dry_run=False, logger=None):
         logger.error(f"削除中にエラーが発生: {e}")
         raise
 
+    finally:
+        cursor.close()
+
 
 def vacuum_database(conn, logger=None):
     """VACUUMを実行してストレージを解放"""
@@ -179,11 +456,37 @@ def main():
                         help='閾値に関係なく強制的に古いデータを削除')
     parser.add_argument('--status', action='store_true',
                         help='容量状況のみを表示（削除なし）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'1トランザクションで削除するレース数 デフォルト: {DEFAULT_BATCH_SIZE}')
+    parser.add_argument('--sleep', type=float, default=DEFAULT_SLEEP,
+                        help=f'バッチ間の待機秒数 デフォルト: {DEFAULT_SLEEP}')
+    parser.add_argument('--archive-dir', type=str, default=DEFAULT_ARCHIVE_DIR,
+                        help=f'削除前にParquetを書き出すディレクトリ デフォルト: {DEFAULT_ARCHIVE_DIR}')
+    parser.add_argument('--archive-bucket', type=str, default=None,
+                        help='削除前にParquetをアップロードするSupabase Storageのバケット'
+                             '（削除には必須、要 pyarrow・SUPABASE_URL・SUPABASE_SERVICE_ROLE_KEY）')
+    parser.add_argument('--time-limit-minutes', type=float, default=None,
+                        help='この時間で削除を打ち切る（再実行で続きから削除）')
 
     args = parser.parse_args()
 
     logger = setup_logging()
 
+    # 削除するデータは Storage に保存できる場合だけ削除する
+    storage = None
+    if not args.status and not args.dry_run:
+        if not args.archive_bucket:
+            logger.error("削除には --archive-bucket が必要です（アーカイブを保存できないため削除しません）")
+            sys.exit(1)
+        if not HAS_PYARROW:
+            logger.error("アーカイブには pyarrow が必要です（pip install pyarrow）")
+            sys.exit(1)
+        try:
+            storage = ArchiveStorage(args.archive_bucket)
+        except RuntimeError as e:
+            logger.error(f"アーカイブの保存先を設定できません: {e}")
+            sys.exit(1)
+
     # データベース接続
     database_url = os.getenv('DATABASE_URL')
     if not database_url:
@@ -191,7 +494,7 @@ def main():
         sys.exit(1)
 
     try:
-        conn = psycopg2.connect(database_url)
+        conn = connect()
         logger.info("データベース接続成功")
     except Exception as e:
         logger.error(f"データベース接続失敗: {e}")
@@ -253,7 +556,12 @@ def main():
             logger.info("削除対象のデータがありません")
         else:
             deleted_races, deleted_entries = delete_old_data(
-                conn, cutoff_date, dry_run=args.dry_run, logger=logger
+                conn, cutoff_date, dry_run=args.dry_run, logger=logger,
+                batch_size=args.batch_size,
+                sleep_seconds=args.sleep,
+                archive_dir=args.archive_dir,
+                storage=storage,
+                time_limit=args.time_limit_minutes * 60 if args.time_limit_minutes else None
             )
 
             if not args.dry_run and (deleted_races > 0 or deleted_entries > 0):
@@ -13,19 +13,19 @@ from datetime import datetime, timedelta
 import os
 import sys
 from dotenv import load_dotenv
-import psycopg2
 
 # スクレイパーディレクトリをパスに追加
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from boatrace_scraper import BoatRaceScraper
+from db import connect
 
 load_dotenv()
 
 
 def get_existing_races(start_date, end_date):
     """データベースから既存レースのリストを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     cursor.execute("""
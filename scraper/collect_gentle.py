@@ -15,9 +15,9 @@ import logging
 from datetime import datetime, timedelta
 from boatrace_scraper import BoatRaceScraper
 from rate_limiter import RateLimiter
+from db import connect
 import os
 from dotenv import load_dotenv
-import psycopg2
 
 try:
     from tqdm import tqdm
@@ -44,7 +44,7 @@ def setup_logging(log_file='scraper.log'):
 
 def get_existing_races(start_date, end_date):
     """データベースから既存レースのリストを取得"""
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     cursor.execute("""
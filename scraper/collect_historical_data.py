@@ -11,16 +11,116 @@ kyotei.funから過去データを一括収集するスクリプト
   --races: 1会場あたりのレース数（1-12、デフォルト: 12）
   --delay: リクエスト間隔（秒、デフォルト: 1.0）
   --max-retries: 最大再試行回数（デフォルト: 3）
+  --batch-size: まとめてDBに書き込むレース数（デフォルト: 50）
+  --flush-interval: バッファを書き込む最大間隔（秒、デフォルト: 60）
+  --async: 取得・パース・DB書き込みを並行実行する非同期パイプラインを使用
+  --concurrency: 非同期モードの同時リクエスト数（デフォルト: 2）
+  --archive-dir: 取得したHTMLを保存するディレクトリ（html_archive.py）
+  --reparse: ネットワークにアクセスせず --archive-dir のHTMLから再パースしてDBを更新
+  --parser: HTMLパーサー（bs4 / lxml、デフォルト: bs4）
+  --crawl-state: クロール状態ファイル（crawl_state.py）。取得済み・開催なしの枠を再リクエストしない
+  --no-schedule: 開催日程（race_schedule.py）を使わず全会場×全レースを取得
+  --metrics-out: 処理時間（取得・パース・DB書き込み）の保存先（ml/instrumentation.py）
+  --profile: 指定したステージ（collect / fetch / parse / db_write）だけプロファイル（ml/profiling.py）
+             非同期モードではパースが別プロセスのため collect のみ
 """
 
 import argparse
+import asyncio
 from datetime import datetime, timedelta
+import os
 import time
 import sys
+from db import connect
 from kyotei24_scraper import Kyotei24Scraper
+from html_archive import HtmlArchive
+from page_parser import DEFAULT_BACKEND, PARSER_BACKENDS
+from crawl_state import CrawlState, STATUS_DONE, STATUS_NO_RACE, STATUS_FAILED
+from race_schedule import load_schedule
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, max_retries=3, start_venue=1, end_venue=None):
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
+
+
+def build_targets(start_date, end_date, start_venue=1, end_venue=24, max_races=12, schedule=None):
+    """
+    収集対象 (datetime, venue_id, race_number) のリストを作成（日付→会場→レース番号順）
+
+    Args:
+        schedule: race_schedule.load_schedule() の結果
+                  指定した場合は開催している会場・レースだけを対象にする（日程不明の日は全会場）
+    """
+    targets = []
+    for day in range((end_date - start_date).days + 1):
+        current_date = start_date + timedelta(days=day)
+        venues = schedule.get(current_date.date()) if schedule else None
+
+        for venue_id in range(start_venue, end_venue + 1):
+            if venues is None:
+                race_count = max_races
+            elif venue_id in venues:
+                race_count = min(venues[venue_id], max_races)
+            else:
+                continue
+
+            for race_number in range(1, race_count + 1):
+                targets.append((current_date, venue_id, race_number))
+
+    return targets
+
+
+def get_completed_races(start_date, end_date):
+    """
+    結果まで保存済みのレースを取得
+
+    出走表だけ保存されたレース（結果未取得）は含めない
+    （Kyotei24Scraper.results_final と同じく、1艇でも着順があれば結果まで保存済み）
+
+    Returns:
+        list: (race_date, venue_id, race_number) のリスト
+    """
+    conn = connect()
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        SELECT r.race_date, r.venue_id, r.race_number
+        FROM races r
+        WHERE r.race_date BETWEEN %s AND %s
+          AND EXISTS (
+              SELECT 1 FROM race_entries re
+              WHERE re.race_id = r.id AND re.result_position IS NOT NULL
+          )
+    """, (start_date.date(), end_date.date()))
+    rows = cursor.fetchall()
+
+    cursor.close()
+    conn.close()
+
+    return rows
+
+
+def open_crawl_state(path, start_date, end_date):
+    """
+    クロール状態を開き、DBで結果まで保存済みのレースを done として記録
+
+    初回実行時や状態ファイルが失われた場合でも、保存済みのレースは再取得しない
+    """
+    crawl_state = CrawlState(path)
+    completed = get_completed_races(start_date, end_date)
+    crawl_state.mark_many(completed, STATUS_DONE)
+
+    summary = crawl_state.summary(start_date, end_date)
+    print(f"Crawl state: {path} "
+          f"(done: {summary.get(STATUS_DONE, 0)}, no race: {summary.get(STATUS_NO_RACE, 0)}, "
+          f"failed: {summary.get(STATUS_FAILED, 0)})")
+
+    return crawl_state
+
+
+def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, max_retries=3, start_venue=1, end_venue=None,
+                 batch_size=50, flush_interval=60.0, use_async=False, concurrency=2, parse_workers=2,
+                 archive_dir=None, parser_backend=DEFAULT_BACKEND, crawl_state_path=None, use_schedule=True):
     """
     指定期間のデータを収集
 
@@ -33,9 +133,19 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
         max_retries: 最大再試行回数
         start_venue: 開始会場番号（1-24、デフォルト: 1）
         end_venue: 終了会場番号（1-24、デフォルト: max_venues）
+        batch_size: まとめてDBに書き込むレース数
+        flush_interval: バッファを書き込む最大間隔（秒）
+        use_async: 非同期パイプライン（async_collector）を使用
+        concurrency: 非同期モードの同時リクエスト数
+        parse_workers: 非同期モードのパース用プロセス数
+        archive_dir: 取得したHTMLを保存するディレクトリ（Noneの場合は保存しない）
+        parser_backend: HTMLパーサー（'bs4' / 'lxml'）
+        crawl_state_path: クロール状態ファイル（Noneの場合は使用しない）
+        use_schedule: 開催日程を取得し、開催している会場・レースだけを取得
+
+    Returns:
+        dict: 収集結果の件数
     """
-    scraper = Kyotei24Scraper()
-
     # end_venueが指定されていない場合はmax_venuesを使用
     if end_venue is None:
         end_venue = max_venues
@@ -48,17 +158,43 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
 
     venue_count = end_venue - start_venue + 1
 
+    if use_async:
+        return collect_data_async(
+            start_date, end_date, max_races=max_races, delay=delay, max_retries=max_retries,
+            start_venue=start_venue, end_venue=end_venue, batch_size=batch_size,
+            flush_interval=flush_interval, concurrency=concurrency, parse_workers=parse_workers,
+            archive_dir=archive_dir, parser_backend=parser_backend, crawl_state_path=crawl_state_path,
+            use_schedule=use_schedule
+        )
+
+    crawl_state = open_crawl_state(crawl_state_path, start_date, end_date) if crawl_state_path else None
+    archive = HtmlArchive(archive_dir) if archive_dir else None
+
+    # 開催している枠のうち、クロール状態で未取得のものだけをリクエストする
+    schedule = load_schedule(start_date, end_date, crawl_state, max_races, archive) if use_schedule else None
+    targets = build_targets(start_date, end_date, start_venue, end_venue, max_races, schedule)
+    scheduled_count = len(targets)
+    if crawl_state is not None:
+        targets = crawl_state.pending(targets)
+    pending = {(t[0].date(), t[1], t[2]) for t in targets}
+
+    scraper = Kyotei24Scraper(batch_size=batch_size, flush_interval=flush_interval, archive=archive,
+                              parser_backend=parser_backend, crawl_state=crawl_state)
+
     # 統計情報
     stats = {
         'total_races': 0,
         'successful': 0,
         'failed': 0,
-        'skipped': 0
+        'skipped': 0,
+        'not_held': 0,
+        'known': scheduled_count - len(pending)
     }
 
     # 日付範囲を計算
     current_date = start_date
     total_days = (end_date - start_date).days + 1
+    stats['not_held'] = total_days * venue_count * max_races - scheduled_count
 
     print(f"=== Historical Data Collection Started ===")
     print(f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
@@ -66,7 +202,14 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
     print(f"Venues: {start_venue}-{end_venue} ({venue_count} venues)")
     print(f"Races per venue: 1-{max_races}")
     print(f"Request delay: {delay}s")
+    print(f"DB write batch: {batch_size} races / {flush_interval}s")
+    if archive_dir:
+        print(f"HTML archive: {archive_dir}")
     print(f"Estimated total races: {total_days * venue_count * max_races}")
+    if schedule is not None:
+        print(f"Scheduled races: {scheduled_count}")
+    if crawl_state is not None:
+        print(f"Pending (not in crawl state): {len(pending)}")
     print()
 
     try:
@@ -84,6 +227,10 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
                 venue_success = 0
 
                 for race_number in range(1, max_races + 1):
+                    # 開催のない枠・取得済みの枠はリクエストしない
+                    if (current_date.date(), venue_id, race_number) not in pending:
+                        continue
+
                     stats['total_races'] += 1
 
                     # 再試行ロジック
@@ -94,22 +241,37 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
                             race_data = scraper.fetch_race_data(current_date, venue_id, race_number)
 
                             if race_data and race_data.get('entries'):
-                                # データベースに保存
-                                if scraper.save_to_db(race_data):
-                                    stats['successful'] += 1
-                                    venue_success += 1
-                                    success = True
-                                    break
-                                else:
-                                    # 保存失敗
-                                    stats['failed'] += 1
-                                    break
-                            else:
+                                # 書き込みバッファに追加（batch_sizeごとにまとめて保存）
+                                # 保存失敗分は最後に write_stats から差し引く
+                                scraper.buffer_race(race_data)
+                                stats['successful'] += 1
+                                venue_success += 1
+                                success = True
+                                break
+
+                            status = scraper.last_fetch_status
+                            parse_error = scraper.last_parse_error
+                            if status == 404 or (status == 200 and parse_error is None):
                                 # データが存在しない（レース未開催など）
+                                # パースに失敗したページは開催なしにせず、失敗として再試行する
                                 stats['skipped'] += 1
+                                if crawl_state is not None:
+                                    crawl_state.mark(current_date, venue_id, race_number, STATUS_NO_RACE, status)
                                 success = True
                                 break
 
+                            # 通信エラー・サーバーエラー・パース失敗は再試行
+                            reason = f"status: {status}" + (f", parse error: {parse_error}" if parse_error else "")
+                            if attempt < max_retries - 1:
+                                print(f"  Venue {venue_id:2d} Race {race_number:2d}: Retry {attempt + 1}/{max_retries} ({reason})")
+                                time.sleep(delay * 2)
+                            else:
+                                print(f"  Venue {venue_id:2d} Race {race_number:2d}: Failed after {max_retries} attempts ({reason})")
+                                stats['failed'] += 1
+                                day_failed += 1
+                                if crawl_state is not None:
+                                    crawl_state.mark(current_date, venue_id, race_number, STATUS_FAILED, status)
+
                         except Exception as e:
                             if attempt < max_retries - 1:
                                 print(f"  Venue {venue_id:2d} Race {race_number:2d}: Retry {attempt + 1}/{max_retries} - {e}")
@@ -117,6 +279,9 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
                             else:
                                 print(f"  Venue {venue_id:2d} Race {race_number:2d}: Failed after {max_retries} attempts - {e}")
                                 stats['failed'] += 1
+                                day_failed += 1
+                                if crawl_state is not None:
+                                    crawl_state.mark(current_date, venue_id, race_number, STATUS_FAILED)
                                 break
 
                     # レート制限
@@ -125,11 +290,12 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
 
                 if venue_success > 0:
                     day_success += venue_success
-                    print(f"  Venue {venue_id:2d}: {venue_success} races saved")
+                    print(f"  Venue {venue_id:2d}: {venue_success} races collected")
 
             # 日次サマリー
             print(f"  Day summary: {day_success} successful, {day_failed} failed")
-            print(f"  Total progress: {stats['successful']}/{stats['total_races']} races ({stats['successful']*100/stats['total_races']:.1f}%)")
+            if stats['total_races'] > 0:
+                print(f"  Total progress: {stats['successful']}/{stats['total_races']} races ({stats['successful']*100/stats['total_races']:.1f}%)")
             print()
 
             # 次の日へ
@@ -139,6 +305,14 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
         print("\n\n=== Collection Interrupted by User ===")
     finally:
         scraper.close()
+        if archive is not None:
+            archive.close()
+        if crawl_state is not None:
+            crawl_state.close()
+
+        # バッファ書き込みで失敗したレースを反映
+        stats['successful'] -= scraper.write_stats['failed_races']
+        stats['failed'] += scraper.write_stats['failed_races']
 
         # 最終統計
         print("\n=== Collection Completed ===")
@@ -146,8 +320,91 @@ def collect_data(start_date, end_date, max_venues=24, max_races=12, delay=1.0, m
         print(f"Successfully saved: {stats['successful']}")
         print(f"Failed: {stats['failed']}")
         print(f"Skipped (no data): {stats['skipped']}")
+        if schedule is not None:
+            print(f"Skipped (not scheduled): {stats['not_held']}")
+        if crawl_state is not None:
+            print(f"Skipped (crawl state): {stats['known']}")
         if stats['total_races'] > 0:
             print(f"Success rate: {stats['successful']*100/stats['total_races']:.1f}%")
+        write_stats = scraper.write_stats
+        if write_stats['flushes'] > 0:
+            print(f"DB writes: {write_stats['races']} races / {write_stats['entries']} entries "
+                  f"in {write_stats['flushes']} flushes ({write_stats['seconds']:.1f}s)")
+
+    return stats
+
+
+def collect_data_async(start_date, end_date, max_races=12, delay=1.0, max_retries=3, start_venue=1, end_venue=24,
+                       batch_size=50, flush_interval=60.0, concurrency=2, parse_workers=2, archive_dir=None,
+                       parser_backend=DEFAULT_BACKEND, crawl_state_path=None, use_schedule=True):
+    """
+    指定期間のデータを非同期パイプラインで収集
+
+    取得・パース・DB書き込みを並行実行する（全体のリクエスト頻度は delay で制限）
+    """
+    from async_collector import collect_races_async
+
+    total_days = (end_date - start_date).days + 1
+    all_count = total_days * (end_venue - start_venue + 1) * max_races
+
+    crawl_state = open_crawl_state(crawl_state_path, start_date, end_date) if crawl_state_path else None
+    archive = HtmlArchive(archive_dir) if archive_dir else None
+
+    schedule = load_schedule(start_date, end_date, crawl_state, max_races, archive) if use_schedule else None
+    targets = build_targets(start_date, end_date, start_venue, end_venue, max_races, schedule)
+    scheduled_count = len(targets)
+    if crawl_state is not None:
+        targets = crawl_state.pending(targets)
+
+    print(f"=== Historical Data Collection Started (async) ===")
+    print(f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+    print(f"Total days: {total_days}")
+    print(f"Venues: {start_venue}-{end_venue} ({end_venue - start_venue + 1} venues)")
+    print(f"Races per venue: 1-{max_races}")
+    print(f"Request delay: {delay}s (concurrency: {concurrency}, parse workers: {parse_workers})")
+    print(f"DB write batch: {batch_size} races / {flush_interval}s")
+    if archive_dir:
+        print(f"HTML archive: {archive_dir}")
+    print(f"Estimated total races: {len(targets)}")
+    if schedule is not None:
+        print(f"Skipped (not scheduled): {all_count - scheduled_count}")
+    if crawl_state is not None:
+        print(f"Skipped (crawl state): {scheduled_count - len(targets)}")
+    print()
+
+    stats = {'total_races': len(targets), 'successful': 0, 'failed': 0, 'skipped': 0}
+    try:
+        stats = asyncio.run(collect_races_async(
+            targets,
+            delay=delay,
+            concurrency=concurrency,
+            max_retries=max_retries,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            parse_workers=parse_workers,
+            archive=archive,
+            parser_backend=parser_backend,
+            crawl_state=crawl_state
+        ))
+    except KeyboardInterrupt:
+        print("\n\n=== Collection Interrupted by User ===")
+    finally:
+        if archive is not None:
+            archive.close()
+        if crawl_state is not None:
+            crawl_state.close()
+
+        print("\n=== Collection Completed ===")
+        print(f"Total races attempted: {stats['total_races']}")
+        print(f"Successfully saved: {stats['successful']}")
+        print(f"Failed: {stats['failed']}")
+        print(f"Skipped (no data): {stats['skipped']}")
+        if stats['total_races'] > 0:
+            print(f"Success rate: {stats['successful']*100/stats['total_races']:.1f}%")
+        if stats.get('seconds'):
+            print(f"Elapsed: {stats['seconds']:.1f}s")
+
+    return stats
 
 
 def main():
@@ -164,8 +421,30 @@ def main():
                         help='Request delay in seconds (default: 1.0)')
     parser.add_argument('--max-retries', type=int, default=3,
                         help='Maximum retry attempts (default: 3)')
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='Races per DB write batch (default: 50)')
+    parser.add_argument('--flush-interval', type=float, default=60.0,
+                        help='Max seconds between DB writes (default: 60)')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Use the asyncio fetch/parse/write pipeline')
+    parser.add_argument('--concurrency', type=int, default=2,
+                        help='Concurrent requests in async mode (default: 2)')
+    parser.add_argument('--parse-workers', type=int, default=2,
+                        help='Parser processes in async mode / --reparse (default: 2)')
+    parser.add_argument('--archive-dir', type=str, default=None,
+                        help='Directory to archive fetched HTML (see html_archive.py)')
+    parser.add_argument('--reparse', action='store_true',
+                        help='Rebuild rows from --archive-dir without network access')
+    parser.add_argument('--parser', type=str, default=DEFAULT_BACKEND, choices=PARSER_BACKENDS,
+                        help=f'HTML parser backend (default: {DEFAULT_BACKEND})')
+    parser.add_argument('--crawl-state', type=str, default=None,
+                        help='SQLite crawl state file; skips races already saved or known to be empty')
+    parser.add_argument('--no-schedule', dest='use_schedule', action='store_false',
+                        help='Probe every venue and race instead of using the daily race schedule')
+    add_metrics_argument(parser)
 
     args = parser.parse_args()
+    enable_profiling(args)
 
     # 日付をパース
     if args.start_date == 'yesterday':
@@ -198,15 +477,47 @@ def main():
         print("Error: Races must be between 1 and 12")
         sys.exit(1)
 
+    if args.reparse:
+        if not args.archive_dir:
+            print("Error: --reparse requires --archive-dir")
+            sys.exit(1)
+
+        from reparse_archive import reparse_kyotei24
+        reparse_kyotei24(
+            args.archive_dir,
+            start_date=start_date,
+            end_date=end_date,
+            max_venues=args.venues,
+            max_races=args.races,
+            workers=args.parse_workers,
+            batch_size=args.batch_size,
+            parser_backend=args.parser
+        )
+        return
+
     # データ収集開始
-    collect_data(
-        start_date=start_date,
-        end_date=end_date,
-        max_venues=args.venues,
-        max_races=args.races,
-        delay=args.delay,
-        max_retries=args.max_retries
-    )
+    try:
+        with span('collect'):
+            collect_data(
+                start_date=start_date,
+                end_date=end_date,
+                max_venues=args.venues,
+                max_races=args.races,
+                delay=args.delay,
+                max_retries=args.max_retries,
+                batch_size=args.batch_size,
+                flush_interval=args.flush_interval,
+                use_async=args.use_async,
+                concurrency=args.concurrency,
+                parse_workers=args.parse_workers,
+                archive_dir=args.archive_dir,
+                parser_backend=args.parser,
+                crawl_state_path=args.crawl_state,
+                use_schedule=args.use_schedule
+            )
+    finally:
+        print_summary()
+        write_metrics(args.metrics_out, job='collect_historical_data')
 
 
 if __name__ == '__main__':
@@ -12,12 +12,23 @@
   python collect_monthly.py --year-month 2024-12  # 2024年12月分を収集
   python collect_monthly.py --year-month 2024-12 --start-venue 1 --end-venue 12  # 会場1-12のみ
   python collect_monthly.py --year-month 2024-12 --start-venue 13 --end-venue 24  # 会場13-24のみ
+  python collect_monthly.py --year-month 2024-12 --crawl-state crawl_state.sqlite  # 中断した月を再開
+  python collect_monthly.py --year-month 2024-12 --metrics-out metrics/collect.json --profile parse  # パースをプロファイル
 """
 
+import os
+import sys
 import argparse
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from collect_historical_data import collect_data
+from collect_historical_data import collect_data, build_targets
+from crawl_state import CrawlState
+from race_schedule import load_schedule
+from page_parser import DEFAULT_BACKEND, PARSER_BACKENDS
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.instrumentation import span, add_metrics_argument, enable_profiling, write_metrics, print_summary
 
 
 def get_month_date_range(year_month_str):
@@ -86,8 +97,59 @@ def main():
         default=3,
         help='Maximum retry attempts (default: 3)'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=50,
+        help='Races per DB write batch (default: 50)'
+    )
+    parser.add_argument(
+        '--flush-interval',
+        type=float,
+        default=60.0,
+        help='Max seconds between DB writes (default: 60)'
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='Use the asyncio fetch/parse/write pipeline'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=2,
+        help='Concurrent requests in async mode (default: 2)'
+    )
+    parser.add_argument(
+        '--archive-dir',
+        type=str,
+        default=None,
+        help='Store raw HTML responses in this archive directory'
+    )
+    parser.add_argument(
+        '--parser',
+        type=str,
+        default=DEFAULT_BACKEND,
+        choices=PARSER_BACKENDS,
+        help=f'HTML parser backend (default: {DEFAULT_BACKEND})'
+    )
+    parser.add_argument(
+        '--crawl-state',
+        type=str,
+        default=None,
+        help='SQLite crawl state file; resumes interrupted months and records job progress'
+    )
+    parser.add_argument(
+        '--no-schedule',
+        dest='use_schedule',
+        action='store_false',
+        help='Probe every venue and race instead of using the daily race schedule'
+    )
+    add_metrics_argument(parser)
 
     args = parser.parse_args()
+    enable_profiling(args)
 
     # end_venueが指定されていない場合はvenuesを使用
     end_venue = args.end_venue if args.end_venue is not None else args.venues
@@ -119,18 +181,50 @@ def main():
     print(f"Request delay: {args.delay}s")
     print()
 
+    # ジョブ開始を記録（中断された場合は get_next_backfill_month.py が同じ月を返す）
+    if args.crawl_state:
+        crawl_state = CrawlState(args.crawl_state)
+        crawl_state.start_job(args.year_month, start_venue, end_venue)
+        crawl_state.close()
+
     # データ収集実行
     try:
-        collect_data(
-            start_date=start_date,
-            end_date=end_date,
-            max_venues=end_venue,  # 後方互換性のため
-            max_races=args.races,
-            delay=args.delay,
-            max_retries=args.max_retries,
-            start_venue=start_venue,
-            end_venue=end_venue
-        )
+        with span('collect'):
+            collect_data(
+                start_date=start_date,
+                end_date=end_date,
+                max_venues=end_venue,  # 後方互換性のため
+                max_races=args.races,
+                delay=args.delay,
+                max_retries=args.max_retries,
+                start_venue=start_venue,
+                end_venue=end_venue,
+                batch_size=args.batch_size,
+                flush_interval=args.flush_interval,
+                use_async=args.use_async,
+                concurrency=args.concurrency,
+                archive_dir=args.archive_dir,
+                parser_backend=args.parser,
+                crawl_state_path=args.crawl_state,
+                use_schedule=args.use_schedule
+            )
+
+        # 全対象が取得済み・開催なし（または再試行上限）になった場合のみ完了とする
+        if args.crawl_state:
+            crawl_state = CrawlState(args.crawl_state)
+            try:
+                # 日程はクロール状態にキャッシュ済みのため、取得できなかった日以外は再リクエストしない
+                schedule = load_schedule(start_date, end_date, crawl_state, args.races) if args.use_schedule else None
+                targets = build_targets(start_date, end_date, start_venue, end_venue, args.races, schedule)
+                remaining = len(crawl_state.pending(targets))
+                if remaining == 0:
+                    crawl_state.finish_job(args.year_month, start_venue, end_venue)
+                    print(f"Job completed: {args.year_month} venues {start_venue}-{end_venue}")
+                else:
+                    print(f"Job incomplete: {remaining} races pending, will resume on next run")
+            finally:
+                crawl_state.close()
+
         return 0
     except KeyboardInterrupt:
         print("\n\nCollection interrupted by user")
@@ -140,6 +234,9 @@ def main():
         import traceback
         traceback.print_exc()
         return 1
+    finally:
+        print_summary()
+        write_metrics(args.metrics_out, job='collect_monthly')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,335 @@
+"""
+クロール状態の永続化（SQLite）
+
+収集対象（日付×会場×レース番号）ごとの結果を記録し、再実行時に
+取得済み・開催なしの枠を再リクエストしないようにする
+
+状態:
+  done:    確定した結果までDBに保存済み（書き込みバッファのフラッシュ成功時に記録）
+           欠場・失格などで着順のない艇があっても、結果ページが確定していれば done
+  no_race: 404 またはデータなし（開催なし）
+           直近 NO_RACE_RECHECK_DAYS 日以内の日付は、ページ公開前の可能性があるため retry_after 後に再確認
+  failed:  通信エラー・5xx・結果未確定など。retry_after まで再試行しない（試行ごとに待ち時間を倍増）
+           max_attempts 回失敗した枠は諦める
+
+月次バックフィルのジョブ（年月×会場範囲）の進捗も記録し、
+get_next_backfill_month.py が途中で止まった月から再開できるようにする
+
+race_schedule.py が取得した開催日程（日付ごとの開催会場・レース数）のキャッシュも保存する
+
+GitHub Actions では actions/cache でファイルを実行間に引き継ぐ
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crawl_state.sqlite')
+
+STATUS_DONE = 'done'
+STATUS_NO_RACE = 'no_race'
+STATUS_FAILED = 'failed'
+
+# この日数以内のレースがデータなしの場合は後で再確認する
+NO_RACE_RECHECK_DAYS = 2
+NO_RACE_RECHECK_INTERVAL = timedelta(hours=6)
+
+# 失敗時の再試行間隔（試行ごとに倍増、上限あり）
+FAILED_RETRY_BASE = timedelta(minutes=15)
+FAILED_RETRY_MAX = timedelta(hours=12)
+
+
+def _date_str(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _now_str(now=None):
+    return (now or datetime.now()).isoformat(timespec='seconds')
+
+
+class CrawlState:
+    """収集対象ごとの状態を記録するSQLiteストア"""
+
+    def __init__(self, path=DEFAULT_PATH, source='kyotei24', max_attempts=5):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            source: 取得元（同じファイルに複数の取得元を記録できる）
+            max_attempts: 失敗した枠を諦めるまでの試行回数
+        """
+        self.path = path
+        self.source = source
+        self.max_attempts = max_attempts
+
+        # 非同期収集ではスレッドから呼ばれることがあるためロックで保護
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_targets (
+                source TEXT NOT NULL,
+                race_date TEXT NOT NULL,
+                venue_id INTEGER NOT NULL,
+                race_number INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                http_status INTEGER,
+                retry_after TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (source, race_date, venue_id, race_number)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS crawl_jobs (
+                source TEXT NOT NULL,
+                year_month TEXT NOT NULL,
+                start_venue INTEGER NOT NULL,
+                end_venue INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                started_at TEXT NOT NULL,
+                finished_at TEXT,
+                PRIMARY KEY (source, year_month, start_venue, end_venue)
+            )
+        """)
+        # 開催日程（venues は "会場ID:レース数" のカンマ区切り、開催なしの日は空文字）
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS race_schedule (
+                race_date TEXT PRIMARY KEY,
+                venues TEXT NOT NULL,
+                fetched_at TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def pending(self, targets, now=None):
+        """
+        未取得の対象だけを返す
+
+        Args:
+            targets: (date/datetime, venue_id, race_number) のリスト
+            now: 基準時刻（Noneの場合は現在時刻）
+
+        Returns:
+            list: targets のうち取得が必要なもの（順序は維持）
+        """
+        if not targets:
+            return []
+
+        dates = sorted({_date_str(t[0]) for t in targets})
+        now_str = _now_str(now)
+
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT race_date, venue_id, race_number, status, attempts, retry_after
+                FROM crawl_targets
+                WHERE source = ? AND race_date BETWEEN ? AND ?
+            """, (self.source, dates[0], dates[-1])).fetchall()
+
+        resolved = set()
+        for race_date, venue_id, race_number, status, attempts, retry_after in rows:
+            if status == STATUS_DONE:
+                resolved.add((race_date, venue_id, race_number))
+            elif status == STATUS_FAILED and attempts >= self.max_attempts:
+                resolved.add((race_date, venue_id, race_number))
+            elif retry_after is None or retry_after > now_str:
+                resolved.add((race_date, venue_id, race_number))
+
+        return [t for t in targets if (_date_str(t[0]), t[1], t[2]) not in resolved]
+
+    def mark_many(self, keys, status, http_status=None, now=None):
+        """
+        複数の対象の状態を記録
+
+        Args:
+            keys: (date/datetime, venue_id, race_number) のリスト
+            status: STATUS_DONE / STATUS_NO_RACE / STATUS_FAILED
+            http_status: 最後のHTTPステータス
+            now: 記録時刻（Noneの場合は現在時刻）
+        """
+        if not keys:
+            return
+
+        now = now or datetime.now()
+        today = now.date()
+
+        with self._lock:
+            attempts = {}
+            if status == STATUS_FAILED:
+                for key in keys:
+                    row = self.conn.execute("""
+                        SELECT attempts FROM crawl_targets
+                        WHERE source = ? AND race_date = ? AND venue_id = ? AND race_number = ?
+                    """, (self.source, _date_str(key[0]), key[1], key[2])).fetchone()
+                    attempts[key] = (row[0] if row else 0) + 1
+
+            rows = []
+            for key in keys:
+                race_date = _date_str(key[0])
+                retry_after = None
+                key_attempts = attempts.get(key, 0)
+
+                if status == STATUS_FAILED:
+                    wait = min(FAILED_RETRY_BASE * (2 ** (key_attempts - 1)), FAILED_RETRY_MAX)
+                    retry_after = _now_str(now + wait)
+                elif status == STATUS_NO_RACE:
+                    if date.fromisoformat(race_date) >= today - timedelta(days=NO_RACE_RECHECK_DAYS):
+                        retry_after = _now_str(now + NO_RACE_RECHECK_INTERVAL)
+
+                rows.append((
+                    self.source, race_date, key[1], key[2], status, key_attempts,
+                    http_status, retry_after, _now_str(now)
+                ))
+
+            self.conn.executemany("""
+                INSERT INTO crawl_targets
+                (source, race_date, venue_id, race_number, status, attempts, http_status, retry_after, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source, race_date, venue_id, race_number) DO UPDATE SET
+                    status = excluded.status,
+                    attempts = excluded.attempts,
+                    http_status = excluded.http_status,
+                    retry_after = excluded.retry_after,
+                    updated_at = excluded.updated_at
+            """, rows)
+            self.conn.commit()
+
+    def mark(self, race_date, venue_id, race_number, status, http_status=None):
+        """1つの対象の状態を記録"""
+        self.mark_many([(race_date, venue_id, race_number)], status, http_status=http_status)
+
+    def summary(self, start_date=None, end_date=None):
+        """
+        状態ごとの件数を取得
+
+        Returns:
+            dict: {status: 件数}
+        """
+        conditions = ["source = ?"]
+        params = [self.source]
+        if start_date is not None:
+            conditions.append("race_date >= ?")
+            params.append(_date_str(start_date))
+        if end_date is not None:
+            conditions.append("race_date <= ?")
+            params.append(_date_str(end_date))
+
+        with self._lock:
+            rows = self.conn.execute(f"""
+                SELECT status, COUNT(*) FROM crawl_targets
+                WHERE {' AND '.join(conditions)}
+                GROUP BY status
+            """, params).fetchall()
+
+        return dict(rows)
+
+    def start_job(self, year_month, start_venue, end_venue):
+        """月次ジョブの開始を記録（完了済みのジョブは再実行中に戻す）"""
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO crawl_jobs (source, year_month, start_venue, end_venue, status, started_at)
+                VALUES (?, ?, ?, ?, 'running', ?)
+                ON CONFLICT (source, year_month, start_venue, end_venue) DO UPDATE SET
+                    status = 'running',
+                    finished_at = NULL
+            """, (self.source, year_month, start_venue, end_venue, _now_str()))
+            self.conn.commit()
+
+    def finish_job(self, year_month, start_venue, end_venue):
+        """月次ジョブの完了を記録"""
+        with self._lock:
+            self.conn.execute("""
+                UPDATE crawl_jobs SET status = 'completed', finished_at = ?
+                WHERE source = ? AND year_month = ? AND start_venue = ? AND end_venue = ?
+            """, (_now_str(), self.source, year_month, start_venue, end_venue))
+            self.conn.commit()
+
+    def next_incomplete_month(self, start_venue, end_venue):
+        """
+        この会場範囲で未完了の月を取得
+
+        いずれかの会場範囲でジョブが記録された月のうち、この会場範囲のジョブが
+        未完了（未開始・中断）の最も新しい月を返す
+
+        Returns:
+            str: YYYY-MM 形式の月、該当なしの場合はNone
+        """
+        with self._lock:
+            months = [row[0] for row in self.conn.execute("""
+                SELECT DISTINCT year_month FROM crawl_jobs
+                WHERE source = ?
+                ORDER BY year_month DESC
+            """, (self.source,)).fetchall()]
+
+            completed = {row[0] for row in self.conn.execute("""
+                SELECT year_month FROM crawl_jobs
+                WHERE source = ? AND start_venue = ? AND end_venue = ? AND status = 'completed'
+            """, (self.source, start_venue, end_venue)).fetchall()}
+
+        for year_month in months:
+            if year_month not in completed:
+                return year_month
+        return None
+
+    def get_schedule(self, dates):
+        """
+        キャッシュ済みの開催日程を取得
+
+        Args:
+            dates: date/datetime のリスト
+
+        Returns:
+            dict: {日付文字列(YYYY-MM-DD): ({会場ID: レース数}, 取得時刻 datetime)}
+                  キャッシュにない日付は含まない
+        """
+        if not dates:
+            return {}
+
+        date_strs = sorted({_date_str(d) for d in dates})
+
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT race_date, venues, fetched_at FROM race_schedule
+                WHERE race_date BETWEEN ? AND ?
+            """, (date_strs[0], date_strs[-1])).fetchall()
+
+        wanted = set(date_strs)
+        schedule = {}
+        for race_date, venues, fetched_at in rows:
+            if race_date not in wanted:
+                continue
+            counts = {}
+            for item in filter(None, venues.split(',')):
+                venue_id, race_count = item.split(':')
+                counts[int(venue_id)] = int(race_count)
+            schedule[race_date] = (counts, datetime.fromisoformat(fetched_at))
+
+        return schedule
+
+    def save_schedule(self, race_date, venues, now=None):
+        """
+        開催日程を保存
+
+        Args:
+            race_date: date/datetime
+            venues: {会場ID: レース数}
+        """
+        value = ','.join(f"{venue_id}:{race_count}" for venue_id, race_count in sorted(venues.items()))
+
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO race_schedule (race_date, venues, fetched_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (race_date) DO UPDATE SET
+                    venues = excluded.venues,
+                    fetched_at = excluded.fetched_at
+            """, (_date_str(race_date), value, _now_str(now)))
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,499 @@
+"""
+PostgreSQL 接続の共通モジュール（接続プール・クエリ計測）
+
+- 接続: プロセス内で共有する ThreadedConnectionPool から取得する
+  connect() が返す接続は close() でプールに戻る（psycopg2.connect と同じ書き方で使える）
+  - しばらく使われていなかった接続は取得時に SELECT 1 で確認し、切れていれば張り直す
+  - 新規接続に失敗した場合は間隔を空けて再試行する
+  - ホスト名を IPv4 アドレスに解決して接続する（GitHub Actions から Supabase へ IPv6 で繋がらない対策、
+    resolve_ipv4.py と同じ処理。TLS の検証にはホスト名を使う）
+  - TCP keepalive を有効にし、アイドル中の切断を早く検出する
+  長時間保持する接続（スクレイパーの db_conn など）は、エラー時に reconnect() で取り直せる
+- 計測: 文ごとの実行回数・時間・行数と、接続取得の待ち時間（新規接続の有無）を記録する
+- 遅いクエリ: DB_SLOW_QUERY_SECONDS 以上かかった文を記録し、
+  DB_EXPLAIN_SLOW=1 の場合は SELECT に限り EXPLAIN (ANALYZE, BUFFERS) の結果も残す
+  （ANALYZE はクエリをもう一度実行するため、調査時だけ有効にする）
+
+環境変数:
+  DATABASE_URL           接続先
+  DB_POOL_MAX            プールの最大接続数（既定: 5）
+  DB_POOL_TIMEOUT        全接続が使用中の場合に空きを待つ秒数（既定: 30）
+  DB_CONNECT_RETRIES     新規接続の試行回数（既定: 3）
+  DB_FORCE_IPV4          0 の場合、IPv4 への解決を行わない
+  DB_SLOW_QUERY_SECONDS  遅いクエリとみなす秒数（既定: 1.0）
+  DB_EXPLAIN_SLOW        1 の場合、遅い SELECT の実行計画を記録
+  DB_TRACE               1 の場合、終了時に集計を表示
+
+使用方法:
+    from db import connect, connection          # scraper/ のスクリプト
+    from scraper.db import connect, connection  # ml/ のスクリプト
+
+    conn = connect()
+    cursor = conn.cursor()
+    ...
+    conn.close()              # プールに戻す（未コミットの変更はロールバック）
+
+    with connection() as conn:
+        df = pd.read_sql_query(query, conn)
+
+    print_query_stats()       # 時間のかかった文の一覧
+"""
+import os
+import re
+import time
+import atexit
+import socket
+import ipaddress
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_POOL_MAX = 5
+DEFAULT_POOL_TIMEOUT = 30.0
+DEFAULT_CONNECT_RETRIES = 3
+DEFAULT_SLOW_QUERY_SECONDS = 1.0
+
+# これ以上使われていなかった接続は、取得時に SELECT 1 で生きているか確認する
+HEALTH_CHECK_IDLE_SECONDS = 30.0
+
+# 接続オプション（DATABASE_URL で指定されている場合はそちらを優先）
+CONNECT_OPTIONS = {
+    'connect_timeout': 10,
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 5,
+}
+
+# 記録する遅いクエリの上限（実行時間の長い順に残す）
+MAX_SLOW_QUERIES = 20
+
+# 集計キーにする文の最大長
+STATEMENT_KEY_LENGTH = 300
+
+_WHITESPACE_RE = re.compile(r'\s+')
+# execute_values の VALUES (...), (...) は値ごとに文が変わるため畳む
+_VALUES_RE = re.compile(r'\bVALUES\s*\(', re.IGNORECASE)
+_VALUES_END_RE = re.compile(r'\s(ON CONFLICT|RETURNING)\b', re.IGNORECASE)
+_EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_MODIFYING_RE = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def normalize_statement(query):
+    """集計用に文を正規化（空白を詰め、VALUES の値を省略）"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    query = _WHITESPACE_RE.sub(' ', str(query)).strip()
+
+    values = _VALUES_RE.search(query)
+    if values:
+        end = _VALUES_END_RE.search(query, values.end())
+        query = query[:values.start()] + 'VALUES (...)' + (query[end.start():] if end else '')
+
+    return query[:STATEMENT_KEY_LENGTH]
+
+
+class QueryTracer:
+    """文ごとの実行時間・行数と接続取得の待ち時間を集計"""
+
+    def __init__(self):
+        self.slow_query_seconds = _env_float('DB_SLOW_QUERY_SECONDS', DEFAULT_SLOW_QUERY_SECONDS)
+        self.explain_slow = os.getenv('DB_EXPLAIN_SLOW') == '1'
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.slow_queries = []
+            self.acquire = {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'new_connections': 0,
+                            'reconnects': 0, 'connect_failures': 0}
+
+    def record_statement(self, statement, seconds, rows, error=False):
+        with self._lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = {
+                    'statement': statement, 'calls': 0, 'total_seconds': 0.0,
+                    'max_seconds': 0.0, 'rows': 0, 'errors': 0,
+                }
+            stats['calls'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if rows is not None and rows >= 0:
+                stats['rows'] += rows
+            if error:
+                stats['errors'] += 1
+
+    def record_slow_query(self, statement, seconds, rows, plan=None):
+        with self._lock:
+            self.slow_queries.append({
+                'statement': statement, 'seconds': round(seconds, 4), 'rows': rows, 'plan': plan,
+            })
+            self.slow_queries.sort(key=lambda q: q['seconds'], reverse=True)
+            del self.slow_queries[MAX_SLOW_QUERIES:]
+
+    def record_acquire(self, seconds):
+        with self._lock:
+            self.acquire['count'] += 1
+            self.acquire['total_seconds'] += seconds
+            self.acquire['max_seconds'] = max(self.acquire['max_seconds'], seconds)
+
+    def record_new_connection(self):
+        with self._lock:
+            self.acquire['new_connections'] += 1
+
+    def record_reconnect(self):
+        with self._lock:
+            self.acquire['reconnects'] += 1
+
+    def record_connect_failure(self):
+        with self._lock:
+            self.acquire['connect_failures'] += 1
+
+    def to_dict(self, top=20):
+        """集計結果（合計時間の長い順に top 件）"""
+        with self._lock:
+            statements = sorted(self.statements.values(), key=lambda s: s['total_seconds'], reverse=True)
+            return {
+                'acquire': {
+                    **self.acquire,
+                    'total_seconds': round(self.acquire['total_seconds'], 4),
+                    'max_seconds': round(self.acquire['max_seconds'], 4),
+                },
+                'statements': [
+                    {**s, 'total_seconds': round(s['total_seconds'], 4), 'max_seconds': round(s['max_seconds'], 4)}
+                    for s in statements[:top]
+                ],
+                'slow_queries': list(self.slow_queries),
+            }
+
+
+_tracer = QueryTracer()
+
+
+class TracedCursor(psycopg2.extensions.cursor):
+    """execute / executemany の時間と行数を記録するカーソル"""
+
+    def execute(self, query, vars=None):
+        return self._traced(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._traced(super().executemany, query, vars_list, explain=False)
+
+    def _traced(self, method, query, vars, explain=True):
+        start = time.perf_counter()
+        error = False
+        try:
+            return method(query, vars)
+        except Exception:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            statement = normalize_statement(query.as_string(self) if hasattr(query, 'as_string') else query)
+            _tracer.record_statement(statement, seconds, self.rowcount, error)
+
+            if not error and seconds >= _tracer.slow_query_seconds:
+                plan = self._explain(query, vars) if explain and _tracer.explain_slow else None
+                _tracer.record_slow_query(statement, seconds, self.rowcount, plan)
+
+    def _explain(self, query, vars):
+        """EXPLAIN (ANALYZE, BUFFERS) の結果（SELECT 以外、または失敗した場合は None）"""
+        if hasattr(query, 'as_string'):
+            query = query.as_string(self)
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', errors='replace')
+        if not _EXPLAINABLE_RE.match(query) or _MODIFYING_RE.search(query):
+            return None
+
+        # トランザクション中に失敗しても呼び出し側のトランザクションを壊さないようにセーブポイントを使う
+        in_transaction = not self.connection.autocommit
+        with self.connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            try:
+                if in_transaction:
+                    cursor.execute('SAVEPOINT db_explain')
+                cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + query, vars)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                if in_transaction:
+                    cursor.execute('RELEASE SAVEPOINT db_explain')
+                return plan
+            except psycopg2.Error as e:
+                if in_transaction:
+                    cursor.execute('ROLLBACK TO SAVEPOINT db_explain')
+                return f"EXPLAIN failed: {e}"
+
+
+class TracedConnection(psycopg2.extensions.connection):
+    """TracedCursor を既定にした接続（新規接続数も記録）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = TracedCursor
+        self.last_used = time.monotonic()
+        _tracer.record_new_connection()
+
+
+def resolve_ipv4(hostname):
+    """ホスト名を IPv4 アドレスに解決（解決できない場合は None）"""
+    try:
+        result = socket.getaddrinfo(hostname, None, socket.AF_INET, socket.SOCK_STREAM)
+    except OSError:
+        return None
+    return result[0][4][0] if result else None
+
+
+def connection_options(dsn):
+    """
+    psycopg2.connect に渡す追加オプション
+
+    keepalive などの既定値と、IPv4 に解決したアドレス（hostaddr）
+    hostaddr を指定しても host は残るため、TLS の検証や認証にはホスト名が使われる
+    """
+    try:
+        params = psycopg2.extensions.parse_dsn(dsn) if dsn else {}
+    except psycopg2.ProgrammingError:
+        params = {}
+
+    options = {key: value for key, value in CONNECT_OPTIONS.items() if key not in params}
+
+    host = params.get('host')
+    if os.getenv('DB_FORCE_IPV4', '1') != '0' and host and 'hostaddr' not in params \
+            and ',' not in host and not host.startswith('/'):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            ipv4 = resolve_ipv4(host)
+            if ipv4:
+                options['hostaddr'] = ipv4
+
+    return options
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    プロセス内で共有する接続プール（初回呼び出し時に作成、接続は必要になった時に開く）
+
+    fork した子プロセスでは親の接続を使わず、新しいプールを作る
+    """
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool.closed or _pool_pid != os.getpid():
+            dsn = os.getenv('DATABASE_URL')
+            max_connections = int(os.getenv('DB_POOL_MAX', DEFAULT_POOL_MAX))
+            _pool = ThreadedConnectionPool(0, max_connections, dsn, connection_factory=TracedConnection,
+                                           **connection_options(dsn))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+class PooledConnection:
+    """
+    プールから取得した接続
+
+    psycopg2 の接続と同じように使え、close() でプールに戻す
+    未コミットのトランザクションはロールバックし、autocommit は元に戻す
+    """
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, name):
+        conn = self._conn
+        if conn is None:
+            raise psycopg2.InterfaceError('connection already returned to the pool')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+
+        if conn.closed:
+            self._pool.putconn(conn, close=True)
+            return
+
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            self._pool.putconn(conn, close=True)
+            return
+        conn.last_used = time.monotonic()
+        self._pool.putconn(conn)
+
+    def reconnect(self):
+        """
+        接続を取り直す（切断されていた接続はプールから外す）
+
+        長時間保持している接続で OperationalError などが起きた後に使う
+        """
+        self.close()
+        fresh = connect()
+        object.__setattr__(self, '_pool', fresh._pool)
+        object.__setattr__(self, '_conn', fresh._conn)
+        object.__setattr__(fresh, '_conn', None)
+
+    # psycopg2 と同じく with 文ではコミット / ロールバックのみ行う（close しない）
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _is_healthy(conn):
+    """接続が使えるか（しばらく使われていなかった場合は SELECT 1 で確認）"""
+    if conn.closed or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if time.monotonic() - conn.last_used < HEALTH_CHECK_IDLE_SECONDS:
+        return True
+
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cursor:
+            cursor.execute('SELECT 1')
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def connect():
+    """
+    プールから接続を取得（close() でプールに戻す）
+
+    - 全接続が使用中の場合は DB_POOL_TIMEOUT 秒まで空きを待つ
+    - 切断されていた接続は捨てて取り直す
+    - 新規接続に失敗した場合は DB_CONNECT_RETRIES 回まで間隔を空けて再試行する
+    """
+    pool = get_pool()
+    pool_timeout = _env_float('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+    retries = int(os.getenv('DB_CONNECT_RETRIES', DEFAULT_CONNECT_RETRIES))
+
+    start = time.perf_counter()
+    failures = 0
+
+    while True:
+        try:
+            conn = pool.getconn()
+        except PoolError:
+            # 全接続が使用中
+            if time.perf_counter() - start >= pool_timeout:
+                raise
+            time.sleep(0.05)
+            continue
+        except psycopg2.OperationalError as e:
+            failures += 1
+            _tracer.record_connect_failure()
+            if failures >= retries:
+                raise
+            wait = min(30, 2 ** failures)
+            print(f"  [DB] 接続エラー、{wait}秒後に再試行します（{failures}/{retries}）: {e}")
+            time.sleep(wait)
+            continue
+
+        if _is_healthy(conn):
+            break
+
+        # 切断されていた接続は閉じて取り直す
+        pool.putconn(conn, close=True)
+        _tracer.record_reconnect()
+
+    _tracer.record_acquire(time.perf_counter() - start)
+    return PooledConnection(pool, conn)
+
+
+@contextmanager
+def connection():
+    """ブロックの間だけプールから接続を借りる（コミットは呼び出し側で行う）"""
+    conn = connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def close_pool():
+    """プールの全接続を閉じる"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+def get_tracer():
+    return _tracer
+
+
+def query_stats(top=20):
+    """計測結果（instrumentation.write_metrics の extra に渡す）"""
+    return _tracer.to_dict(top)
+
+
+def print_query_stats(top=10, file=None):
+    """接続取得の待ち時間と、合計時間の長い文を表示"""
+    stats = _tracer.to_dict(top)
+    acquire = stats['acquire']
+    if acquire['count'] == 0:
+        return
+
+    print("\n=== DB queries ===", file=file)
+    print(f"  Connections: {acquire['count']} acquired ({acquire['new_connections']} new, "
+          f"{acquire['reconnects']} reconnected, {acquire['connect_failures']} failed attempts), "
+          f"{acquire['total_seconds']:.2f}s total wait, {acquire['max_seconds']:.2f}s max", file=file)
+    for s in stats['statements']:
+        print(f"  {s['total_seconds']:8.2f}s x{s['calls']:<5} {s['rows']:>9,} rows  {s['statement'][:100]}", file=file)
+
+    if stats['slow_queries']:
+        print(f"\n  Slow queries (>= {_tracer.slow_query_seconds}s):", file=file)
+        for q in stats['slow_queries']:
+            print(f"  {q['seconds']:8.2f}s {q['statement'][:120]}", file=file)
+            if q['plan']:
+                for line in q['plan'].splitlines():
+                    print(f"      {line}", file=file)
+
+
+def _at_exit():
+    if os.getenv('DB_TRACE') == '1':
+        print_query_stats()
+    close_pool()
+
+
+atexit.register(_at_exit)
@@ -4,14 +4,42 @@
 使用例:
     python scraper/fetch_scheduled_races.py 2025-12-07
     python scraper/fetch_scheduled_races.py 2025-12-07 --venue 2  # 戸田のみ
+    python scraper/fetch_scheduled_races.py 2025-12-07 --async --concurrency 3  # 非同期パイプライン
+    python scraper/fetch_scheduled_races.py 2025-12-07 --no-schedule  # 開催日程を使わず全会場を確認
 """
 import argparse
+import asyncio
 import time
 from datetime import datetime
 from kyotei24_scraper import Kyotei24Scraper
+from race_schedule import load_schedule
 
 
-def fetch_races_for_date(target_date, venue_ids=None, delay=3.0):
+def get_race_counts(target_date, venue_ids=None, use_schedule=True):
+    """
+    取得する会場ごとのレース数を求める
+
+    開催日程を取得できた場合は開催している会場だけを返す
+    （取得できなかった場合、または use_schedule=False の場合は指定会場すべて×12レース）
+
+    Returns:
+        dict: {会場ID: レース数}
+    """
+    if venue_ids is None:
+        venue_ids = list(range(1, 25))
+
+    venues = None
+    if use_schedule:
+        venues = load_schedule(target_date, target_date)[target_date.date()]
+
+    if venues is None:
+        return {venue_id: 12 for venue_id in venue_ids}
+
+    return {venue_id: venues[venue_id] for venue_id in venue_ids if venue_id in venues}
+
+
+def fetch_races_for_date(target_date, venue_ids=None, delay=3.0, batch_size=12, flush_interval=60.0,
+                         use_schedule=True):
     """
     指定日のレースデータを取得
 
@@ -19,11 +47,14 @@ def fetch_races_for_date(target_date, venue_ids=None, delay=3.0):
         target_date: datetime object
         venue_ids: 取得する会場IDのリスト（Noneの場合は全24会場）
         delay: リクエスト間隔（秒）
+        batch_size: まとめてDBに書き込むレース数（デフォルトは1会場分）
+        flush_interval: バッファを書き込む最大間隔（秒）
+        use_schedule: 開催日程を取得し、開催している会場だけを取得
     """
-    scraper = Kyotei24Scraper()
+    race_counts = get_race_counts(target_date, venue_ids, use_schedule)
+    venue_ids = list(race_counts)
 
-    if venue_ids is None:
-        venue_ids = list(range(1, 25))
+    scraper = Kyotei24Scraper(batch_size=batch_size, flush_interval=flush_interval)
 
     date_str = target_date.strftime('%Y-%m-%d')
     print(f"\n{'='*60}")
@@ -41,19 +72,17 @@ def fetch_races_for_date(target_date, venue_ids=None, delay=3.0):
             venue_name = get_venue_name(venue_id)
             print(f"\n--- {venue_name} (会場{venue_id}) ---")
 
-            for race_number in range(1, 13):
+            for race_number in range(1, race_counts[venue_id] + 1):
                 print(f"  R{race_number:02d}: ", end="", flush=True)
 
                 try:
                     race_data = scraper.fetch_race_data(target_date, venue_id, race_number)
 
                     if race_data and race_data.get('entries'):
-                        # データベースに保存
-                        if scraper.save_to_db(race_data):
-                            total_saved += 1
-                            print(f"OK ({len(race_data['entries'])}艇)")
-                        else:
-                            print("保存失敗")
+                        # 書き込みバッファに追加（batch_sizeごとにまとめて保存）
+                        scraper.buffer_race(race_data)
+                        total_saved += 1
+                        print(f"OK ({len(race_data['entries'])}艇)")
                     else:
                         total_skipped += 1
                         print("データなし")
@@ -70,6 +99,9 @@ def fetch_races_for_date(target_date, venue_ids=None, delay=3.0):
     finally:
         scraper.close()
 
+    # バッファ書き込みで失敗したレースを反映
+    total_saved -= scraper.write_stats['failed_races']
+
     print(f"\n{'='*60}")
     print(f"  完了: {total_saved}レース保存, {total_skipped}件スキップ")
     print(f"{'='*60}\n")
@@ -77,6 +109,48 @@ def fetch_races_for_date(target_date, venue_ids=None, delay=3.0):
     return total_saved
 
 
+def fetch_races_for_date_async(target_date, venue_ids=None, delay=3.0, batch_size=12, flush_interval=60.0,
+                               concurrency=2, parse_workers=2, use_schedule=True):
+    """
+    指定日のレースデータを非同期パイプラインで取得
+
+    取得・パース・DB書き込みを並行実行する（全体のリクエスト頻度は delay で制限）
+    """
+    from async_collector import collect_races_async
+
+    race_counts = get_race_counts(target_date, venue_ids, use_schedule)
+    venue_ids = list(race_counts)
+
+    date_str = target_date.strftime('%Y-%m-%d')
+    print(f"\n{'='*60}")
+    print(f"  {date_str} のレースデータを取得（非同期）")
+    print(f"{'='*60}\n")
+    print(f"対象会場: {venue_ids}")
+    print(f"リクエスト間隔: {delay}秒 / 同時リクエスト数: {concurrency}")
+    print()
+
+    targets = [
+        (target_date, venue_id, race_number)
+        for venue_id in venue_ids
+        for race_number in range(1, race_counts[venue_id] + 1)
+    ]
+
+    stats = asyncio.run(collect_races_async(
+        targets,
+        delay=delay,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        parse_workers=parse_workers
+    ))
+
+    print(f"\n{'='*60}")
+    print(f"  完了: {stats['successful']}レース保存, {stats['skipped'] + stats['failed']}件スキップ")
+    print(f"{'='*60}\n")
+
+    return stats['successful']
+
+
 def get_venue_name(venue_id):
     """会場IDから会場名を取得"""
     venues = {
@@ -93,6 +167,12 @@ def main():
     parser.add_argument('date', type=str, help='取得日 (YYYY-MM-DD形式)')
     parser.add_argument('--venue', type=int, default=None, help='特定会場のみ取得 (1-24)')
     parser.add_argument('--delay', type=float, default=3.0, help='リクエスト間隔（秒）')
+    parser.add_argument('--batch-size', type=int, default=12, help='まとめてDBに書き込むレース数')
+    parser.add_argument('--flush-interval', type=float, default=60.0, help='バッファを書き込む最大間隔（秒）')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='非同期パイプラインで取得')
+    parser.add_argument('--concurrency', type=int, default=2, help='非同期モードの同時リクエスト数')
+    parser.add_argument('--no-schedule', dest='use_schedule', action='store_false',
+                        help='開催日程を使わず全会場×12レースを確認')
 
     args = parser.parse_args()
 
@@ -104,7 +184,12 @@ def main():
 
     venue_ids = [args.venue] if args.venue else None
 
-    fetch_races_for_date(target_date, venue_ids, args.delay)
+    if args.use_async:
+        fetch_races_for_date_async(target_date, venue_ids, args.delay, args.batch_size, args.flush_interval,
+                                   concurrency=args.concurrency, use_schedule=args.use_schedule)
+    else:
+        fetch_races_for_date(target_date, venue_ids, args.delay, args.batch_size, args.flush_interval,
+                             use_schedule=args.use_schedule)
 
 
 if __name__ == '__main__':
@@ -3,23 +3,27 @@
 次に収集すべき月を自動判定するスクリプト
 
 データベース内の最古のデータから、その前月を返します。
-2022年1月より古い場合は、収集完了とみなします。
+2020年1月より古い場合は、収集完了とみなします。
+
+--crawl-state を指定した場合は、クロール状態に記録された未完了のジョブ
+（中断された月、または他の会場範囲だけが開始した月）を優先して返します。
+これにより会場範囲を分割した並列ジョブが同じ月を対象にします。
 """
 import os
 import sys
-import psycopg2
+from db import connect
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from dotenv import load_dotenv
-
-load_dotenv()
 
-def get_next_backfill_month(force_month=None):
+def get_next_backfill_month(force_month=None, crawl_state_path=None, start_venue=1, end_venue=24):
     """
     次に収集すべき月を取得
 
     Args:
         force_month: 強制的に指定する月（YYYY-MM形式）
+        crawl_state_path: クロール状態ファイル（Noneの場合は使用しない）
+        start_venue: 開始会場番号（クロール状態のジョブ判定用）
+        end_venue: 終了会場番号（クロール状態のジョブ判定用）
 
     Returns:
         str: YYYY-MM形式の月、または None（収集完了時）
@@ -28,9 +32,24 @@ def get_next_backfill_month(force_month=None):
     if force_month:
         return force_month
 
+    # 未完了のジョブがあれば再開
+    if crawl_state_path and os.path.exists(crawl_state_path):
+        from crawl_state import CrawlState
+
+        try:
+            crawl_state = CrawlState(crawl_state_path)
+            try:
+                incomplete = crawl_state.next_incomplete_month(start_venue, end_venue)
+            finally:
+                crawl_state.close()
+            if incomplete:
+                return incomplete
+        except Exception as e:
+            print(f"Warning: could not read crawl state: {e}", file=sys.stderr)
+
     # データベース接続
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        conn = connect()
         cur = conn.cursor()
 
         # 最古のデータを取得
@@ -71,10 +90,29 @@ if __name__ == "__main__":
         default=None,
         help='Force specific month (YYYY-MM format)'
     )
+    parser.add_argument(
+        '--crawl-state',
+        type=str,
+        default=None,
+        help='SQLite crawl state file; resume incomplete jobs first'
+    )
+    parser.add_argument(
+        '--start-venue',
+        type=int,
+        default=1,
+        help='Start venue number of this job (default: 1)'
+    )
+    parser.add_argument(
+        '--end-venue',
+        type=int,
+        default=24,
+        help='End venue number of this job (default: 24)'
+    )
 
     args = parser.parse_args()
 
-    target_month = get_next_backfill_month(args.force_month)
+    target_month = get_next_backfill_month(args.force_month, args.crawl_state,
+                                           args.start_venue, args.end_venue)
 
     if target_month:
         print(target_month)
@@ -0,0 +1,235 @@
+"""
+取得したHTMLのローカルアーカイブ
+
+スクレイパーが取得したレスポンスを圧縮して保存し、パーサー修正時に
+ネットワークへアクセスせずに再パース（reparse_archive.py）できるようにする
+
+構成:
+  {root}/index.sqlite               URL・取得時刻・ハッシュの索引
+  {root}/objects/ab/abcdef....zst   本文（SHA-256 でコンテンツアドレス、同一内容は1つだけ保存）
+
+圧縮は zstandard がインストールされていれば zstd、なければ gzip を使用する
+（拡張子で判別するため、混在していても読み出せる）
+"""
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+
+def _blob_relpath(sha256, ext):
+    return os.path.join('objects', sha256[:2], f"{sha256}{ext}")
+
+
+def read_blob(root, relpath):
+    """
+    アーカイブから本文を読み出して展開
+
+    DB・SQLite接続を持たないため、再パース用の別プロセスからも呼び出せる
+    """
+    path = os.path.join(root, relpath)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if relpath.endswith('.zst'):
+        if not HAS_ZSTD:
+            raise RuntimeError(f"zstandard is required to read {relpath} (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    return gzip.decompress(data)
+
+
+class HtmlArchive:
+    """取得レスポンスの圧縮アーカイブ"""
+
+    def __init__(self, root, compression_level=None):
+        """
+        Args:
+            root: アーカイブのディレクトリ（存在しない場合は作成）
+            compression_level: 圧縮レベル（Noneの場合は zstd 10 / gzip 6）
+        """
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+        if HAS_ZSTD:
+            self.ext = '.zst'
+            self._compressor = zstandard.ZstdCompressor(level=compression_level or 10)
+        else:
+            self.ext = '.gz'
+            self._compressor = None
+            self._gzip_level = compression_level or 6
+
+        # 非同期収集ではスレッドから呼ばれることがあるためロックで保護
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                source TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                meta TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_url ON responses(url, fetched_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_source ON responses(source, fetched_at)")
+        self.conn.commit()
+
+    def _compress(self, content):
+        if self._compressor is not None:
+            return self._compressor.compress(content)
+        return gzip.compress(content, compresslevel=self._gzip_level)
+
+    def put(self, url, content, source, status=200, meta=None, fetched_at=None):
+        """
+        レスポンスを保存
+
+        Args:
+            url: 取得したURL
+            content: レスポンス本文（bytes または str）
+            source: 取得元（'kyotei24' / 'boatrace_db' / 'weather'）
+            status: HTTPステータス
+            meta: 再パースに必要な情報（日付・会場など、JSONに変換できるdict）
+            fetched_at: 取得時刻（Noneの場合は現在時刻）
+
+        Returns:
+            str: 本文の SHA-256
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        sha256 = hashlib.sha256(content).hexdigest()
+        fetched_at = (fetched_at or datetime.now()).isoformat(timespec='seconds')
+
+        # 同一内容のファイルがあれば再利用（既存拡張子を優先）
+        relpath = None
+        for ext in ('.zst', '.gz'):
+            candidate = _blob_relpath(sha256, ext)
+            if os.path.exists(os.path.join(self.root, candidate)):
+                relpath = candidate
+                break
+
+        if relpath is None:
+            relpath = _blob_relpath(sha256, self.ext)
+            path = os.path.join(self.root, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # 書き込み途中のファイルを読まないよう一時ファイルから置き換える
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(self._compress(content))
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self.conn.execute("""
+                INSERT INTO responses (url, fetched_at, source, status, sha256, path, size, meta)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                url, fetched_at, source, status, sha256, relpath, len(content),
+                json.dumps(meta, ensure_ascii=False, default=str) if meta is not None else None
+            ))
+            self.conn.commit()
+
+        return sha256
+
+    def get(self, url):
+        """URLの最新のレスポンス本文を取得（未保存の場合はNone）"""
+        with self._lock:
+            row = self.conn.execute("""
+                SELECT path FROM responses
+                WHERE url = ?
+                ORDER BY fetched_at DESC, id DESC
+                LIMIT 1
+            """, (url,)).fetchone()
+
+        if row is None:
+            return None
+        return read_blob(self.root, row[0])
+
+    def records(self, source, since=None, until=None, latest_only=True):
+        """
+        保存済みレスポンスの索引を取得
+
+        Args:
+            source: 取得元
+            since: 取得時刻の下限（datetime、含む）
+            until: 取得時刻の上限（datetime、含む）
+            latest_only: URLごとに最新の1件のみ返す
+
+        Returns:
+            list: dict(url, fetched_at, status, path, meta) のリスト
+        """
+        conditions = ["source = ?", "status = 200"]
+        params = [source]
+
+        if since is not None:
+            conditions.append("fetched_at >= ?")
+            params.append(since.isoformat(timespec='seconds'))
+        if until is not None:
+            conditions.append("fetched_at <= ?")
+            params.append(until.isoformat(timespec='seconds'))
+
+        where = " AND ".join(conditions)
+
+        if latest_only:
+            query = f"""
+                SELECT url, fetched_at, status, path, meta FROM (
+                    SELECT url, fetched_at, status, path, meta,
+                           ROW_NUMBER() OVER (PARTITION BY url ORDER BY fetched_at DESC, id DESC) AS rn
+                    FROM responses
+                    WHERE {where}
+                )
+                WHERE rn = 1
+                ORDER BY fetched_at
+            """
+        else:
+            query = f"""
+                SELECT url, fetched_at, status, path, meta
+                FROM responses
+                WHERE {where}
+                ORDER BY fetched_at
+            """
+
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        return [
+            {
+                'url': url,
+                'fetched_at': datetime.fromisoformat(fetched_at),
+                'status': status,
+                'path': path,
+                'meta': json.loads(meta) if meta else {}
+            }
+            for url, fetched_at, status, path, meta in rows
+        ]
+
+    def summary(self):
+        """取得元ごとの件数・元サイズを取得"""
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT source, COUNT(*), COUNT(DISTINCT sha256), SUM(size)
+                FROM responses
+                GROUP BY source
+                ORDER BY source
+            """).fetchall()
+        return rows
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
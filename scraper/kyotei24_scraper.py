@@ -6,22 +6,65 @@ URL形式: https://info.kyotei.fun/info-{YYYYMMDD}-{会場番号}-{レース番
 """
 
 import requests
-from bs4 import BeautifulSoup
 from datetime import datetime
 import re
 import os
-from dotenv import load_dotenv
-import psycopg2
+import sys
+import time
+from db import connect
+from psycopg2.extras import execute_values
+from page_parser import parse_page, DEFAULT_BACKEND
+from crawl_state import STATUS_DONE, STATUS_FAILED
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.instrumentation import span
+from ml.race_cards import try_refresh_race_cards
 
 
 class Kyotei24Scraper:
     """kyotei.funサイトからデータを収集するスクレイパー"""
 
-    def __init__(self):
+    def __init__(self, batch_size=1, flush_interval=60.0, archive=None, parser_backend=DEFAULT_BACKEND,
+                 crawl_state=None):
+        """
+        Args:
+            batch_size: buffer_race() でまとめて書き込むレース数
+            flush_interval: 最後の書き込みからこの秒数が経過したら batch_size 未満でも書き込む
+            archive: 取得したHTMLを保存する HtmlArchive（Noneの場合は保存しない）
+            parser_backend: HTMLパーサー（'bs4' / 'lxml'、page_parser.py 参照）
+            crawl_state: 保存結果を記録する CrawlState（Noneの場合は記録しない）
+        """
         self.base_url = "https://info.kyotei.fun"
-        self.db_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        self.session = requests.Session()
+        self.archive = archive
+        self.parser_backend = parser_backend
+        self.crawl_state = crawl_state
+
+        # 直前の fetch_race_data() のHTTPステータス（通信エラー時はNone）
+        self.last_fetch_status = None
+        # 直前の fetch_race_data() でページを取得できたがパースに失敗した場合のエラー（成功・開催なしはNone）
+        self.last_parse_error = None
+        self.db_conn = connect()
+
+        # 書き込みバッファ
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending_races = []
+        self._last_flush = time.monotonic()
+        self.write_stats = {
+            'races': 0,
+            'entries': 0,
+            'failed_races': 0,
+            'flushes': 0,
+            'seconds': 0.0
+        }
+
+    def race_url(self, date, venue_id, race_number):
+        """1レース分のページURLを構築"""
+        date_str = date.strftime('%Y%m%d')
+        venue_str = str(venue_id).zfill(2)
+        return f"{self.base_url}/info-{date_str}-{venue_str}-{race_number}.html"
 
     def fetch_race_data(self, date, venue_id, race_number):
         """
@@ -34,47 +77,96 @@ class Kyotei24Scraper:
 
         Returns:
             dict: レースデータ、取得失敗時はNone
+                  Noneの場合、last_fetch_status が 404、または 200 で last_parse_error が None なら開催なし
+                  （200 でパースに失敗した場合は last_parse_error にエラーが入る）
         """
         # URL構築
-        date_str = date.strftime('%Y%m%d')
-        venue_str = str(venue_id).zfill(2)
-        url = f"{self.base_url}/info-{date_str}-{venue_str}-{race_number}.html"
+        url = self.race_url(date, venue_id, race_number)
+        self.last_fetch_status = None
+        self.last_parse_error = None
 
         try:
-            response = requests.get(url, timeout=30)
+            # keep-aliveで接続を使い回す
+            with span('fetch'):
+                response = self.session.get(url, timeout=30)
+            self.last_fetch_status = response.status_code
 
             if response.status_code != 200:
                 print(f"Failed to fetch: {url} (status: {response.status_code})")
                 return None
 
-            # HTMLをパース
-            soup = BeautifulSoup(response.content, 'html.parser')
+            self.archive_page(url, response.content, date, venue_id, race_number)
 
-            # メインテーブル（Table 3）を取得
-            tables = soup.find_all('table')
-            if len(tables) < 3:
+            with span('parse'):
+                race_data = self.parse_race_page(response.content, date, venue_id, race_number,
+                                                 parser_backend=self.parser_backend)
+            if race_data is None:
                 print(f"Not enough tables in page: {url}")
+            elif not race_data['entries']:
+                # メインテーブルはあるが出走を取り出せない（ページ構成の変更など）
+                self.last_parse_error = 'no entries in main table'
+                print(f"No entries parsed from page: {url}")
                 return None
 
-            main_table = tables[2]  # Table 3
-
-            # レースデータを抽出
-            race_data = self.parse_race_table(main_table, date, venue_id, race_number)
-
             return race_data
 
         except Exception as e:
             print(f"Error fetching {url}: {e}")
+            if self.last_fetch_status == 200:
+                self.last_parse_error = str(e) or type(e).__name__
             import traceback
             traceback.print_exc()
             return None
 
-    def parse_race_table(self, table, date, venue_id, race_number):
+    def archive_page(self, url, content, date, venue_id, race_number):
+        """取得したページをアーカイブに保存（アーカイブ未指定の場合は何もしない）"""
+        if self.archive is None:
+            return
+
+        self.archive.put(url, content, source='kyotei24', meta={
+            'date': date.strftime('%Y-%m-%d'),
+            'venue_id': venue_id,
+            'race_number': race_number
+        })
+
+    @staticmethod
+    def results_final(race_data):
+        """
+        レース結果が確定しているか
+
+        結果は全艇まとめて掲載されるため、1艇でも着順があれば確定とみなす
+        （欠場・フライング・失格などの艇は確定後も着順が数字にならない）
+        """
+        return any(entry.get('result_position') is not None for entry in race_data['entries'])
+
+    @staticmethod
+    def parse_race_page(content, date, venue_id, race_number, parser_backend=DEFAULT_BACKEND):
+        """
+        レースページのHTMLからレースデータを抽出
+
+        DB接続を持たないため、別プロセス・別スレッドからも呼び出せる
+
+        Returns:
+            dict: レースデータ、メインテーブルがない場合はNone
+        """
+        page = parse_page(content, parser_backend)
+
+        # メインテーブル（Table 3）を取得
+        if len(page.tables) < 3:
+            return None
+
+        main_table = page.tables[2].rows  # Table 3
+
+        # レースデータを抽出
+        return Kyotei24Scraper.parse_race_rows(main_table, date, venue_id, race_number)
+
+    @staticmethod
+    def parse_race_rows(rows, date, venue_id, race_number):
         """
         メインテーブルからデータを抽出
 
         Args:
-            table: BeautifulSoup table element
+            rows: メインテーブルの行リスト（行はセルテキストのリスト）
             date: datetime object
             venue_id: 会場ID
             race_number: レース番号
@@ -82,22 +174,17 @@ class Kyotei24Scraper:
         Returns:
             dict: レースデータ
         """
-        rows = table.find_all('tr')
-
         # 各行のデータを格納
         row_data = {}
-        for i, row in enumerate(rows):
-            cells = row.find_all(['td', 'th'])
+        for i, cells in enumerate(rows):
             if cells:
                 # 最初のセルはラベル、残りは各艇のデータ
-                label = cells[0].text.strip()
-                values = [cell.text.strip() for cell in cells[1:]]
-                row_data[i] = {'label': label, 'values': values}
+                row_data[i] = {'label': cells[0], 'values': cells[1:]}
 
         # 6艇分のデータを抽出
         entries = []
         for boat_idx in range(6):  # 6艇
-            entry = self.extract_boat_data(row_data, boat_idx)
+            entry = Kyotei24Scraper.extract_boat_data(row_data, boat_idx)
             if entry:
                 entries.append(entry)
 
@@ -108,7 +195,8 @@ class Kyotei24Scraper:
             'entries': entries
         }
 
-    def extract_boat_data(self, row_data, boat_idx):
+    @staticmethod
+    def extract_boat_data(row_data, boat_idx):
         """
         1艇分のデータを抽出
 
@@ -252,70 +340,101 @@ class Kyotei24Scraper:
             return None
 
     def save_to_db(self, race_data):
-        """データベースに保存"""
+        """データベースに保存（1レースを即時書き込み）"""
+        return self.save_many([race_data])
+
+    def buffer_race(self, race_data):
+        """
+        レースデータを書き込みバッファに追加
+
+        batch_size に達するか flush_interval が経過した時点でまとめて書き込む
+
+        Returns:
+            bool: 書き込みが発生した場合はその成否、バッファに積んだだけの場合はTrue
+        """
+        self._pending_races.append(race_data)
+
+        if (len(self._pending_races) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            return self.flush()
+
+        return True
+
+    def flush(self):
+        """バッファ内のレースを書き込む"""
+        self._last_flush = time.monotonic()
+
+        if not self._pending_races:
+            return True
+
+        races = self._pending_races
+        self._pending_races = []
+
+        with span('db_write', rows=len(races)):
+            return self.save_many(races)
+
+    @staticmethod
+    def _race_key(race_data):
+        """(race_date, venue_id, race_number) のキーを返す"""
+        race_date = race_data['date']
+        if isinstance(race_date, datetime):
+            race_date = race_date.date()
+        return (race_date, race_data['venue_id'], race_data['race_number'])
+
+    def save_many(self, races):
+        """
+        複数レースを1トランザクションで保存
+
+        races / racers / race_entries をそれぞれ execute_values の複数行upsertで書き込む
+
+        Args:
+            races: fetch_race_data() が返すレースデータのリスト
+
+        Returns:
+            bool: 成功時True
+        """
+        # 同一キーが複数ある場合は後のものを優先（ON CONFLICT は同一文内の重複キーを扱えない）
+        race_by_key = {}
+        for race_data in races:
+            race_by_key[self._race_key(race_data)] = race_data
+
+        if not race_by_key:
+            return True
+
         cursor = self.db_conn.cursor()
+        start_time = time.monotonic()
 
         try:
             # レース基本情報を保存
-            cursor.execute("""
+            race_rows = execute_values(cursor, """
                 INSERT INTO races (race_date, venue_id, race_number, grade)
-                VALUES (%s, %s, %s, %s)
+                VALUES %s
                 ON CONFLICT (race_date, venue_id, race_number) DO UPDATE
                 SET grade = EXCLUDED.grade
-                RETURNING id
-            """, (
-                race_data['date'],
-                race_data['venue_id'],
-                race_data['race_number'],
-                '一般'  # グレードはデフォルト
-            ))
-
-            result = cursor.fetchone()
-            if result:
-                race_id = result[0]
-
-                # 出走情報を保存
+                RETURNING id, race_date, venue_id, race_number
+            """, [
+                key + ('一般',)  # グレードはデフォルト
+                for key in race_by_key
+            ], fetch=True)
+
+            race_ids = {
+                (race_date, venue_id, race_number): race_id
+                for race_id, race_date, venue_id, race_number in race_rows
+            }
+
+            racers = {}
+            entry_rows = {}
+            for key, race_data in race_by_key.items():
+                race_id = race_ids.get(key)
+                if race_id is None:
+                    continue
+
                 for entry in race_data['entries']:
-                    # レーサー情報を保存
-                    cursor.execute("""
-                        INSERT INTO racers (racer_number, name)
-                        VALUES (%s, %s)
-                        ON CONFLICT (racer_number) DO UPDATE
-                        SET name = EXCLUDED.name
-                    """, (
-                        entry.get('racer_number', 0),
-                        entry.get('racer_name', '')
-                    ))
-
-                    # 出走情報を保存
-                    cursor.execute("""
-                        INSERT INTO race_entries
-                        (race_id, boat_number, racer_id, start_timing, result_position,
-                         racer_grade, win_rate, place_rate_2, place_rate_3, weight,
-                         motor_number, motor_rate_2, boat_hull_number, boat_rate_2,
-                         exhibition_time, local_win_rate, local_place_rate_2,
-                         average_st, flying_count, late_count)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ON CONFLICT (race_id, boat_number) DO UPDATE
-                        SET racer_id = EXCLUDED.racer_id,
-                            start_timing = EXCLUDED.start_timing,
-                            result_position = EXCLUDED.result_position,
-                            racer_grade = EXCLUDED.racer_grade,
-                            win_rate = EXCLUDED.win_rate,
-                            place_rate_2 = EXCLUDED.place_rate_2,
-                            place_rate_3 = EXCLUDED.place_rate_3,
-                            weight = EXCLUDED.weight,
-                            motor_number = EXCLUDED.motor_number,
-                            motor_rate_2 = EXCLUDED.motor_rate_2,
-                            boat_hull_number = EXCLUDED.boat_hull_number,
-                            boat_rate_2 = EXCLUDED.boat_rate_2,
-                            exhibition_time = EXCLUDED.exhibition_time,
-                            local_win_rate = EXCLUDED.local_win_rate,
-                            local_place_rate_2 = EXCLUDED.local_place_rate_2,
-                            average_st = EXCLUDED.average_st,
-                            flying_count = EXCLUDED.flying_count,
-                            late_count = EXCLUDED.late_count
-                    """, (
+                    # レーサー情報
+                    racers[entry.get('racer_number', 0)] = entry.get('racer_name', '')
+
+                    # 出走情報
+                    entry_rows[(race_id, entry.get('boat_number'))] = (
                         race_id,
                         entry.get('boat_number'),
                         entry.get('racer_number', 0),
@@ -336,22 +455,95 @@ class Kyotei24Scraper:
                         entry.get('average_st'),
                         entry.get('flying_count'),
                         entry.get('late_count')
-                    ))
+                    )
+
+            # レーサー情報を保存
+            if racers:
+                execute_values(cursor, """
+                    INSERT INTO racers (racer_number, name)
+                    VALUES %s
+                    ON CONFLICT (racer_number) DO UPDATE
+                    SET name = EXCLUDED.name
+                """, list(racers.items()), page_size=1000)
+
+            # 出走情報を保存
+            if entry_rows:
+                execute_values(cursor, """
+                    INSERT INTO race_entries
+                    (race_id, boat_number, racer_id, start_timing, result_position,
+                     racer_grade, win_rate, place_rate_2, place_rate_3, weight,
+                     motor_number, motor_rate_2, boat_hull_number, boat_rate_2,
+                     exhibition_time, local_win_rate, local_place_rate_2,
+                     average_st, flying_count, late_count)
+                    VALUES %s
+                    ON CONFLICT (race_id, boat_number) DO UPDATE
+                    SET racer_id = EXCLUDED.racer_id,
+                        start_timing = EXCLUDED.start_timing,
+                        result_position = EXCLUDED.result_position,
+                        racer_grade = EXCLUDED.racer_grade,
+                        win_rate = EXCLUDED.win_rate,
+                        place_rate_2 = EXCLUDED.place_rate_2,
+                        place_rate_3 = EXCLUDED.place_rate_3,
+                        weight = EXCLUDED.weight,
+                        motor_number = EXCLUDED.motor_number,
+                        motor_rate_2 = EXCLUDED.motor_rate_2,
+                        boat_hull_number = EXCLUDED.boat_hull_number,
+                        boat_rate_2 = EXCLUDED.boat_rate_2,
+                        exhibition_time = EXCLUDED.exhibition_time,
+                        local_win_rate = EXCLUDED.local_win_rate,
+                        local_place_rate_2 = EXCLUDED.local_place_rate_2,
+                        average_st = EXCLUDED.average_st,
+                        flying_count = EXCLUDED.flying_count,
+                        late_count = EXCLUDED.late_count
+                """, list(entry_rows.values()), page_size=1000)
 
             self.db_conn.commit()
-            print(f"Saved race {race_data['date'].strftime('%Y-%m-%d')} venue {race_data['venue_id']} race {race_data['race_number']}")
+
+            # 予測用の出走表を作り直す（失敗しても保存済みのデータはそのまま）
+            try_refresh_race_cards(self.db_conn, race_ids=list(race_ids.values()))
+
+            elapsed = time.monotonic() - start_time
+            self.write_stats['races'] += len(race_ids)
+            self.write_stats['entries'] += len(entry_rows)
+            self.write_stats['flushes'] += 1
+            self.write_stats['seconds'] += elapsed
+
+            if self.crawl_state is not None:
+                # 結果が確定したレースだけ取得済みにする
+                # 結果前に保存したレースは failed として retry_after 後に取り直す
+                done_keys = [key for key, race_data in race_by_key.items() if self.results_final(race_data)]
+                done_set = set(done_keys)
+                self.crawl_state.mark_many(done_keys, STATUS_DONE)
+                self.crawl_state.mark_many(
+                    [key for key in race_by_key if key not in done_set], STATUS_FAILED
+                )
+
+            if len(race_by_key) == 1:
+                race_date, venue_id, race_number = next(iter(race_by_key))
+                print(f"Saved race {race_date.strftime('%Y-%m-%d')} venue {venue_id} race {race_number}")
+            else:
+                rate = len(race_ids) / elapsed if elapsed > 0 else 0
+                print(f"Saved {len(race_ids)} races / {len(entry_rows)} entries in {elapsed:.2f}s ({rate:.1f} races/s)")
             return True
 
         except Exception as e:
             self.db_conn.rollback()
+            self.write_stats['failed_races'] += len(race_by_key)
             print(f"Database error: {e}")
+
+            if self.crawl_state is not None:
+                self.crawl_state.mark_many(list(race_by_key), STATUS_FAILED)
             import traceback
             traceback.print_exc()
             return False
 
     def close(self):
-        """リソースを解放"""
-        self.db_conn.close()
+        """リソースを解放（未書き込みのバッファがあれば書き込む）"""
+        try:
+            self.flush()
+        finally:
+            self.session.close()
+            self.db_conn.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,33 @@
+-- 訓練・予測・バックテストのクエリ用インデックス
+--
+-- 対象のクエリ:
+--   - ml/backtest.py build_completed_races_query（6艇とも着順のあるレースを新しい順に LIMIT 件）
+--   - ml/train_model.py / ml/enhanced_feature_engineer.py TRAINING_DATA_QUERY
+--     （着順のある全出走を race_date DESC, venue_id, race_number, boat_number 順に取得）
+--   - ml/point_in_time_stats.py update_daily_stats（指定日以降の着順のある出走を集計）
+--
+-- 効果の確認: python ml/explain_queries.py --postgres-url <検証用DB>
+-- （合成データで追加前後の EXPLAIN (ANALYZE, BUFFERS) を比較する）
+-- 100万レースでの計測結果: ml/benchmarks/README.md
+--
+-- 本番で書き込みを止めずに作成する場合は、psql で1文ずつ CREATE INDEX CONCURRENTLY として実行する
+
+-- races をクエリの ORDER BY と同じ順（日付の新しい順、会場・レース番号順）で読む
+-- id を含めるため、race_entries との結合キーまでインデックスだけで取得できる
+CREATE INDEX IF NOT EXISTS idx_races_recent
+ON races (race_date DESC, venue_id, race_number) INCLUDE (id);
+
+-- 着順のある出走だけの部分インデックス
+-- レースごとの確定艇数は index-only scan で数えられ、出走は boat_number 順に読める
+CREATE INDEX IF NOT EXISTS idx_entries_finished
+ON race_entries (race_id, boat_number)
+WHERE result_position IS NOT NULL;
+
+-- 先頭列が同じインデックスがあるため不要になったもの（容量上限 500MB 対策）
+--   idx_races_date   → idx_races_date_venue / UNIQUE(race_date, venue_id, race_number)
+--   idx_entries_race → UNIQUE(race_id, boat_number) / idx_entries_result
+DROP INDEX IF EXISTS idx_races_date;
+DROP INDEX IF EXISTS idx_entries_race;
+
+ANALYZE races;
+ANALYZE race_entries;
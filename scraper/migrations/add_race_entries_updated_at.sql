@@ -0,0 +1,43 @@
+-- race_entries に updated_at（最終更新日時）を追加
+--
+-- 着順などの結果は、出走表の行を作成した後の upsert（ON CONFLICT DO UPDATE）で入るため、
+-- created_at は結果が入った日時にならない
+-- 集計スクリプトは updated_at を前回の集計日時と比べて、再計算する対象を決める
+--   - ml/point_in_time_stats.py / ml/analytics_summary.py: 変更された出走のレース日
+--   - ml/calculate_racer_stats.py --since-last-run: 変更された出走の選手
+--   - ml/advanced_stats.py --incremental: 変更された出走の選手×会場
+-- バックフィルで過去の月を追加した場合も、その月の日付が再集計される
+
+-- 適用後は各スクリプトを一度全件で実行する（それまでに取りこぼした分を反映する）
+--   python ml/point_in_time_stats.py --rebuild
+--   python ml/analytics_summary.py --rebuild
+--   python ml/calculate_racer_stats.py
+--   python ml/advanced_stats.py
+
+ALTER TABLE race_entries ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+-- 既存の行は作成日時を更新日時とする
+UPDATE race_entries SET updated_at = created_at WHERE updated_at IS NULL;
+
+ALTER TABLE race_entries ALTER COLUMN updated_at SET DEFAULT NOW();
+
+-- 値が変わった更新（upsert を含む）のたびに updated_at を現在時刻にする
+-- 同じ内容の再取得では変えない（集計の再計算対象にしない）
+CREATE OR REPLACE FUNCTION update_race_entries_timestamp()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS race_entries_update_timestamp ON race_entries;
+CREATE TRIGGER race_entries_update_timestamp
+    BEFORE UPDATE ON race_entries
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION update_race_entries_timestamp();
+
+CREATE INDEX IF NOT EXISTS idx_entries_updated ON race_entries(updated_at);
+
+COMMENT ON COLUMN race_entries.updated_at IS '最終更新日時（結果の反映を含む）';
@@ -0,0 +1,11 @@
+-- racer_detailed_stats に HTTP 条件付きリクエスト用の列を追加
+-- racer_profile_crawler.py（boatrace_db_scraper.py --async）が前回の ETag / Last-Modified を送り、
+-- 304（変更なし）の選手ページを再取得・再保存しないようにする
+
+ALTER TABLE racer_detailed_stats
+ADD COLUMN IF NOT EXISTS http_etag TEXT,
+ADD COLUMN IF NOT EXISTS http_last_modified TEXT;
+
+-- カラムコメント
+COMMENT ON COLUMN racer_detailed_stats.http_etag IS '選手ページの ETag（条件付きリクエスト用）';
+COMMENT ON COLUMN racer_detailed_stats.http_last_modified IS '選手ページの Last-Modified（条件付きリクエスト用）';
@@ -0,0 +1,101 @@
+-- =====================================================
+-- race_cards（出走表）テーブル作成マイグレーション
+-- 予測に必要な1レース分のデータを1艇1行にまとめたもの
+-- =====================================================
+--
+-- race_entries / races / racers / racer_detailed_stats を結合し、
+-- racer_detailed_stats の JSONB（grade_stats / course_stats / venue_stats）から
+-- その艇の枠番・会場に該当する数値だけを取り出して列にしている
+-- 予測（ml/predict_race_enhanced.py）と /api/predict は race_id の主キー検索1回で読む
+--
+-- 更新は ml/race_cards.py（kyotei24_scraper.py / boatrace_db_scraper.py からも呼ばれる）
+-- 既存レースの作成: python ml/race_cards.py --since 2025-01-01
+
+CREATE TABLE IF NOT EXISTS race_cards (
+    race_id INT NOT NULL REFERENCES races(id) ON DELETE CASCADE,
+    boat_number INT NOT NULL,
+
+    -- 出走情報（race_entries）
+    racer_id INT,
+    motor_number INT,
+    start_timing FLOAT,
+    course INT,
+    result_position INT,
+    racer_grade VARCHAR(10),
+    win_rate DECIMAL(4,2),
+    place_rate_2 DECIMAL(5,2),
+    place_rate_3 DECIMAL(5,2),
+    motor_rate_2 DECIMAL(5,2),
+    motor_rate_3 DECIMAL(5,2),
+    boat_rate_2 DECIMAL(5,2),
+    boat_rate_3 DECIMAL(5,2),
+    exhibition_time DECIMAL(5,2),
+    exhibition_turn_time DECIMAL(5,2),
+    exhibition_straight_time DECIMAL(5,2),
+    average_st DECIMAL(3,2),
+    flying_count INT,
+    late_count INT,
+    actual_course INT,
+
+    -- レース情報（races）
+    race_date DATE NOT NULL,
+    venue_id INT NOT NULL,
+    race_number INT NOT NULL,
+    race_grade VARCHAR(10),
+
+    -- 選手（racers）
+    racer_name VARCHAR(100),
+    racer_number INT,
+    racer_current_grade VARCHAR(5),
+
+    -- 選手詳細統計（racer_detailed_stats）
+    racer_overall_win_rate FLOAT,
+    racer_1st_rate FLOAT,
+    racer_2nd_rate FLOAT,
+    racer_3rd_rate FLOAT,
+    racer_avg_st FLOAT,
+    sg_appearances INT,
+    racer_flying_count INT,
+    racer_late_count INT,
+
+    -- grade_stats から取り出した値
+    sg_win_rate FLOAT,
+    sg_experience_score INT,
+    g1_win_rate FLOAT,
+    g2_win_rate FLOAT,
+    g3_win_rate FLOAT,
+    total_yusyutsu INT,
+    total_yusho INT,
+
+    -- course_stats から取り出した値（この艇の枠番）
+    course_specific_1st_rate FLOAT,
+    course_win_rate_venue FLOAT,
+    course_nige_rate FLOAT,
+    course_sashi_rate FLOAT,
+    course_makuri_rate FLOAT,
+
+    -- venue_stats から取り出した値（このレースの会場）
+    venue_specific_win_rate FLOAT,
+    venue_specific_1st_rate FLOAT,
+    venue_specific_2nd_rate FLOAT,
+    racer_avg_st_venue FLOAT,
+    venue_experience INT,
+
+    refreshed_at TIMESTAMP DEFAULT NOW(),
+
+    PRIMARY KEY (race_id, boat_number)
+);
+
+CREATE INDEX IF NOT EXISTS idx_race_cards_date ON race_cards(race_date);
+
+COMMENT ON TABLE race_cards IS '出走表（予測用に race_entries / racers / racer_detailed_stats を1艇1行にまとめたもの）';
+COMMENT ON COLUMN race_cards.racer_current_grade IS '選手マスタの現在の級別（racer_grade は出走時点の級別）';
+COMMENT ON COLUMN race_cards.refreshed_at IS '出走表を作成した日時';
+
+-- 読み取りのみ許可（書き込みは DATABASE_URL の接続から ml/race_cards.py が行う）
+ALTER TABLE race_cards ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "race_cards_select_policy" ON race_cards;
+CREATE POLICY "race_cards_select_policy" ON race_cards
+    FOR SELECT
+    USING (true);
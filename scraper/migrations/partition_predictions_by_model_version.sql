@@ -0,0 +1,132 @@
+-- =====================================================
+-- predictions を model_version ごとに分割（LIST パーティション）
+-- =====================================================
+--
+-- 複数のモデルの予測を同じレースに並べて保存する（ml/prediction_writer.py）ため、
+-- model_version ごとに子テーブルを分ける
+-- - /api/predict などの model_version を指定した読み取りは、そのバージョンの子テーブルだけを読む
+-- - 不要になったバージョンは DROP TABLE で子テーブルごと削除できる（DELETE で全件を消さずに済む）
+--
+-- 新しい model_version の子テーブルは ensure_prediction_partition() で作成する
+-- （PredictionWriter が書き込み前に呼ぶ。子テーブルがないバージョンの行は predictions_default に入る）
+--
+-- 分割したテーブルの主キーには分割キーを含める必要があるため、主キーを (id, model_version) に、
+-- model_version を NOT NULL（既存の NULL は 'latest'）に変更する
+
+BEGIN;
+
+ALTER TABLE predictions RENAME TO predictions_unpartitioned;
+ALTER INDEX IF EXISTS idx_predictions_race RENAME TO idx_predictions_race_unpartitioned;
+
+CREATE TABLE predictions (
+    id SERIAL,
+    race_id INT REFERENCES races(id) ON DELETE CASCADE,
+    boat_number INT NOT NULL,
+    predicted_win_prob FLOAT,        -- 1着確率
+    predicted_second_prob FLOAT,     -- 2着確率
+    predicted_third_prob FLOAT,      -- 3着確率
+    predicted_fourth_prob FLOAT,     -- 4着確率
+    predicted_fifth_prob FLOAT,      -- 5着確率
+    predicted_sixth_prob FLOAT,      -- 6着確率
+    model_version VARCHAR(50) NOT NULL DEFAULT 'latest',
+    created_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (id, model_version),
+    UNIQUE (race_id, boat_number, model_version)
+) PARTITION BY LIST (model_version);
+
+CREATE TABLE predictions_default PARTITION OF predictions DEFAULT;
+
+CREATE INDEX idx_predictions_race ON predictions(race_id);
+
+COMMENT ON TABLE predictions IS 'AI予測結果（model_version ごとに分割）';
+
+-- model_version の子テーブルを作成（既にあれば何もしない）
+-- 子テーブル名: predictions_<英数字にしたバージョン>_<md5 の先頭8文字>
+-- predictions_default に同じバージョンの行がある場合は、子テーブルに移してから追加する
+CREATE OR REPLACE FUNCTION ensure_prediction_partition(version TEXT)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    SELECT c.relname INTO partition_name
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'predictions'::regclass
+    AND pg_get_expr(c.relpartbound, c.oid) = format('FOR VALUES IN (%L)', version);
+
+    IF partition_name IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    partition_name := left('predictions_' || regexp_replace(lower(version), '[^a-z0-9]+', '_', 'g'), 50)
+                      || '_' || left(md5(version), 8);
+
+    IF EXISTS (SELECT 1 FROM predictions_default WHERE model_version = version) THEN
+        EXECUTE format('CREATE TABLE %I (LIKE predictions INCLUDING DEFAULTS)', partition_name);
+        EXECUTE format('WITH moved AS (DELETE FROM predictions_default WHERE model_version = %L RETURNING *) '
+                       'INSERT INTO %I SELECT * FROM moved', version, partition_name);
+        EXECUTE format('ALTER TABLE predictions ATTACH PARTITION %I FOR VALUES IN (%L)', partition_name, version);
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF predictions FOR VALUES IN (%L)', partition_name, version);
+    END IF;
+
+    RETURN partition_name;
+EXCEPTION
+    -- 別のプロセスが同時に同じバージョンの子テーブルを作成した場合
+    WHEN duplicate_table THEN
+        RETURN partition_name;
+END;
+$$;
+
+-- 既存のバージョンの子テーブルを作成してから、既存の予測を移す
+SELECT ensure_prediction_partition(version)
+FROM (SELECT DISTINCT COALESCE(model_version, 'latest') AS version FROM predictions_unpartitioned) v;
+
+INSERT INTO predictions (
+    id, race_id, boat_number,
+    predicted_win_prob, predicted_second_prob, predicted_third_prob,
+    predicted_fourth_prob, predicted_fifth_prob, predicted_sixth_prob,
+    model_version, created_at
+)
+SELECT
+    id, race_id, boat_number,
+    predicted_win_prob, predicted_second_prob, predicted_third_prob,
+    predicted_fourth_prob, predicted_fifth_prob, predicted_sixth_prob,
+    COALESCE(model_version, 'latest'), created_at
+FROM predictions_unpartitioned
+-- model_version が NULL の行は 'latest' の行と重なる場合があるため、'latest' の行を優先する
+ORDER BY model_version IS NULL
+ON CONFLICT (race_id, boat_number, model_version) DO NOTHING;
+
+SELECT setval(pg_get_serial_sequence('predictions', 'id'), COALESCE((SELECT MAX(id) FROM predictions), 0) + 1, false);
+
+DROP TABLE predictions_unpartitioned;
+
+-- RLS（supabase/enable_rls_policies.sql と同じポリシー）
+ALTER TABLE predictions ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "predictions_select_policy" ON predictions;
+CREATE POLICY "predictions_select_policy" ON predictions
+    FOR SELECT
+    USING (true);
+
+DROP POLICY IF EXISTS "predictions_insert_policy" ON predictions;
+CREATE POLICY "predictions_insert_policy" ON predictions
+    FOR INSERT
+    WITH CHECK (true);
+
+DROP POLICY IF EXISTS "predictions_update_policy" ON predictions;
+CREATE POLICY "predictions_update_policy" ON predictions
+    FOR UPDATE
+    USING (true);
+
+DROP POLICY IF EXISTS "predictions_delete_policy" ON predictions;
+CREATE POLICY "predictions_delete_policy" ON predictions
+    FOR DELETE
+    USING (true);
+
+COMMIT;
+
+ANALYZE predictions;
@@ -0,0 +1,290 @@
+"""
+HTMLテーブル抽出（パーサーバックエンド）
+
+ページを一度だけパースし、全テーブルのヘッダー行を1回の走査で取り出す
+（各テーブルの全行は最初に参照したときに1回だけ抽出する）
+Kyotei24Scraper / BoatraceDBScraper はこの結果（ParsedPage）からデータを抽出する
+
+バックエンド:
+  bs4:  BeautifulSoup(html.parser)（従来と同じ解釈）
+  lxml: lxml.html で直接走査（BeautifulSoupのオブジェクトを作らないため高速）
+
+どちらも同じ形式を返すが、閉じタグが欠けたHTMLなどでは木の解釈が異なる場合がある
+lxml を使う前に --check-parity でアーカイブ済みページの結果が一致することを確認する
+パーサーを変更したときは tests/test_page_parser.py（tests/fixtures/ の保存済みページ）も実行する
+
+使用方法:
+  python page_parser.py --archive-dir data/html_archive --source kyotei24 --check-parity
+  python page_parser.py --archive-dir data/html_archive --source boatrace_db --benchmark --limit 500
+  python page_parser.py --files page1.html page2.html --source kyotei24 --check-parity --benchmark
+"""
+import argparse
+import time
+from datetime import datetime
+
+from bs4 import BeautifulSoup
+from bs4.dammit import UnicodeDammit
+
+try:
+    import lxml.html
+    from lxml.etree import ParserError
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+
+PARSER_BACKENDS = ('bs4', 'lxml')
+DEFAULT_BACKEND = 'bs4'
+
+
+class PageTable:
+    """
+    テーブル1つ分
+
+    Attributes:
+        headers: 1行目のセルテキストのリスト（行がない場合は空リスト）
+        rows: 全行（ヘッダー行を含む）のリスト、行はセルテキストのリスト（セルのない行は空リスト）
+              行・セルは文書順で、入れ子のテーブルの行も外側のテーブルに含まれる
+    """
+
+    __slots__ = ('headers', '_element', '_extract_rows', '_rows')
+
+    def __init__(self, headers, element, extract_rows):
+        self.headers = headers
+        self._element = element
+        self._extract_rows = extract_rows
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = self._extract_rows(self._element)
+            self._element = None
+        return self._rows
+
+
+class ParsedPage:
+    """
+    パース済みページ
+
+    Attributes:
+        tables: PageTable のリスト（文書順）
+        links: <a> のテキストのリスト
+    """
+
+    __slots__ = ('tables', 'links')
+
+    def __init__(self, tables, links):
+        self.tables = tables
+        self.links = links
+
+
+def _bs4_cells(row):
+    return [cell.get_text().strip() for cell in row.find_all(['td', 'th'])]
+
+
+def _bs4_rows(table):
+    return [_bs4_cells(row) for row in table.find_all('tr')]
+
+
+def _parse_bs4(content):
+    soup = BeautifulSoup(content, 'html.parser')
+
+    tables = []
+    for table in soup.find_all('table'):
+        header_row = table.find('tr')
+        headers = _bs4_cells(header_row) if header_row else []
+        tables.append(PageTable(headers, table, _bs4_rows))
+
+    links = [link.get_text() for link in soup.find_all('a')]
+
+    return ParsedPage(tables, links)
+
+
+def _decode(content):
+    """bytes をBeautifulSoupと同じ方法で文字列に変換（lxmlは宣言がないとLatin-1で解釈するため）"""
+    if isinstance(content, bytes):
+        content = UnicodeDammit(content, is_html=True).unicode_markup
+
+    # lxml は XML宣言付きの文字列を受け付けない
+    if content.lstrip().startswith('<?xml'):
+        content = content[content.index('?>') + 2:]
+
+    return content
+
+
+def _lxml_cells(row):
+    return [cell.text_content().strip() for cell in row.iter('td', 'th')]
+
+
+def _lxml_rows(table):
+    return [_lxml_cells(row) for row in table.iter('tr')]
+
+
+def _parse_lxml(content):
+    if not HAS_LXML:
+        raise RuntimeError("lxml is not installed (pip install lxml)")
+
+    try:
+        root = lxml.html.fromstring(_decode(content))
+    except ParserError:
+        # 空のページ
+        return ParsedPage([], [])
+
+    tables = []
+    for table in root.iter('table'):
+        header_row = next(table.iter('tr'), None)
+        headers = _lxml_cells(header_row) if header_row is not None else []
+        tables.append(PageTable(headers, table, _lxml_rows))
+
+    links = [link.text_content() for link in root.iter('a')]
+
+    return ParsedPage(tables, links)
+
+
+def parse_page(content, backend=DEFAULT_BACKEND):
+    """
+    ページをパースして全テーブルを抽出
+
+    Args:
+        content: HTML（bytes または str）
+        backend: 'bs4' または 'lxml'
+
+    Returns:
+        ParsedPage
+    """
+    if backend == 'lxml':
+        return _parse_lxml(content)
+    if backend == 'bs4':
+        return _parse_bs4(content)
+    raise ValueError(f"Unknown parser backend: {backend}")
+
+
+def _load_pages(args):
+    """
+    対象ページを読み込む
+
+    Returns:
+        list: (名前, HTML bytes, パース関数) のリスト
+    """
+    from kyotei24_scraper import Kyotei24Scraper
+    from boatrace_db_scraper import BoatraceDBScraper
+
+    racer_parser = BoatraceDBScraper(connect_db=False)
+
+    def kyotei24_parser(meta):
+        race_date = datetime.strptime(meta.get('date', '2000-01-01'), '%Y-%m-%d')
+        return lambda content, backend: Kyotei24Scraper.parse_race_page(
+            content, race_date, meta.get('venue_id', 0), meta.get('race_number', 0), parser_backend=backend
+        )
+
+    def boatrace_db_parser(meta):
+        if meta.get('page', 'racer') == 'venue':
+            return lambda content, backend: racer_parser.parse_venue_page(
+                content, meta.get('venue_id', 0), meta.get('venue_name', ''), parser_backend=backend
+            )
+        return lambda content, backend: racer_parser.parse_racer_page(
+            content, meta.get('racer_number', 0), parser_backend=backend
+        )
+
+    make_parser = kyotei24_parser if args.source == 'kyotei24' else boatrace_db_parser
+
+    if args.files:
+        pages = []
+        for path in args.files[:args.limit]:
+            with open(path, 'rb') as f:
+                pages.append((path, f.read(), make_parser({})))
+        return pages
+
+    from html_archive import HtmlArchive, read_blob
+
+    archive = HtmlArchive(args.archive_dir)
+    try:
+        records = archive.records(args.source)
+    finally:
+        archive.close()
+
+    # 新しいページを優先
+    records = records[::-1][:args.limit]
+    return [
+        (r['url'], read_blob(args.archive_dir, r['path']), make_parser(r['meta']))
+        for r in records
+    ]
+
+
+def check_parity(pages):
+    """bs4 と lxml の抽出結果が一致するか確認"""
+    mismatches = 0
+
+    for name, content, parse in pages:
+        expected = parse(content, 'bs4')
+        actual = parse(content, 'lxml')
+
+        if expected != actual:
+            mismatches += 1
+            print(f"  MISMATCH: {name}")
+
+    print(f"Parity: {len(pages) - mismatches}/{len(pages)} pages identical")
+    return mismatches == 0
+
+
+def benchmark(pages, repeat=3):
+    """バックエンドごとのパース速度を計測"""
+    total_bytes = sum(len(content) for _, content, _ in pages)
+
+    for backend in PARSER_BACKENDS:
+        if backend == 'lxml' and not HAS_LXML:
+            continue
+
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _, content, parse in pages:
+                parse(content, backend)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"  {backend:5s}: {len(pages) / best:8.1f} pages/s  "
+              f"{total_bytes / best / 1024 / 1024:6.1f} MB/s  ({best:.2f}s for {len(pages)} pages)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare and benchmark HTML parser backends')
+    parser.add_argument('--archive-dir', type=str, default=None,
+                        help='HTML archive to read pages from (see html_archive.py)')
+    parser.add_argument('--files', nargs='+', default=None,
+                        help='HTML files to use instead of the archive')
+    parser.add_argument('--source', type=str, default='kyotei24',
+                        choices=['kyotei24', 'boatrace_db'],
+                        help='Page type (default: kyotei24)')
+    parser.add_argument('--limit', type=int, default=1000,
+                        help='Maximum pages to use (default: 1000)')
+    parser.add_argument('--check-parity', action='store_true',
+                        help='Check that bs4 and lxml produce identical results')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Measure parse throughput per backend')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Benchmark repetitions, best is reported (default: 3)')
+    args = parser.parse_args()
+
+    if not args.archive_dir and not args.files:
+        parser.error('--archive-dir or --files is required')
+
+    pages = _load_pages(args)
+    print(f"=== {len(pages)} {args.source} pages ===")
+
+    if not pages:
+        return
+
+    ok = True
+    if args.check_parity:
+        ok = check_parity(pages)
+    if args.benchmark:
+        benchmark(pages, repeat=args.repeat)
+
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+開催日程の取得
+
+boatrace.jp の日別開催一覧（/owpc/pc/race/index?hd=YYYYMMDD）を1日1回だけ取得し、
+その日に開催している会場とレース数を求める
+収集スクリプトは全24会場×12レースを総当たりせず、開催している枠だけを取得する
+
+取得結果は CrawlState（crawl_state.py）にキャッシュする
+- 過去の日付: 日程は変わらないため再取得しない
+- 当日・未来の日付: REFRESH_INTERVAL ごとに再取得（中止・追加に対応）
+
+一覧ページを取得できない日、または開催会場を1つも読み取れなかった日は None を返し、
+呼び出し側は従来どおり全会場を対象にする
+
+使用方法:
+  python race_schedule.py 2025-12-07
+  python race_schedule.py 2025-12-01 --end-date 2025-12-31 --crawl-state crawl_state.sqlite
+"""
+import argparse
+import re
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+
+INDEX_URL = "https://www.boatrace.jp/owpc/pc/race/index?hd={date}"
+
+# 当日・未来の日程を再取得する間隔
+REFRESH_INTERVAL = timedelta(hours=1)
+
+DEFAULT_RACE_COUNT = 12
+
+# 会場ごとのレース一覧へのリンク（ヘッダーの会場紹介リンク stadium?jcd= は対象外）
+RACEINDEX_RE = re.compile(r'raceindex\?jcd=(\d{2})(?:&amp;|&)hd=(\d{8})')
+# 出走表へのリンク（あればレース数の判定に使う）
+RACELIST_RE = re.compile(r'racelist\?rno=(\d{1,2})(?:&amp;|&)jcd=(\d{2})(?:&amp;|&)hd=(\d{8})')
+
+
+def parse_schedule_page(html, target_date, max_races=DEFAULT_RACE_COUNT):
+    """
+    開催一覧ページから開催会場とレース数を抽出
+
+    Args:
+        html: 開催一覧ページのHTML（str）
+        target_date: date/datetime
+        max_races: レース数の上限（出走表リンクがない会場はこの値とする）
+
+    Returns:
+        dict: {会場ID: レース数}
+    """
+    date_str = target_date.strftime('%Y%m%d')
+
+    venues = {}
+    for jcd, hd in RACEINDEX_RE.findall(html):
+        if hd == date_str:
+            venues[int(jcd)] = max_races
+
+    race_numbers = {}
+    for rno, jcd, hd in RACELIST_RE.findall(html):
+        if hd == date_str and int(jcd) in venues:
+            race_numbers[int(jcd)] = max(race_numbers.get(int(jcd), 0), int(rno))
+
+    for venue_id, last_race in race_numbers.items():
+        venues[venue_id] = min(last_race, max_races)
+
+    return venues
+
+
+class RaceSchedule:
+    """日付ごとの開催会場・レース数を取得（CrawlState にキャッシュ）"""
+
+    def __init__(self, crawl_state=None, delay=1.0, archive=None):
+        """
+        Args:
+            crawl_state: キャッシュ先の CrawlState（Noneの場合は実行中のみ保持）
+            delay: 一覧ページのリクエスト間隔（秒）
+            archive: 取得したHTMLを保存する HtmlArchive（Noneの場合は保存しない）
+        """
+        self.crawl_state = crawl_state
+        self.delay = delay
+        self.archive = archive
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        })
+        self._memory = {}
+        self.stats = {'cached': 0, 'fetched': 0, 'unavailable': 0}
+
+    def fetch_day(self, target_date, max_races=DEFAULT_RACE_COUNT):
+        """
+        1日分の開催一覧ページを取得
+
+        Returns:
+            dict: {会場ID: レース数}、取得・解析できなかった場合はNone
+        """
+        url = INDEX_URL.format(date=target_date.strftime('%Y%m%d'))
+
+        try:
+            response = self.session.get(url, timeout=30)
+        except Exception as e:
+            print(f"  Schedule: failed to fetch {url} - {e}")
+            return None
+
+        if self.archive is not None:
+            self.archive.put(url, response.content, 'schedule', status=response.status_code,
+                             meta={'date': target_date.strftime('%Y-%m-%d')})
+
+        if response.status_code != 200:
+            print(f"  Schedule: failed to fetch {url} (status: {response.status_code})")
+            return None
+
+        response.encoding = response.apparent_encoding
+        venues = parse_schedule_page(response.text, target_date, max_races)
+
+        # レイアウト変更などで読み取れない場合に全レースを取りこぼさないよう、空の結果は使わない
+        if not venues:
+            print(f"  Schedule: no venues found on {url}")
+            return None
+
+        return venues
+
+    def _is_fresh(self, target_date, fetched_at, now):
+        # 翌日以降に取得した日程は確定済み
+        if fetched_at.date() > target_date.date():
+            return True
+        return now - fetched_at < REFRESH_INTERVAL
+
+    def get(self, start_date, end_date, max_races=DEFAULT_RACE_COUNT):
+        """
+        期間内の開催日程を取得
+
+        Args:
+            start_date: datetime
+            end_date: datetime
+            max_races: レース数の上限
+
+        Returns:
+            dict: {date: {会場ID: レース数} または None（不明）}
+        """
+        now = datetime.now()
+        days = [start_date + timedelta(days=day) for day in range((end_date - start_date).days + 1)]
+
+        cached = self.crawl_state.get_schedule(days) if self.crawl_state is not None else {}
+
+        schedule = {}
+        for day in days:
+            key = day.strftime('%Y-%m-%d')
+            entry = self._memory.get(key) or cached.get(key)
+
+            if entry and self._is_fresh(day, entry[1], now):
+                self.stats['cached'] += 1
+                venues = entry[0]
+            else:
+                if self.stats['fetched'] > 0:
+                    time.sleep(self.delay)
+                self.stats['fetched'] += 1
+
+                venues = self.fetch_day(day, max_races)
+                if venues is None:
+                    self.stats['unavailable'] += 1
+                    schedule[day.date()] = None
+                    continue
+
+                self._memory[key] = (venues, now)
+                if self.crawl_state is not None:
+                    self.crawl_state.save_schedule(day, venues, now=now)
+
+            schedule[day.date()] = {
+                venue_id: min(race_count, max_races) for venue_id, race_count in venues.items()
+            }
+
+        return schedule
+
+    def close(self):
+        self.session.close()
+
+
+def load_schedule(start_date, end_date, crawl_state=None, max_races=DEFAULT_RACE_COUNT, archive=None):
+    """
+    期間内の開催日程を取得して概要を表示
+
+    Returns:
+        dict: RaceSchedule.get() と同じ形式
+    """
+    race_schedule = RaceSchedule(crawl_state=crawl_state, archive=archive)
+    try:
+        schedule = race_schedule.get(start_date, end_date, max_races)
+    finally:
+        race_schedule.close()
+
+    known = [venues for venues in schedule.values() if venues is not None]
+    stats = race_schedule.stats
+    print(f"Schedule: {len(known)}/{len(schedule)} days known "
+          f"(cached: {stats['cached']}, fetched: {stats['fetched']}, unavailable: {stats['unavailable']}), "
+          f"{sum(sum(v.values()) for v in known)} scheduled races")
+
+    return schedule
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show held venues and race counts from the boatrace.jp index')
+    parser.add_argument('date', type=str, help='Date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', type=str, default=None, help='Last date (YYYY-MM-DD, default: same as date)')
+    parser.add_argument('--crawl-state', type=str, default=None, help='SQLite crawl state file used as cache')
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.date, '%Y-%m-%d')
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d') if args.end_date else start_date
+
+    crawl_state = None
+    if args.crawl_state:
+        from crawl_state import CrawlState
+        crawl_state = CrawlState(args.crawl_state)
+
+    try:
+        schedule = load_schedule(start_date, end_date, crawl_state=crawl_state)
+    finally:
+        if crawl_state is not None:
+            crawl_state.close()
+
+    for day, venues in sorted(schedule.items()):
+        if venues is None:
+            print(f"{day}: unknown")
+        else:
+            print(f"{day}: " + ', '.join(f"{venue_id:02d}({race_count}R)" for venue_id, race_count in sorted(venues.items())))
+
+
+if __name__ == '__main__':
+    main()
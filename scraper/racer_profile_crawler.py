@@ -0,0 +1,247 @@
+"""
+boatrace-db.net 選手ページの非同期クローラー
+
+BoatraceDBScraper.collect_all_racer_stats の非同期版
+- 取得: aiohttp セッションを共有し、RateLimiter.slot() で同時数・頻度を制限
+- 条件付きリクエスト: 前回の ETag / Last-Modified を送り、304（変更なし）の選手はパース・保存しない
+- パース: プロセスプールで実行
+- DB書き込み: batch_size 人ごとに BoatraceDBScraper.flush_racer_stats() でまとめて保存
+
+ETag / Last-Modified は racer_detailed_stats の http_etag / http_last_modified 列に保存する
+（migrations/add_racer_http_validators.sql、未適用の場合は条件付きリクエストを使わない）
+
+boatrace_db_scraper.py の --async オプションから利用する
+"""
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from async_collector import build_rate_limiter, RETRY_STATUSES
+
+
+# パース専用の BoatraceDBScraper（ワーカープロセスごとに1つ）
+_parser = None
+
+
+def _init_parser(parser_backend):
+    global _parser
+    from boatrace_db_scraper import BoatraceDBScraper
+    _parser = BoatraceDBScraper(connect_db=False, parser_backend=parser_backend)
+
+
+def _parse_racer(content, racer_number):
+    return _parser.parse_racer_page(content, racer_number)
+
+
+async def fetch_racer_page(session, rate_limiter, url, validators=None, max_retries=5, timeout=60):
+    """
+    選手ページを取得（validators があれば条件付きリクエスト）
+
+    Returns:
+        tuple: (status, content, (ETag, Last-Modified))
+               304 の場合は content が None
+               status は HTTPステータス（通信エラーで全試行失敗した場合は None）
+    """
+    headers = {}
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    status = None
+
+    for attempt in range(max_retries):
+        try:
+            async with rate_limiter.slot(url):
+                async with session.get(url, headers=headers,
+                                       timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    status = response.status
+                    rate_limiter.report(url, status, response.headers.get('Retry-After'))
+
+                    if status == 200:
+                        content = await response.read()
+                        return status, content, (response.headers.get('ETag'),
+                                                 response.headers.get('Last-Modified'))
+
+                    if status not in RETRY_STATUSES:
+                        return status, None, None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = None
+            if attempt == max_retries - 1:
+                print(f"  Error fetching {url}: {e}")
+
+        # 429 / 503 の待機は RateLimiter が行う
+        if attempt < max_retries - 1 and status not in (429, 503):
+            await asyncio.sleep(min(30, 2 ** attempt))
+
+    return status, None, None
+
+
+async def _fetch_worker(scraper, session, rate_limiter, executor, racer_queue, db_queue,
+                        validators, stats, max_retries):
+    """選手番号を取り出して取得・パースし、結果をDBキューへ渡す"""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        racer_number = await racer_queue.get()
+        if racer_number is None:
+            racer_queue.task_done()
+            return
+
+        url = f"{scraper.base_url}/racer/index2/regno/{racer_number}/"
+
+        try:
+            status, content, new_validators = await fetch_racer_page(
+                session, rate_limiter, url, validators.get(racer_number), max_retries=max_retries
+            )
+
+            if status == 304:
+                stats['not_modified'] += 1
+                continue
+
+            if content is None:
+                print(f"  Failed to fetch racer {racer_number} (status: {status})")
+                stats['failed'] += 1
+                continue
+
+            if scraper.archive is not None:
+                await asyncio.to_thread(scraper.archive.put, url, content, 'boatrace_db', 200,
+                                        {'page': 'racer', 'racer_number': racer_number})
+
+            racer_data = await loop.run_in_executor(executor, _parse_racer, content, racer_number)
+            await db_queue.put((racer_data, new_validators))
+
+        except Exception as e:
+            print(f"  Error fetching racer {racer_number}: {e}")
+            stats['failed'] += 1
+        finally:
+            stats['processed'] += 1
+            racer_queue.task_done()
+
+
+async def _db_consumer(scraper, db_queue, batch_size, stats, conditional):
+    """
+    パース済みの選手データを batch_size 人ごとにまとめて保存
+
+    conditional の場合は ETag / Last-Modified も保存する（返されなかった場合は消して無条件で取得させる）
+    """
+    batch = []
+    batch_validators = {}
+
+    async def flush():
+        saved = await asyncio.to_thread(scraper.flush_racer_stats, batch, batch_validators)
+        stats['saved'] += saved
+        stats['failed'] += len(batch) - saved
+        batch.clear()
+        batch_validators.clear()
+
+    while True:
+        item = await db_queue.get()
+        if item is None:
+            if batch:
+                await flush()
+            db_queue.task_done()
+            return
+
+        racer_data, validators = item
+        batch.append(racer_data)
+        if conditional:
+            batch_validators[racer_data['racer_number']] = validators
+
+        if len(batch) >= batch_size:
+            await flush()
+        db_queue.task_done()
+
+
+async def crawl_racer_profiles(scraper, racers, delay=2.0, concurrency=4, batch_size=50, parse_workers=2,
+                               conditional=True, max_retries=5, progress_interval=60):
+    """
+    選手ページを非同期で取得して racer_detailed_stats を更新
+
+    Args:
+        scraper: BoatraceDBScraper（DB接続・アーカイブ・パーサー設定を使用）
+        racers: 選手番号のリスト
+        delay: 平均リクエスト間隔（秒）
+        concurrency: 同時リクエスト数
+        batch_size: まとめてDBに書き込む選手数
+        parse_workers: パース用プロセス数
+        conditional: 前回の ETag / Last-Modified で条件付きリクエストを行う
+        max_retries: 最大再試行回数
+        progress_interval: 進捗を表示する間隔（秒）
+
+    Returns:
+        dict: saved / not_modified / failed 件数
+    """
+    stats = {'total': len(racers), 'processed': 0, 'saved': 0, 'not_modified': 0, 'failed': 0}
+
+    validators = {}
+    if conditional:
+        if await asyncio.to_thread(scraper.has_http_validator_columns):
+            validators = await asyncio.to_thread(scraper.get_http_validators, racers)
+            print(f"Conditional requests: {len(validators)}/{len(racers)} racers have a stored ETag/Last-Modified")
+        else:
+            print("[WARNING] racer_detailed_stats.http_etag / http_last_modified がありません"
+                  "（scraper/migrations/add_racer_http_validators.sql を実行してください）。"
+                  "条件付きリクエストを使わずに取得します")
+            conditional = False
+
+    rate_limiter = build_rate_limiter(delay, concurrency)
+    racer_queue = asyncio.Queue()
+    db_queue = asyncio.Queue(maxsize=max(batch_size * 2, 10))
+
+    for racer_number in racers:
+        racer_queue.put_nowait(racer_number)
+    for _ in range(concurrency):
+        racer_queue.put_nowait(None)
+
+    # requests.Session と同じヘッダー（brotli は aiohttp の追加依存のため除く）
+    headers = dict(scraper.session.headers)
+    headers['Accept-Encoding'] = 'gzip, deflate'
+
+    start_time = time.monotonic()
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+
+    with ProcessPoolExecutor(max_workers=max(1, parse_workers), initializer=_init_parser,
+                             initargs=(scraper.parser_backend,)) as executor:
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+            consumer = asyncio.create_task(_db_consumer(scraper, db_queue, batch_size, stats, conditional))
+            workers = [
+                asyncio.create_task(_fetch_worker(
+                    scraper, session, rate_limiter, executor,
+                    racer_queue, db_queue, validators, stats, max_retries
+                ))
+                for _ in range(concurrency)
+            ]
+
+            # 進捗表示
+            pending = set(workers)
+            while pending:
+                _, pending = await asyncio.wait(pending, timeout=progress_interval)
+                elapsed = time.monotonic() - start_time
+                print(f"  Progress: {stats['processed']}/{len(racers)} racers "
+                      f"(saved: {stats['saved']}, not modified: {stats['not_modified']}, "
+                      f"failed: {stats['failed']}, {elapsed:.0f}s)")
+
+            await asyncio.gather(*workers)
+
+            # 残りを書き込んでコンシューマを終了
+            await db_queue.put(None)
+            await consumer
+
+    stats['seconds'] = time.monotonic() - start_time
+    stats['rate_limiter'] = rate_limiter.metrics()
+
+    print(f"\n=== Collection Complete (async) ===")
+    print(f"Saved: {stats['saved']}")
+    print(f"Not modified (304): {stats['not_modified']}")
+    print(f"Failed: {stats['failed']}")
+    print(f"Total: {stats['total']}")
+    print(f"Elapsed: {stats['seconds']:.1f}s")
+    rate_limiter.print_metrics()
+
+    return stats
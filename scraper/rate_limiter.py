@@ -1,6 +1,118 @@
+"""
+リクエストレート制限（ホスト別 GCRA）
+
+時間窓（秒・分・時間・日）ごとに GCRA（Generic Cell Rate Algorithm）で制限する
+各窓は「次に許可される理論上の時刻（TAT）」だけを持つため、判定・更新は O(1)
+
+- 窓ごとの許容量: 窓の長さの中で requests_per_xxx 件まで（1件未満の場合は 1/レート 秒間隔）
+- ホストごとに別の予算・同時実行数を持つ（host_limits で個別に上書き可能）
+- 429 / 503 を受けたら Retry-After（なければ指数バックオフ）まで停止し、間隔を広げる
+  その後、成功が続くと元の間隔に戻す
+
+使い方:
+    limiter = RateLimiter(requests_per_second=0.5, concurrent_requests=2)
+
+    async with limiter.slot(url):
+        async with session.get(url) as response:
+            limiter.report(url, response.status, response.headers.get('Retry-After'))
+
+slot() はリクエストが終わるまで同時実行数の枠を保持する
+acquire() は頻度の制限のみ（同時実行数は制限しない）
+"""
 import asyncio
 import time
-from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+
+# 429 / 503 を受けたときのバックオフ
+THROTTLE_STATUSES = {429, 503}
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 600.0
+
+# 間隔を広げる倍率の上限と、倍率を半分に戻すまでの連続成功数
+MAX_SLOWDOWN = 16.0
+RECOVERY_SUCCESSES = 20
+
+
+def parse_retry_after(value, now=None):
+    """
+    Retry-After ヘッダーを秒数に変換
+
+    Args:
+        value: 秒数、またはHTTP日付
+        now: 基準時刻（テスト用）
+
+    Returns:
+        float: 待機秒数（解釈できない場合はNone）
+    """
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+class _Window:
+    """1つの時間窓の GCRA 状態"""
+
+    __slots__ = ('interval', 'tolerance', 'tat')
+
+    def __init__(self, window_seconds, max_requests):
+        # 1件あたりの間隔と、まとめて送ってよい時間幅（バースト許容量）
+        self.interval = window_seconds / max_requests
+        self.tolerance = max(0.0, window_seconds - self.interval)
+        self.tat = 0.0
+
+    def earliest(self):
+        """次のリクエストを送れる最も早い時刻"""
+        return self.tat - self.tolerance
+
+    def consume(self, at, slowdown):
+        self.tat = max(self.tat, at) + self.interval * slowdown
+
+
+class _HostState:
+    """ホストごとの制限状態と計測値"""
+
+    def __init__(self, limits, concurrent_requests):
+        self.windows = [
+            _Window(window_seconds, max_requests)
+            for window_seconds, max_requests in limits
+            if max_requests
+        ]
+        self.concurrent_requests = concurrent_requests
+        self.semaphore = asyncio.Semaphore(concurrent_requests)
+
+        self.blocked_until = 0.0
+        # 停止で予約済みの送信時刻を後ろにずらした累計秒数
+        self.shift = 0.0
+        self.backoff = BACKOFF_BASE
+        self.slowdown = 1.0
+        self.successes = 0
+
+        self.requests = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.first_request = None
+        self.last_request = None
 
 
 class RateLimiter:
@@ -8,11 +120,14 @@ class RateLimiter:
     複数の時間窓でリクエストレートを制限
 
     Args:
-        requests_per_second: 秒あたりのリクエスト数
+        requests_per_second: 秒あたりのリクエスト数（1未満なら 1/値 秒に1件）
         requests_per_minute: 分あたりのリクエスト数
         requests_per_hour: 時間あたりのリクエスト数
         requests_per_day: 日あたりのリクエスト数
-        concurrent_requests: 同時実行可能なリクエスト数
+        concurrent_requests: 同時実行可能なリクエスト数（slot() で制限）
+        host_limits: {ホスト名: {上記の引数名: 値}} ホストごとの上書き
+
+    None を指定した窓は制限しない
     """
 
     def __init__(
@@ -21,52 +136,150 @@ class RateLimiter:
         requests_per_minute=20,    # 1分に20リクエスト
         requests_per_hour=500,     # 1時間に500リクエスト
         requests_per_day=10000,    # 1日10,000リクエスト
-        concurrent_requests=3       # 同時実行3つまで
+        concurrent_requests=3,     # 同時実行3つまで
+        host_limits=None
     ):
         self.requests_per_second = requests_per_second
         self.requests_per_minute = requests_per_minute
         self.requests_per_hour = requests_per_hour
         self.requests_per_day = requests_per_day
         self.concurrent_requests = concurrent_requests
+        self.host_limits = host_limits or {}
 
-        self.request_times = deque()
-        self.semaphore = asyncio.Semaphore(concurrent_requests)
+        self._hosts = {}
+
+    def _host_state(self, url):
+        host = urlsplit(url).netloc if url else ''
+        state = self._hosts.get(host)
+        if state is None:
+            config = {
+                'requests_per_second': self.requests_per_second,
+                'requests_per_minute': self.requests_per_minute,
+                'requests_per_hour': self.requests_per_hour,
+                'requests_per_day': self.requests_per_day,
+                'concurrent_requests': self.concurrent_requests,
+            }
+            config.update(self.host_limits.get(host, {}))
+            limits = [
+                (1, config['requests_per_second']),
+                (60, config['requests_per_minute']),
+                (3600, config['requests_per_hour']),
+                (86400, config['requests_per_day']),
+            ]
+            state = self._hosts[host] = _HostState(limits, config['concurrent_requests'])
+        return state
+
+    async def acquire(self, url=None):
+        """
+        リクエスト許可を取得（頻度のみ制限）
+
+        送信時刻を予約してから待機するため、待機中の他のリクエストと時刻が重ならない
+        待機中に 429 / 503 で停止された場合は report() が予約全体を後ろにずらすので、
+        予約は取り直さずにずれた分だけ待つ
+        """
+        state = self._host_state(url)
+
+        now = time.monotonic()
+        start = max([now, state.blocked_until] + [w.earliest() for w in state.windows])
+        for window in state.windows:
+            window.consume(start, state.slowdown)
+        shift = state.shift
+
+        while True:
+            now = time.monotonic()
+            wait = start + (state.shift - shift) - now
+            if wait <= 0:
+                break
+            state.wait_seconds += wait
+            await asyncio.sleep(wait)
+
+        now = time.monotonic()
+        state.requests += 1
+        if state.first_request is None:
+            state.first_request = now
+        state.last_request = now
+
+    @asynccontextmanager
+    async def slot(self, url=None):
+        """
+        同時実行数の枠を確保して頻度制限を待つ（ブロックを抜けるまで枠を保持）
+        """
+        state = self._host_state(url)
+
+        async with state.semaphore:
+            await self.acquire(url)
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                yield
+            finally:
+                state.in_flight -= 1
+
+    def report(self, url, status, retry_after=None):
+        """
+        レスポンスのステータスを通知
+
+        429 / 503 の場合は Retry-After（なければ指数バックオフ）までそのホストへの送信を止め、
+        間隔を2倍に広げる。成功が RECOVERY_SUCCESSES 回続くと間隔を半分に戻す
+
+        Args:
+            url: リクエストしたURL
+            status: HTTPステータス（通信エラーの場合はNone）
+            retry_after: Retry-After ヘッダーの値
+        """
+        state = self._host_state(url)
+
+        if status in THROTTLE_STATUSES:
+            wait = parse_retry_after(retry_after)
+            if wait is None:
+                wait = state.backoff
+                state.backoff = min(state.backoff * 2, BACKOFF_MAX)
+
+            # 予約済みの送信時刻を停止が延びた分だけ後ろにずらす
+            now = time.monotonic()
+            delay = now + wait - max(now, state.blocked_until)
+            if delay > 0:
+                state.blocked_until = now + wait
+                state.shift += delay
+                for window in state.windows:
+                    window.tat += delay
+            state.slowdown = min(state.slowdown * 2, MAX_SLOWDOWN)
+            state.successes = 0
+            state.throttled += 1
+            return
+
+        if status is not None and status < 500:
+            state.successes += 1
+            if state.successes >= RECOVERY_SUCCESSES:
+                state.successes = 0
+                state.backoff = BACKOFF_BASE
+                state.slowdown = max(1.0, state.slowdown / 2)
+
+    def metrics(self):
+        """
+        ホストごとの計測値
+
+        Returns:
+            dict: {ホスト名: {requests, throttled, wait_seconds, max_in_flight,
+                              slowdown, requests_per_second}}
+        """
+        result = {}
+        for host, state in self._hosts.items():
+            elapsed = (state.last_request - state.first_request) if state.requests > 1 else 0.0
+            result[host] = {
+                'requests': state.requests,
+                'throttled': state.throttled,
+                'wait_seconds': round(state.wait_seconds, 3),
+                'max_in_flight': state.max_in_flight,
+                'slowdown': state.slowdown,
+                'requests_per_second': round((state.requests - 1) / elapsed, 3) if elapsed > 0 else None,
+            }
+        return result
 
-    async def acquire(self):
-        """リクエスト許可を取得"""
-        async with self.semaphore:
-            await self._wait_if_needed()
-            self.request_times.append(time.time())
-
-    async def _wait_if_needed(self):
-        """必要に応じて待機"""
-        now = time.time()
-
-        # 古いレコードを削除
-        self._cleanup_old_requests(now)
-
-        # 各制限をチェック
-        wait_time = max(
-            self._check_limit(now, 1, self.requests_per_second),
-            self._check_limit(now, 60, self.requests_per_minute),
-            self._check_limit(now, 3600, self.requests_per_hour),
-            self._check_limit(now, 86400, self.requests_per_day)
-        )
-
-        if wait_time > 0:
-            await asyncio.sleep(wait_time)
-
-    def _cleanup_old_requests(self, now):
-        """24時間以上前のレコードを削除"""
-        while self.request_times and now - self.request_times[0] > 86400:
-            self.request_times.popleft()
-
-    def _check_limit(self, now, window_seconds, max_requests):
-        """指定期間内のリクエスト数をチェック"""
-        cutoff = now - window_seconds
-        recent_requests = sum(1 for t in self.request_times if t > cutoff)
-
-        if recent_requests >= max_requests:
-            oldest_in_window = next(t for t in self.request_times if t > cutoff)
-            return (oldest_in_window + window_seconds) - now
-        return 0
+    def print_metrics(self):
+        """計測値を表示"""
+        for host, m in self.metrics().items():
+            rate = f"{m['requests_per_second']:.2f} req/s" if m['requests_per_second'] else '-'
+            print(f"  Rate limiter {host or '(default)'}: {m['requests']} requests ({rate}), "
+                  f"throttled {m['throttled']}, waited {m['wait_seconds']:.1f}s, "
+                  f"max in flight {m['max_in_flight']}, slowdown x{m['slowdown']:g}")
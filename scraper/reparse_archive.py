@@ -0,0 +1,305 @@
+"""
+HTMLアーカイブからの再パーススクリプト
+
+html_archive.py に保存したHTMLをネットワークにアクセスせずに再パースし、DBの行を作り直す
+パーサーを修正したときに、数ヶ月分のページを再クロールせずに反映できる
+パースはプロセスプールで並列実行し、DB書き込みはメインプロセスで行う
+
+使用方法:
+  python reparse_archive.py --archive-dir data/html_archive --source kyotei24 --start-date 2025-01-01 --end-date 2025-06-30
+  python reparse_archive.py --archive-dir data/html_archive --source boatrace_db
+  python reparse_archive.py --archive-dir data/html_archive --source all --workers 8
+  python reparse_archive.py --archive-dir data/html_archive --summary
+
+各スクレイパーの --reparse オプションからも呼び出される
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from html_archive import HtmlArchive, read_blob
+from page_parser import DEFAULT_BACKEND, PARSER_BACKENDS
+
+
+# パース専用の BoatraceDBScraper（ワーカープロセスごとに1つ）
+_boatrace_db_parser = None
+
+
+def _init_boatrace_db_worker(parser_backend):
+    global _boatrace_db_parser
+    from boatrace_db_scraper import BoatraceDBScraper
+    _boatrace_db_parser = BoatraceDBScraper(connect_db=False, parser_backend=parser_backend)
+
+
+def _parse_kyotei24(task):
+    """ワーカー: kyotei.fun のレースページを再パース"""
+    from kyotei24_scraper import Kyotei24Scraper
+
+    root, record, parser_backend = task
+    meta = record['meta']
+
+    try:
+        content = read_blob(root, record['path'])
+        race_date = datetime.strptime(meta['date'], '%Y-%m-%d')
+        return Kyotei24Scraper.parse_race_page(content, race_date, meta['venue_id'], meta['race_number'],
+                                               parser_backend=parser_backend), None
+    except Exception as e:
+        return None, f"{record['url']}: {e}"
+
+
+def _parse_boatrace_db(task):
+    """ワーカー: boatrace-db.net の選手・会場ページを再パース"""
+    root, record = task
+    meta = record['meta']
+
+    try:
+        content = read_blob(root, record['path'])
+        if meta['page'] == 'racer':
+            return _boatrace_db_parser.parse_racer_page(content, meta['racer_number']), None
+        return _boatrace_db_parser.parse_venue_page(content, meta['venue_id'], meta['venue_name']), None
+    except Exception as e:
+        return None, f"{record['url']}: {e}"
+
+
+def _parse_weather(task):
+    """ワーカー: 会場公式サイトの天気ページを再パース（記録時刻は取得時刻）"""
+    from weather_scraper import WeatherScraper
+
+    root, record = task
+
+    try:
+        content = read_blob(root, record['path'])
+        return WeatherScraper.parse_weather_data(content, record['meta']['venue_id'],
+                                                 record_datetime=record['fetched_at']), None
+    except Exception as e:
+        return None, f"{record['url']}: {e}"
+
+
+def _print_result(name, stats, elapsed):
+    print(f"\n=== Reparse complete: {name} ===")
+    print(f"Pages: {stats['pages']}")
+    print(f"Saved: {stats['saved']}")
+    print(f"Skipped (no data): {stats['skipped']}")
+    print(f"Failed: {stats['failed']}")
+    if elapsed > 0:
+        print(f"Elapsed: {elapsed:.1f}s ({stats['pages'] / elapsed:.1f} pages/s)")
+
+
+def reparse_kyotei24(archive_dir, start_date=None, end_date=None, max_venues=24, max_races=12,
+                     workers=None, batch_size=200, parser_backend=DEFAULT_BACKEND):
+    """
+    kyotei.fun のレースページを再パースして races / race_entries を更新
+
+    Args:
+        archive_dir: アーカイブのディレクトリ
+        start_date: 対象レース日の開始（datetime、Noneの場合は制限なし）
+        end_date: 対象レース日の終了（datetime、Noneの場合は制限なし）
+        max_venues: 対象会場（1〜max_venues）
+        max_races: 対象レース番号（1〜max_races）
+        workers: パース用プロセス数（Noneの場合はCPU数）
+        batch_size: まとめてDBに書き込むレース数
+        parser_backend: HTMLパーサー（'bs4' / 'lxml'）
+    """
+    from kyotei24_scraper import Kyotei24Scraper
+
+    archive = HtmlArchive(archive_dir)
+    try:
+        records = archive.records('kyotei24')
+    finally:
+        archive.close()
+
+    start_str = start_date.strftime('%Y-%m-%d') if start_date else None
+    end_str = end_date.strftime('%Y-%m-%d') if end_date else None
+    records = [
+        r for r in records
+        if (start_str is None or r['meta']['date'] >= start_str)
+        and (end_str is None or r['meta']['date'] <= end_str)
+        and r['meta']['venue_id'] <= max_venues
+        and r['meta']['race_number'] <= max_races
+    ]
+
+    print(f"=== Reparse kyotei24 from {archive_dir} ===")
+    print(f"Pages: {len(records)} (workers: {workers or os.cpu_count()}, parser: {parser_backend})")
+    print()
+
+    stats = {'pages': len(records), 'saved': 0, 'skipped': 0, 'failed': 0}
+    start_time = time.monotonic()
+    scraper = Kyotei24Scraper(batch_size=batch_size)
+
+    try:
+        tasks = [(archive_dir, r, parser_backend) for r in records]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for race_data, error in executor.map(_parse_kyotei24, tasks, chunksize=32):
+                if error:
+                    print(f"  Parse error {error}")
+                    stats['failed'] += 1
+                elif race_data and race_data.get('entries'):
+                    scraper.buffer_race(race_data)
+                    stats['saved'] += 1
+                else:
+                    stats['skipped'] += 1
+    finally:
+        scraper.close()
+
+    # バッファ書き込みで失敗したレースを反映
+    stats['saved'] -= scraper.write_stats['failed_races']
+    stats['failed'] += scraper.write_stats['failed_races']
+
+    _print_result('kyotei24', stats, time.monotonic() - start_time)
+    return stats
+
+
+def reparse_boatrace_db(archive_dir, pages=('racer', 'venue'), workers=None, parser_backend=DEFAULT_BACKEND):
+    """
+    boatrace-db.net の選手・会場ページを再パースして racer_detailed_stats / venue_detailed_stats を更新
+
+    Args:
+        archive_dir: アーカイブのディレクトリ
+        pages: 対象ページ種別（'racer' / 'venue'）
+        workers: パース用プロセス数（Noneの場合はCPU数）
+        parser_backend: HTMLパーサー（'bs4' / 'lxml'）
+    """
+    from boatrace_db_scraper import BoatraceDBScraper
+
+    archive = HtmlArchive(archive_dir)
+    try:
+        records = [r for r in archive.records('boatrace_db') if r['meta'].get('page') in pages]
+    finally:
+        archive.close()
+
+    print(f"=== Reparse boatrace_db from {archive_dir} ===")
+    print(f"Pages: {len(records)} (workers: {workers or os.cpu_count()}, parser: {parser_backend})")
+    print()
+
+    stats = {'pages': len(records), 'saved': 0, 'skipped': 0, 'failed': 0}
+    start_time = time.monotonic()
+    scraper = BoatraceDBScraper()
+
+    try:
+        tasks = [(archive_dir, r) for r in records]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_boatrace_db_worker,
+                                 initargs=(parser_backend,)) as executor:
+            for record, (data, error) in zip(records, executor.map(_parse_boatrace_db, tasks, chunksize=16)):
+                if error:
+                    print(f"  Parse error {error}")
+                    stats['failed'] += 1
+                    continue
+
+                if record['meta']['page'] == 'racer':
+                    saved = scraper.save_racer_stats(data)
+                else:
+                    saved = scraper.save_venue_stats(data)
+
+                if saved:
+                    stats['saved'] += 1
+                else:
+                    stats['failed'] += 1
+    finally:
+        scraper.close()
+
+    _print_result('boatrace_db', stats, time.monotonic() - start_time)
+    return stats
+
+
+def reparse_weather(archive_dir, workers=None):
+    """
+    会場公式サイトの天気ページを再パースして weather_data を更新
+
+    Args:
+        archive_dir: アーカイブのディレクトリ
+        workers: パース用プロセス数（Noneの場合はCPU数）
+    """
+    from weather_scraper import WeatherScraper
+
+    archive = HtmlArchive(archive_dir)
+    try:
+        records = archive.records('weather', latest_only=False)
+    finally:
+        archive.close()
+
+    print(f"=== Reparse weather from {archive_dir} ===")
+    print(f"Pages: {len(records)} (workers: {workers or os.cpu_count()})")
+    print()
+
+    stats = {'pages': len(records), 'saved': 0, 'skipped': 0, 'failed': 0}
+    start_time = time.monotonic()
+    weather_data_list = []
+
+    tasks = [(archive_dir, r) for r in records]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for weather_data, error in executor.map(_parse_weather, tasks, chunksize=16):
+            if error:
+                print(f"  Parse error {error}")
+                stats['failed'] += 1
+            elif weather_data and (weather_data['wind_speed'] or weather_data['temperature']):
+                weather_data_list.append(weather_data)
+            else:
+                stats['skipped'] += 1
+
+    if weather_data_list:
+        scraper = WeatherScraper()
+        try:
+            scraper.save_to_db(weather_data_list)
+            stats['saved'] = len(weather_data_list)
+        finally:
+            scraper.close()
+
+    _print_result('weather', stats, time.monotonic() - start_time)
+    return stats
+
+
+def show_summary(archive_dir):
+    """アーカイブの保存件数を表示"""
+    archive = HtmlArchive(archive_dir)
+    try:
+        rows = archive.summary()
+    finally:
+        archive.close()
+
+    print(f"=== HTML archive: {archive_dir} ===")
+    for source, responses, blobs, size in rows:
+        print(f"  {source:12s} responses: {responses:8d}  unique bodies: {blobs:8d}  "
+              f"raw size: {size / 1024 / 1024:9.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild DB rows from archived HTML without network access')
+    parser.add_argument('--archive-dir', type=str, required=True,
+                        help='Archive directory written with --archive-dir')
+    parser.add_argument('--source', type=str, default='kyotei24',
+                        choices=['kyotei24', 'boatrace_db', 'weather', 'all'],
+                        help='Source to reparse (default: kyotei24)')
+    parser.add_argument('--start-date', type=str, default=None,
+                        help='kyotei24: first race date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', type=str, default=None,
+                        help='kyotei24: last race date (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Parser processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help='kyotei24: races per DB write batch (default: 200)')
+    parser.add_argument('--parser', type=str, default=DEFAULT_BACKEND, choices=PARSER_BACKENDS,
+                        help=f'HTML parser backend (default: {DEFAULT_BACKEND})')
+    parser.add_argument('--summary', action='store_true',
+                        help='Show archive contents and exit')
+    args = parser.parse_args()
+
+    if args.summary:
+        show_summary(args.archive_dir)
+        return
+
+    start_date = datetime.strptime(args.start_date, '%Y-%m-%d') if args.start_date else None
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d') if args.end_date else None
+
+    if args.source in ('kyotei24', 'all'):
+        reparse_kyotei24(args.archive_dir, start_date=start_date, end_date=end_date,
+                         workers=args.workers, batch_size=args.batch_size, parser_backend=args.parser)
+    if args.source in ('boatrace_db', 'all'):
+        reparse_boatrace_db(args.archive_dir, workers=args.workers, parser_backend=args.parser)
+    if args.source in ('weather', 'all'):
+        reparse_weather(args.archive_dir, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
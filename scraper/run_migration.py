@@ -1,17 +1,13 @@
 """
 データベースマイグレーションスクリプト
 """
-import os
-from dotenv import load_dotenv
-import psycopg2
-
-load_dotenv()
+from db import connect
 
 
 def run_migration():
     """マイグレーションを実行"""
     print("データベース接続中...")
-    conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+    conn = connect()
     cursor = conn.cursor()
 
     try:
@@ -216,6 +216,30 @@ def get_venues_by_region(region):
 # 地域リスト
 REGIONS = ['関東', '東海', '近畿', '四国', '中国', '九州']
 
+# 発走予定時刻の目安（1R の発走時刻とレース間隔、分単位）
+# 各会場の公式サイト（official_url）の開催スケジュールにある通常開催の時刻を丸めた概算で、
+# 節・季節・薄暮開催などで前後する。レースごとの発走時刻はDBにないため、
+# 天気の結合（ml/weather_alignment.py、訓練・予測の両方）はこの値で発走時刻を推定する
+FIRST_RACE_MINUTES = 10 * 60 + 45   # デイ開催
+RACE_INTERVAL_MINUTES = 30
+
+# ナイター・モーニング開催の会場（1R の時刻を上書き）
+VENUE_FIRST_RACE_MINUTES = {
+    # ナイター
+    1: 15 * 60,    # 桐生
+    7: 15 * 60,    # 蒲郡
+    12: 15 * 60,   # 住之江
+    15: 15 * 60,   # 丸亀
+    19: 15 * 60,   # 下関
+    20: 15 * 60,   # 若松
+    24: 15 * 60,   # 大村
+    # モーニング
+    14: 8 * 60 + 40,   # 鳴門
+    18: 8 * 60 + 40,   # 徳山
+    21: 8 * 60 + 40,   # 芦屋
+    23: 8 * 60 + 40,   # 唐津
+}
+
 
 if __name__ == '__main__':
     # テスト: 会場情報の表示
@@ -1,18 +1,14 @@
 """
 データベースに保存されたデータの確認
 """
-import os
-from dotenv import load_dotenv
-import psycopg2
-
-load_dotenv()
+from db import connect
 
 def verify_saved_data():
     """保存されたデータを確認"""
     print("=== Database Data Verification ===\n")
 
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        conn = connect()
         cursor = conn.cursor()
 
         # レース情報を確認
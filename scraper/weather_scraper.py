@@ -9,33 +9,64 @@
 
 注意: 各会場のHTML構造は異なる可能性があるため、
       実際の運用時には調整が必要です。
+
+会場ごとに別ホストのため、全会場を並行して取得する（頻度は会場ごとに制限）
+
+使用方法:
+  python weather_scraper.py
+  python weather_scraper.py --repeat 8 --interval 1800   # 30分ごとに8回収集
 """
 import asyncio
 import aiohttp
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import os
-from dotenv import load_dotenv
-import psycopg2
 import sys
 import re
+import argparse
+import time
 
 # 親ディレクトリをパスに追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from scraper.venues_config import VENUES, get_all_venue_ids
 from scraper.rate_limiter import RateLimiter
+from scraper.html_archive import HtmlArchive
+from scraper.db import connect
+
+
+# 会場ごとに別ホストのため、同時に取得する会場数（ホストごとの頻度は RateLimiter が制限）
+DEFAULT_CONCURRENCY = 8
+
+# 天気データの抽出パターン（パースのたびにコンパイルしない）
+WIND_LABEL_RE = re.compile(r'風速|風')
+WIND_SPEED_RE = re.compile(r'([\d.]+)\s*m/?s?')
+WIND_DIRECTION_LABEL_RE = re.compile(r'風向|風\s*向')
+TEMPERATURE_LABEL_RE = re.compile(r'気温|温度')
+TEMPERATURE_RE = re.compile(r'([\d.]+)\s*℃')
+WAVE_LABEL_RE = re.compile(r'波|波高')
+WAVE_HEIGHT_RE = re.compile(r'([\d.]+)\s*cm')
+CONDITION_RE = re.compile(r'晴|曇|雨|雪')
 
-load_dotenv()
+WIND_DIRECTIONS = ['北東', '北西', '南東', '南西', '北', '南', '東', '西']
+WEATHER_CONDITIONS = ['晴れ', '曇り', '雨', '雪', '晴', '曇']
 
 
 class WeatherScraper:
     """天気データスクレイパー"""
 
-    def __init__(self):
+    def __init__(self, archive=None, concurrency=DEFAULT_CONCURRENCY):
+        """
+        Args:
+            archive: 取得したHTMLを保存する HtmlArchive（Noneの場合は保存しない）
+            concurrency: 同時に取得する会場数
+        """
         self.session = None
+        self.archive = archive
+        self.concurrency = concurrency
+        # 制限はホスト（会場サイト）ごと
         self.rate_limiter = RateLimiter(
-            requests_per_second=0.33,  # 3秒に1リクエスト
+            requests_per_second=0.33,  # 1会場あたり3秒に1リクエスト
             concurrent_requests=2
         )
 
@@ -45,42 +76,62 @@ class WeatherScraper:
             'Accept-Language': 'ja,en-US;q=0.7',
         }
 
-        self.db_conn = psycopg2.connect(os.getenv('DATABASE_URL'))
+        self.db_conn = connect()
+
+    async def fetch_with_retry(self, url, max_retries=3, meta=None):
+        """
+        リトライ機能付きフェッチ
 
-    async def fetch_with_retry(self, url, max_retries=3):
-        """リトライ機能付きフェッチ"""
+        Args:
+            url: 取得するURL
+            max_retries: 最大再試行回数
+            meta: アーカイブに記録する再パース用の情報
+        """
         for attempt in range(max_retries):
+            status = None
             try:
-                await self.rate_limiter.acquire()
-
-                async with self.session.get(
-                    url,
-                    headers=self.headers,
-                    timeout=aiohttp.ClientTimeout(total=30)
-                ) as response:
-                    if response.status == 200:
-                        return await response.text()
-                    elif response.status == 404:
-                        return None
-                    else:
-                        print(f"HTTP {response.status}: {url}")
+                async with self.rate_limiter.slot(url):
+                    async with self.session.get(
+                        url,
+                        headers=self.headers,
+                        timeout=aiohttp.ClientTimeout(total=30)
+                    ) as response:
+                        status = response.status
+                        self.rate_limiter.report(url, status, response.headers.get('Retry-After'))
+
+                        if status == 200:
+                            content = await response.read()
+                            if self.archive is not None:
+                                self.archive.put(url, content, source='weather', meta=meta)
+                            return content.decode(response.get_encoding(), errors='replace')
+                        elif status == 404:
+                            return None
+                        else:
+                            print(f"HTTP {status}: {url}")
 
             except asyncio.TimeoutError:
                 print(f"Timeout on attempt {attempt + 1}: {url}")
             except Exception as e:
                 print(f"Error on attempt {attempt + 1}: {e}")
 
-            if attempt < max_retries - 1:
+            # 429 / 503 の待機は RateLimiter が行う
+            if attempt < max_retries - 1 and status not in (429, 503):
                 await asyncio.sleep(2 ** attempt)
 
         return None
 
-    def parse_weather_data(self, html, venue_id):
+    @staticmethod
+    def parse_weather_data(html, venue_id, record_datetime=None):
         """
         HTMLから天気データを抽出
 
         注意: 各会場でHTML構造が異なるため、汎用的なパーサーを実装
               実際の運用時には各会場に合わせて調整が必要
+
+        Args:
+            html: ページのHTML
+            venue_id: 会場ID
+            record_datetime: 記録時刻（Noneの場合は現在時刻、再パース時は取得時刻を指定）
         """
         if not html:
             return None
@@ -90,7 +141,7 @@ class WeatherScraper:
         # 天気データを抽出（会場ごとに異なる可能性がある）
         weather_data = {
             'venue_id': venue_id,
-            'record_datetime': datetime.now(),
+            'record_datetime': record_datetime or datetime.now(),
             'temperature': None,
             'humidity': None,
             'pressure': None,
@@ -106,41 +157,42 @@ class WeatherScraper:
 
         try:
             # 風速を抽出（例: "風速: 3.5m/s" のようなテキストを探す）
-            wind_text = soup.find(string=re.compile(r'風速|風'))
+            wind_text = soup.find(string=WIND_LABEL_RE)
             if wind_text:
                 # 数値を抽出
-                wind_match = re.search(r'([\d.]+)\s*m/?s?', str(wind_text.parent))
+                wind_match = WIND_SPEED_RE.search(str(wind_text.parent))
                 if wind_match:
                     weather_data['wind_speed'] = float(wind_match.group(1))
 
             # 風向を抽出
-            wind_dir_text = soup.find(string=re.compile(r'風向|風\s*向'))
+            wind_dir_text = soup.find(string=WIND_DIRECTION_LABEL_RE)
             if wind_dir_text:
                 # 風向テキスト（例: "北東"）を抽出
-                for direction in ['北東', '北西', '南東', '南西', '北', '南', '東', '西']:
-                    if direction in str(wind_dir_text.parent):
+                parent_text = str(wind_dir_text.parent)
+                for direction in WIND_DIRECTIONS:
+                    if direction in parent_text:
                         weather_data['wind_direction_text'] = direction
-                        weather_data['wind_direction'] = self._direction_to_degrees(direction)
+                        weather_data['wind_direction'] = WeatherScraper._direction_to_degrees(direction)
                         break
 
             # 気温を抽出
-            temp_text = soup.find(string=re.compile(r'気温|温度'))
+            temp_text = soup.find(string=TEMPERATURE_LABEL_RE)
             if temp_text:
-                temp_match = re.search(r'([\d.]+)\s*℃', str(temp_text.parent))
+                temp_match = TEMPERATURE_RE.search(str(temp_text.parent))
                 if temp_match:
                     weather_data['temperature'] = float(temp_match.group(1))
 
             # 波高を抽出
-            wave_text = soup.find(string=re.compile(r'波|波高'))
+            wave_text = soup.find(string=WAVE_LABEL_RE)
             if wave_text:
-                wave_match = re.search(r'([\d.]+)\s*cm', str(wave_text.parent))
+                wave_match = WAVE_HEIGHT_RE.search(str(wave_text.parent))
                 if wave_match:
                     weather_data['wave_height'] = float(wave_match.group(1))
 
             # 天気状態を抽出
-            weather_condition_text = soup.find(string=re.compile(r'晴|曇|雨|雪'))
+            weather_condition_text = soup.find(string=CONDITION_RE)
             if weather_condition_text:
-                for condition in ['晴れ', '曇り', '雨', '雪', '晴', '曇']:
+                for condition in WEATHER_CONDITIONS:
                     if condition in str(weather_condition_text):
                         weather_data['weather_condition'] = condition.replace('れ', '').replace('り', '')
                         break
@@ -150,7 +202,8 @@ class WeatherScraper:
 
         return weather_data
 
-    def _direction_to_degrees(self, direction_text):
+    @staticmethod
+    def _direction_to_degrees(direction_text):
         """風向テキストを角度に変換"""
         directions = {
             '北': 0,
@@ -181,7 +234,7 @@ class WeatherScraper:
 
         print(f"Fetching weather for {venue['name']} ({venue_id})...")
 
-        html = await self.fetch_with_retry(url)
+        html = await self.fetch_with_retry(url, meta={'venue_id': venue_id, 'date': target_date.strftime('%Y-%m-%d')})
 
         if html:
             weather_data = self.parse_weather_data(html, venue_id)
@@ -247,25 +300,33 @@ class WeatherScraper:
             cursor.close()
 
     async def collect_all_venues(self, target_date=None):
-        """全会場の天気データを収集"""
+        """
+        全会場の天気データを収集
+
+        会場ごとに別ホストのため、concurrency 会場ずつ並行して取得する
+        """
         print("=" * 80)
         print(f"  全24会場の天気データ収集")
         print("=" * 80)
         print()
 
-        async with aiohttp.ClientSession() as session:
-            self.session = session
+        start_time = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
 
-            all_weather_data = []
+        async def fetch(venue_id):
+            async with semaphore:
+                return await self.fetch_venue_weather(venue_id, target_date)
 
-            for venue_id in get_all_venue_ids():
-                weather_data = await self.fetch_venue_weather(venue_id, target_date)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self.session = session
 
-                if weather_data:
-                    all_weather_data.append(weather_data)
+            results = await asyncio.gather(*(fetch(venue_id) for venue_id in get_all_venue_ids()))
+            all_weather_data = [weather_data for weather_data in results if weather_data]
 
             print()
-            print(f"収集完了: {len(all_weather_data)} / 24 会場")
+            print(f"収集完了: {len(all_weather_data)} / 24 会場 ({time.monotonic() - start_time:.1f}秒)")
+            self.rate_limiter.print_metrics()
 
             # データベースに保存
             if all_weather_data:
@@ -278,8 +339,44 @@ class WeatherScraper:
         self.db_conn.close()
 
 
-async def main():
-    """メイン処理"""
+def print_summary(weather_data):
+    """収集結果のサマリーを表示"""
+    print()
+    print("=" * 80)
+    print("  収集結果サマリー")
+    print("=" * 80)
+
+    if weather_data:
+        print(f"\n総収集件数: {len(weather_data)}件")
+
+        # 統計表示
+        wind_count = sum(1 for d in weather_data if d['wind_speed'] is not None)
+        temp_count = sum(1 for d in weather_data if d['temperature'] is not None)
+        wave_count = sum(1 for d in weather_data if d['wave_height'] is not None)
+
+        print(f"風速データ: {wind_count}件")
+        print(f"気温データ: {temp_count}件")
+        print(f"波高データ: {wave_count}件")
+
+        if wind_count > 0:
+            avg_wind = sum(d['wind_speed'] for d in weather_data if d['wind_speed']) / wind_count
+            print(f"\n平均風速: {avg_wind:.1f} m/s")
+
+    else:
+        print("\n[WARNING] データが取得できませんでした")
+        print("HTML構造の調整が必要な可能性があります")
+
+
+async def main(archive_dir=None, concurrency=DEFAULT_CONCURRENCY, repeat=1, interval=1800):
+    """
+    メイン処理
+
+    Args:
+        archive_dir: 取得したHTMLを保存するディレクトリ（Noneの場合は保存しない）
+        concurrency: 同時に取得する会場数
+        repeat: 収集回数（2以上の場合は interval 秒ごとに繰り返し、1日に複数回の天気を記録する）
+        interval: 繰り返し時の収集間隔（秒、前回の開始時刻から数える）
+    """
     print()
     print("=" * 80)
     print("  天気データ収集スクリプト")
@@ -291,39 +388,50 @@ async def main():
     print("- 初回実行時はデータが正しく取得できているか確認してください")
     print()
 
-    scraper = WeatherScraper()
+    archive = HtmlArchive(archive_dir) if archive_dir else None
+    scraper = WeatherScraper(archive=archive, concurrency=concurrency)
 
     try:
-        weather_data = await scraper.collect_all_venues()
+        for run in range(repeat):
+            started = time.monotonic()
+            if repeat > 1:
+                print(f"\n[{run + 1}/{repeat}] {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-        print()
-        print("=" * 80)
-        print("  収集結果サマリー")
-        print("=" * 80)
-
-        if weather_data:
-            print(f"\n総収集件数: {len(weather_data)}件")
+            weather_data = await scraper.collect_all_venues()
+            print_summary(weather_data)
 
-            # 統計表示
-            wind_count = sum(1 for d in weather_data if d['wind_speed'] is not None)
-            temp_count = sum(1 for d in weather_data if d['temperature'] is not None)
-            wave_count = sum(1 for d in weather_data if d['wave_height'] is not None)
-
-            print(f"風速データ: {wind_count}件")
-            print(f"気温データ: {temp_count}件")
-            print(f"波高データ: {wave_count}件")
-
-            if wind_count > 0:
-                avg_wind = sum(d['wind_speed'] for d in weather_data if d['wind_speed']) / wind_count
-                print(f"\n平均風速: {avg_wind:.1f} m/s")
-
-        else:
-            print("\n[WARNING] データが取得できませんでした")
-            print("HTML構造の調整が必要な可能性があります")
+            if run < repeat - 1:
+                wait = max(0.0, interval - (time.monotonic() - started))
+                print(f"\n次の収集まで {wait:.0f}秒待機")
+                await asyncio.sleep(wait)
 
     finally:
         scraper.close()
+        if archive is not None:
+            archive.close()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='Collect weather data from venue websites')
+    parser.add_argument('--archive-dir', type=str, default=None,
+                        help='Directory to archive fetched HTML (see html_archive.py)')
+    parser.add_argument('--reparse', action='store_true',
+                        help='Rebuild rows from --archive-dir without network access')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'Number of venues fetched in parallel (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of collection rounds (default: 1)')
+    parser.add_argument('--interval', type=int, default=1800,
+                        help='Seconds between the starts of consecutive rounds (default: 1800)')
+    args = parser.parse_args()
+
+    if args.reparse:
+        if not args.archive_dir:
+            print("Error: --reparse requires --archive-dir")
+            sys.exit(1)
+
+        from scraper.reparse_archive import reparse_weather
+        reparse_weather(args.archive_dir)
+    else:
+        asyncio.run(main(archive_dir=args.archive_dir, concurrency=args.concurrency,
+                         repeat=args.repeat, interval=args.interval))
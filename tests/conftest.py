@@ -0,0 +1,14 @@
+"""
+テスト共通設定
+
+ml/ のスクリプトは `from ml.x import ...`、scraper/ のスクリプトは `from db import ...` で
+読み込むため、リポジトリのルートと scraper/ の両方を import パスに追加する
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (ROOT, os.path.join(ROOT, 'scraper')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
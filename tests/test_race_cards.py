@@ -0,0 +1,128 @@
+"""
+race_cards.read_race_card の回帰テスト
+
+psycopg2 は NUMERIC 列を Decimal で返すため、出走表の DataFrame で float に変換されていないと
+EnhancedFeatureEngineer.create_features が float と Decimal の演算でエラーになる
+"""
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import psycopg2
+
+from ml.enhanced_feature_engineer import EnhancedFeatureEngineer
+from ml.race_cards import CARD_COLUMNS, DETAILED_STATS_DEFAULTS, read_race_card
+
+
+# NUMERIC 列（psycopg2 が Decimal で返す列）
+DECIMAL_COLUMNS = {
+    'start_timing', 'win_rate', 'place_rate_2', 'place_rate_3', 'motor_rate_2', 'motor_rate_3',
+    'boat_rate_2', 'boat_rate_3', 'exhibition_time', 'exhibition_turn_time', 'exhibition_straight_time',
+    'average_st', 'racer_overall_win_rate', 'racer_1st_rate', 'racer_2nd_rate', 'racer_3rd_rate',
+    'racer_avg_st',
+}
+
+
+def make_card_row(boat_number):
+    """psycopg2 が返すのと同じ型の出走表1行"""
+    row = {
+        'race_id': 1,
+        'boat_number': boat_number,
+        'racer_id': 100 + boat_number,
+        'motor_number': 10 + boat_number,
+        'course': boat_number,
+        'result_position': None,
+        'racer_grade': 'A1' if boat_number <= 2 else 'B1',
+        'flying_count': 0,
+        'late_count': 0,
+        'actual_course': boat_number,
+        'race_date': date(2025, 1, 1),
+        'venue_id': 12,
+        'race_number': 1,
+        'race_grade': '一般',
+        'racer_name': f'選手{boat_number}',
+        'racer_number': 4000 + boat_number,
+        'racer_current_grade': 'A1',
+        'sg_appearances': 0,
+        'racer_flying_count': 0,
+        'racer_late_count': 0,
+    }
+    for column in DECIMAL_COLUMNS:
+        row[column] = Decimal('6.75') if 'exhibition' in column else Decimal(f'0.{10 + boat_number}')
+    # 欠損値も混ぜる
+    if boat_number == 6:
+        row['exhibition_time'] = None
+        row['motor_rate_2'] = None
+    row.update(DETAILED_STATS_DEFAULTS)
+    return tuple(row[column] for column in CARD_COLUMNS)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.rows)
+
+
+class MissingTableCursor(FakeCursor):
+    """race_cards テーブルがない場合（fetch_card_rows の dict を使う経路）"""
+
+    def __init__(self, rows):
+        super().__init__(rows)
+        self.description = None
+
+    def execute(self, query, params=None):
+        if 'FROM race_cards' in query:
+            raise psycopg2.errors.UndefinedTable('relation "race_cards" does not exist')
+        # fetch_card_rows は CARD_SOURCE_QUERY の列（JSONB 列を含む）を読む
+        self.description = [(column,) for column in CARD_COLUMNS if column not in DETAILED_STATS_DEFAULTS]
+        self.description += [('grade_stats',), ('course_stats',), ('venue_stats',)]
+
+    def fetchall(self):
+        n = len(CARD_COLUMNS) - len(DETAILED_STATS_DEFAULTS)
+        return [row[:n] + (None, None, None) for row in self.rows]
+
+
+class MissingTableConnection(FakeConnection):
+    def cursor(self):
+        return MissingTableCursor(self.rows)
+
+    def rollback(self):
+        pass
+
+
+def test_read_race_card_converts_decimal_to_float():
+    rows = [make_card_row(boat_number) for boat_number in range(1, 7)]
+    df = read_race_card(FakeConnection(rows), 1)
+
+    for column in DECIMAL_COLUMNS:
+        assert df[column].dtype == np.float64, column
+
+    features = EnhancedFeatureEngineer().create_features(df)
+    assert len(features) == 6
+
+
+def test_read_race_card_without_table_converts_decimal_to_float():
+    rows = [make_card_row(boat_number) for boat_number in range(1, 7)]
+    df = read_race_card(MissingTableConnection(rows), 1)
+
+    for column in DECIMAL_COLUMNS:
+        assert df[column].dtype == np.float64, column
+
+    features = EnhancedFeatureEngineer().create_features(df)
+    assert len(features) == 6